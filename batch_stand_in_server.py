@@ -0,0 +1,151 @@
+# batch_stand_in_server.py
+#
+# Minimal local stand-in for the OpenAI Files and Batches API, for testing bulk drafting without cost:
+#
+#   python3 batch_stand_in_server.py --port 8766 --delay 2
+#   LLM_BATCH_BASE_URL=http://127.0.0.1:8766/v1 python3 bulk_draft.py ...
+#
+# Batches complete `--delay` seconds after creation. Every request is answered with a canned JSON answer:
+# a structure proposal (array) if the prompt asks for an offer structure, otherwise a one-position offer.
+# Requests whose custom_id contains "fail" get an error response, to exercise the error path.
+
+import json
+import time
+import uuid
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+files = {}   # file id -> {"meta": dict, "content": bytes}
+batches = {} # batch id -> batch dict
+state_lock = threading.Lock()
+completion_delay = 2.0
+
+
+def canned_answer(body: dict) -> str:
+    prompt = " ".join(str(message.get("content", "")) for message in body.get("messages", []))
+    if "propose the offer structure" in prompt:
+        return json.dumps([
+            {"type": "Text Position", "proposed_title": "Ausgangslage", "focus_description": "Introduces the project."},
+            {"type": "Offer Position", "proposed_title": "Konzeption", "focus_description": "Concept and planning.",
+             "estimated_hours_suggestion": 8, "suggested_service_area": "Default"},
+        ])
+    return json.dumps({
+        "project_title": "Stand-in Offer",
+        "positions": [{"position_id": 1, "type": "Text Position", "position_title": "Ausgangslage", "description": "Stand-in text."}],
+    })
+
+
+def process_batch(batch: dict):
+    """Builds the output and error files of a batch from its input file."""
+    output_lines, error_lines = [], []
+    for line in files[batch["input_file_id"]]["content"].decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if "fail" in request["custom_id"]:
+            error_lines.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"], "response": None,
+                                "error": {"code": "stand_in_failure", "message": "Requested failure."}})
+            continue
+        content = canned_answer(request["body"])
+        output_lines.append({
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": {
+                "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+                "model": request["body"].get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(json.dumps(request["body"])) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (len(json.dumps(request["body"])) + len(content)) // 4},
+            }},
+            "error": None,
+        })
+    for key, lines in (("output_file_id", output_lines), ("error_file_id", error_lines)):
+        if lines:
+            batch[key] = store_file("\n".join(json.dumps(line) for line in lines).encode("utf-8"), f"{batch['id']}_{key}.jsonl", "batch_output")["id"]
+    batch["request_counts"] = {"total": len(output_lines) + len(error_lines), "completed": len(output_lines), "failed": len(error_lines)}
+
+
+def store_file(content: bytes, filename: str, purpose: str) -> dict:
+    meta = {"id": f"file-{uuid.uuid4().hex}", "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose, "status": "processed"}
+    files[meta["id"]] = {"meta": meta, "content": content}
+    return meta
+
+
+def batch_view(batch: dict) -> dict:
+    """Batches report 'in_progress' until the configured delay has passed, then 'completed'."""
+    if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= completion_delay:
+        process_batch(batch)
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+    return batch
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_POST(self):
+        body = self.read_body()
+        with state_lock:
+            if self.path == "/v1/files":
+                message = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body
+                )
+                fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+                upload = fields["file"]
+                purpose = fields["purpose"].get_content().strip() if "purpose" in fields else "batch"
+                return self.send_json(200, store_file(upload.get_payload(decode=True), upload.get_filename() or "upload.jsonl", purpose))
+            if self.path == "/v1/batches":
+                payload = json.loads(body or b"{}")
+                if payload.get("input_file_id") not in files:
+                    return self.send_json(404, {"error": {"message": "Unknown input_file_id."}})
+                batch = {
+                    "id": f"batch_{uuid.uuid4().hex}", "object": "batch", "endpoint": payload.get("endpoint"),
+                    "input_file_id": payload["input_file_id"], "completion_window": payload.get("completion_window", "24h"),
+                    "status": "in_progress", "created_at": int(time.time()), "output_file_id": None, "error_file_id": None,
+                    "metadata": payload.get("metadata"), "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                }
+                batches[batch["id"]] = batch
+                return self.send_json(200, batch)
+        self.send_json(404, {"error": {"message": f"No stand-in endpoint for POST {self.path}"}})
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        with state_lock:
+            if parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in batches:
+                return self.send_json(200, batch_view(batches[parts[2]]))
+            if parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content" and parts[2] in files:
+                content = files[parts[2]]["content"]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                return
+        self.send_json(404, {"error": {"message": f"No stand-in endpoint for GET {self.path}"}})
+
+    def log_message(self, format, *args):
+        print(f"[batch_stand_in] {format % args}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI Files and Batches API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--delay", type=float, default=2.0, help="Seconds until a batch reports 'completed'.")
+    args = parser.parse_args()
+    completion_delay = args.delay
+    print(f"Batch stand-in listening on http://{args.host}:{args.port}/v1")
+    ThreadingHTTPServer((args.host, args.port), StandInHandler).serve_forever()
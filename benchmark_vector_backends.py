@@ -0,0 +1,159 @@
+# benchmark_vector_backends.py
+#
+# Compares the ChromaDB backend with the quantized memmap backend on synthetic embeddings.
+# Reports build time, query latency (p50/p99), recall@k against exact float32 search and
+# the resident memory (RSS) of a fresh reader process that opens the index and runs the queries.
+#
+# Usage:
+#   python3 benchmark_vector_backends.py                       # 10k and 100k vectors
+#   python3 benchmark_vector_backends.py --sizes 10000 1000000 --backends memmap-int8 memmap-ivf
+#
+# Each measurement runs in its own process so that RSS numbers are not polluted by the other backends.
+
+import os
+import sys
+import time
+import queue
+import shutil
+import argparse
+import tempfile
+import multiprocessing as mp
+import numpy as np
+
+from vector_backends import get_vector_backend
+
+DIM = 384 # Same dimensionality as all-MiniLM-L6-v2
+NUM_QUERIES = 200
+TOP_K = 10
+SUBPROCESS_TIMEOUT_SECONDS = 2 * 3600 # Per build or query run; a crashed or hung child fails the run instead of blocking it
+
+BACKEND_CONFIGS = {
+    "chroma": {"backend": "chroma", "options": {}},
+    "memmap-float16": {"backend": "memmap", "options": {"dtype": "float16"}},
+    "memmap-int8": {"backend": "memmap", "options": {"dtype": "int8"}},
+    "memmap-ivf": {"backend": "memmap", "options": {"dtype": "int8", "nprobe": 16}, "nlist": 1024},
+}
+
+
+def make_dataset(num_vectors: int, seed: int = 42):
+    """Clustered random unit vectors, which resemble real sentence embeddings better than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(16, num_vectors // 500), DIM)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=num_vectors)
+    vectors = centers[labels] + 0.6 * rng.normal(size=(num_vectors, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_labels = rng.integers(0, len(centers), size=NUM_QUERIES)
+    queries = centers[query_labels] + 0.6 * rng.normal(size=(NUM_QUERIES, DIM)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries
+
+
+def exact_top_k(vectors, queries, k):
+    ground_truth = []
+    for q in queries:
+        scores = vectors @ q
+        top = np.argpartition(-scores, k - 1)[:k]
+        ground_truth.append(set(top[np.argsort(-scores[top])].tolist()))
+    return ground_truth
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource # Fallback (peak instead of current RSS; kilobytes on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def build_index(config_name, store_path, num_vectors, result_queue):
+    config = BACKEND_CONFIGS[config_name]
+    vectors, _ = make_dataset(num_vectors)
+    backend = get_vector_backend(config["backend"], store_path, "bench", **config["options"])
+    ids = [str(i) for i in range(num_vectors)]
+    documents = [f"doc {i}" for i in range(num_vectors)]
+    metadatas = [{"row": i} for i in range(num_vectors)]
+    start = time.perf_counter()
+    backend.add(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+    if config.get("nlist"):
+        backend.build_ivf(config["nlist"])
+    result_queue.put(time.perf_counter() - start)
+
+
+def query_index(config_name, store_path, num_vectors, result_queue):
+    config = BACKEND_CONFIGS[config_name]
+    _, queries = make_dataset(num_vectors)
+    rss_before = current_rss_mb()
+    backend = get_vector_backend(config["backend"], store_path, "bench", **config["options"])
+    latencies, retrieved = [], []
+    for q in queries:
+        start = time.perf_counter()
+        hits = backend.query(q, n_results=TOP_K)
+        latencies.append(time.perf_counter() - start)
+        retrieved.append({int(hit["id"]) for hit in hits})
+    result_queue.put({
+        "latencies": latencies,
+        "retrieved": retrieved,
+        "rss_mb": current_rss_mb() - rss_before,
+    })
+
+
+def run_in_subprocess(target, *args, timeout: float = SUBPROCESS_TIMEOUT_SECONDS):
+    """Runs target(*args, result_queue) in a fresh process. Raises instead of waiting forever if it dies or hangs."""
+    ctx = mp.get_context("spawn")
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=target, args=(*args, result_queue))
+    process.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                return result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if process.exitcode is not None:
+                    try: # The result may still be in flight from a process that just exited
+                        return result_queue.get(timeout=1.0)
+                    except queue.Empty:
+                        raise RuntimeError(f"{target.__name__} exited with code {process.exitcode} without a result.") from None
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{target.__name__} did not finish within {timeout:.0f}s.")
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def run_benchmark(sizes, backend_names):
+    print(f"{'backend':<16} {'vectors':>9} {'build s':>9} {'p50 ms':>8} {'p99 ms':>8} {'recall@' + str(TOP_K):>10} {'RSS MB':>8} {'disk MB':>8}")
+    for num_vectors in sizes:
+        vectors, queries = make_dataset(num_vectors)
+        ground_truth = exact_top_k(vectors, queries, TOP_K)
+        del vectors
+        for config_name in backend_names:
+            store_path = tempfile.mkdtemp(prefix=f"bench_{config_name}_")
+            try:
+                build_seconds = run_in_subprocess(build_index, config_name, store_path, num_vectors)
+                stats = run_in_subprocess(query_index, config_name, store_path, num_vectors)
+                latencies_ms = np.array(stats["latencies"]) * 1000
+                recall = np.mean([len(gt & got) / TOP_K for gt, got in zip(ground_truth, stats["retrieved"])])
+                disk_mb = sum(
+                    os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(store_path) for f in files
+                ) / (1024 * 1024)
+                print(f"{config_name:<16} {num_vectors:>9} {build_seconds:>9.2f} {np.percentile(latencies_ms, 50):>8.2f} "
+                      f"{np.percentile(latencies_ms, 99):>8.2f} {recall:>10.3f} {stats['rss_mb']:>8.1f} {disk_mb:>8.1f}")
+            finally:
+                shutil.rmtree(store_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark vector store backends (recall, latency, RSS).")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000],
+                        help="Number of vectors per run, e.g. 10000 100000 1000000")
+    parser.add_argument("--backends", nargs="+", default=list(BACKEND_CONFIGS.keys()),
+                        choices=list(BACKEND_CONFIGS.keys()))
+    args = parser.parse_args()
+    run_benchmark(args.sizes, args.backends)
@@ -0,0 +1,282 @@
+# bexio_master_data.py
+#
+# Local cache of the Bexio master data (contacts, taxes, units, accounts, users) with name -> id resolution.
+# Each resource is fetched in bulk from its paginated list endpoint and stored in one JSON file
+# (BEXIO_MASTER_DATA_CACHE_PATH). After BEXIO_MASTER_DATA_TTL_SECONDS a resource is revalidated with its ETag
+# (If-None-Match, 304 = unchanged) if Bexio sent one, otherwise refetched. Lookups are in-memory dict lookups,
+# so exporting a quote needs no extra API calls to find the client contact or the tax/unit/account IDs.
+#
+#   python3 bexio_master_data.py --refresh               # Refetch everything and print the counts
+#   python3 bexio_master_data.py contacts "Acme AG"      # Resolve a name
+
+import os
+import re
+import json
+import time
+import difflib
+import argparse
+import threading
+import requests
+
+from config_data import (
+    BEXIO_API_TOKEN, BEXIO_API_BASE_URL, BEXIO_MASTER_DATA_CACHE_PATH, BEXIO_MASTER_DATA_TTL_SECONDS,
+    BEXIO_PAGE_SIZE, BEXIO_NAME_MATCH_CUTOFF, BEXIO_CONTACT_BY_CLIENT_NAME,
+    BEXIO_USER_ID, BEXIO_CONTACT_ID, BEXIO_TAX_ID_STANDARD, BEXIO_UNIT_ID_HOURS, BEXIO_ACCOUNT_ID_SERVICES,
+    BEXIO_USER_NAME, BEXIO_TAX_NAME_STANDARD, BEXIO_UNIT_NAME_HOURS, BEXIO_ACCOUNT_NAME_SERVICES
+)
+from cassette import cassette
+
+CACHE_VERSION = 1
+FAILED_REFRESH_RETRY_SECONDS = 300 # Stale data is used without new API attempts for this long after a failed refresh
+
+# List endpoint, extra query parameters, fields kept in the cache and the names an item can be found by
+RESOURCES = {
+    "contacts": {
+        "path": "/2.0/contact",
+        "params": {"show_archived": "false"},
+        "fields": ["id", "nr", "contact_type_id", "name_1", "name_2", "mail"],
+        "names": lambda item: [item.get("name_1"), f"{item.get('name_1') or ''} {item.get('name_2') or ''}",
+                               f"{item.get('name_2') or ''} {item.get('name_1') or ''}", item.get("nr"), item.get("mail")],
+    },
+    "taxes": {
+        "path": "/3.0/taxes",
+        "params": {"types": "sales_tax", "scope": "active"},
+        "fields": ["id", "name", "code", "display_name", "value", "type", "is_active"],
+        "names": lambda item: [item.get("display_name"), item.get("name"), item.get("code")],
+    },
+    "units": {
+        "path": "/2.0/unit",
+        "params": {},
+        "fields": ["id", "name"],
+        "names": lambda item: [item.get("name")],
+    },
+    "accounts": {
+        "path": "/2.0/accounts",
+        "params": {},
+        "fields": ["id", "account_no", "name", "account_type", "is_active"],
+        "names": lambda item: [item.get("name"), item.get("account_no")],
+    },
+    "users": {
+        "path": "/3.0/users",
+        "params": {},
+        "fields": ["id", "firstname", "lastname", "email"],
+        "names": lambda item: [f"{item.get('firstname') or ''} {item.get('lastname') or ''}",
+                               f"{item.get('lastname') or ''} {item.get('firstname') or ''}", item.get("email")],
+    },
+}
+
+# Legal forms ignored when matching contact names ("Acme" finds "Acme AG")
+LEGAL_FORMS = re.compile(r"\b(ag|gmbh|sa|sàrl|sarl|ltd|inc|llc|kg|co|plc|se)\.?$")
+
+
+def normalize_name(name, strip_legal_form: bool = False) -> str:
+    """Case-insensitive, whitespace- and ß/ss-insensitive key for name lookups."""
+    key = re.sub(r"\s+", " ", str(name).replace("ß", "ss")).strip().casefold()
+    if strip_legal_form:
+        key = LEGAL_FORMS.sub("", key).strip(" ,.-")
+    return key
+
+
+def _token_configured() -> bool:
+    return bool(BEXIO_API_TOKEN) and BEXIO_API_TOKEN != "YOUR_BEXIO_API_TOKEN_PLACEHOLDER_IN_CONFIG"
+
+
+class BexioMasterData:
+    """Cached master data of one Bexio account. Thread-safe; the module-level `master_data` is shared."""
+
+    def __init__(self, cache_path: str = BEXIO_MASTER_DATA_CACHE_PATH, ttl_seconds: float = BEXIO_MASTER_DATA_TTL_SECONDS):
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.RLock()
+        self.http_session = cassette.mount(requests.Session())
+        self.resources = None # resource -> {"fetched_at", "etag", "single_page", "items"}
+        self.indexes = {}     # resource -> {normalized name: [ids]}
+        self.refreshed_at = 0.0
+
+    # --- CACHE FILE ---
+    def _load_cache_file(self):
+        self.resources = {}
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read the Bexio master data cache {self.cache_path}: {e}")
+            return
+        if cached.get("version") == CACHE_VERSION:
+            self.resources = cached.get("resources", {})
+
+    def _save_cache_file(self):
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": CACHE_VERSION, "resources": self.resources}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    # --- FETCHING ---
+    def _fetch(self, resource: str, cached: dict = None) -> dict:
+        """Fetches all pages of a resource. A single-page resource with an ETag is revalidated instead."""
+        spec = RESOURCES[resource]
+        headers = {'Accept': "application/json", 'Authorization': f"Bearer {BEXIO_API_TOKEN}"}
+        items, offset, etag = [], 0, None
+        while True:
+            page_headers = dict(headers)
+            if offset == 0 and cached and cached.get("etag") and cached.get("single_page"):
+                page_headers["If-None-Match"] = cached["etag"]
+            response = self.http_session.get(
+                f"{BEXIO_API_BASE_URL}{spec['path']}", headers=page_headers, timeout=30,
+                params={**spec["params"], "limit": BEXIO_PAGE_SIZE, "offset": offset}
+            )
+            if response.status_code == 304:
+                return dict(cached, fetched_at=time.time())
+            response.raise_for_status()
+            page = response.json()
+            if offset == 0:
+                etag = response.headers.get("ETag")
+            items.extend({field: item.get(field) for field in spec["fields"]} for item in page)
+            if len(page) < BEXIO_PAGE_SIZE:
+                break
+            offset += BEXIO_PAGE_SIZE
+        return {"fetched_at": time.time(), "etag": etag, "single_page": offset == 0, "items": items}
+
+    def _build_index(self, resource: str):
+        index = {}
+        for item in self.resources.get(resource, {}).get("items", []):
+            for name in RESOURCES[resource]["names"](item):
+                if name is None or not str(name).strip():
+                    continue
+                keys = {normalize_name(name)}
+                if resource == "contacts":
+                    keys.add(normalize_name(name, strip_legal_form=True))
+                for key in keys - {""}:
+                    ids = index.setdefault(key, [])
+                    if item["id"] not in ids:
+                        ids.append(item["id"])
+        self.indexes[resource] = index
+
+    def refresh(self, force: bool = False) -> dict:
+        """
+        Loads the cache file and refetches/revalidates every resource older than the TTL (all with force=True).
+        A resource that cannot be fetched keeps its stale cached items. Returns the item count per resource.
+        """
+        with self.lock:
+            if self.resources is None:
+                self._load_cache_file()
+            self.refreshed_at = time.time()
+            changed = False
+            for resource in RESOURCES:
+                cached = self.resources.get(resource)
+                if not force and cached and time.time() - cached.get("fetched_at", 0) < self.ttl_seconds:
+                    continue
+                if not _token_configured():
+                    continue
+                try:
+                    self.resources[resource] = self._fetch(resource, None if force else cached)
+                    changed = True
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    print(f"Warning: Could not fetch Bexio {resource}: {e}" + (" Using the cached data." if cached else ""))
+            if changed:
+                self._save_cache_file()
+            for resource in RESOURCES:
+                self._build_index(resource)
+            return {resource: len(self.resources.get(resource, {}).get("items", [])) for resource in RESOURCES}
+
+    def _ensure_fresh(self):
+        with self.lock:
+            stale = self.resources is None or any(
+                time.time() - self.resources.get(resource, {}).get("fetched_at", 0) >= self.ttl_seconds for resource in RESOURCES
+            )
+            if stale and time.time() - self.refreshed_at >= min(self.ttl_seconds, FAILED_REFRESH_RETRY_SECONDS):
+                self.refresh()
+
+    # --- LOOKUPS ---
+    def items(self, resource: str) -> list:
+        self._ensure_fresh()
+        return self.resources.get(resource, {}).get("items", [])
+
+    def resolve(self, resource: str, name):
+        """
+        Returns the ID of the item named `name` (exact normalized match first, then the closest name above
+        BEXIO_NAME_MATCH_CUTOFF), or None if nothing or more than one item matches. Integers are returned as-is.
+        Contacts are never matched fuzzily: a near-miss name ("Acne AG" for "Acme AG") is another customer.
+        """
+        if name is None or isinstance(name, int):
+            return name
+        self._ensure_fresh()
+        index = self.indexes.get(resource, {})
+        if resource == "taxes":
+            try:
+                rate = float(str(name).strip().rstrip("%"))
+                ids = [item["id"] for item in self.resources.get("taxes", {}).get("items", [])
+                       if item.get("value") is not None and abs(float(item["value"]) - rate) < 1e-9]
+                return self._single(resource, name, ids)
+            except ValueError:
+                pass
+        keys = [normalize_name(name)]
+        if resource == "contacts":
+            keys.append(normalize_name(name, strip_legal_form=True))
+        for key in keys:
+            if key in index:
+                return self._single(resource, name, index[key])
+        if BEXIO_NAME_MATCH_CUTOFF < 1.0 and resource != "contacts":
+            close = difflib.get_close_matches(keys[-1], list(index.keys()), n=1, cutoff=BEXIO_NAME_MATCH_CUTOFF)
+            if close:
+                print(f"Bexio {resource}: '{name}' matched to '{close[0]}'.")
+                return self._single(resource, name, index[close[0]])
+        return None
+
+    @staticmethod
+    def _single(resource: str, name, ids: list):
+        if len(ids) > 1:
+            print(f"Warning: '{name}' matches several Bexio {resource} (IDs {ids}). Not using any of them.")
+            return None
+        return ids[0] if ids else None
+
+
+master_data = BexioMasterData()
+
+
+def _resolve_or_default(resource: str, name, default_id, setting: str):
+    if name is None:
+        return default_id
+    resolved = master_data.resolve(resource, name)
+    if resolved is None:
+        print(f"Warning: No Bexio {resource} entry matches {setting} = '{name}'. Using the configured ID {default_id}.")
+        return default_id
+    return resolved
+
+
+def resolve_quote_ids(client_name: str = None) -> dict:
+    """
+    IDs for a quote: the client's contact (if BEXIO_CONTACT_BY_CLIENT_NAME and a contact matches) and the
+    user/tax/unit/account from their configured names, each falling back to the configured ID.
+    Only touches the master data (and possibly the API) if there is something to resolve.
+    """
+    ids = {
+        "contact_id": BEXIO_CONTACT_ID,
+        "user_id": _resolve_or_default("users", BEXIO_USER_NAME, BEXIO_USER_ID, "BEXIO_USER_NAME"),
+        "tax_id": _resolve_or_default("taxes", BEXIO_TAX_NAME_STANDARD, BEXIO_TAX_ID_STANDARD, "BEXIO_TAX_NAME_STANDARD"),
+        "unit_id": _resolve_or_default("units", BEXIO_UNIT_NAME_HOURS, BEXIO_UNIT_ID_HOURS, "BEXIO_UNIT_NAME_HOURS"),
+        "account_id": _resolve_or_default("accounts", BEXIO_ACCOUNT_NAME_SERVICES, BEXIO_ACCOUNT_ID_SERVICES, "BEXIO_ACCOUNT_NAME_SERVICES"),
+    }
+    if BEXIO_CONTACT_BY_CLIENT_NAME and client_name:
+        contact_id = master_data.resolve("contacts", client_name)
+        if contact_id is None:
+            print(f"No Bexio contact matches client '{client_name}'. Using BEXIO_CONTACT_ID ({BEXIO_CONTACT_ID}).")
+        else:
+            print(f"Bexio contact for client '{client_name}': ID {contact_id}.")
+            ids["contact_id"] = contact_id
+    return ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bexio master data cache and name resolver.")
+    parser.add_argument("resource", nargs="?", choices=list(RESOURCES), help="Resource to resolve a name in.")
+    parser.add_argument("name", nargs="?", help="Name to resolve.")
+    parser.add_argument("--refresh", action="store_true", help="Refetch all resources, ignoring the TTL.")
+    args = parser.parse_args()
+
+    counts = master_data.refresh(force=args.refresh)
+    print("Bexio master data: " + ", ".join(f"{count} {resource}" for resource, count in counts.items()))
+    if args.resource and args.name:
+        print(f"{args.resource} '{args.name}' -> {master_data.resolve(args.resource, args.name)}")
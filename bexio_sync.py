@@ -0,0 +1,324 @@
+# bexio_sync.py
+#
+# Incremental Bexio -> knowledge base sync. Quotes (kb_offer) changed since the stored cursor are paged
+# through in updated_at order, converted to the offer JSON schema of DATA_DIR (position texts are turned back
+# from the HTML written by format_bexio_position) and written as bexio_<id>.json. Only files whose content
+# changed are written and handed to the indexer. The Bexio status (won/lost/...) is stored with the offer
+# and ends up in the retrieval metadata.
+# Bexio has no feed of deleted quotes: every BEXIO_SYNC_DELETION_CHECK_SECONDS (and on --full) all quote ids
+# are listed, and files of quotes that are gone (confirmed with a 404) are removed.
+#
+#   python3 bexio_sync.py            # Sync changes since the last run
+#   python3 bexio_sync.py --full     # Ignore the cursor, sync all quotes and remove deleted ones
+
+import os
+import json
+import time
+import argparse
+import threading
+from html.parser import HTMLParser
+
+import requests
+
+from config_data import (
+    BEXIO_API_TOKEN, BEXIO_API_BASE_URL, BEXIO_PAGE_SIZE, BEXIO_CURRENCY_ID, DATA_DIR,
+    BEXIO_SYNC_STATE_PATH, BEXIO_SYNC_FILE_PREFIX, BEXIO_SYNC_DELETION_CHECK_SECONDS, BEXIO_OFFER_STATUS
+)
+from bexio_utils import bexio_http_session
+from bexio_master_data import master_data
+from vector_store_utils import index_offer_files, remove_offer_files
+
+PRICED_POSITION_TYPES = {"KbPositionCustom", "KbPositionArticle"} # Text, subtotal, page break and discount rows are skipped
+
+sync_lock = threading.Lock()
+last_sync_result = {}
+
+
+# --- HTML -> TEXT ---
+class _PositionTextParser(HTMLParser):
+    """Reverses format_bexio_position: leading <strong> = title, <br /> = line break, <li> = '- ' bullet."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title_parts, self.lines, self.current = [], [], []
+        self.in_title = False
+        self.title_done = False
+
+    def _break(self):
+        line = " ".join("".join(self.current).split())
+        if line and line != "-":
+            self.lines.append(line)
+        self.current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("strong", "b") and not self.title_done and not self.lines and not "".join(self.current).strip():
+            self.in_title = True
+        elif tag in ("br", "p", "div", "ul", "ol"):
+            self._break()
+        elif tag == "li":
+            self._break()
+            self.current.append("- ")
+
+    def handle_endtag(self, tag):
+        if tag in ("strong", "b") and self.in_title:
+            self.in_title = False
+            self.title_done = True
+        elif tag in ("p", "div", "li", "ul", "ol"):
+            self._break()
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title_parts.append(data)
+            return
+        for line_idx, part in enumerate(data.split("\n")): # Plain-text positions typed in Bexio keep their line breaks
+            if line_idx:
+                self._break()
+            self.current.append(part)
+
+
+def html_to_position_text(html: str):
+    """Returns (title, description) of a Bexio position text. Without a bold title, the first line is the title."""
+    parser = _PositionTextParser()
+    parser.feed(html or "")
+    parser.close()
+    parser._break()
+    title = " ".join("".join(parser.title_parts).split())
+    lines = parser.lines
+    if not title and lines:
+        title, lines = lines[0].lstrip("- "), lines[1:]
+    return title, "\n".join(lines)
+
+
+# --- CONVERSION ---
+def _number(value):
+    try:
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        return None
+
+
+def _user_name(user_id):
+    for user in master_data.items("users"):
+        if user["id"] == user_id:
+            return f"{user.get('firstname') or ''} {user.get('lastname') or ''}".strip()
+    return f"Bexio user {user_id}" if user_id else ""
+
+
+def convert_bexio_offer(offer: dict) -> dict:
+    """Converts a Bexio quote (with its positions) to the offer JSON schema of the knowledge base."""
+    positions = []
+    for pos_idx, bexio_position in enumerate(offer.get("positions") or []):
+        if bexio_position.get("type") not in PRICED_POSITION_TYPES:
+            continue
+        title, description = html_to_position_text(bexio_position.get("text"))
+        if not description and not title:
+            continue
+        positions.append({
+            "position_id": str(bexio_position.get("pos") or bexio_position.get("internal_pos") or pos_idx + 1),
+            "position_title": title,
+            "description": description or title,
+            "quantity": _number(bexio_position.get("amount")),
+            "unit_price_chf": _number(bexio_position.get("unit_price")),
+            "total_price_chf": _number(bexio_position.get("position_total")),
+            "service_tags": [],
+        })
+    status_id = offer.get("kb_item_status_id")
+    return {
+        "offer_id": offer.get("document_nr") or f"BX-{offer['id']}",
+        "creation_date": offer.get("is_valid_from"),
+        "valid_until_date": offer.get("is_valid_until"),
+        "offer_title": offer.get("title") or "",
+        "client_name_anonymized": f"Bexio contact {offer.get('contact_id')}",
+        "client_industry_anonymized": "",
+        "contact_person_internal": _user_name(offer.get("user_id")),
+        "offer_type": "Bexio",
+        "project_focus_tags": [],
+        "total_price_chf_excl_vat": _number(offer.get("total_net")),
+        "total_price_chf_incl_vat": _number(offer.get("total")),
+        "currency": "CHF" if offer.get("currency_id") in (None, BEXIO_CURRENCY_ID) else f"Bexio currency {offer.get('currency_id')}",
+        "services_offered": [],
+        "status": BEXIO_OFFER_STATUS.get(status_id, "unknown"),
+        "source": {"system": "bexio", "id": offer["id"], "kb_item_status_id": status_id, "updated_at": offer.get("updated_at")},
+        "positions": positions,
+    }
+
+
+# --- SYNC ---
+def _headers() -> dict:
+    return {'Accept': "application/json", 'Content-Type': "application/json", 'Authorization': f"Bearer {BEXIO_API_TOKEN}"}
+
+
+def _changed_offers(cursor):
+    """
+    Yields quotes with updated_at >= cursor (all quotes without a cursor), oldest change first.
+    Pages are keyed on the last updated_at seen instead of an offset: a quote edited during the sync moves to
+    the end of the order, which would shift an offset past a quote that was not synced yet. A quote may
+    therefore be yielded twice; writing its file again is a no-op.
+    """
+    last_seen, ids_at_last_seen, offset = cursor, set(), 0
+    while True:
+        params = {"order_by": "updated_at", "limit": BEXIO_PAGE_SIZE, "offset": offset}
+        if last_seen:
+            criteria = [{"field": "updated_at", "value": last_seen, "criteria": ">="}]
+            response = bexio_http_session.post(f"{BEXIO_API_BASE_URL}/2.0/kb_offer/search", params=params,
+                                               data=json.dumps(criteria), headers=_headers(), timeout=30)
+        else:
+            response = bexio_http_session.get(f"{BEXIO_API_BASE_URL}/2.0/kb_offer", params=params, headers=_headers(), timeout=30)
+        response.raise_for_status()
+        page = response.json()
+        for offer in page:
+            if offer.get("updated_at") == last_seen and offer["id"] in ids_at_last_seen:
+                continue
+            yield offer
+        if len(page) < BEXIO_PAGE_SIZE:
+            return
+        newest = page[-1].get("updated_at")
+        if newest == last_seen or newest is None: # A full page with one updated_at: page on within it
+            offset += BEXIO_PAGE_SIZE
+        else:
+            last_seen, ids_at_last_seen, offset = newest, set(), 0
+        ids_at_last_seen.update(offer["id"] for offer in page if offer.get("updated_at") == last_seen)
+
+
+def _all_offer_ids() -> set:
+    ids, offset = set(), 0
+    while True:
+        response = bexio_http_session.get(f"{BEXIO_API_BASE_URL}/2.0/kb_offer", headers=_headers(), timeout=30,
+                                          params={"order_by": "id", "limit": BEXIO_PAGE_SIZE, "offset": offset})
+        response.raise_for_status()
+        page = response.json()
+        ids.update(offer["id"] for offer in page)
+        if len(page) < BEXIO_PAGE_SIZE:
+            return ids
+        offset += BEXIO_PAGE_SIZE
+
+
+def _offer_exists(offer_id) -> bool:
+    response = bexio_http_session.get(f"{BEXIO_API_BASE_URL}/2.0/kb_offer/{offer_id}", headers=_headers(), timeout=30)
+    if response.status_code == 404:
+        return False
+    response.raise_for_status()
+    return True
+
+
+def _remove_deleted_offers(data_dir: str) -> list:
+    """
+    Deletes the synced files of quotes that no longer exist in Bexio. Returns the removed paths.
+    A quote missing from the id listing is only treated as deleted after a 404 for it, as deletions during
+    the (offset-paged) listing can shift a quote out of it.
+    """
+    synced = {}
+    for filename in os.listdir(data_dir):
+        quote_id = filename[len(BEXIO_SYNC_FILE_PREFIX):-len(".json")]
+        if filename.startswith(BEXIO_SYNC_FILE_PREFIX) and filename.endswith(".json") and quote_id.isdigit():
+            synced[int(quote_id)] = os.path.join(data_dir, filename)
+    if not synced:
+        return []
+    existing = _all_offer_ids()
+    removed = []
+    for quote_id in sorted(synced.keys() - existing):
+        if not _offer_exists(quote_id):
+            os.remove(synced[quote_id])
+            removed.append(synced[quote_id])
+    return removed
+
+
+def _fetch_offer(offer_id) -> dict:
+    response = bexio_http_session.get(f"{BEXIO_API_BASE_URL}/2.0/kb_offer/{offer_id}", headers=_headers(), timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def _load_state(state_path: str) -> dict:
+    if not os.path.exists(state_path):
+        return {"cursor": None, "ids_at_cursor": [], "deletions_checked_at": 0}
+    with open(state_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_json_if_changed(path: str, data: dict) -> bool:
+    content = json.dumps(data, ensure_ascii=False, indent=2)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == content:
+                return False
+    tmp_path = f"{path}.tmp" # Not *.json, so the watcher never sees a half-written file
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def sync_bexio_offers(data_dir: str = DATA_DIR, state_path: str = BEXIO_SYNC_STATE_PATH, index: bool = True, full: bool = False) -> dict:
+    """
+    Syncs quotes changed since the stored cursor into `data_dir` and, every BEXIO_SYNC_DELETION_CHECK_SECONDS
+    (always with full=True), removes the files of quotes deleted in Bexio. With index=True the changed and
+    removed files are (re-)indexed right away (leave it False when the knowledge base watcher is running, it
+    picks them up). The cursor is only advanced after all changes were written, so a failed run is simply repeated.
+    Returns a summary dict, or an error dict.
+    """
+    if not BEXIO_API_TOKEN or BEXIO_API_TOKEN == "YOUR_BEXIO_API_TOKEN_PLACEHOLDER_IN_CONFIG":
+        return {"error": "BEXIO_API_TOKEN not configured"}
+    with sync_lock:
+        started_at = time.time()
+        state = _load_state(state_path)
+        if full:
+            state.update(cursor=None, ids_at_cursor=[])
+        cursor, ids_at_cursor = state["cursor"], set(state["ids_at_cursor"])
+        new_cursor, new_ids_at_cursor = cursor, set(ids_at_cursor)
+        deletions_checked_at = state.get("deletions_checked_at", 0)
+        check_deletions = full or (BEXIO_SYNC_DELETION_CHECK_SECONDS is not None and started_at - deletions_checked_at >= BEXIO_SYNC_DELETION_CHECK_SECONDS)
+        seen, changed_paths, removed_paths = 0, [], []
+        try:
+            for offer in _changed_offers(cursor):
+                updated_at = offer.get("updated_at")
+                if updated_at == cursor and offer["id"] in ids_at_cursor:
+                    continue # Already synced in the last run (same-second updates share the cursor value)
+                seen += 1
+                path = os.path.join(data_dir, f"{BEXIO_SYNC_FILE_PREFIX}{offer['id']}.json")
+                if _write_json_if_changed(path, convert_bexio_offer(_fetch_offer(offer["id"]))):
+                    changed_paths.append(path)
+                if updated_at and (new_cursor is None or updated_at > new_cursor):
+                    new_cursor, new_ids_at_cursor = updated_at, set()
+                if updated_at == new_cursor:
+                    new_ids_at_cursor.add(offer["id"])
+            if check_deletions:
+                removed_paths = _remove_deleted_offers(data_dir)
+                deletions_checked_at = started_at
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error: Bexio sync failed after {seen} quote(s): {e}")
+            if index and changed_paths:
+                index_offer_files(changed_paths)
+            return {"error": "BEXIO_SYNC_FAILED", "details": str(e)}
+
+        if index and changed_paths:
+            index_offer_files(changed_paths)
+        if index and removed_paths:
+            remove_offer_files(removed_paths)
+        with open(state_path, 'w', encoding='utf-8') as f:
+            json.dump({"cursor": new_cursor, "ids_at_cursor": sorted(new_ids_at_cursor), "deletions_checked_at": deletions_checked_at}, f)
+        last_sync_result.clear()
+        last_sync_result.update({
+            "synced_at": time.time(), "duration_seconds": round(time.time() - started_at, 2),
+            "quotes_seen": seen, "files_changed": len(changed_paths), "files_removed": len(removed_paths), "cursor": new_cursor,
+        })
+        print(f"Bexio sync: {seen} changed quote(s), {len(changed_paths)} offer file(s) written, {len(removed_paths)} removed (cursor {new_cursor}).")
+        return dict(last_sync_result)
+
+
+def start_periodic_sync(interval_seconds: float, stop_event: threading.Event, data_dir: str = DATA_DIR, index: bool = True):
+    """Runs sync_bexio_offers every `interval_seconds` in a daemon thread until `stop_event` is set."""
+    def loop():
+        while not stop_event.wait(interval_seconds):
+            sync_bexio_offers(data_dir, index=index)
+    thread = threading.Thread(target=loop, name="bexio-sync", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync quotes changed in Bexio into the offers knowledge base.")
+    parser.add_argument("--full", action="store_true", help="Ignore the stored cursor, sync all quotes and remove deleted ones.")
+    parser.add_argument("--no-index", action="store_true", help="Only write the offer files (e.g. while the server's watcher runs).")
+    args = parser.parse_args()
+    print(json.dumps(sync_bexio_offers(index=not args.no_index, full=args.full), indent=2))
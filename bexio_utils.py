@@ -8,16 +8,19 @@ import re
 
 # Assuming config_data.py will store these constants
 from config_data import (
-    BEXIO_API_TOKEN, BEXIO_API_URL, BEXIO_USER_ID, BEXIO_CONTACT_ID, BEXIO_CURRENCY_ID,
-    BEXIO_LANGUAGE_ID, BEXIO_MWST_TYPE, BEXIO_MWST_IS_NET, BEXIO_UNIT_ID_HOURS,
-    BEXIO_ACCOUNT_ID_SERVICES, BEXIO_TAX_ID_STANDARD, BEXIO_BANK_ACCOUNT_ID,
+    BEXIO_API_TOKEN, BEXIO_API_URL, BEXIO_CURRENCY_ID,
+    BEXIO_LANGUAGE_ID, BEXIO_MWST_TYPE, BEXIO_MWST_IS_NET, BEXIO_BANK_ACCOUNT_ID,
     BEXIO_PAYMENT_TYPE_ID, BEXIO_LOGOPAPER_ID, BEXIO_TEMPLATE_SLUG,
     BEXIO_DOCUMENT_NR, BEXIO_SHOW_POSITION_TAXES
 )
+from bexio_master_data import resolve_quote_ids
+from cassette import cassette
 
+# Shared HTTP session: keeps the TLS connection to Bexio alive between quotes (relevant in server mode)
+bexio_http_session = cassette.mount(requests.Session())
 
 
-def transform_to_bexio_format(llm_offer_json):
+def transform_to_bexio_format(llm_offer_json, discount_in_percent=None, client_name=None):
     """
     Transforms the AI-generated offer JSON (which includes project title and positions)
     into the JSON format required by the Bexio "Create quote" API.
@@ -41,6 +44,9 @@ def transform_to_bexio_format(llm_offer_json):
                     ...
                 ]
             }
+        discount_in_percent (float, optional): Volume discount applied to every Offer Position.
+        client_name (str, optional): Client of the offer; the quote goes to the matching Bexio contact
+            (cached master data, see bexio_master_data.py), otherwise to BEXIO_CONTACT_ID.
 
     Returns:
         dict: The payload ready for the Bexio API, or None if essential data is missing.
@@ -55,6 +61,7 @@ def transform_to_bexio_format(llm_offer_json):
         return None
 
     project_title = llm_offer_json.get("project_title", "Offer") # Default title if missing
+    bexio_ids = resolve_quote_ids(client_name)
     llm_positions = llm_offer_json.get("positions", [])
 
     bexio_api_positions = []
@@ -77,12 +84,12 @@ def transform_to_bexio_format(llm_offer_json):
             bexio_item = {
                 "type": "KbPositionCustom",
                 "amount": "1",
-                "unit_id": BEXIO_UNIT_ID_HOURS,
-                "account_id": BEXIO_ACCOUNT_ID_SERVICES,
-                "tax_id": BEXIO_TAX_ID_STANDARD,
+                "unit_id": bexio_ids["unit_id"],
+                "account_id": bexio_ids["account_id"],
+                "tax_id": bexio_ids["tax_id"],
                 "text": position_text,
                 "unit_price": str(total_position_price),
-                "discount_in_percent": None,
+                "discount_in_percent": str(discount_in_percent) if discount_in_percent else None,
             }
             bexio_api_positions.append(bexio_item)
         elif pos_type == "Text Position":
@@ -109,8 +116,8 @@ def transform_to_bexio_format(llm_offer_json):
 
     payload = {
         "title": project_title,
-        "contact_id": BEXIO_CONTACT_ID, 
-        "user_id": BEXIO_USER_ID, 
+        "contact_id": bexio_ids["contact_id"],
+        "user_id": bexio_ids["user_id"],
         # "logopaper_id": BEXIO_LOGOPAPER_ID, # Often specific to Bexio setup, can be optional
         "language_id": BEXIO_LANGUAGE_ID, # e.g., 1 for German, 2 for English
         "bank_account_id": BEXIO_BANK_ACCOUNT_ID, # Default bank account
@@ -186,7 +193,7 @@ def create_bexio_quote(bexio_payload):
     }
 
     try:
-        response = requests.post(BEXIO_API_URL, data=json.dumps(bexio_payload), headers=headers, timeout=30)
+        response = bexio_http_session.post(BEXIO_API_URL, data=json.dumps(bexio_payload), headers=headers, timeout=30)
         response.raise_for_status() # Raises an HTTPError for bad responses (4XX or 5XX)
         print(f"Bexio API Response Status: {response.status_code}")
         response_json = response.json()
@@ -0,0 +1,102 @@
+# bulk_draft.py
+#
+# Offline bulk drafting through the OpenAI Batch API (cheaper, and not bound by the synchronous rate limits).
+# Input is a JSON array of offer sessions, each a high-level info dict plus a "session_id":
+#
+#   [{"session_id": "acme-2025-01", "client_name": "...", "client_industry": "...", "project_title": "...",
+#     "key_services_description": "...", "language": "German", "structure": [...optional confirmed structure...]}]
+#
+#   python3 bulk_draft.py offers.json --stage structure --out structures.json
+#   python3 bulk_draft.py structures.json --stage draft --out drafts.json
+#
+# The output is the same array with "proposed_structure" (stage structure) or "draft" (stage draft) filled in,
+# so the result of the structure stage can be reviewed and fed into the draft stage.
+
+import json
+import argparse
+
+import offer_workflow as ow
+import prompt_templates as pt
+from config_data import DATA_DIR, LLM_BATCH_POLL_SECONDS
+from llm_utils import build_batch_request, run_batch
+from hours_estimator import apply_hours_estimates
+
+SESSION_ONLY_KEYS = ["session_id", "structure", "proposed_structure", "draft", "error"]
+
+
+def session_info(session: dict) -> dict:
+    info = {key: value for key, value in session.items() if key not in SESSION_ONLY_KEYS}
+    info.setdefault("client_research_summary", "No client research performed.")
+    info.setdefault("offer_focused_research_summary", "No offer-focused research performed.")
+    return info
+
+
+def structure_request(session: dict) -> dict:
+    info = session_info(session)
+    messages = ow.build_structure_proposal_messages(
+        info, ow.retrieve_overall_context(info), info["client_research_summary"], info["offer_focused_research_summary"]
+    )
+    return build_batch_request(f"{session['session_id']}__structure", messages)
+
+
+def draft_request(session: dict) -> dict:
+    info = session_info(session)
+    structure = session.get("structure") or session.get("proposed_structure")
+    if not info.get("positions_details"):
+        if not isinstance(structure, list) or not structure:
+            raise ValueError(f"Session '{session['session_id']}' has no structure to draft.")
+        ow.confirm_offer_structure(info, structure) # Adds the terms text position and prices all positions
+        session["positions_details"] = info["positions_details"]
+        session["pricing_summary"] = info["pricing_summary"]
+    system_prompt, user_prompt = ow.construct_final_drafting_prompts(
+        info, ow.retrieve_overall_context(info), info["client_research_summary"], info["offer_focused_research_summary"]
+    )
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+    return build_batch_request(f"{session['session_id']}__draft", messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk structure proposals or drafts via the OpenAI Batch API.")
+    parser.add_argument("sessions", help="JSON file with an array of offer sessions (each with a unique 'session_id').")
+    parser.add_argument("--stage", choices=["structure", "draft"], required=True)
+    parser.add_argument("--out", required=True, help="Where to write the sessions with their results.")
+    parser.add_argument("--poll-seconds", type=float, default=LLM_BATCH_POLL_SECONDS)
+    args = parser.parse_args()
+
+    with open(args.sessions, 'r', encoding='utf-8') as f:
+        sessions = json.load(f)
+    ow.load_and_vectorize_offers(DATA_DIR)
+
+    build_request = structure_request if args.stage == "structure" else draft_request
+    prompt_name = pt.PROPOSE_STRUCTURE.name if args.stage == "structure" else pt.DRAFT_OFFER.name
+    requests, skipped = [], 0
+    for session in sessions:
+        try:
+            requests.append(build_request(session))
+        except ValueError as e:
+            print(f"Warning: {e} Skipping it.")
+            session["error"] = str(e)
+            skipped += 1
+    print(f"Prepared {len(requests)} {args.stage} requests ({skipped} skipped).")
+
+    results = run_batch(requests, description=f"bulk {args.stage}", prompt_name=prompt_name, poll_seconds=args.poll_seconds) if requests else {}
+    failed = 0
+    for session in sessions:
+        result = results.get(f"{session['session_id']}__{args.stage}")
+        if result is None:
+            continue
+        if args.stage == "structure":
+            if isinstance(result, list):
+                apply_hours_estimates(result, session.get("client_industry"))
+            session["proposed_structure"] = result
+        else:
+            session["draft"] = result
+        failed += isinstance(result, dict) and "error" in result
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(sessions, f, ensure_ascii=False, indent=2)
+    print(f"Wrote {len(sessions)} sessions to {args.out} ({failed} failed requests).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+# cassette.py
+#
+# Record/replay of all network I/O of the workflow: OpenAI chat completions (llm_utils.py), OpenRouter research
+# (research_utils.py) and the Bexio API (bexio_utils.py, bexio_master_data.py, bexio_sync.py).
+#   CASSETTE_MODE=off      normal operation
+#   CASSETTE_MODE=record   every request goes out as usual; its response (or transport error) and the time it took
+#                          are appended to CASSETTE_PATH
+#   CASSETTE_MODE=replay   nothing goes out: responses come from CASSETTE_PATH, after the recorded time
+#                          (CASSETTE_REPLAY_LATENCY=real) or at once (zero)
+# The layer sits below the clients - an httpx transport under the OpenAI SDK, a requests adapter under the Bexio
+# sessions - so SDK retries, error types from status codes and the rate limit headers seen by the governor behave
+# in a replay exactly as in the recorded run.
+#
+# Requests are matched by method, URL and body (credentials are neither matched nor stored). Identical requests
+# get their responses in recorded order; a request whose body changed (e.g. a date in a Bexio quote) gets the next
+# unused response recorded for the same method and URL, with a warning. A request that is not in the cassette
+# fails like a connection error.
+#
+# Usage:
+#   CASSETTE_MODE=record CASSETTE_PATH=cassettes/acme.jsonl.gz python3 main.py
+#   CASSETTE_MODE=replay CASSETTE_PATH=cassettes/acme.jsonl.gz python3 main.py   # same inputs, no network
+# OPENROUTER_API_KEY and BEXIO_API_TOKEN decide whether research and the Bexio export run at all, so a replay needs
+# them set (any value) if they were set when recording. The Batch API (bulk_draft.py) is not recorded.
+
+import io
+import os
+import json
+import gzip
+import time
+import atexit
+import base64
+import asyncio
+import hashlib
+import threading
+from collections import deque
+from datetime import datetime
+
+import requests
+try:
+    import httpx2 as httpx # openai >= 3 is built on httpx2, older versions on httpx (same API)
+except ImportError:
+    import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+from config_data import CASSETTE_MODE, CASSETTE_PATH, CASSETTE_REPLAY_LATENCY
+
+# Not stored: the body is stored decoded, and these would describe the encoded body
+DROPPED_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "set-cookie"}
+
+
+def request_key(method: str, url: str, body) -> str:
+    """Hash of method, URL and body. JSON bodies are compared with sorted keys, so key order does not matter."""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    body = body or b""
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return hashlib.sha256(f"{method.upper()} {url}\n".encode("utf-8") + body).hexdigest()[:32]
+
+
+def _encode_content(content: bytes) -> dict:
+    try:
+        return {"content": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"content_b64": base64.b64encode(content).decode("ascii")}
+
+
+def _decode_content(entry: dict) -> bytes:
+    if "content_b64" in entry:
+        return base64.b64decode(entry["content_b64"])
+    return entry.get("content", "").encode("utf-8")
+
+
+def _kept_headers(headers) -> dict:
+    return {name.lower(): value for name, value in headers.items() if name.lower() not in DROPPED_RESPONSE_HEADERS}
+
+
+class Cassette:
+    """One cassette file. Thread-safe; the module-level `cassette` is shared by all clients."""
+
+    def __init__(self, mode: str = CASSETTE_MODE, path: str = CASSETTE_PATH, replay_latency: str = CASSETTE_REPLAY_LATENCY):
+        if mode not in ("off", "record", "replay"):
+            raise ValueError(f"CASSETTE_MODE must be 'off', 'record' or 'replay', not '{mode}'.")
+        self.mode = mode
+        self.path = path
+        self.replay_latency = replay_latency
+        self.lock = threading.Lock()
+        self.file = None
+        self.entries = None  # Replay: all recorded entries, in recorded order
+        self.by_key = {}     # request key -> deque of entry indexes
+        self.by_route = {}   # (method, url) -> deque of entry indexes
+        self.used = set()
+        self.stats = {"recorded": 0, "replayed": 0, "replayed_by_url": 0, "misses": 0}
+
+    # --- RECORDING ---
+    def record(self, method: str, url: str, body, elapsed: float, status: int = None, reason: str = None,
+               headers=None, content: bytes = None, error: BaseException = None, cancelled: bool = False):
+        entry = {"key": request_key(method, url, body), "method": method.upper(), "url": url, "elapsed": round(elapsed, 4)}
+        if cancelled:
+            entry["cancelled"] = True
+        elif error is not None:
+            entry["error"] = {"type": type(error).__name__, "message": str(error)}
+        else:
+            entry.update(status=status, reason=reason, headers=_kept_headers(headers or {}), **_encode_content(content or b""))
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self.lock:
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self.file = gzip.open(self.path, "wt", encoding="utf-8") if self.path.endswith(".gz") else open(self.path, "w", encoding="utf-8")
+                self.file.write(json.dumps({"cassette": 1, "recorded_at": datetime.now().isoformat(timespec="seconds")}) + "\n")
+                atexit.register(self.close)
+            self.file.write(line)
+            self.file.flush() # A crashed run still leaves a usable cassette
+            self.stats["recorded"] += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    # --- REPLAY ---
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"CASSETTE_MODE=replay, but there is no cassette at {self.path}. Record one with CASSETTE_MODE=record.")
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "rt", encoding="utf-8") as f:
+            entries = [entry for entry in (json.loads(line) for line in f if line.strip()) if "key" in entry]
+        for index, entry in enumerate(entries):
+            self.by_key.setdefault(entry["key"], deque()).append(index)
+            self.by_route.setdefault((entry["method"], entry["url"]), deque()).append(index)
+        self.entries = entries
+        print(f"Replaying {len(entries)} recorded request(s) from {self.path} ({self.replay_latency} latency).")
+
+    def _next_unused(self, indexes: deque):
+        while indexes and indexes[0] in self.used:
+            indexes.popleft()
+        return indexes.popleft() if indexes else None
+
+    def lookup(self, method: str, url: str, body):
+        """The recorded entry for this request, or None if the cassette has no (unused) response for it."""
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            index = self._next_unused(self.by_key.get(request_key(method, url, body), deque()))
+            by_url = index is None
+            if by_url:
+                index = self._next_unused(self.by_route.get((method.upper(), url), deque()))
+            if index is None:
+                self.stats["misses"] += 1
+                return None
+            self.used.add(index)
+            self.stats["replayed"] += 1
+            self.stats["replayed_by_url"] += int(by_url)
+        if by_url:
+            print(f"Warning: {method.upper()} {url} was not recorded with this body; replaying the next response recorded for the URL.")
+        return self.entries[index]
+
+    def replay_delay(self, entry: dict) -> float:
+        return entry["elapsed"] if self.replay_latency == "real" else 0.0
+
+    def miss_message(self, method: str, url: str) -> str:
+        return f"{method.upper()} {url} is not in the cassette {self.path} (replay mode, no network)."
+
+    # --- CLIENT HOOKS (no-ops with CASSETTE_MODE=off) ---
+    def http_client(self):
+        """httpx client for OpenAI(http_client=...), or None for the SDK default."""
+        if self.mode == "off":
+            return None
+        from openai import DefaultHttpxClient
+        return DefaultHttpxClient(transport=CassetteTransport(self))
+
+    def async_http_client(self):
+        """httpx client for AsyncOpenAI(http_client=...), or None for the SDK default."""
+        if self.mode == "off":
+            return None
+        from openai import DefaultAsyncHttpxClient
+        return DefaultAsyncHttpxClient(transport=AsyncCassetteTransport(self))
+
+    def mount(self, session: requests.Session) -> requests.Session:
+        """Routes all requests of `session` through the cassette."""
+        if self.mode != "off":
+            adapter = CassetteAdapter(self)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        return session
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return dict(self.stats, mode=self.mode, path=self.path if self.mode != "off" else None)
+
+
+# --- HTTPX (OpenAI SDK, sync and async) ---
+def _httpx_response(entry: dict, request: httpx.Request) -> httpx.Response:
+    if "error" in entry or entry.get("cancelled"):
+        error = entry.get("error") or {"type": "ReadTimeout", "message": "No response: the request was abandoned while recording."}
+        error_class = getattr(httpx, error["type"], None)
+        if not (isinstance(error_class, type) and issubclass(error_class, httpx.TransportError)):
+            error_class = httpx.TransportError
+        raise error_class(error["message"], request=request)
+    return httpx.Response(entry["status"], headers=entry["headers"], content=_decode_content(entry), request=request)
+
+
+class CassetteTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+        self.live = httpx.HTTPTransport() if cassette.mode == "record" else None
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        if self.live is None:
+            entry = self.cassette.lookup(request.method, str(request.url), body)
+            if entry is None:
+                raise httpx.ConnectError(self.cassette.miss_message(request.method, str(request.url)), request=request)
+            time.sleep(self.cassette.replay_delay(entry))
+            return _httpx_response(entry, request)
+        start = time.perf_counter()
+        try:
+            response = self.live.handle_request(request)
+            response.read()
+        except httpx.TransportError as e:
+            self.cassette.record(request.method, str(request.url), body, time.perf_counter() - start, error=e)
+            raise
+        self.cassette.record(request.method, str(request.url), body, time.perf_counter() - start, response.status_code,
+                             response.reason_phrase, response.headers, response.content)
+        return response
+
+    def close(self):
+        if self.live is not None:
+            self.live.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+        self.live = httpx.AsyncHTTPTransport() if cassette.mode == "record" else None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        if self.live is None:
+            entry = self.cassette.lookup(request.method, str(request.url), body)
+            if entry is None:
+                raise httpx.ConnectError(self.cassette.miss_message(request.method, str(request.url)), request=request)
+            await asyncio.sleep(self.cassette.replay_delay(entry))
+            return _httpx_response(entry, request)
+        start = time.perf_counter()
+        try:
+            response = await self.live.handle_async_request(request)
+            await response.aread()
+        except httpx.TransportError as e:
+            self.cassette.record(request.method, str(request.url), body, time.perf_counter() - start, error=e)
+            raise
+        except asyncio.CancelledError: # The losing request of a hedged research call
+            self.cassette.record(request.method, str(request.url), body, time.perf_counter() - start, cancelled=True)
+            raise
+        self.cassette.record(request.method, str(request.url), body, time.perf_counter() - start, response.status_code,
+                             response.reason_phrase, response.headers, response.content)
+        return response
+
+    async def aclose(self):
+        if self.live is not None:
+            await self.live.aclose()
+
+
+# --- REQUESTS (Bexio) ---
+class CassetteAdapter(HTTPAdapter):
+    def __init__(self, cassette: Cassette):
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        if self.cassette.mode == "replay":
+            entry = self.cassette.lookup(request.method, request.url, request.body)
+            if entry is None:
+                raise requests.exceptions.ConnectionError(self.cassette.miss_message(request.method, request.url), request=request)
+            time.sleep(self.cassette.replay_delay(entry))
+            if "error" in entry:
+                error_class = getattr(requests.exceptions, entry["error"]["type"], None)
+                if not (isinstance(error_class, type) and issubclass(error_class, requests.exceptions.RequestException)):
+                    error_class = requests.exceptions.ConnectionError
+                raise error_class(entry["error"]["message"], request=request)
+            raw = HTTPResponse(body=io.BytesIO(_decode_content(entry)), headers=entry["headers"], status=entry["status"],
+                               reason=entry.get("reason"), preload_content=False)
+            return self.build_response(request, raw)
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+            content = response.content
+        except requests.exceptions.RequestException as e:
+            self.cassette.record(request.method, request.url, request.body, time.perf_counter() - start, error=e)
+            raise
+        self.cassette.record(request.method, request.url, request.body, time.perf_counter() - start, response.status_code,
+                             response.reason, response.headers, content)
+        return response
+
+
+cassette = Cassette()
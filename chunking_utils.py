@@ -0,0 +1,64 @@
+# chunking_utils.py
+
+import re
+
+BULLET_PATTERN = re.compile(r'^[-*•]\s+')
+
+
+def split_description_units(description: str) -> list:
+    """
+    Splits a position description into its natural units: one unit per bullet line,
+    one per paragraph of normal text (consecutive non-bullet lines are kept together).
+    """
+    units = []
+    paragraph = []
+    for line in description.splitlines():
+        stripped = line.strip()
+        if BULLET_PATTERN.match(stripped):
+            if paragraph:
+                units.append(" ".join(paragraph))
+                paragraph = []
+            units.append(stripped)
+        elif stripped:
+            paragraph.append(stripped)
+        elif paragraph: # Blank line ends the paragraph
+            units.append(" ".join(paragraph))
+            paragraph = []
+    if paragraph:
+        units.append(" ".join(paragraph))
+    return units
+
+
+def chunk_description(description: str, max_words: int = 120, overlap_units: int = 1) -> list:
+    """
+    Packs the units of a description greedily into chunks of at most `max_words` words.
+    The last `overlap_units` units of a chunk are repeated at the start of the next one,
+    so a bullet that depends on its neighbour is still found together with it.
+    A single unit longer than `max_words` is split on word boundaries.
+    Returns the chunk texts (bullets separated by newlines, as in the original description).
+    """
+    units = []
+    for unit in split_description_units(description):
+        words = unit.split()
+        if len(words) <= max_words:
+            units.append(unit)
+        else:
+            units.extend(" ".join(words[i:i + max_words]) for i in range(0, len(words), max_words))
+
+    chunks = []
+    current = []
+    current_words = 0
+    for unit in units:
+        unit_words = len(unit.split())
+        if current and current_words + unit_words > max_words:
+            chunks.append("\n".join(current))
+            current = current[-overlap_units:] if overlap_units > 0 else []
+            current_words = sum(len(u.split()) for u in current)
+            # Drop overlap if it alone would push the new unit over the limit
+            while current and current_words + unit_words > max_words:
+                current_words -= len(current.pop(0).split())
+        current.append(unit)
+        current_words += unit_words
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
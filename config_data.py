@@ -10,17 +10,162 @@ INTERNAL_HOURLY_RATES = {
 
 TYPICAL_SERVICE_AREAS = list(INTERNAL_HOURLY_RATES.keys())
 
+# --- PRICING ---
+# Per-client rate overrides (matched case-insensitively on the client name), applied on top of INTERNAL_HOURLY_RATES.
+CLIENT_RATE_OVERRIDES = {
+    # "Example Client AG": {"Strategy & Concept": 90},
+}
+# Volume discount by offer subtotal: (from subtotal in CHF, discount in percent). Empty list = no discounts.
+VOLUME_DISCOUNT_TIERS = [
+    # (20000, 3),
+    # (50000, 5),
+]
+VAT_RATE_PERCENT = 8.1                  # Standard Swiss VAT rate, should match BEXIO_TAX_ID_STANDARD
+TOTAL_ROUNDING_RAPPEN = 5               # Round document totals to 5 Rappen (1 = no extra rounding)
+
+# --- HISTORICAL HOURS ESTIMATOR ---
+HOURS_NEIGHBOURS = 5                    # Similar past positions used to estimate hours of a proposed position
+HOURS_OUTLIER_FACTOR = 2.0              # Flag suggestions above 2x the typical high (p75) or below half the typical low (p25)
+HOURS_INDEX_CHECK_SECONDS = 30.0        # The offer files are checked for changes at most this often (one directory scan per check)
+
 # --- LLM MODELS ---
 LLM_MODEL_CHAT = "gpt-4.1"
 LLM_MODEL_JSON_DRAFT = "gpt-4.1"
 
+# --- MODEL ROUTING ---
+# Each workflow step (prompt name) runs on a model tier; steps not listed use LLM_MODEL_CHAT / LLM_MODEL_JSON_DRAFT. Small-tier output that fails validation (invalid JSON,
+# wrong schema, edit operations that cannot be applied) is retried once on LLM_ESCALATION_TIER.
+LLM_MODEL_TIERS = {"small": "gpt-4.1-mini", "large": LLM_MODEL_JSON_DRAFT}
+LLM_STEP_TIERS = {
+    "project_title": "small",
+    "propose_structure": "small",
+    "edit_structure": "small",
+    "draft_introduction": "small",
+    "draft_position": "large",
+    "draft_offer": "large",
+}
+LLM_STEP_MODEL_OVERRIDES = {}           # Step -> model name, wins over the tier, e.g. {"propose_structure": "gpt-4.1"}
+LLM_ESCALATION_TIER = "large"           # None = no escalation
+
+# --- OFFER BUDGET ---
+# Limits per offer (CLI run or server session), tracked over all LLM and research calls. From OFFER_BUDGET_DEGRADE_AT
+# of any limit on, the workflow degrades: cheaper models, no external research, fewer JSON retries, smaller retrieval context.
+OFFER_BUDGET_MAX_TOKENS = 500000        # Prompt + completion tokens (0 = no limit)
+OFFER_BUDGET_MAX_USD = 2.00             # Estimated cost from LLM_PRICES_USD_PER_1M_TOKENS (0 = no limit)
+OFFER_BUDGET_MAX_SECONDS = 600          # Wall-clock time spent in model calls, overlapping calls counted once (0 = no limit)
+OFFER_BUDGET_DEGRADE_AT = 0.8
+OFFER_BUDGET_FALLBACK_MODELS = {"gpt-4.1": "gpt-4.1-mini"} # Used instead of the key once the offer is degraded
+OFFER_BUDGET_DEGRADED_CONTEXT = 2       # Past positions retrieved (overall and per drafted position) once degraded
+OFFER_BUDGET_HARD_STOP = False          # True: LLM calls fail with OFFER_BUDGET_EXCEEDED once a limit is reached
+# USD per 1M tokens: (input, cached input, output). "default" is used for models not listed.
+LLM_PRICES_USD_PER_1M_TOKENS = {
+    "default": (2.00, 0.50, 8.00),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "perplexity/sonar-pro": (3.00, 3.00, 15.00),
+    "perplexity/sonar": (1.00, 1.00, 1.00),
+    "perplexity/sonar-deep-research": (2.00, 2.00, 8.00),
+}
+
+# --- FINAL DRAFTING ---
+DRAFT_MODE = "parallel"                 # "parallel" (one concurrent call per position) | "single" (one call for the whole offer)
+DRAFT_MAX_WORKERS = 8                   # Concurrent position drafting calls
+DRAFT_CONTEXT_PER_POSITION = 3          # Past positions retrieved as context for each drafted position
+
+# --- RATE LIMITS ---
+# Requests and tokens per minute per model (set these to your organization's limits; the governor also
+# adapts to the x-ratelimit-* headers of every response). "default" is used for models not listed.
+LLM_RATE_LIMITS = {
+    "default": {"rpm": 500, "tpm": 30000},
+    "gpt-4.1": {"rpm": 500, "tpm": 30000},
+    "gpt-4.1-mini": {"rpm": 500, "tpm": 200000},
+    "perplexity/sonar-pro": {"rpm": 50, "tpm": 1000000},
+    "perplexity/sonar": {"rpm": 50, "tpm": 1000000},
+    "perplexity/sonar-deep-research": {"rpm": 5, "tpm": 1000000},
+}
+RATE_LIMIT_SAFETY_FACTOR = 0.9          # Stay at 90% of the limits
+RATE_LIMIT_STATE_PATH = None            # e.g. "rate_limits.sqlite" to share the budget between processes on this machine
+RATE_LIMIT_MAX_REQUEUES = 8             # 429 responses a single call waits out before it is reported as failed
+
+# --- BATCH API (offline bulk drafting, see bulk_draft.py) ---
+LLM_BATCH_BASE_URL = os.getenv("LLM_BATCH_BASE_URL") # None = OpenAI; e.g. "http://127.0.0.1:8766/v1" for batch_stand_in_server.py
+LLM_BATCH_DIR = "batches"               # Where batch input files (JSONL) are written
+LLM_BATCH_MAX_REQUESTS = 50000          # OpenAI limit per batch file
+LLM_BATCH_POLL_SECONDS = 30.0
+
 # --- DATA DIRECTORIES ---
 DATA_DIR = "data/offers_knowledge_base"
+CORPUS_SNAPSHOT_DIR = "vector_store/corpus_snapshot" # Memory-mapped columnar copy of DATA_DIR, rebuilt when an offer file changes
+
+# --- EMBEDDINGS ---
+# Most offers are written in German, so the default is a multilingual model. Other options, e.g.:
+#   "all-MiniLM-L6-v2"                       English only, fastest
+#   "paraphrase-multilingual-MiniLM-L12-v2"  German/English/French/Italian, 384 dims
+#   "intfloat/multilingual-e5-small"         Multilingual, 384 dims, stronger retrieval quality
+# The model id is stored with the vector index; changing it here triggers a re-embed on next start.
+EMBEDDING_MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_RUNTIME = "torch"             # "torch" | "onnx" (ONNX Runtime on CPU, needs sentence-transformers[onnx])
+EMBEDDING_ONNX_QUANTIZED = True         # Use a dynamically int8-quantized ONNX model (only for runtime "onnx")
+EMBEDDING_ONNX_QUANTIZATION_CONFIG = "avx2"  # "avx2" | "avx512" | "avx512_vnni" | "arm64" - match the CPU of the host
+EMBEDDING_BATCH_TOKEN_BUDGET = 16384    # Max padded tokens (batch size x longest text) per encoder batch
+EMBEDDING_MAX_BATCH_SIZE = 128
+# Full index builds can encode in several worker processes, each with its own model copy and a fixed number of
+# intra-op threads (one process per core scales better than one process with many threads).
+EMBEDDING_WORKERS = 0                   # Encoder processes for full builds (0/1 = encode in-process; e.g. cores / threads per worker)
+EMBEDDING_THREADS_PER_WORKER = 1        # Torch / ONNX Runtime threads per worker process
+EMBEDDING_SHARD_SIZE = 2048             # Consecutive texts per work unit (length-sorted batches within a shard)
+
+# --- CHUNKING ---
+# Long position descriptions are split on bullets/paragraphs before embedding, because the
+# encoder truncates its input (256 tokens for MiniLM). Retrieval returns the whole parent position.
+CHUNK_MAX_WORDS = 120                   # ~ 180-250 tokens for German text
+CHUNK_OVERLAP_UNITS = 1                 # Bullets/paragraphs repeated from the previous chunk
+CHUNK_QUERY_OVERSAMPLE = 4              # Chunks fetched per requested parent position before de-duplication
+
+# --- VECTOR STORE ---
+VECTOR_BACKEND = "chroma"               # "chroma" (SQLite + HNSW) | "memmap" (quantized, memory-mapped flat/IVF index)
+MEMMAP_INDEX_DTYPE = "int8"             # "int8" (4x smaller than float32) | "float16"
+MEMMAP_IVF_NLIST = 0                    # 0 = exact search. For large archives (>100k vectors) e.g. 1024 clusters.
+MEMMAP_IVF_NPROBE = 8                   # Number of IVF clusters scanned per query (only used if MEMMAP_IVF_NLIST > 0)
+MEMMAP_GENERATION_GRACE_SECONDS = 300   # Files of a replaced memmap generation are kept this long for readers in other processes
+QUERY_EMBEDDING_CACHE_SIZE = 1024       # Query embeddings kept in memory (LRU, 0 = off)
+QUERY_RESULT_CACHE_SIZE = 256           # Retrieval results kept in memory until the index changes (LRU, 0 = off)
+
+# --- SERVER MODE ---
+SERVER_HOST = "127.0.0.1"               # Use "0.0.0.0" only inside a trusted network - the API has no authentication
+SERVER_PORT = 8765
+SERVER_SESSION_IDLE_SECONDS = 3600      # Sessions unused this long are dropped from memory (restored from the session store on the next request)
+
+# --- SESSION STORE ---
+# Sessions, stage outputs, LLM calls (tokens, latency), drafts and Bexio exports of CLI runs and server sessions
+SESSION_STORE_PATH = "sessions.sqlite3"  # SQLite file (WAL mode); None disables recording
+SESSION_STORE_FLUSH_SECONDS = 0.5       # Queued rows are committed in one transaction at most this long after being recorded
+SESSION_STORE_MAX_BATCH = 500           # ...or as soon as this many rows are queued
+
+# --- RECORD / REPLAY (see cassette.py) ---
+# Records all OpenAI, OpenRouter and Bexio traffic of a run, or replays it without network
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off")           # "off", "record" or "replay"
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassettes/offer_run.jsonl.gz")  # JSON lines, gzip-compressed if the name ends in .gz
+CASSETTE_REPLAY_LATENCY = os.getenv("CASSETTE_REPLAY_LATENCY", "zero")      # "real" = answer after the recorded time, "zero" = at once
+
+# --- KNOWLEDGE BASE WATCHER (server mode) ---
+KB_WATCH_ENABLED = True                 # Re-index new/changed/deleted offer files in DATA_DIR in the background
+KB_WATCH_DEBOUNCE_SECONDS = 1.0         # Wait until no new file events arrived for this long...
+KB_WATCH_MAX_DELAY_SECONDS = 10.0       # ...but never delay a change longer than this
+KB_WATCH_POLL_INTERVAL_SECONDS = 2.0    # Only used if the optional 'watchdog' package (inotify) is not installed
+KB_WATCH_RETRY_SECONDS = 5.0           # A failed sync is retried after this long, doubling per consecutive failure...
+KB_WATCH_RETRY_MAX_SECONDS = 300.0      # ...up to this
 
 # --- EXTERNAL API CONFIGURATIONS ---
 # For OpenRouter/Perplexity Integration
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 PERPLEXITY_MODEL_NAME = "perplexity/sonar-pro" # QUALITY: perplexity/sonar-deep-research | QUICK: perplexity/sonar-pro
+PERPLEXITY_FALLBACK_MODEL_NAME = "perplexity/sonar" # Hedge model if PERPLEXITY_MODEL_NAME is slow or fails (must differ from it, else no hedging)
+RESEARCH_HEDGE_AFTER_SECONDS = 30.0     # Start the fallback model in parallel if the primary has not answered by then
+RESEARCH_DEADLINE_SECONDS = 120.0       # Hard upper bound per research call (primary and hedge together)
+RESEARCH_BRIEF_MODEL = "gpt-4.1-mini"   # Condenses the raw research into the structured brief used in all prompts
+RESEARCH_BRIEF_MAX_ITEMS = 5            # Max entries per list (key facts, challenges, opportunities, sources)
+RESEARCH_BRIEF_MAX_ITEM_CHARS = 240     # Max characters per entry
 
 
 def calculate_position_price(service_area: str, estimated_hours: float) -> dict:
@@ -84,3 +229,26 @@ BEXIO_TAX_ID_STANDARD = 67              # Tax ID for the standard VAT rate (e.g.
                                         # CRITICAL: Find this ID via Bexio API /3.0/taxes?types=sales_tax&scope=active
                                         # or in Bexio UI. An incorrect ID will cause errors.
                                         # Example: If you have a tax named "MWST 8.1% (Verkauf)" with ID 15, use 15.
+
+# --- BEXIO MASTER DATA (see bexio_master_data.py) ---
+# Contacts, taxes, units, accounts and users are fetched in bulk, cached locally and resolved by name,
+# so the IDs above can be given as names instead and each quote can go to the right client contact.
+BEXIO_API_BASE_URL = "https://api.bexio.com"
+BEXIO_MASTER_DATA_CACHE_PATH = "bexio_master_data.json"
+BEXIO_MASTER_DATA_TTL_SECONDS = 24 * 3600 # After this, the cache is revalidated (ETag) or refetched
+BEXIO_PAGE_SIZE = 2000                  # Max page size of the Bexio list endpoints
+BEXIO_NAME_MATCH_CUTOFF = 0.9           # Similarity (0-1) for fuzzy name matches (not contacts); 1.0 = exact (normalized) matches only
+BEXIO_CONTACT_BY_CLIENT_NAME = True     # Use the Bexio contact matching the offer's client name (BEXIO_CONTACT_ID if none matches)
+# Optional names resolved to IDs at runtime; None = use the IDs above.
+BEXIO_USER_NAME = None                  # e.g. "Omar ..." or the user's e-mail
+BEXIO_TAX_NAME_STANDARD = None          # e.g. "UN81", "MWST 8.1%" or just the rate "8.1" (active sales taxes only)
+BEXIO_UNIT_NAME_HOURS = None            # e.g. "Std." or "Stunden"
+BEXIO_ACCOUNT_NAME_SERVICES = None      # e.g. "3400" or "Dienstleistungserlöse"
+
+# --- BEXIO SYNC-BACK (see bexio_sync.py) ---
+# Quotes changed in Bexio since the last run are converted to the offer JSON schema and written to DATA_DIR.
+BEXIO_SYNC_STATE_PATH = "bexio_sync_state.json" # Stores the cursor (last synced updated_at)
+BEXIO_SYNC_INTERVAL_SECONDS = 0         # Server mode: sync every N seconds (0 = only via python3 bexio_sync.py)
+BEXIO_SYNC_FILE_PREFIX = "bexio_"       # Synced offers are written as bexio_<quote id>.json
+BEXIO_SYNC_DELETION_CHECK_SECONDS = 3600 # Quotes deleted in Bexio: all quote ids are listed at most this often and their files removed (None = never)
+BEXIO_OFFER_STATUS = {1: "draft", 2: "pending", 3: "won", 4: "lost"} # kb_item_status_id -> status stored with the offer
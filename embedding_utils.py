@@ -0,0 +1,161 @@
+# embedding_utils.py
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from config_data import (
+    EMBEDDING_MODEL_NAME, EMBEDDING_RUNTIME, EMBEDDING_ONNX_QUANTIZED, EMBEDDING_ONNX_QUANTIZATION_CONFIG,
+    EMBEDDING_BATCH_TOKEN_BUDGET, EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_WORKERS, EMBEDDING_THREADS_PER_WORKER,
+    EMBEDDING_SHARD_SIZE
+)
+
+ONNX_MODEL_CACHE_DIR = "models"
+
+
+class EmbeddingModel:
+    """
+    Thin wrapper around a SentenceTransformer (PyTorch or ONNX Runtime backend).
+
+    encode() sorts the input texts by token length and forms batches under a token budget
+    (dynamic batching with length bucketing), so short position descriptions are not padded
+    to the length of the longest one in the archive. Results are returned in input order.
+    `model_id` identifies model + runtime and is stored with the index to detect mixed-model indexes.
+    encode_shards() spreads large inputs over worker processes (EMBEDDING_WORKERS) for full index builds.
+    """
+
+    def __init__(self, model_name: str, runtime: str = "torch", quantized: bool = True, num_threads: int = 0):
+        self.model_name = model_name
+        self.runtime = runtime
+        self.quantized = quantized and runtime == "onnx"
+        if runtime == "torch":
+            if num_threads > 0:
+                import torch
+                torch.set_num_threads(num_threads)
+            self.model = SentenceTransformer(model_name)
+        elif runtime == "onnx":
+            self.model = _load_onnx_model(model_name, self.quantized, num_threads)
+        else:
+            raise ValueError(f"Unknown embedding runtime '{runtime}'. Use 'torch' or 'onnx'.")
+        self.model_id = f"{model_name}|{runtime}" + ("-qint8" if self.quantized else "")
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def token_lengths(self, texts: list) -> list:
+        tokenized = self.model.tokenizer(
+            texts, add_special_tokens=True, truncation=True, max_length=self.model.max_seq_length
+        )
+        return [len(ids) for ids in tokenized["input_ids"]]
+
+    def length_sorted_batches(self, texts: list) -> list:
+        """Splits indices into batches of similar token length that stay under EMBEDDING_BATCH_TOKEN_BUDGET."""
+        lengths = self.token_lengths(texts)
+        order = np.argsort(lengths, kind="stable")
+        batches, current, current_max = [], [], 0
+        for idx in order:
+            longest = max(current_max, lengths[idx])
+            # Padded size of the batch is (number of texts) x (longest text in the batch)
+            if current and (longest * (len(current) + 1) > EMBEDDING_BATCH_TOKEN_BUDGET or len(current) >= EMBEDDING_MAX_BATCH_SIZE):
+                batches.append(current)
+                current, longest = [], lengths[idx]
+            current.append(int(idx))
+            current_max = longest
+        if current:
+            batches.append(current)
+        return batches
+
+    def encode(self, texts, show_progress_bar: bool = False) -> np.ndarray:
+        if isinstance(texts, str): # Single query: no bucketing overhead
+            return self.model.encode(texts, convert_to_numpy=True).astype(np.float32)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        batches = self.length_sorted_batches(texts)
+        for batch_num, batch in enumerate(batches):
+            embeddings[batch] = self.model.encode(
+                [texts[i] for i in batch], batch_size=len(batch), convert_to_numpy=True
+            )
+            if show_progress_bar and (batch_num + 1) % 10 == 0:
+                print(f"  Embedded {batch_num + 1}/{len(batches)} batches...")
+        return embeddings
+
+    def encode_shards(self, texts: list, show_progress_bar: bool = False, workers: int = EMBEDDING_WORKERS,
+                      threads_per_worker: int = EMBEDDING_THREADS_PER_WORKER, shard_size: int = EMBEDDING_SHARD_SIZE):
+        """
+        Yields (start, embeddings) for consecutive shards of `texts`, in input order, so callers can write each
+        shard to the vector store while later shards are still being encoded. Every shard is encoded in
+        length-sorted batches. With workers > 1 (and at least two shards) the shards are spread over a pool of
+        spawned processes that each load the model once; otherwise they are encoded in this process.
+        """
+        shards = [(start, texts[start:start + shard_size]) for start in range(0, len(texts), shard_size)]
+        if workers <= 1 or len(shards) < 2:
+            for start, shard in shards:
+                yield start, self.encode(shard)
+                if show_progress_bar:
+                    print(f"  Embedded {min(start + shard_size, len(texts))}/{len(texts)} texts...")
+            return
+
+        workers = min(workers, len(shards))
+        print(f"  Encoding {len(shards)} shards in {workers} worker processes ({threads_per_worker} thread(s) each)...")
+        # "spawn": forking a process with initialized torch/ORT thread pools can deadlock
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_encode_worker,
+            initargs=(self.model_name, self.runtime, self.quantized, threads_per_worker)
+        ) as pool:
+            # map() submits all shards at once and returns results in submission order
+            for (start, shard), embeddings in zip(shards, pool.map(_encode_in_worker, [shard for _, shard in shards])):
+                yield start, embeddings
+                if show_progress_bar:
+                    print(f"  Embedded {start + len(shard)}/{len(texts)} texts...")
+
+
+# --- WORKER PROCESSES ---
+# Spawned workers import this module (and the entry script, guarded by __main__) and load their own model.
+_worker_model = None
+
+def _init_encode_worker(model_name: str, runtime: str, quantized: bool, num_threads: int):
+    global _worker_model
+    _worker_model = EmbeddingModel(model_name, runtime, quantized, num_threads=num_threads)
+
+
+def _encode_in_worker(texts: list) -> np.ndarray:
+    return _worker_model.encode(texts)
+
+
+def _load_onnx_model(model_name: str, quantized: bool, num_threads: int = 0) -> SentenceTransformer:
+    """
+    Loads the model with the ONNX Runtime backend (requires `pip install sentence-transformers[onnx]`).
+    If a dynamically int8-quantized export is requested but not published for the model,
+    it is created once and cached under models/. num_threads > 0 caps the ORT intra-op thread pool.
+    """
+    model_kwargs = {}
+    if num_threads > 0:
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = num_threads
+        model_kwargs["session_options"] = session_options
+    if not quantized:
+        return SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs)
+
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+    quantized_file = f"onnx/model_qint8_{EMBEDDING_ONNX_QUANTIZATION_CONFIG}.onnx"
+    local_dir = os.path.join(ONNX_MODEL_CACHE_DIR, model_name.replace("/", "__") + "-onnx")
+
+    if os.path.exists(os.path.join(local_dir, quantized_file)):
+        return SentenceTransformer(local_dir, backend="onnx", model_kwargs={"file_name": quantized_file, **model_kwargs})
+    try:
+        return SentenceTransformer(model_name, backend="onnx", model_kwargs={"file_name": quantized_file, **model_kwargs})
+    except Exception:
+        print(f"No pre-quantized ONNX file for '{model_name}' found. Exporting and quantizing locally (one-time)...")
+    model = SentenceTransformer(model_name, backend="onnx")
+    model.save(local_dir)
+    export_dynamic_quantized_onnx_model(model, EMBEDDING_ONNX_QUANTIZATION_CONFIG, local_dir)
+    return SentenceTransformer(local_dir, backend="onnx", model_kwargs={"file_name": quantized_file, **model_kwargs})
+
+
+def get_embedding_model() -> EmbeddingModel:
+    """Creates the embedding model configured in config_data.py."""
+    print(f"Loading embedding model '{EMBEDDING_MODEL_NAME}' (runtime: {EMBEDDING_RUNTIME})...")
+    return EmbeddingModel(EMBEDDING_MODEL_NAME, EMBEDDING_RUNTIME, EMBEDDING_ONNX_QUANTIZED)
@@ -0,0 +1,173 @@
+# evaluate_retrieval.py
+#
+# Measures retrieval quality and speed on the offers knowledge base, for any vector backend.
+# Labeled queries come from held-out offers: the overall RAG query of an offer (industry, title, focus tags,
+# services - built exactly like in the workflow) should retrieve that offer's own positions.
+# Reports recall@k, MRR and nDCG@k next to p50/p99 query latency and the index build time, so every change to
+# retrieve_context, the embedding model, chunking or n_results can be measured for both speed and quality.
+#
+# Usage:
+#   python3 evaluate_retrieval.py                                  # Configured backend, up to 50 held-out offers
+#   python3 evaluate_retrieval.py --backends configured memmap-int8 memmap-ivf --queries 200 --k 1 3 5 10
+#   python3 evaluate_retrieval.py --json eval.json                 # Also write the numbers for later comparison
+#
+# The index is built in a temporary directory; the real vector store is not touched. Query latency is
+# measured cold (encoder + vector store + chunk collapsing, without the query caches).
+
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+from config_data import (
+    DATA_DIR, VECTOR_BACKEND, MEMMAP_INDEX_DTYPE, MEMMAP_IVF_NLIST, MEMMAP_IVF_NPROBE, CHUNK_QUERY_OVERSAMPLE
+)
+from benchmark_vector_backends import BACKEND_CONFIGS
+from offer_corpus import iter_offers
+from vector_backends import get_vector_backend
+from vector_store_utils import embedding_model, build_position_documents, build_overall_query, collapse_hits
+
+CONFIGURED_BACKEND = {
+    "backend": VECTOR_BACKEND,
+    "options": {"dtype": MEMMAP_INDEX_DTYPE, "nprobe": MEMMAP_IVF_NPROBE} if VECTOR_BACKEND == "memmap" else {},
+    "nlist": MEMMAP_IVF_NLIST if VECTOR_BACKEND == "memmap" else 0,
+}
+
+
+# --- LABELED QUERY SET ---
+def build_documents_and_queries(data_dir: str, num_queries: int, seed: int = 42):
+    """
+    Returns the documents of all offers and the labeled queries of up to `num_queries` randomly held-out offers:
+    [{"offer_id", "query", "relevant": set of parent ids (offer_id_position_id)}].
+    """
+    ids, texts, metadatas, queries = [], [], [], []
+    for path, offer_data in iter_offers(data_dir):
+        offer_id = str(offer_data["offer_id"])
+        relevant = set()
+        for pos_idx, position in enumerate(offer_data["positions"]):
+            for doc_id, text, metadata in build_position_documents(offer_id, position, pos_idx, os.path.basename(path), offer_data.get("status") or "unknown"):
+                ids.append(doc_id)
+                texts.append(text)
+                metadatas.append(metadata)
+                relevant.add(metadata["parent_id"])
+        if relevant:
+            queries.append({
+                "offer_id": offer_id,
+                "query": build_overall_query({
+                    "client_industry": offer_data.get("client_industry_anonymized") or "",
+                    "project_title": offer_data.get("offer_title") or "",
+                    "project_focus_tags_input": ", ".join(offer_data.get("project_focus_tags") or []),
+                    "key_services_description": ", ".join(offer_data.get("services_offered") or []),
+                }),
+                "relevant": relevant,
+            })
+    random.Random(seed).shuffle(queries)
+    return ids, texts, metadatas, queries[:num_queries]
+
+
+# --- METRICS ---
+def recall_at_k(ranked: list, relevant: set, k: int) -> float:
+    return len(set(ranked[:k]) & relevant) / len(relevant)
+
+
+def reciprocal_rank(ranked: list, relevant: set) -> float:
+    for rank, parent_id in enumerate(ranked, start=1):
+        if parent_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked: list, relevant: set, k: int) -> float:
+    dcg = sum(1.0 / np.log2(rank + 1) for rank, parent_id in enumerate(ranked[:k], start=1) if parent_id in relevant)
+    ideal = sum(1.0 / np.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal
+
+
+# --- EVALUATION ---
+def evaluate_backend(config_name: str, ids, embeddings, texts, metadatas, queries, query_embeddings, encode_seconds, ks) -> dict:
+    config = CONFIGURED_BACKEND if config_name == "configured" else BACKEND_CONFIGS[config_name]
+    store_path = tempfile.mkdtemp(prefix=f"eval_{config_name}_")
+    try:
+        backend = get_vector_backend(config["backend"], store_path, "eval", **config["options"])
+        start = time.perf_counter()
+        backend.add(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+        if config.get("nlist"):
+            backend.build_ivf(config["nlist"])
+        insert_seconds = time.perf_counter() - start
+
+        max_k = max(ks)
+        search_seconds, scores = [], {f"recall@{k}": [] for k in ks}
+        scores.update({f"ndcg@{k}": [] for k in ks})
+        scores["mrr"] = []
+        for query, query_embedding in zip(queries, query_embeddings):
+            start = time.perf_counter()
+            hits = backend.query(query_embedding, n_results=max_k * CHUNK_QUERY_OVERSAMPLE)
+            ranked = [f"{doc['offer_id']}_{doc['position_id']}" for doc in collapse_hits(hits, max_k)]
+            search_seconds.append(time.perf_counter() - start)
+            for k in ks:
+                scores[f"recall@{k}"].append(recall_at_k(ranked, query["relevant"], k))
+                scores[f"ndcg@{k}"].append(ndcg_at_k(ranked, query["relevant"], k))
+            scores["mrr"].append(reciprocal_rank(ranked, query["relevant"]))
+    finally:
+        shutil.rmtree(store_path, ignore_errors=True)
+
+    search_ms = np.array(search_seconds) * 1000
+    total_ms = search_ms + np.array(encode_seconds) * 1000
+    return {
+        "backend": config_name,
+        "documents": len(ids),
+        "queries": len(queries),
+        "insert_seconds": round(insert_seconds, 3),
+        "latency_p50_ms": round(float(np.percentile(total_ms, 50)), 2),
+        "latency_p99_ms": round(float(np.percentile(total_ms, 99)), 2),
+        "search_p50_ms": round(float(np.percentile(search_ms, 50)), 2),
+        "search_p99_ms": round(float(np.percentile(search_ms, 99)), 2),
+        **{name: round(float(np.mean(values)), 4) for name, values in scores.items()},
+    }
+
+
+def run_evaluation(data_dir: str, backend_names: list, num_queries: int, ks: list) -> dict:
+    ids, texts, metadatas, queries = build_documents_and_queries(data_dir, num_queries)
+    if not queries:
+        print(f"No offers with indexable positions found in {data_dir}.")
+        return {}
+    print(f"Embedding {len(texts)} chunks of the knowledge base with {embedding_model.model_id}...")
+    start = time.perf_counter()
+    embeddings = embedding_model.encode(texts)
+    embed_seconds = time.perf_counter() - start
+
+    query_embeddings, encode_seconds = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_embeddings.append(embedding_model.encode(query["query"]))
+        encode_seconds.append(time.perf_counter() - start)
+
+    results = [evaluate_backend(name, ids, embeddings, texts, metadatas, queries, query_embeddings, encode_seconds, ks) for name in backend_names]
+    for result in results: # Index build = embedding the corpus (shared by all backends) + inserting it
+        result["build_seconds"] = round(embed_seconds + result["insert_seconds"], 3)
+    metric_names = [f"recall@{k}" for k in ks] + ["mrr"] + [f"ndcg@{k}" for k in ks]
+    print(f"\n{len(queries)} held-out offers as queries, {len(ids)} indexed chunks, embedding took {embed_seconds:.2f}s.")
+    print(f"{'backend':<16} {'build s':>9} {'p50 ms':>8} {'p99 ms':>8} " + " ".join(f"{name:>9}" for name in metric_names))
+    for result in results:
+        print(f"{result['backend']:<16} {result['build_seconds']:>9.2f} {result['latency_p50_ms']:>8.2f} {result['latency_p99_ms']:>8.2f} "
+              + " ".join(f"{result[name]:>9.3f}" for name in metric_names))
+    return {"embedding_model": embedding_model.model_id, "embed_seconds": round(embed_seconds, 3), "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality (recall@k, MRR, nDCG) and latency.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--backends", nargs="+", default=["configured"], choices=["configured"] + list(BACKEND_CONFIGS.keys()))
+    parser.add_argument("--queries", type=int, default=50, help="Number of held-out offers used as queries.")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5, 10])
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+    summary = run_evaluation(args.data_dir, args.backends, args.queries, sorted(args.k))
+    if args.json and summary:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Results written to {args.json}")
@@ -0,0 +1,183 @@
+# hours_estimator.py
+#
+# Grounds the hour estimates of the structure proposal in the offers knowledge base.
+# A small statistics index (hours distribution per service tag, per industry and overall, plus hours
+# per indexed position) is precomputed once from the columnar offer corpus and cached next to the vector store. Estimates for a new
+# position combine its nearest historical positions (via the vector store) with the tag/industry statistics.
+
+import os
+import json
+import time
+import numpy as np
+
+from config_data import DATA_DIR, INTERNAL_HOURLY_RATES, HOURS_OUTLIER_FACTOR, HOURS_NEIGHBOURS, HOURS_INDEX_CHECK_SECONDS
+from vector_store_utils import VECTOR_STORE_PATH, retrieve_context
+from offer_corpus import load_corpus, data_dir_signature
+
+HOURS_INDEX_PATH = os.path.join(VECTOR_STORE_PATH, "hours_index.json")
+MIN_SAMPLES = 3 # Minimum number of historical positions for a tag/industry distribution to be used
+
+_hours_index = None
+_hours_index_checked = None # (data_dir, time.monotonic()) of the last signature check of the cached index
+
+
+# --- BUILDING THE INDEX ---
+def implied_hours(quantity: np.ndarray, unit_price: np.ndarray, total_price: np.ndarray) -> np.ndarray:
+    """
+    Hours historical positions were priced with (NaN where there is no usable price data). If the unit price
+    is one of our hourly rates, the quantity is the number of hours; otherwise (fixed-price positions)
+    the total is converted with the default rate.
+    """
+    hourly = np.isin(unit_price, list(INTERNAL_HOURLY_RATES.values())) & (quantity > 0)
+    fixed = total_price > 0
+    return np.where(hourly, quantity, np.where(fixed, total_price / INTERNAL_HOURLY_RATES["Default"], np.nan))
+
+
+def _distribution(hours) -> dict:
+    values = np.asarray(hours, dtype=np.float64)
+    p25, median, p75 = np.percentile(values, [25, 50, 75])
+    return {"count": len(values), "p25": round(p25, 2), "median": round(median, 2), "p75": round(p75, 2), "mean": round(values.mean(), 2)}
+
+
+def _grouped_distributions(group_keys: list, group_ids: np.ndarray, hours: np.ndarray) -> dict:
+    """Distribution of `hours` per normalized key (several vocabulary ids may share one key, e.g. 'SEO' and 'seo ')."""
+    distributions = {}
+    key_of_id = np.array([key.strip().lower() for key in group_keys], dtype=object)
+    keys = key_of_id[np.asarray(group_ids, dtype=np.int64)]
+    for key in set(keys) - {""}:
+        values = hours[keys == key]
+        if len(values) >= MIN_SAMPLES:
+            distributions[key] = _distribution(values)
+    return distributions
+
+
+def build_hours_index(data_dir: str = DATA_DIR) -> dict:
+    """Computes the hours distributions from the columnar offer corpus."""
+    corpus = load_corpus(data_dir)
+    hours = implied_hours(np.asarray(corpus.quantity), np.asarray(corpus.unit_price), np.asarray(corpus.total_price))
+    priced = ~np.isnan(hours)
+
+    tag_positions = corpus.tag_position_index()
+    tag_priced = priced[tag_positions]
+    industry_ids = np.asarray(corpus.industry_id)[np.asarray(corpus.offer_index)]
+    by_position = {
+        f"{corpus.offer_id[corpus.offer_index[p]]}_{corpus.position_id[p]}": round(float(hours[p]), 2)
+        for p in np.flatnonzero(priced)
+    }
+    return {
+        "signature": corpus.signature,
+        "overall": _distribution(hours[priced]) if priced.any() else None,
+        "by_tag": _grouped_distributions(corpus.tags, np.asarray(corpus.tag_id)[tag_priced], hours[tag_positions[tag_priced]]),
+        "by_industry": _grouped_distributions(corpus.industries, industry_ids[priced], hours[priced]),
+        "by_position": by_position,
+    }
+
+
+def get_hours_index(data_dir: str = DATA_DIR) -> dict:
+    """
+    Returns the cached index, rebuilding it only if offer files were added, removed or changed. The offer files
+    are scanned for changes at most every HOURS_INDEX_CHECK_SECONDS, not once per estimated position.
+    """
+    global _hours_index, _hours_index_checked
+    if (_hours_index is not None and _hours_index_checked is not None and _hours_index_checked[0] == data_dir
+            and time.monotonic() - _hours_index_checked[1] < HOURS_INDEX_CHECK_SECONDS):
+        return _hours_index
+    signature = data_dir_signature(data_dir)
+    _hours_index_checked = (data_dir, time.monotonic())
+    if _hours_index is not None and _hours_index["signature"] == signature:
+        return _hours_index
+    if os.path.exists(HOURS_INDEX_PATH):
+        with open(HOURS_INDEX_PATH, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get("signature") == signature:
+            _hours_index = cached
+            return _hours_index
+    print("Building historical hours statistics from the knowledge base...")
+    _hours_index = build_hours_index(data_dir)
+    os.makedirs(VECTOR_STORE_PATH, exist_ok=True)
+    with open(HOURS_INDEX_PATH, 'w', encoding='utf-8') as f:
+        json.dump(_hours_index, f, ensure_ascii=False)
+    return _hours_index
+
+
+# --- ESTIMATION ---
+def estimate_hours(title: str, description: str = "", service_area: str = None, industry: str = None) -> dict:
+    """
+    Estimates hours for a new position from its most similar historical positions,
+    falling back to the service area (as tag), industry and overall distributions.
+
+    Returns:
+        dict: {"estimate", "low", "high", "basis", "samples"} or {"estimate": None, ...} if there is no data.
+    """
+    index = get_hours_index()
+    neighbours = retrieve_context(f"Offer Position Title: {title}\nDescription: {description}", n_results=HOURS_NEIGHBOURS)
+    neighbour_hours = [
+        index["by_position"][f"{ctx['offer_id']}_{ctx['position_id']}"]
+        for ctx in neighbours if f"{ctx.get('offer_id')}_{ctx.get('position_id')}" in index["by_position"]
+    ]
+    if len(neighbour_hours) >= 2:
+        dist = _distribution(neighbour_hours)
+        return {"estimate": dist["median"], "low": dist["p25"], "high": dist["p75"], "basis": "similar positions", "samples": dist["count"]}
+
+    for basis, key, table in (
+        ("service area", (service_area or "").strip().lower(), index["by_tag"]),
+        ("industry", (industry or "").strip().lower(), index["by_industry"]),
+    ):
+        if key and key in table:
+            dist = table[key]
+            return {"estimate": dist["median"], "low": dist["p25"], "high": dist["p75"], "basis": basis, "samples": dist["count"]}
+
+    if index["overall"]:
+        dist = index["overall"]
+        return {"estimate": dist["median"], "low": dist["p25"], "high": dist["p75"], "basis": "all positions", "samples": dist["count"]}
+    return {"estimate": None, "low": None, "high": None, "basis": "no data", "samples": 0}
+
+
+def check_hours(proposed_hours, estimate: dict) -> str:
+    """Returns a warning text if the proposed hours are far outside the historical range, else an empty string."""
+    if estimate.get("estimate") is None or not isinstance(proposed_hours, (int, float)):
+        return ""
+    if proposed_hours > estimate["high"] * HOURS_OUTLIER_FACTOR:
+        return f"well above similar past work ({estimate['low']}-{estimate['high']} h, {estimate['basis']})"
+    if proposed_hours < estimate["low"] / HOURS_OUTLIER_FACTOR:
+        return f"well below similar past work ({estimate['low']}-{estimate['high']} h, {estimate['basis']})"
+    return ""
+
+
+def historical_hours_reference(industry: str = None) -> str:
+    """Compact text block with hours distributions for the structure proposal prompt."""
+    index = get_hours_index()
+    if not index["overall"]:
+        return "No historical hours data available."
+    lines = [f"- All past positions: median {index['overall']['median']} h (typical range {index['overall']['p25']}-{index['overall']['p75']} h, n={index['overall']['count']})"]
+    industry_key = (industry or "").strip().lower()
+    if industry_key in index["by_industry"]:
+        dist = index["by_industry"][industry_key]
+        lines.append(f"- Past positions in this industry: median {dist['median']} h (typical range {dist['p25']}-{dist['p75']} h, n={dist['count']})")
+    for tag, dist in sorted(index["by_tag"].items(), key=lambda item: -item[1]["count"])[:10]:
+        lines.append(f"- Service '{tag}': median {dist['median']} h (typical range {dist['p25']}-{dist['p75']} h, n={dist['count']})")
+    return "\n".join(lines)
+
+
+def apply_hours_estimates(proposed_structure: list, industry: str = None) -> list:
+    """
+    Post-processes an LLM structure proposal: fills missing hour suggestions with the historical estimate
+    and attaches 'historical_hours' and, for outliers, 'hours_warning' to each Offer Position.
+    """
+    for pos in proposed_structure:
+        if not isinstance(pos, dict) or pos.get("type") != "Offer Position":
+            continue
+        estimate = estimate_hours(pos.get("proposed_title", ""), pos.get("focus_description", ""), pos.get("suggested_service_area"), industry)
+        pos["historical_hours"] = estimate
+        try:
+            suggested = float(pos.get("estimated_hours_suggestion"))
+        except (TypeError, ValueError):
+            suggested = 0
+        if suggested <= 0:
+            if estimate["estimate"] is not None:
+                pos["estimated_hours_suggestion"] = estimate["estimate"]
+            continue
+        warning = check_hours(suggested, estimate)
+        if warning:
+            pos["hours_warning"] = warning
+    return proposed_structure
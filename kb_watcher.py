@@ -0,0 +1,209 @@
+# kb_watcher.py
+#
+# Keeps the vector store in sync with DATA_DIR while a long-running process (server mode) is up.
+# File events come from watchdog (inotify on Linux, FSEvents on macOS) if it is installed,
+# otherwise from a polling loop. Events are debounced and only the affected files are re-indexed
+# in a background thread; retrieve_context keeps serving queries from the previous index state meanwhile.
+# A batch that fails to index goes back to the pending files and is retried with backoff.
+
+import os
+import time
+import threading
+
+from config_data import (
+    KB_WATCH_DEBOUNCE_SECONDS, KB_WATCH_MAX_DELAY_SECONDS, KB_WATCH_POLL_INTERVAL_SECONDS,
+    KB_WATCH_RETRY_SECONDS, KB_WATCH_RETRY_MAX_SECONDS
+)
+from vector_store_utils import index_offer_files, remove_offer_files
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError: # Optional dependency: pip install watchdog
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _WatchdogHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        self.watcher.notify(event.src_path)
+        if getattr(event, "dest_path", None): # Moves/renames (e.g. editors writing via a temp file)
+            self.watcher.notify(event.dest_path)
+
+
+class KnowledgeBaseWatcher:
+    """
+    Watches `data_dir` for created, modified and deleted offer JSON files and re-indexes them.
+
+    Freshness metrics (see get_freshness()):
+      - last_lag_seconds: time from the last change of a file (mtime, or detection time for deletes)
+        until it was queryable, for the most recent sync
+      - oldest_pending_seconds: age of the oldest change that is not indexed yet (0 if up to date)
+    """
+
+    def __init__(self, data_dir: str, debounce_seconds: float = KB_WATCH_DEBOUNCE_SECONDS,
+                 max_delay_seconds: float = KB_WATCH_MAX_DELAY_SECONDS,
+                 poll_interval_seconds: float = KB_WATCH_POLL_INTERVAL_SECONDS, use_inotify: bool = True,
+                 retry_seconds: float = KB_WATCH_RETRY_SECONDS, retry_max_seconds: float = KB_WATCH_RETRY_MAX_SECONDS):
+        self.data_dir = os.path.abspath(data_dir)
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.retry_seconds = retry_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.use_inotify = use_inotify and Observer is not None
+        self.pending = {} # path -> time of first unprocessed event
+        self.last_event_at = 0.0
+        self.failed_syncs = 0 # Consecutive failures, for the retry backoff
+        self.retry_at = 0.0   # No batch before this time after a failed sync
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.observer = None
+        self.metrics = {
+            "mode": "inotify" if self.use_inotify else "polling",
+            "last_sync_at": None,
+            "last_lag_seconds": None,
+            "max_lag_seconds": 0.0,
+            "files_indexed_total": 0,
+            "files_removed_total": 0,
+            "sync_errors_total": 0,
+        }
+
+    # --- event intake ---
+    def notify(self, path: str):
+        if not path.endswith(".json"):
+            return
+        now = time.time()
+        with self.condition:
+            self.pending.setdefault(os.path.abspath(path), now)
+            self.last_event_at = now
+            self.condition.notify()
+
+    def _snapshot_dir(self) -> dict:
+        snapshot = {}
+        try:
+            with os.scandir(self.data_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(".json"):
+                        stat = entry.stat()
+                        snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pass
+        return snapshot
+
+    def _poll_loop(self):
+        previous = self._snapshot_dir()
+        while not self.stop_event.wait(self.poll_interval_seconds):
+            current = self._snapshot_dir()
+            for path in current.keys() | previous.keys():
+                if current.get(path) != previous.get(path):
+                    self.notify(path)
+            previous = current
+
+    # --- background sync ---
+    def _next_batch(self):
+        """
+        Blocks until a batch is due: no new events for `debounce_seconds`, or the oldest event waited `max_delay_seconds`.
+        After a failed sync no batch is due before `retry_at`.
+        """
+        with self.condition:
+            while not self.stop_event.is_set():
+                if self.pending:
+                    now = time.time()
+                    if now < self.retry_at:
+                        self.condition.wait(timeout=self.retry_at - now)
+                        continue
+                    quiet_for = now - self.last_event_at
+                    oldest = min(self.pending.values())
+                    if quiet_for >= self.debounce_seconds or now - oldest >= self.max_delay_seconds:
+                        batch, self.pending = self.pending, {}
+                        return batch
+                    self.condition.wait(timeout=min(self.debounce_seconds - quiet_for, self.max_delay_seconds - (now - oldest)))
+                else:
+                    self.condition.wait(timeout=1.0)
+        return None
+
+    def _sync_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self.sync(batch)
+
+    def sync(self, batch: dict):
+        """
+        Re-indexes existing files of the batch and removes deleted ones from the index. If that fails, the files go back
+        to the pending ones with their original change times and are retried after a backoff.
+        """
+        existing = [path for path in batch if os.path.exists(path)]
+        deleted = [path for path in batch if path not in existing]
+        try:
+            changed_at = {path: os.path.getmtime(path) for path in existing}
+            changed_at.update({path: batch[path] for path in deleted})
+            if existing:
+                index_offer_files(existing)
+            if deleted:
+                remove_offer_files(deleted)
+        except Exception as e:
+            with self.condition:
+                for path, changed in batch.items():
+                    self.pending[path] = min(changed, self.pending.get(path, changed))
+                self.failed_syncs += 1
+                delay = min(self.retry_seconds * 2 ** (self.failed_syncs - 1), self.retry_max_seconds)
+                self.retry_at = time.time() + delay
+            print(f"Warning: Knowledge base sync failed for {len(batch)} file(s): {e}. Retrying in {delay:.0f}s.")
+            self.metrics["sync_errors_total"] += 1
+            return
+        with self.condition:
+            self.failed_syncs = 0
+            self.retry_at = 0.0
+        done_at = time.time()
+        lag = max(done_at - min(changed_at.values()), 0.0)
+        self.metrics.update({
+            "last_sync_at": done_at,
+            "last_lag_seconds": round(lag, 3),
+            "max_lag_seconds": round(max(self.metrics["max_lag_seconds"], lag), 3),
+            "files_indexed_total": self.metrics["files_indexed_total"] + len(existing),
+            "files_removed_total": self.metrics["files_removed_total"] + len(deleted),
+        })
+        print(f"Knowledge base sync: {len(existing)} file(s) re-indexed, {len(deleted)} removed (lag {lag:.2f}s).")
+
+    # --- lifecycle ---
+    def start(self):
+        print(f"Watching '{self.data_dir}' for offer changes ({self.metrics['mode']})...")
+        if self.use_inotify:
+            self.observer = Observer()
+            self.observer.schedule(_WatchdogHandler(self), self.data_dir, recursive=False)
+            self.observer.start()
+        else:
+            self.threads.append(threading.Thread(target=self._poll_loop, name="kb-watcher-poll", daemon=True))
+        self.threads.append(threading.Thread(target=self._sync_loop, name="kb-watcher-sync", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+    def get_freshness(self) -> dict:
+        with self.condition:
+            oldest = min(self.pending.values()) if self.pending else None
+            pending_files = len(self.pending)
+        return dict(
+            self.metrics,
+            pending_files=pending_files,
+            oldest_pending_seconds=round(time.time() - oldest, 3) if oldest else 0.0,
+        )
@@ -4,28 +4,169 @@ import os
 import json
 from dotenv import load_dotenv
 from openai import OpenAI, APIError, RateLimitError
-import numpy as np
 import time
+import uuid
+import threading
 
 # Import configurations
 # import prompts_config as pc # No longer needed here
-from config_data import LLM_MODEL_CHAT, LLM_MODEL_JSON_DRAFT # <--- ADD THIS
+from config_data import (
+    LLM_MODEL_CHAT, LLM_MODEL_JSON_DRAFT, RATE_LIMIT_MAX_REQUEUES, # <--- ADD THIS
+    LLM_BATCH_BASE_URL, LLM_BATCH_DIR, LLM_BATCH_MAX_REQUESTS, LLM_BATCH_POLL_SECONDS, CASSETTE_MODE
+)
+from rate_limiter import governor, estimate_tokens
+from session_store import session_store
+from offer_budget import charge_call, budget_model, budget_max_retries, budget_exceeded_error
+from model_routing import models_for_step, record_routing
+from cassette import cassette
 
 # --- CONFIGURATION ---
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+if not OPENAI_API_KEY and CASSETTE_MODE == "replay":
+    OPENAI_API_KEY = "replay" # Requests are answered from the cassette, the key is never sent
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY not found in .env file. Please add it.")
 
 # --- INITIALIZE CLIENTS ---
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# No SDK retries: 429s are waited out by the rate limit governor in create_chat_completion, which must see every attempt
+openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0, http_client=cassette.http_client()) # Record/replay, see cassette.py
+# Batch jobs can go to a local stand-in server (batch_stand_in_server.py) instead of OpenAI
+batch_client = OpenAI(api_key=OPENAI_API_KEY, base_url=LLM_BATCH_BASE_URL) if LLM_BATCH_BASE_URL else openai_client
+
+# --- TOKEN USAGE ---
+# Prompt cache statistics per prompt name (see prompt_templates.py), from the usage fields of each response
+prompt_cache_stats = {}
+prompt_cache_stats_lock = threading.Lock()
+
+
+def record_token_usage(prompt_name: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int):
+    with prompt_cache_stats_lock:
+        stats = prompt_cache_stats.setdefault(prompt_name or "other", {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        stats["calls"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+        stats["completion_tokens"] += completion_tokens
+
+
+def log_token_usage(completion, prompt_name: str = None):
+    """Prints prompt, cached prompt (prefix cache hits) and completion tokens of a chat completion and records them."""
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    print(f"Tokens: {usage.prompt_tokens} prompt ({cached_tokens} cached), {usage.completion_tokens} completion")
+    record_token_usage(prompt_name, usage.prompt_tokens, cached_tokens, usage.completion_tokens)
+
+
+def get_prompt_cache_stats() -> dict:
+    """Token counts and prompt cache hit rate (cached / prompt tokens) per prompt name since startup."""
+    with prompt_cache_stats_lock:
+        return {
+            name: dict(stats, cache_hit_rate=round(stats["cached_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else 0.0)
+            for name, stats in prompt_cache_stats.items()
+        }
+
+
+# --- RATE-LIMITED CALLS ---
+def create_chat_completion(model: str, messages: list, prompt_name: str = None, **kwargs):
+    """
+    chat.completions.create through the shared rate limit governor: waits for budget before the call,
+    adapts to the x-ratelimit-* response headers and waits out up to RATE_LIMIT_MAX_REQUEUES 429 responses.
+    Every call (queue wait, latency, tokens or error) is recorded in the session store and charged to the offer budget.
+    """
+    estimated_tokens = estimate_tokens(messages)
+    queued_seconds = 0.0
+    for requeue in range(RATE_LIMIT_MAX_REQUEUES + 1):
+        queue_start = time.perf_counter()
+        governor.acquire(model, estimated_tokens)
+        call_start = time.perf_counter()
+        queued_seconds += call_start - queue_start
+        try:
+            raw_response = openai_client.chat.completions.with_raw_response.create(model=model, messages=messages, **kwargs)
+        except Exception as e:
+            if isinstance(e, RateLimitError):
+                governor.observe_rate_limit(model, getattr(e.response, "headers", None))
+                if requeue < RATE_LIMIT_MAX_REQUEUES:
+                    continue
+            session_store.record_llm_call(model, prompt_name, queued_ms=queued_seconds * 1000,
+                                          latency_ms=(time.perf_counter() - call_start) * 1000, error=f"{type(e).__name__}: {e}")
+            charge_call(model, started=call_start, duration=time.perf_counter() - call_start)
+            raise
+        governor.observe_response(model, raw_response.headers)
+        completion = raw_response.parse()
+        latency_ms = (time.perf_counter() - call_start) * 1000
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            governor.observe_usage(model, estimated_tokens, usage.total_tokens)
+        details = getattr(usage, "prompt_tokens_details", None)
+        prompt_tokens, cached_tokens = getattr(usage, "prompt_tokens", None), getattr(details, "cached_tokens", 0) or 0
+        session_store.record_llm_call(
+            model, prompt_name, prompt_tokens, cached_tokens, getattr(usage, "completion_tokens", None),
+            queued_ms=queued_seconds * 1000, latency_ms=latency_ms
+        )
+        charge_call(model, prompt_tokens, cached_tokens, getattr(usage, "completion_tokens", None), started=call_start, duration=latency_ms / 1000)
+        return completion
+
 
 # --- LLM HELPER FUNCTIONS ---
-def get_llm_response(system_prompt: str, user_prompt: str, model: str = None, temperature: float = 0.7, max_retries: int = 3): # <--- CHANGE HERE
-    """Generic function to get a response from an LLM."""
+def supports_json_mode(model: str) -> bool:
+    # Check if model supports JSON mode (common in newer OpenAI models)
+    # Example: "gpt-3.5-turbo-0125", "gpt-4-turbo", "gpt-4-turbo-preview"
+    return "0125" in model or "turbo" in model # Heuristic, adjust if needed
+
+def run_routed(call, model: str, default_model: str, prompt_name: str, validate=None):
+    """
+    Runs call(model) on the model routed for the step `prompt_name` (an explicit `model` is used as is).
+    If the output is an error or `validate(output)` returns problems, the step is retried on the escalation model.
+    Output that still fails validation is returned as an OUTPUT_VALIDATION_FAILED error dict.
+    Over the offer budget every model is replaced by its cheaper fallback (budget_model); an escalation that would
+    run a model already tried is skipped, and the routing stats record the models actually called.
+    """
+    models = [model] if model else models_for_step(prompt_name, default_model)
+    tried, result, problems = [], None, []
+    for candidate in models:
+        candidate = budget_model(candidate)
+        if candidate in tried:
+            print(f"Not escalating '{prompt_name}': over the offer budget, {candidate} would run again.")
+            break
+        if tried:
+            print(f"Output of {tried[-1]} for '{prompt_name}' is not usable ({'; '.join(problems[:3])}). Escalating to {candidate}...")
+        tried.append(candidate)
+        result = call(candidate)
+        if isinstance(result, dict) and "error" in result:
+            problems = [f"{result['error']}: {result.get('details', '')}"]
+        else:
+            problems = validate(result) if validate else []
+        if not problems or (isinstance(result, dict) and result.get("error") == "OFFER_BUDGET_EXCEEDED"):
+            break
+    record_routing(prompt_name, tried[-1], len(tried) > 1)
+    if problems and not (isinstance(result, dict) and "error" in result):
+        raw_output = result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)
+        return {"error": "OUTPUT_VALIDATION_FAILED", "details": problems, "raw_output": raw_output}
+    return result
+
+def get_llm_response(system_prompt: str, user_prompt: str, model: str = None, temperature: float = 0.7, max_retries: int = 3, prompt_name: str = None, validate=None):
+    """
+    Generic function to get a response from an LLM. Without `model`, the model is routed by the step (`prompt_name`,
+    see model_routing.py); `validate(text)` returning problems escalates a small-tier answer to the large tier.
+    """
+    return run_routed(
+        lambda routed_model: _get_llm_response_once(system_prompt, user_prompt, routed_model, temperature, max_retries, prompt_name),
+        model, LLM_MODEL_CHAT, prompt_name, validate
+    )
+
+def _get_llm_response_once(system_prompt: str, user_prompt: str, model: str = None, temperature: float = 0.7, max_retries: int = 3, prompt_name: str = None): # <--- CHANGE HERE
+    """Generic function to get a response from an LLM. Over the offer budget, fewer retries are used."""
     # If no model is passed, use the default chat model from config_data
     if model is None: 
         model = LLM_MODEL_CHAT 
+    budget_error = budget_exceeded_error()
+    if budget_error:
+        print(f"Skipping LLM call: {budget_error['details']}")
+        return budget_error
+    max_retries = budget_max_retries(max_retries) # The model was already swapped by run_routed if over the budget
 
     print(f"\n--- Calling LLM ({model}) ---")
     print(f"System: {system_prompt[:100]}...")
@@ -37,18 +178,19 @@ def get_llm_response(system_prompt: str, user_prompt: str, model: str = None, te
     ]
     for attempt in range(max_retries):
         try:
-            completion = openai_client.chat.completions.create(
+            completion = create_chat_completion(
                 model=model,
                 messages=messages,
+                prompt_name=prompt_name,
                 temperature=temperature,
             )
             response_content = completion.choices[0].message.content
             print(f"LLM Response (snippet): {response_content[:100]}...")
+            log_token_usage(completion, prompt_name)
             return response_content
         except RateLimitError as e:
-            wait_time = (2 ** attempt) + np.random.rand() # Exponential backoff
-            print(f"Rate limit hit. Retrying in {wait_time:.2f} seconds... (Attempt {attempt+1}/{max_retries})")
-            time.sleep(wait_time)
+            # create_chat_completion already queued this call; the governor paces the retry (no own backoff)
+            print(f"Rate limit still hit after queuing. Retrying... (Attempt {attempt+1}/{max_retries})")
         except APIError as e:
             print(f"OpenAI API Error: {e}. Retrying... (Attempt {attempt+1}/{max_retries})")
             time.sleep(5) # General wait for API errors
@@ -60,40 +202,60 @@ def get_llm_response(system_prompt: str, user_prompt: str, model: str = None, te
     return {"error": "LLM_CALL_MAX_RETRIES_EXCEEDED", "details": "Max retries reached."}
 
 
-def get_llm_json_response(system_prompt: str, user_prompt: str, model: str = None, temperature: float = 0.2, max_retries: int = 3): # <--- CHANGE HERE
-    """Gets a response from an LLM and attempts to parse it as JSON, using native JSON mode if supported."""
+def get_llm_json_response(system_prompt: str, user_prompt: str, model: str = None, temperature: float = 0.2, max_retries: int = 3, messages: list = None, prompt_name: str = None, validate=None):
+    """
+    Gets a response from an LLM and attempts to parse it as JSON, using native JSON mode if supported.
+    Pass `messages` instead of the two prompts to continue a conversation, e.g. to reuse an identical
+    (and therefore prefix-cached) system/user prompt from an earlier call. `prompt_name` labels the
+    token usage in get_prompt_cache_stats() and selects the routed model if no `model` is given;
+    `validate(parsed_json)` returning a list of problems escalates a small-tier answer to the large tier.
+    """
+    return run_routed(
+        lambda routed_model: _get_llm_json_response_once(system_prompt, user_prompt, routed_model, temperature, max_retries, messages, prompt_name),
+        model, LLM_MODEL_JSON_DRAFT, prompt_name, validate
+    )
+
+def _get_llm_json_response_once(system_prompt: str, user_prompt: str, model: str = None, temperature: float = 0.2, max_retries: int = 3, messages: list = None, prompt_name: str = None): # <--- CHANGE HERE
+    """One JSON call on `model` with JSON repair retries. Over the offer budget, fewer repair retries are used."""
     # If no model is passed, use the default JSON drafting model from config_data
     if model is None: # <--- ADD THIS
         model = LLM_MODEL_JSON_DRAFT # <--- MODIFIED THIS
+    budget_error = budget_exceeded_error()
+    if budget_error:
+        print(f"Skipping LLM JSON call: {budget_error['details']}")
+        return budget_error
+    max_retries = budget_max_retries(max_retries) # The model was already swapped by run_routed if over the budget
 
+    if messages is None:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
     print(f"\n--- Calling LLM for JSON Output ({model}) ---")
-    print(f"System: {system_prompt[:100]}...")
-    print(f"User: {user_prompt[:150]}...")
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
+    print(f"System: {messages[0]['content'][:100]}...")
+    print(f"User: {messages[-1]['content'][:150]}...")
 
     for attempt in range(max_retries):
         try:
-            # Check if model supports JSON mode (common in newer OpenAI models)
-            # Example: "gpt-3.5-turbo-0125", "gpt-4-turbo", "gpt-4-turbo-preview"
-            if "0125" in model or "turbo" in model: # Heuristic, adjust if needed
-                completion = openai_client.chat.completions.create(
+            if supports_json_mode(model):
+                completion = create_chat_completion(
                     model=model,
                     messages=messages,
+                    prompt_name=prompt_name,
                     temperature=temperature,
                     response_format={"type": "json_object"}
                 )
             else: # Fallback for models without explicit JSON mode
-                 completion = openai_client.chat.completions.create(
+                 completion = create_chat_completion(
                     model=model,
                     messages=messages,
+                    prompt_name=prompt_name,
                     temperature=temperature
                 )
 
             raw_output = completion.choices[0].message.content
             print(f"LLM Raw JSON Output (snippet): {raw_output[:100]}...")
+            log_token_usage(completion, prompt_name)
             try:
                 parsed_json = json.loads(raw_output)
                 return parsed_json
@@ -104,19 +266,14 @@ def get_llm_json_response(system_prompt: str, user_prompt: str, model: str = Non
                 # For this PoC, we'll let it retry or return an error.
                 if attempt < max_retries - 1:
                     print("Retrying LLM call for JSON...")
-                    user_prompt += "\n\nIMPORTANT: Your previous response was not valid JSON. Please ensure your entire output is a single, valid JSON object or array as requested, with no surrounding text or explanations."
-                    messages = [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ]
+                    messages = messages[:-1] + [dict(messages[-1], content=messages[-1]["content"] + "\n\nIMPORTANT: Your previous response was not valid JSON. Please ensure your entire output is a single, valid JSON object or array as requested, with no surrounding text or explanations.")]
                     time.sleep(2) # Short delay before retrying
                     continue
                 return {"error": "JSON_PARSE_FAILED", "details": str(e), "raw_output": raw_output}
 
         except RateLimitError as e:
-            wait_time = (2 ** attempt) + np.random.rand()
-            print(f"Rate limit hit. Retrying in {wait_time:.2f} seconds... (Attempt {attempt+1}/{max_retries})")
-            time.sleep(wait_time)
+            # create_chat_completion already queued this call; the governor paces the retry (no own backoff)
+            print(f"Rate limit still hit after queuing. Retrying... (Attempt {attempt+1}/{max_retries})")
         except APIError as e:
             print(f"OpenAI API Error: {e}. Retrying... (Attempt {attempt+1}/{max_retries})")
             time.sleep(5)
@@ -126,3 +283,103 @@ def get_llm_json_response(system_prompt: str, user_prompt: str, model: str = Non
 
     print(f"LLM JSON call failed after {max_retries} retries.")
     return {"error": "LLM_JSON_CALL_MAX_RETRIES_EXCEEDED", "details": "Max retries reached."}
+
+
+# --- BATCH API ---
+# For offline bulk work (see bulk_draft.py): requests are written to a JSONL file, submitted as one OpenAI batch
+# (lower price, separate and much higher rate limits), polled until done and mapped back by their custom_id.
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def build_batch_request(custom_id: str, messages: list, model: str = None, temperature: float = 0.2) -> dict:
+    """One line of a batch input file: a JSON chat completion request (same settings as get_llm_json_response)."""
+    model = model or LLM_MODEL_JSON_DRAFT
+    body = {"model": model, "messages": messages, "temperature": temperature}
+    if supports_json_mode(model):
+        body["response_format"] = {"type": "json_object"}
+    return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+
+def submit_batch(batch_requests: list, description: str = "") -> list:
+    """
+    Writes the requests to JSONL files in LLM_BATCH_DIR (at most LLM_BATCH_MAX_REQUESTS per file),
+    uploads them and creates one batch per file. Returns the batch ids.
+    """
+    custom_ids = [request["custom_id"] for request in batch_requests]
+    if len(set(custom_ids)) != len(custom_ids):
+        raise ValueError("Batch requests need unique custom_id values.")
+    os.makedirs(LLM_BATCH_DIR, exist_ok=True)
+    batch_ids = []
+    for start in range(0, len(batch_requests), LLM_BATCH_MAX_REQUESTS):
+        chunk = batch_requests[start:start + LLM_BATCH_MAX_REQUESTS]
+        # Unique per submission: two runs started in the same second must not overwrite each other's input files
+        path = os.path.join(LLM_BATCH_DIR, f"batch_{int(time.time())}_{uuid.uuid4().hex[:12]}_{start // LLM_BATCH_MAX_REQUESTS}.jsonl")
+        with open(path, 'w', encoding='utf-8') as f:
+            for request in chunk:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        with open(path, 'rb') as f:
+            input_file = batch_client.files.create(file=f, purpose="batch")
+        batch = batch_client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"description": description} if description else None
+        )
+        print(f"Submitted batch {batch.id} with {len(chunk)} requests ({path}).")
+        batch_ids.append(batch.id)
+    return batch_ids
+
+
+def wait_for_batch(batch_id: str, poll_seconds: float = LLM_BATCH_POLL_SECONDS, timeout: float = None):
+    """Polls a batch until it reaches a final status (or `timeout` seconds passed) and returns the batch object."""
+    started = time.time()
+    while True:
+        batch = batch_client.batches.retrieve(batch_id)
+        counts = getattr(batch, "request_counts", None)
+        progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""
+        print(f"Batch {batch_id}: {batch.status}{progress}")
+        if batch.status in BATCH_FINAL_STATUSES:
+            return batch
+        if timeout is not None and time.time() - started > timeout:
+            return batch
+        time.sleep(poll_seconds)
+
+
+def _read_jsonl_file(file_id: str) -> list:
+    content = batch_client.files.content(file_id).text
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def fetch_batch_results(batch, prompt_name: str = None) -> dict:
+    """
+    Downloads the results of a finished batch. Returns {custom_id: parsed JSON answer or error dict}.
+    Requests without a result (failed, expired) get an error dict as well.
+    """
+    results = {}
+    for line in _read_jsonl_file(batch.output_file_id) if getattr(batch, "output_file_id", None) else []:
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            results[line["custom_id"]] = {"error": "BATCH_REQUEST_FAILED", "details": str(line.get("error") or response.get("body"))}
+            continue
+        body = response["body"]
+        usage = body.get("usage") or {}
+        record_token_usage(prompt_name, usage.get("prompt_tokens", 0), (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0), usage.get("completion_tokens", 0))
+        raw_output = body["choices"][0]["message"]["content"]
+        try:
+            results[line["custom_id"]] = json.loads(raw_output)
+        except json.JSONDecodeError as e:
+            results[line["custom_id"]] = {"error": "JSON_PARSE_FAILED", "details": str(e), "raw_output": raw_output}
+    for line in _read_jsonl_file(batch.error_file_id) if getattr(batch, "error_file_id", None) else []:
+        results.setdefault(line["custom_id"], {"error": "BATCH_REQUEST_FAILED", "details": str(line.get("error") or line.get("response"))})
+    return results
+
+
+def run_batch(batch_requests: list, description: str = "", prompt_name: str = None, poll_seconds: float = LLM_BATCH_POLL_SECONDS) -> dict:
+    """Submits the requests, waits for all batches and returns {custom_id: result} for every request."""
+    results = {}
+    for batch_id in submit_batch(batch_requests, description):
+        batch = wait_for_batch(batch_id, poll_seconds)
+        results.update(fetch_batch_results(batch, prompt_name))
+    for request in batch_requests:
+        results.setdefault(request["custom_id"], {"error": "BATCH_NO_RESULT", "details": "The batch finished without a result for this request."})
+    return results
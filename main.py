@@ -1,5 +1,17 @@
 # main.py
-import offer_workflow
+import argparse
 
 if __name__ == "__main__":
-    offer_workflow.main()
+    parser = argparse.ArgumentParser(description="Sidekicks AI Offer Assistant")
+    parser.add_argument("--serve", action="store_true", help="Run the local HTTP/JSON API instead of the interactive CLI")
+    parser.add_argument("--host", default=None, help="Server host (default: SERVER_HOST in config_data.py)")
+    parser.add_argument("--port", type=int, default=None, help="Server port (default: SERVER_PORT in config_data.py)")
+    args = parser.parse_args()
+
+    if args.serve:
+        import offer_server
+        from config_data import SERVER_HOST, SERVER_PORT
+        offer_server.serve(args.host or SERVER_HOST, args.port or SERVER_PORT)
+    else:
+        import offer_workflow
+        offer_workflow.main()
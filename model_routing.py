@@ -0,0 +1,40 @@
+# model_routing.py
+#
+# Maps every workflow step (the prompt name of the call) to a model. Cheap steps - project title, structure
+# proposal and edits, the offer introduction - run on the small tier; drafting the positions runs on the large
+# tier. If small-tier output fails validation, llm_utils retries the step once on LLM_ESCALATION_TIER (unless the
+# offer budget maps the escalation model back to a model already tried, see llm_utils.run_routed).
+# Counts per step (calls, escalations) are reported under GET /metrics in server mode.
+
+import threading
+
+from config_data import LLM_MODEL_TIERS, LLM_STEP_TIERS, LLM_STEP_MODEL_OVERRIDES, LLM_ESCALATION_TIER
+
+routing_stats = {}
+routing_stats_lock = threading.Lock()
+
+
+def models_for_step(step: str, default_model: str) -> list:
+    """
+    Models to try for `step`, in order: its own model, then the escalation model if that is a different one.
+    Steps without a tier or override use `default_model` and are not escalated.
+    """
+    if step not in LLM_STEP_MODEL_OVERRIDES and step not in LLM_STEP_TIERS:
+        return [default_model]
+    model = LLM_STEP_MODEL_OVERRIDES.get(step) or LLM_MODEL_TIERS[LLM_STEP_TIERS[step]]
+    escalation_model = LLM_MODEL_TIERS.get(LLM_ESCALATION_TIER) if LLM_ESCALATION_TIER else None
+    return [model, escalation_model] if escalation_model and escalation_model != model else [model]
+
+
+def record_routing(step: str, model: str, escalated: bool):
+    with routing_stats_lock:
+        stats = routing_stats.setdefault(step or "other", {"calls": 0, "escalations": 0, "models": {}})
+        stats["calls"] += 1
+        stats["escalations"] += int(escalated)
+        stats["models"][model] = stats["models"].get(model, 0) + 1
+
+
+def get_routing_stats() -> dict:
+    """Calls, escalations and calls per model for each step since startup."""
+    with routing_stats_lock:
+        return {step: dict(stats, models=dict(stats["models"])) for step, stats in routing_stats.items()}
@@ -0,0 +1,149 @@
+# offer_budget.py
+#
+# Per-offer budget for tokens, estimated cost (USD) and wall-clock time spent in model calls. The budget of the
+# current offer lives in a context variable (like the session id of session_store.py): every chat completion
+# and research call charges it, and the workflow asks it how to proceed:
+#   - budget_model():        the cheaper OFFER_BUDGET_FALLBACK_MODELS model once the offer is degraded
+#   - research_allowed():    no external research once degraded
+#   - budget_max_retries():  fewer JSON repair retries once degraded, none once exceeded
+#   - budget_context_size(): OFFER_BUDGET_DEGRADED_CONTEXT retrieved positions once degraded
+# Degraded = any limit at OFFER_BUDGET_DEGRADE_AT or more, exceeded = any limit reached. Without a budget in the
+# context (scripts, bulk jobs) all of these are no-ops.
+
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from config_data import (
+    OFFER_BUDGET_MAX_TOKENS, OFFER_BUDGET_MAX_USD, OFFER_BUDGET_MAX_SECONDS, OFFER_BUDGET_DEGRADE_AT,
+    OFFER_BUDGET_FALLBACK_MODELS, OFFER_BUDGET_DEGRADED_CONTEXT, OFFER_BUDGET_HARD_STOP, LLM_PRICES_USD_PER_1M_TOKENS
+)
+
+current_budget = contextvars.ContextVar("current_budget", default=None)
+
+
+def estimate_cost_usd(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    input_price, cached_price, output_price = LLM_PRICES_USD_PER_1M_TOKENS.get(model) or LLM_PRICES_USD_PER_1M_TOKENS["default"]
+    cached_tokens = min(cached_tokens or 0, prompt_tokens or 0)
+    return ((prompt_tokens or 0) - cached_tokens) * input_price / 1e6 + cached_tokens * cached_price / 1e6 + (completion_tokens or 0) * output_price / 1e6
+
+
+class OfferBudget:
+    """Running totals of one offer. Thread-safe; parallel drafting calls charge the same budget."""
+
+    def __init__(self, max_tokens: int = OFFER_BUDGET_MAX_TOKENS, max_usd: float = OFFER_BUDGET_MAX_USD,
+                 max_seconds: float = OFFER_BUDGET_MAX_SECONDS, degrade_at: float = OFFER_BUDGET_DEGRADE_AT):
+        self.limits = {"tokens": max_tokens, "usd": max_usd, "seconds": max_seconds}
+        self.degrade_at = degrade_at
+        self.lock = threading.Lock()
+        self.used = {"tokens": 0, "usd": 0.0, "seconds": 0.0}
+        self.calls = 0
+        self.busy_until = None # End of the latest charged call, so overlapping calls add their time only once
+        self.notices = set()
+
+    def charge(self, model: str, prompt_tokens: int = 0, cached_tokens: int = 0, completion_tokens: int = 0,
+               started: float = None, duration: float = 0.0):
+        """Adds one call. `started` (time.perf_counter()) and `duration` in seconds; without `started` the duration is added as is."""
+        with self.lock:
+            self.calls += 1
+            self.used["tokens"] += (prompt_tokens or 0) + (completion_tokens or 0)
+            self.used["usd"] += estimate_cost_usd(model, prompt_tokens, cached_tokens, completion_tokens)
+            if started is None:
+                self.used["seconds"] += duration
+            else:
+                ended = started + duration
+                if self.busy_until is None or ended > self.busy_until:
+                    self.used["seconds"] += ended - max(started, self.busy_until or started)
+                    self.busy_until = ended
+
+    def fraction(self) -> float:
+        """Highest used/limit ratio over all limits (0.0 if no limit is set)."""
+        with self.lock:
+            return max([self.used[name] / limit for name, limit in self.limits.items() if limit] or [0.0])
+
+    @property
+    def level(self) -> str:
+        fraction = self.fraction()
+        return "exceeded" if fraction >= 1.0 else "degraded" if fraction >= self.degrade_at else "ok"
+
+    def notice(self, message: str):
+        """Prints each degradation step once per offer."""
+        with self.lock:
+            if message in self.notices:
+                return
+            self.notices.add(message)
+        print(f"Offer budget {self.level} ({self.fraction():.0%} used): {message}")
+
+    def summary(self) -> dict:
+        with self.lock:
+            used = dict(self.used, usd=round(self.used["usd"], 4), seconds=round(self.used["seconds"], 1))
+            calls = self.calls
+        return {"level": self.level, "calls": calls, "used": used, "limits": dict(self.limits)}
+
+    def format_line(self) -> str:
+        used, limits = self.summary()["used"], self.limits
+        parts = [
+            f"{used['tokens']:,}" + (f"/{limits['tokens']:,}" if limits["tokens"] else "") + " tokens",
+            f"${used['usd']:.2f}" + (f"/${limits['usd']:.2f}" if limits["usd"] else ""),
+            f"{used['seconds']:.0f}" + (f"/{limits['seconds']:.0f}" if limits["seconds"] else "") + "s model time",
+        ]
+        return f"Offer budget: {', '.join(parts)} ({self.level})"
+
+
+@contextmanager
+def budget_context(budget: OfferBudget):
+    """Calls made inside this block (and in asyncio tasks or copied contexts started from it) use `budget`."""
+    token = current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        current_budget.reset(token)
+
+
+# --- HOOKS FOR THE WORKFLOW (no-ops without a budget) ---
+def charge_call(model: str, prompt_tokens: int = 0, cached_tokens: int = 0, completion_tokens: int = 0, started: float = None, duration: float = 0.0):
+    budget = current_budget.get()
+    if budget is not None:
+        budget.charge(model, prompt_tokens, cached_tokens, completion_tokens, started, duration)
+
+
+def budget_model(model: str) -> str:
+    budget = current_budget.get()
+    fallback = OFFER_BUDGET_FALLBACK_MODELS.get(model)
+    if budget is None or not fallback or budget.level == "ok":
+        return model
+    budget.notice(f"using {fallback} instead of {model}")
+    return fallback
+
+
+def research_allowed() -> bool:
+    budget = current_budget.get()
+    if budget is None or budget.level == "ok":
+        return True
+    budget.notice("skipping external research")
+    return False
+
+
+def budget_max_retries(max_retries: int) -> int:
+    budget = current_budget.get()
+    level = budget.level if budget is not None else "ok"
+    if level == "ok":
+        return max_retries
+    budget.notice("fewer JSON repair retries")
+    return 1 if level == "exceeded" else min(max_retries, 2)
+
+
+def budget_context_size(n_results: int) -> int:
+    budget = current_budget.get()
+    if budget is None or budget.level == "ok" or n_results <= OFFER_BUDGET_DEGRADED_CONTEXT:
+        return n_results
+    budget.notice(f"retrieving {OFFER_BUDGET_DEGRADED_CONTEXT} instead of {n_results} past positions as context")
+    return OFFER_BUDGET_DEGRADED_CONTEXT
+
+
+def budget_exceeded_error():
+    """Error dict for a call that must not run (OFFER_BUDGET_HARD_STOP and a limit reached), else None."""
+    budget = current_budget.get()
+    if not OFFER_BUDGET_HARD_STOP or budget is None or budget.level != "exceeded":
+        return None
+    return {"error": "OFFER_BUDGET_EXCEEDED", "details": budget.format_line()}
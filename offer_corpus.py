@@ -0,0 +1,359 @@
+# offer_corpus.py
+#
+# One loader for the offer corpus in DATA_DIR, shared by the indexer, the hours statistics and analytics.
+#   - read_offer_file() parses and validates one file against the offer schema. Malformed JSON (e.g. a trailing
+#     comma) is reported with line, column and the offending line; schema errors with their JSON path.
+#   - iter_offers() streams the valid offers one file at a time.
+#   - OfferCorpus holds all positions in columnar NumPy arrays (prices, quantities, tag ids in CSR layout,
+#     texts in one UTF-8 buffer) and is saved as a binary snapshot (one .npy file per array). Later startups
+#     memory-map the snapshot instead of reparsing every JSON file, as long as no offer file changed.
+#
+#   python3 offer_corpus.py            # Validate DATA_DIR and print a summary
+
+import os
+import json
+import shutil
+import numpy as np
+
+from config_data import DATA_DIR, CORPUS_SNAPSHOT_DIR
+
+SNAPSHOT_VERSION = 1
+
+# Offer schema: field -> kind. "positions" and "offer_id" are required, all other fields may be missing or null.
+OFFER_FIELDS = {
+    "offer_id": "id", "creation_date": "str", "valid_until_date": "str", "offer_title": "str",
+    "client_name_anonymized": "str", "client_industry_anonymized": "str", "contact_person_internal": "str",
+    "offer_type": "str", "project_focus_tags": "str_list", "total_price_chf_excl_vat": "number",
+    "total_price_chf_incl_vat": "number", "currency": "str", "services_offered": "str_list", "status": "str",
+    "positions": "list",
+}
+REQUIRED_OFFER_FIELDS = ["offer_id", "positions"]
+POSITION_FIELDS = {
+    "position_id": "id", "position_title": "str", "description": "str", "quantity": "number",
+    "unit_price_chf": "number", "total_price_chf": "number", "service_tags": "str_list",
+}
+KIND_NAMES = {"id": "a string or integer", "str": "a string", "number": "a number", "str_list": "a list of strings", "list": "a list"}
+
+
+class OfferFileError(ValueError):
+    """An offer file that cannot be used. `errors` lists every problem found, each with its location."""
+
+    def __init__(self, path: str, errors: list):
+        self.path = path
+        self.errors = errors
+        super().__init__(f"{os.path.basename(path)}: " + "; ".join(errors))
+
+
+# --- VALIDATION ---
+def _kind_ok(value, kind: str) -> bool:
+    if kind == "id":
+        return isinstance(value, str) or (isinstance(value, int) and not isinstance(value, bool))
+    if kind == "str":
+        return isinstance(value, str)
+    if kind == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind == "str_list":
+        return isinstance(value, list) and all(isinstance(item, str) for item in value)
+    return isinstance(value, list)
+
+
+def validate_offer(offer_data) -> list:
+    """Returns the schema errors of a parsed offer (empty list if it is valid)."""
+    if not isinstance(offer_data, dict):
+        return [f"$: expected an object, got {type(offer_data).__name__}"]
+    errors = [f"$.{field}: missing" for field in REQUIRED_OFFER_FIELDS if offer_data.get(field) is None]
+    for field, kind in OFFER_FIELDS.items():
+        value = offer_data.get(field)
+        if value is not None and not _kind_ok(value, kind):
+            errors.append(f"$.{field}: expected {KIND_NAMES[kind]}, got {type(value).__name__}")
+    for pos_idx, position in enumerate(offer_data.get("positions") if isinstance(offer_data.get("positions"), list) else []):
+        if not isinstance(position, dict):
+            errors.append(f"$.positions[{pos_idx}]: expected an object, got {type(position).__name__}")
+            continue
+        for field, kind in POSITION_FIELDS.items():
+            value = position.get(field)
+            if value is not None and not _kind_ok(value, kind):
+                errors.append(f"$.positions[{pos_idx}].{field}: expected {KIND_NAMES[kind]}, got {type(value).__name__}")
+    return errors
+
+
+def _line_and_column(text, pos: int):
+    line = text.count("\n" if isinstance(text, str) else b"\n", 0, pos) + 1
+    line_start = text.rfind("\n" if isinstance(text, str) else b"\n", 0, pos) + 1
+    return line, pos - line_start + 1
+
+
+def _json_error(text: str, e: json.JSONDecodeError) -> str:
+    """Describes a JSON syntax error with line/column and the offending line; detects trailing commas."""
+    before = text[:e.pos].rstrip()
+    if before.endswith(",") and text[e.pos:e.pos + 1] in ("]", "}"):
+        line, column = _line_and_column(text, len(before) - 1)
+        message = f"trailing comma before '{text[e.pos]}'"
+    else:
+        line, column = e.lineno, e.colno
+        message = e.msg
+    source_line = text.splitlines()[line - 1] if text.splitlines() else ""
+    return f"line {line}, column {column}: {message}\n    {source_line}\n    {' ' * (column - 1)}^"
+
+
+def read_offer_file(path: str) -> dict:
+    """Reads and validates one offer file. Raises OfferFileError with precise messages if it is unusable."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        line, column = _line_and_column(raw, e.start)
+        raise OfferFileError(path, [f"line {line}, column {column}: not UTF-8 (byte 0x{raw[e.start]:02x}); save the file as UTF-8"])
+    try:
+        offer_data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise OfferFileError(path, [_json_error(text, e)])
+    errors = validate_offer(offer_data)
+    if errors:
+        raise OfferFileError(path, errors)
+    return offer_data
+
+
+def offer_file_paths(data_dir: str = DATA_DIR) -> list:
+    return [os.path.join(data_dir, name) for name in sorted(os.listdir(data_dir)) if name.endswith(".json")]
+
+
+def iter_offers(data_dir: str = DATA_DIR, errors: dict = None):
+    """
+    Yields (path, offer dict) for every valid offer file, one file at a time.
+    Invalid files are skipped; their errors go into `errors` (path -> list) if given, otherwise they are printed.
+    """
+    for path in offer_file_paths(data_dir):
+        try:
+            yield path, read_offer_file(path)
+        except OfferFileError as e:
+            if errors is None:
+                print(f"Warning: Skipping invalid offer file {e}")
+            else:
+                errors[path] = e.errors
+        except OSError as e:
+            if errors is None:
+                print(f"Warning: Could not read {path}: {e}")
+            else:
+                errors[path] = [str(e)]
+
+
+def data_dir_signature(data_dir: str = DATA_DIR) -> dict:
+    """Modification time and size of every offer file; any change means the corpus must be rebuilt."""
+    signature = {}
+    for path in offer_file_paths(data_dir):
+        stat = os.stat(path)
+        signature[os.path.basename(path)] = [stat.st_mtime_ns, stat.st_size]
+    return signature
+
+
+# --- COLUMNAR CORPUS ---
+class StringColumn:
+    """Strings stored as one UTF-8 byte buffer plus offsets (n+1). Decodes a string only when it is accessed."""
+
+    __slots__ = ("data", "offsets")
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: list):
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8).copy(), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def _optional_number(value) -> float:
+    return float(value) if value is not None else np.nan
+
+
+def _number_or_none(value):
+    return None if np.isnan(value) else float(value)
+
+
+class OfferCorpus:
+    """
+    All valid offers of a data directory in columnar form.
+
+    Offer columns (n_offers): offer_id, offer_title, source_file, industry_id, status_id, total_excl_vat,
+    position_start (n_offers+1, CSR offsets into the position columns).
+    Position columns (n_positions): offer_index, position_id, position_title, description, quantity,
+    unit_price, total_price (NaN if missing), tag_start (n_positions+1, CSR offsets into tag_id).
+    Vocabularies: industries, statuses, tags (ids index into these lists).
+    """
+
+    __slots__ = (
+        "offer_id", "offer_title", "source_file", "industry_id", "status_id", "total_excl_vat", "position_start",
+        "offer_index", "position_id", "position_title", "description", "quantity", "unit_price", "total_price",
+        "tag_start", "tag_id", "industries", "statuses", "tags", "errors", "signature",
+    )
+    STRING_COLUMNS = ("offer_id", "offer_title", "source_file", "position_id", "position_title", "description")
+    ARRAY_COLUMNS = ("industry_id", "status_id", "total_excl_vat", "position_start", "offer_index",
+                     "quantity", "unit_price", "total_price", "tag_start", "tag_id")
+
+    @property
+    def n_offers(self) -> int:
+        return len(self.offer_id)
+
+    @property
+    def n_positions(self) -> int:
+        return len(self.position_id)
+
+    # --- building ---
+    @classmethod
+    def build(cls, data_dir: str = DATA_DIR):
+        """Streams all offer files once and builds the columns."""
+        corpus = cls()
+        corpus.errors = {}
+        corpus.signature = data_dir_signature(data_dir)
+        vocabularies = {"industries": {}, "statuses": {}, "tags": {}}
+        columns = {name: [] for name in cls.STRING_COLUMNS + cls.ARRAY_COLUMNS}
+        columns["position_start"].append(0)
+        columns["tag_start"].append(0)
+
+        def vocab_id(vocabulary: str, value: str) -> int:
+            return vocabularies[vocabulary].setdefault(value, len(vocabularies[vocabulary]))
+
+        for path, offer_data in iter_offers(data_dir, corpus.errors):
+            offer_index = len(columns["offer_id"])
+            columns["offer_id"].append(str(offer_data["offer_id"]))
+            columns["offer_title"].append(offer_data.get("offer_title") or "")
+            columns["source_file"].append(os.path.basename(path))
+            columns["industry_id"].append(vocab_id("industries", (offer_data.get("client_industry_anonymized") or "").strip()))
+            columns["status_id"].append(vocab_id("statuses", offer_data.get("status") or "unknown"))
+            columns["total_excl_vat"].append(_optional_number(offer_data.get("total_price_chf_excl_vat")))
+            for pos_idx, position in enumerate(offer_data["positions"]):
+                columns["offer_index"].append(offer_index)
+                columns["position_id"].append(str(position["position_id"] if position.get("position_id") is not None else pos_idx + 1))
+                columns["position_title"].append(position.get("position_title") or "")
+                columns["description"].append(position.get("description") or "")
+                columns["quantity"].append(_optional_number(position.get("quantity")))
+                columns["unit_price"].append(_optional_number(position.get("unit_price_chf")))
+                columns["total_price"].append(_optional_number(position.get("total_price_chf")))
+                columns["tag_id"].extend(vocab_id("tags", tag) for tag in position.get("service_tags") or [])
+                columns["tag_start"].append(len(columns["tag_id"]))
+            columns["position_start"].append(len(columns["offer_index"]))
+
+        for name in cls.STRING_COLUMNS:
+            setattr(corpus, name, StringColumn.from_strings(columns[name]))
+        dtypes = {"total_excl_vat": np.float64, "quantity": np.float64, "unit_price": np.float64, "total_price": np.float64,
+                  "position_start": np.int64, "tag_start": np.int64}
+        for name in cls.ARRAY_COLUMNS:
+            setattr(corpus, name, np.asarray(columns[name], dtype=dtypes.get(name, np.int32)))
+        for vocabulary, ids in vocabularies.items():
+            setattr(corpus, vocabulary, list(ids))
+        return corpus
+
+    # --- snapshot ---
+    def save_snapshot(self, snapshot_dir: str = CORPUS_SNAPSHOT_DIR):
+        """Writes the columns as .npy files plus a manifest; replaces an existing snapshot as a whole."""
+        tmp_dir = f"{snapshot_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name in self.STRING_COLUMNS:
+            column = getattr(self, name)
+            np.save(os.path.join(tmp_dir, f"{name}.data.npy"), column.data)
+            np.save(os.path.join(tmp_dir, f"{name}.offsets.npy"), column.offsets)
+        for name in self.ARRAY_COLUMNS:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+            json.dump({"version": SNAPSHOT_VERSION, "signature": self.signature, "errors": self.errors,
+                       "industries": self.industries, "statuses": self.statuses, "tags": self.tags}, f, ensure_ascii=False)
+        old_dir = f"{snapshot_dir}.old-{os.getpid()}"
+        if os.path.exists(snapshot_dir):
+            os.replace(snapshot_dir, old_dir) # Open memory maps of the old snapshot stay valid
+        os.replace(tmp_dir, snapshot_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load_snapshot(cls, snapshot_dir: str = CORPUS_SNAPSHOT_DIR):
+        """Memory-maps a snapshot. Returns None if there is none or it has an older format."""
+        manifest_path = os.path.join(snapshot_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("version") != SNAPSHOT_VERSION:
+            return None
+        corpus = cls()
+        for name in cls.STRING_COLUMNS:
+            setattr(corpus, name, StringColumn(
+                np.load(os.path.join(snapshot_dir, f"{name}.data.npy"), mmap_mode="r"),
+                np.load(os.path.join(snapshot_dir, f"{name}.offsets.npy"), mmap_mode="r"),
+            ))
+        for name in cls.ARRAY_COLUMNS:
+            setattr(corpus, name, np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode="r"))
+        for key in ("signature", "errors", "industries", "statuses", "tags"):
+            setattr(corpus, key, manifest[key])
+        return corpus
+
+    # --- access ---
+    def positions_of(self, offer_index: int) -> range:
+        return range(int(self.position_start[offer_index]), int(self.position_start[offer_index + 1]))
+
+    def position_tags(self, position_index: int) -> list:
+        return [self.tags[t] for t in self.tag_id[self.tag_start[position_index]:self.tag_start[position_index + 1]]]
+
+    def position(self, position_index: int) -> dict:
+        """One position as a dict in the offer file format."""
+        return {
+            "position_id": self.position_id[position_index],
+            "position_title": self.position_title[position_index],
+            "description": self.description[position_index],
+            "quantity": _number_or_none(self.quantity[position_index]),
+            "unit_price_chf": _number_or_none(self.unit_price[position_index]),
+            "total_price_chf": _number_or_none(self.total_price[position_index]),
+            "service_tags": self.position_tags(position_index),
+        }
+
+    def offer_status(self, offer_index: int) -> str:
+        return self.statuses[self.status_id[offer_index]]
+
+    def offer_industry(self, offer_index: int) -> str:
+        return self.industries[self.industry_id[offer_index]]
+
+    def tag_position_index(self) -> np.ndarray:
+        """Position index of every entry of tag_id (to group position values by tag without a Python loop)."""
+        return np.repeat(np.arange(self.n_positions), np.diff(self.tag_start))
+
+
+_corpus = None
+
+
+def load_corpus(data_dir: str = DATA_DIR, snapshot_dir: str = CORPUS_SNAPSHOT_DIR) -> OfferCorpus:
+    """
+    Returns the corpus of `data_dir`: the in-process copy or the memory-mapped snapshot if no offer file
+    changed since it was written, otherwise a fresh build (which then replaces the snapshot).
+    """
+    global _corpus
+    signature = data_dir_signature(data_dir)
+    if _corpus is not None and _corpus.signature == signature:
+        return _corpus
+    snapshot = OfferCorpus.load_snapshot(snapshot_dir)
+    if snapshot is not None and snapshot.signature == signature:
+        _corpus = snapshot
+    else:
+        print(f"Building the offer corpus snapshot from {data_dir}...")
+        _corpus = OfferCorpus.build(data_dir)
+        _corpus.save_snapshot(snapshot_dir)
+    for path, errors in _corpus.errors.items():
+        print(f"Warning: Skipping invalid offer file {os.path.basename(path)}:\n  " + "\n  ".join(errors))
+    return _corpus
+
+
+if __name__ == "__main__":
+    corpus = load_corpus()
+    print(f"{corpus.n_offers} valid offer(s) with {corpus.n_positions} positions, {len(corpus.tags)} service tags, "
+          f"{len(corpus.errors)} invalid file(s).")
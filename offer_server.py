@@ -0,0 +1,399 @@
+# offer_server.py
+#
+# Local HTTP/JSON API around the offer workflow. One long-running process keeps the embedding model,
+# the vector store and the API clients warm, and several consultants work against it concurrently.
+#
+# Start with:  python3 main.py --serve   (or python3 offer_server.py)
+#
+# Endpoints (all bodies and responses are JSON):
+#   GET  /health
+#   GET  /metrics                           knowledge base index freshness (watcher lag), prompt and retrieval cache hit rates,
+#                                           rate limit queuing, last Bexio sync-back, session store writes,
+#                                           model routing (calls and escalations per step), record/replay cassette
+#   POST /sessions                          body: high-level info (client_name, client_industry, project_title, ...)
+#   GET  /sessions/<id>
+#   POST /sessions/<id>/research            body: {"enabled": true}
+#   POST /sessions/<id>/structure           body: {"feedback": "optional change request"}  (edits the last proposal if there is one)
+#   POST /sessions/<id>/structure/accept    body: {"structure": [...]}  (optional, defaults to the last proposal)
+#   POST /sessions/<id>/price               body: {"overrides": [{"index": 0, "hours": 12, "service_area": "..."}]}
+#   POST /sessions/<id>/draft               body: {"generate_title": true}
+#   POST /sessions/<id>/draft/edit          body: {"edits": [{"index": 0, "title": "...", "description": "...", "hours": 12, "service_area": "..."}]}
+#                                           (re-drafts only the changed positions)
+#   POST /sessions/<id>/bexio
+#
+# Sessions, every stage result, LLM call, draft and Bexio export are recorded in the session store
+# (session_store.py); a session unknown to this process (e.g. after a restart, or evicted after
+# SERVER_SESSION_IDLE_SECONDS without requests) is restored from there.
+
+import re
+import json
+import time
+import uuid
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import offer_workflow as ow
+from config_data import DATA_DIR, SERVER_HOST, SERVER_PORT, SERVER_SESSION_IDLE_SECONDS, KB_WATCH_ENABLED, BEXIO_SYNC_INTERVAL_SECONDS
+from kb_watcher import KnowledgeBaseWatcher
+from llm_utils import get_prompt_cache_stats
+from vector_store_utils import get_retrieval_cache_stats
+from rate_limiter import governor
+from bexio_master_data import master_data as bexio_master_data
+from bexio_sync import start_periodic_sync, last_sync_result
+from session_store import session_store, session_context
+from offer_budget import OfferBudget, budget_context
+from model_routing import get_routing_stats
+from cassette import cassette
+
+HIGH_LEVEL_INFO_KEYS = [
+    "client_name", "client_industry", "project_title",
+    "key_services_description", "project_focus_tags_input",
+    "estimated_num_components", "language", "additional_context"
+]
+
+# --- SESSION STATE ---
+sessions = {}
+sessions_lock = threading.Lock()
+kb_watcher = None
+bexio_sync_stop = threading.Event()
+
+
+class StageError(Exception):
+    """Raised by a stage handler to answer with an HTTP error status."""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def create_session(payload):
+    high_level_info = {key: str(payload.get(key, "")) for key in HIGH_LEVEL_INFO_KEYS}
+    if not high_level_info["estimated_num_components"].isdigit():
+        high_level_info["estimated_num_components"] = "1"
+    session = {
+        "id": uuid.uuid4().hex,
+        "lock": threading.Lock(), # Serializes stages of one session; different sessions run in parallel
+        "created_at": time.time(),
+        "last_used": time.monotonic(),
+        "info": high_level_info,
+        "retrieved_contexts": None,
+        "proposed_structure": None,
+        "draft": None,
+        "bexio_response": None,
+        "budget": OfferBudget(),
+    }
+    with sessions_lock:
+        evict_idle_sessions()
+        sessions[session["id"]] = session
+    save_session(session)
+    return session
+
+
+def get_session(session_id):
+    """The live session dict. last_used is refreshed under sessions_lock, so a concurrent eviction cannot orphan it."""
+    while True:
+        with sessions_lock:
+            session = sessions.get(session_id)
+            if session is not None:
+                session["last_used"] = time.monotonic()
+                return session
+        # Not in memory: restore it, then look it up again (the restored dict is only used once it is in `sessions`)
+        if restore_session(session_id) is None:
+            raise StageError(404, f"Unknown session '{session_id}'.")
+
+
+def evict_idle_sessions(idle_seconds: float = SERVER_SESSION_IDLE_SECONDS):
+    """Drops sessions not used for idle_seconds from memory (caller holds sessions_lock). Without a session store
+    nothing is evicted, as an evicted session could not be restored. Sessions with a running stage are kept."""
+    if not session_store.enabled or idle_seconds <= 0:
+        return 0
+    cutoff = time.monotonic() - idle_seconds
+    idle = [session_id for session_id, session in sessions.items() if session["last_used"] < cutoff and not session["lock"].locked()]
+    for session_id in idle:
+        del sessions[session_id]
+    return len(idle)
+
+
+def save_session(session):
+    session_store.save_session(session["id"], session["info"], session["proposed_structure"], session["draft"], session["bexio_response"])
+
+
+def restore_session(session_id):
+    """Loads a session of an earlier server run from the session store. Retrieval context is fetched again when needed."""
+    stored = session_store.load_session(session_id)
+    if stored is None:
+        return None
+    budget = OfferBudget() # Continues from the calls recorded so far
+    usage_rows = session_store.llm_usage_summary(session_id)
+    for usage in usage_rows:
+        budget.charge(usage["model"], usage["prompt_tokens"], usage["cached_tokens"], usage["completion_tokens"],
+                      duration=(usage["avg_latency_ms"] or 0) * usage["calls"] / 1000)
+    budget.calls = sum(usage["calls"] for usage in usage_rows)
+    session = {
+        "id": session_id,
+        "lock": threading.Lock(),
+        "created_at": stored["created_at"],
+        "last_used": time.monotonic(),
+        "info": stored["info"],
+        "retrieved_contexts": None,
+        "proposed_structure": stored["proposed_structure"],
+        "draft": stored["draft"],
+        "bexio_response": stored["bexio_response"],
+        "budget": budget,
+    }
+    with sessions_lock:
+        evict_idle_sessions()
+        session = sessions.setdefault(session_id, session) # Another request may have restored it meanwhile
+        session["last_used"] = time.monotonic()
+    return session
+
+
+def session_state(session):
+    return {
+        "session_id": session["id"],
+        "info": {key: value for key, value in session["info"].items() if key != "draft_cache"},
+        "proposed_structure": session["proposed_structure"],
+        "draft": session["draft"],
+        "bexio_response": session["bexio_response"],
+        "budget": session["budget"].summary(),
+    }
+
+
+def ensure_research(session):
+    """Research is optional; stages that need the summaries fall back to 'not performed'."""
+    if "client_research_summary" not in session["info"]:
+        ow.run_external_research(session["info"], research_enabled=False)
+
+
+def ensure_context(session):
+    if session["retrieved_contexts"] is None:
+        session["retrieved_contexts"] = ow.retrieve_overall_context(session["info"], n_results=5)
+    return session["retrieved_contexts"]
+
+
+# --- STAGE HANDLERS ---
+def stage_research(session, payload):
+    ow.run_external_research(session["info"], bool(payload.get("enabled", True)))
+    return {
+        "client_research_summary": session["info"]["client_research_summary"],
+        "offer_focused_research_summary": session["info"]["offer_focused_research_summary"],
+        "research_models": session["info"]["research_models"],
+        "research_brief": session["info"]["research_brief"],
+    }
+
+
+def stage_propose_structure(session, payload):
+    ensure_research(session)
+    args = (
+        session["info"], ensure_context(session),
+        session["info"]["client_research_summary"], session["info"]["offer_focused_research_summary"]
+    )
+    feedback = payload.get("feedback", "")
+    proposal = None
+    if feedback and session["proposed_structure"]: # Patch the current proposal instead of regenerating it
+        proposal = ow.request_structure_edit(*args, session["proposed_structure"], feedback)
+        if "error" in proposal:
+            proposal = None
+    if proposal is None:
+        proposal = ow.request_structure_proposal(*args, feedback)
+    if "error" in proposal or not isinstance(proposal, list):
+        raise StageError(502, f"AI failed to propose a valid structure: {proposal}")
+    session["proposed_structure"] = proposal
+    return {"proposed_structure": proposal}
+
+
+def stage_accept_structure(session, payload):
+    structure = payload.get("structure") or session["proposed_structure"]
+    if not structure:
+        raise StageError(409, "No structure to accept. Call /structure first or pass 'structure'.")
+    ow.confirm_offer_structure(session["info"], structure)
+    return {"positions_details": session["info"]["positions_details"]}
+
+
+def stage_price(session, payload):
+    if not session["info"].get("positions_details"):
+        raise StageError(409, "No confirmed structure to price. Call /structure/accept first.")
+    positions = ow.update_position_pricing(session["info"], payload.get("overrides", []))
+    return {"positions_details": positions, "pricing_summary": session["info"]["pricing_summary"]}
+
+
+def stage_draft(session, payload):
+    if not session["info"].get("positions_details"):
+        raise StageError(409, "No confirmed structure to draft. Call /structure/accept first.")
+    ensure_research(session)
+    if payload.get("generate_title", True):
+        ow.generate_project_title(session["info"])
+    draft = ow.draft_final_offer(session["info"], ensure_context(session))
+    if "error" in draft:
+        raise StageError(502, f"Failed to generate valid JSON output for the final offer: {draft.get('error')}")
+    session["draft"] = draft
+    session_store.record_draft(session["id"], draft)
+    return {"draft": draft}
+
+
+def stage_edit_draft(session, payload):
+    if not session["draft"] or not session["info"].get("positions_details"):
+        raise StageError(409, "No drafted offer to edit. Call /draft first.")
+    edits = payload.get("edits")
+    if not isinstance(edits, list) or not edits:
+        raise StageError(400, "'edits' must be a non-empty list.")
+    ow.edit_confirmed_positions(session["info"], edits)
+    draft = ow.redraft_final_offer(session["info"], ensure_context(session))
+    if "error" in draft:
+        raise StageError(502, f"Failed to re-draft the changed positions: {draft.get('error')}")
+    session["draft"] = draft
+    session_store.record_draft(session["id"], draft)
+    return {
+        "draft": draft,
+        "redrafted_positions": (session["info"].get("draft_cache") or {}).get("last_redrafted"),
+        "pricing_summary": session["info"]["pricing_summary"],
+    }
+
+
+def stage_bexio(session, payload):
+    if not ow.bexio_is_configured():
+        raise StageError(409, "BEXIO_API_TOKEN is not configured or is using a placeholder.")
+    if not session["draft"] or not session["draft"].get("positions"):
+        raise StageError(409, "No drafted offer with positions to export. Call /draft first.")
+    session["bexio_response"] = ow.export_offer_to_bexio(
+        session["draft"], session["info"].get("pricing_summary"), session["info"].get("client_name")
+    )
+    session_store.record_bexio_export(session["id"], session["bexio_response"])
+    if session["bexio_response"] and "error" in session["bexio_response"]:
+        raise StageError(502, f"Bexio quote creation returned an error: {session['bexio_response']}")
+    return {"bexio_response": session["bexio_response"]}
+
+
+def run_stage(session, method, stage, handler, payload):
+    """Runs a stage handler and records its result (or error) and the resulting session state in the session store."""
+    if method == "GET":
+        return 200, handler(session, payload)
+    start = time.perf_counter()
+    status, output = 500, None
+    try:
+        output = handler(session, payload)
+        status = 200
+        return status, output
+    except StageError as e:
+        status, output = e.status, {"error": e.message}
+        raise
+    except Exception as e:
+        output = {"error": "INTERNAL_ERROR", "details": str(e)}
+        raise
+    finally:
+        session_store.record_stage(session["id"], stage, output, (time.perf_counter() - start) * 1000, status)
+        save_session(session)
+
+
+SESSION_ROUTES = {
+    ("GET", ""): lambda session, payload: session_state(session),
+    ("POST", "research"): stage_research,
+    ("POST", "structure"): stage_propose_structure,
+    ("POST", "structure/accept"): stage_accept_structure,
+    ("POST", "price"): stage_price,
+    ("POST", "draft"): stage_draft,
+    ("POST", "draft/edit"): stage_edit_draft,
+    ("POST", "bexio"): stage_bexio,
+}
+SESSION_PATH = re.compile(r"^/sessions/([0-9a-f]+)/?(.*)$")
+
+
+# --- HTTP LAYER ---
+class OfferRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive for clients that reuse connections
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def read_json_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            payload = json.loads(self.rfile.read(length).decode("utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise StageError(400, f"Request body is not valid JSON: {e}")
+        if not isinstance(payload, dict):
+            raise StageError(400, "Request body must be a JSON object.")
+        return payload
+
+    def dispatch(self, method):
+        start = time.perf_counter()
+        try:
+            payload = self.read_json_body() if method == "POST" else {}
+            path = self.path.split("?", 1)[0]
+            if method == "GET" and path == "/health":
+                status, body = 200, {"status": "ok", "sessions": len(sessions)}
+            elif method == "GET" and path == "/metrics":
+                status, body = 200, {
+                    "index_freshness": kb_watcher.get_freshness() if kb_watcher else None,
+                    "prompt_cache": get_prompt_cache_stats(),
+                    "retrieval_cache": get_retrieval_cache_stats(),
+                    "rate_limits": governor.get_stats(),
+                    "bexio_sync": dict(last_sync_result) or None,
+                    "session_store": session_store.get_stats(),
+                    "model_routing": get_routing_stats(),
+                    "cassette": cassette.get_stats(),
+                }
+            elif method == "POST" and path.rstrip("/") == "/sessions":
+                status, body = 201, session_state(create_session(payload))
+            else:
+                match = SESSION_PATH.match(path)
+                handler = SESSION_ROUTES.get((method, match.group(2).rstrip("/"))) if match else None
+                if handler is None:
+                    raise StageError(404, f"No endpoint for {method} {path}")
+                session = get_session(match.group(1))
+                with session["lock"], session_context(session["id"]), budget_context(session["budget"]):
+                    status, body = run_stage(session, method, match.group(2).rstrip("/"), handler, payload)
+        except StageError as e:
+            status, body = e.status, {"error": e.message}
+        except Exception as e:
+            print(f"Unexpected error while handling {method} {self.path}: {e}")
+            status, body = 500, {"error": "INTERNAL_ERROR", "details": str(e)}
+        body["stage_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        self.send_json(status, body)
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"[offer_server] {self.address_string()} - {format % args}")
+
+
+def serve(host: str = SERVER_HOST, port: int = SERVER_PORT):
+    global kb_watcher
+    print("Starting Sidekicks AI Offer Assistant server...")
+    ow.load_and_vectorize_offers(DATA_DIR) # Warm-up: model, vector store and clients are loaded once here
+    if KB_WATCH_ENABLED:
+        kb_watcher = KnowledgeBaseWatcher(DATA_DIR)
+        kb_watcher.start()
+    if ow.bexio_is_configured():
+        counts = bexio_master_data.refresh() # Warm-up: contact/tax/unit lookups for quotes are served from memory
+        print("Bexio master data: " + ", ".join(f"{count} {resource}" for resource, count in counts.items()))
+        if BEXIO_SYNC_INTERVAL_SECONDS > 0: # Changed quotes land in DATA_DIR; the watcher (if enabled) re-indexes them
+            start_periodic_sync(BEXIO_SYNC_INTERVAL_SECONDS, bexio_sync_stop, DATA_DIR, index=not KB_WATCH_ENABLED)
+    server = ThreadingHTTPServer((host, port), OfferRequestHandler)
+    server.daemon_threads = True
+    print(f"Offer Assistant API listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+    finally:
+        server.server_close()
+        session_store.flush()
+        bexio_sync_stop.set()
+        if kb_watcher:
+            kb_watcher.stop()
+
+
+if __name__ == "__main__":
+    serve()
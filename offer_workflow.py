@@ -2,22 +2,36 @@
 
 import os
 import json
+import time
+import uuid
 from dotenv import load_dotenv
 
 # Import configurations
-import prompts_config as pc
+import prompt_templates as pt
 from config_data import (
-    INTERNAL_HOURLY_RATES, TYPICAL_SERVICE_AREAS, calculate_position_price, DATA_DIR,
+    INTERNAL_HOURLY_RATES, TYPICAL_SERVICE_AREAS, DATA_DIR, DRAFT_MODE,
     BEXIO_API_TOKEN # Import BEXIO_API_TOKEN to check if it's set for Bexio integration
 )
-from llm_utils import get_llm_response, get_llm_json_response
-from vector_store_utils import load_and_vectorize_offers, retrieve_context
-from research_utils import ask_for_external_research, perform_client_research, perform_offer_focused_research
+from llm_utils import get_llm_response, get_llm_json_response, get_prompt_cache_stats
+from vector_store_utils import load_and_vectorize_offers, retrieve_context, build_overall_query
+from research_utils import ask_for_external_research, perform_research
 from bexio_utils import transform_to_bexio_format, create_bexio_quote # For Bexio integration
+from pricing_utils import price_positions, price_confirmed_positions
+from hours_estimator import historical_hours_reference, apply_hours_estimates
+from structure_edits import apply_structure_operations, structure_for_prompt, validate_structure
+from parallel_drafting import draft_offer_in_parallel, redraft_changed_positions
+from session_store import session_store, current_session_id
+from offer_budget import OfferBudget, current_budget, research_allowed, budget_context_size
 
 # --- CONFIGURATION ---
 load_dotenv()
 
+# Workflow state stored in high_level_info that is not part of the offer requirements shown to the LLM
+NON_DETAIL_KEYS = [
+    "client_research_summary", "offer_focused_research_summary", "research_models", "research_brief",
+    "positions_details", "pricing_summary", "draft_cache"
+]
+
 # --- HELPER FUNCTIONS ---
 def request_positions_manually_from_consultant(num_positions_str):
     """
@@ -76,10 +90,10 @@ def request_positions_manually_from_consultant(num_positions_str):
             
             # Price calculation only for Offer Positions
             if position_detail["type"] == "Offer Position":
-                price_info = calculate_position_price(
-                    position_detail["suggested_service_area"],
-                    position_detail["estimated_hours_suggestion"]
-                )
+                price_info = price_positions([{
+                    "service_area": position_detail["suggested_service_area"],
+                    "hours": position_detail["estimated_hours_suggestion"]
+                }])["positions"][0]
                 # Storing calculated price info, though it's not part of the final JSON structure per se,
                 # it's useful context for the consultant during this manual step.
                 position_detail["calculated_price_info"] = price_info
@@ -128,42 +142,199 @@ def display_proposed_structure(proposed_structure_json):
         print(f"    Focus: {pos_suggestion.get('focus_description', 'N/A')}")
         if pos_suggestion.get('type') == "Offer Position":
             print(f"    Suggested Hours: {pos_suggestion.get('estimated_hours_suggestion', 'N/A')}")
+            historical = pos_suggestion.get("historical_hours") or {}
+            if historical.get("estimate") is not None:
+                print(f"    Historical Hours: ~{historical['estimate']} h (range {historical['low']}-{historical['high']} h, based on {historical['basis']})")
+            if pos_suggestion.get("hours_warning"):
+                print(f"    WARNING: Suggested hours are {pos_suggestion['hours_warning']}")
             print(f"    Suggested Service Area: {pos_suggestion.get('suggested_service_area', 'N/A')}")
 
+def confirm_offer_structure(high_level_info, proposed_structure):
+    """
+    Turns an accepted structure proposal into the confirmed 'positions_details' (with prices)
+    and appends the Abgrenzung/Terms and Conditions text position. Updates and returns high_level_info.
+    """
+    confirmed_positions = []
+    for pos in proposed_structure:
+        confirmed_pos = {
+            "type": pos.get("type"),
+            "title_input": pos.get("proposed_title"),
+            "description_input": pos.get("focus_description")
+        }
+        if pos.get("type") == "Offer Position":
+            confirmed_pos["service_area_input"] = pos.get("suggested_service_area")
+            confirmed_pos["service_area_input"] = pos.get("suggested_service_area", TYPICAL_SERVICE_AREAS[0])
+            try:
+                hours = float(pos.get('estimated_hours_suggestion', 1))
+                if hours <= 0: hours = 1
+                confirmed_pos["hours_input"] = hours
+            except (ValueError, TypeError):
+                print(f"Warning: Invalid hours for '{pos.get('proposed_title')}'. Defaulting to 1.")
+                confirmed_pos["hours_input"] = 1.0
+        confirmed_positions.append(confirmed_pos)
+    # --- Always append Abgrenzung/Terms and Conditions as a Text Position ---
+    abgr_de = (
+        "Wenn nicht explizit anders definiert, gilt f&uuml;r alle Positionen:<br />"
+        "<ul>"
+        "<li>Kosten von Drittanbietern sind nicht Bestandteil und werden vom Kunden &uuml;bernommen</li>"
+        "<li>Als Basis f&uuml;r eine Zusammenarbeit ist das Digital Horizon Support Abo Voraussetzung (Ausnahme einzelne Workshops und Kurzprojekte)</li>"
+        "<li>Abonnemente starten am Zusagedatum und werden direkt im Voraus in Rechnung gestellt</li>"
+        "<li>Abonnemente erneuern sich ohne Gegenbericht automatisch. R&uuml;ckerstattungen bei K&uuml;ndigung innerhalb einer laufenden Periode sind nur in Ausnahmef&auml;llen m&ouml;glich</li>"
+        "<li>Bildmaterial, Videos, Texte und andere Medien werden durch den Kunden angeliefert, ausser die Erstellung ist Teil der Offerte</li>"
+        "<li>Abkl&auml;rungen, &Uuml;bergaben, Besprechungen, Einf&uuml;hrungen und Abnahmen finden remote statt (Telefon, Bildschirm&uuml;bertragung, E-Mail etc.)</li>"
+        "<li>Workshops, Meetings oder Schulungen in Person finden an einem Sidekick Standort statt</li>"
+        "<li>Ist ein Vor-Ort Termin gew&uuml;nscht, so werden Anfahrtszeit zum Stundensatz und Fahrtkosten verrechnet</li>"
+        "<li>Bestehende Zug&auml;nge oder Freigaben zu Plattformen werden von Kunde an Sidekicks weitergegeben</li>"
+        "<li>Entscheidet der Kunde bei der Abnahme einer Leistung, wie etwa einer Kampagne, diese nicht zu publizieren, aktivieren oder verschicken, so wird die Position trotzdem verrechnet</li>"
+        "<li>Falls von einer Plattform ein Zahlungsmittel ben&ouml;tigt wird, hinterlegt der Kunde seine eigene Firmenkreditkarte</li>"
+        "<li>Der Kunde ist verpflichtet, seine Finanzen im Zusammenhang mit den Dienstleistungen der Your Sidekicks AG sorgf&auml;ltig zu &uuml;berwachen, einschliesslich der Kontrolle von Werbebudgetausgaben, und Unstimmigkeiten umgehend zu melden. Sidekicks haftet nicht f&uuml;r finanzielle Verluste bei Mediabudgetausgaben.&nbsp;</li>"
+        "<li>Sidekicks haftet nicht f&uuml;r Drittanbieter-Tools, die im Rahmen der Dienstleistung verwendet werden, auch wenn die Toolkosten via Sidekicks getragen werden.&nbsp;</li>"
+        "<li>Auch wenn eine Plattform eine Kampagne, Zielgruppe oder Inhalt unerwartet ablehnen sollte, wird die zugeh&ouml;rige Position verrechnet</li>"
+        "<li>Der Kunde hat die Offertenpunkte und zugeh&ouml;rigen Informationen genau zu pr&uuml;fen, bei Unklarheiten nachzufragen und akzeptiert diese mit der Zusage als Pauschalpreise</li>"
+        "<li>Die Rechnungserstellung erfolgt nach der ersten &Uuml;bergabe der Arbeitsergebnisse f&uuml;r alle Positionen gleichzeitig&nbsp;</li>"
+        "<li>Es gelten die Allgemeine Gesch&auml;ftsbedingungen (AGB) sowie die Datenschutzerkl&auml;rung von Your Sidekicks AG einsehbar unter&nbsp;www.sidekicks.ch</li>"
+        "</ul>"
+    )
+    abgr_en = (
+        "Unless explicitly defined otherwise, the following applies to all positions:<br />"
+        "<ul>"
+        "<li>Costs incurred from third-party services are not included and will be covered by the customer.</li>"
+        "<li>The Digital Horizon Support subscription is a prerequisite for collaboration (except for individual workshops and short-term projects).</li>"
+        "<li>Subscriptions start from the date of confirmation and are billed in advance.</li>"
+        "<li>Subscriptions renew automatically unless notified otherwise. Refunds for cancellations within a current period are only possible in exceptional circumstances.</li>"
+        "<li>Visuals, videos, texts, and other media are to be provided by the customer, unless their creation is included in the offer.</li>"
+        "<li>Clarifications, handovers, meetings, introductions, and acceptances will be conducted remotely (via phone, screen sharing, email, etc.).</li>"
+        "<li>Workshops, meetings, or training sessions in person will take place at a Sidekick location.</li>"
+        "<li>If an on-site meeting is requested, travel time will be billed at the hourly rate, along with travel expenses.</li>"
+        "<li>Existing access or permissions to platforms will be transferred from the customer to Sidekicks.</li>"
+        "<li>If the customer decides not to publish, activate, or distribute a service upon acceptance, such as a campaign, the position will still be invoiced.</li>"
+        "<li>If a platform requires payment, the customer must provide their own corporate credit card.</li>"
+        "<li>The customer is responsible for monitoring their finances related to Your Sidekicks AG's services, including advertising budget expenditures, and reporting any discrepancies promptly. Sidekicks is not liable for financial losses incurred from media budget expenditures.</li>"
+        "<li>Sidekicks is not liable for third-party tools used within the scope of the service, even if the tool costs are covered by Sidekicks.</li>"
+        "<li>Even if a platform unexpectedly rejects a campaign, target audience, or content, the associated position will still be invoiced.</li>"
+        "<li>The customer is responsible for carefully reviewing the offer points and associated information, seeking clarification if needed, and accepting them as fixed prices upon confirmation.</li>"
+        "<li>Invoicing will occur after the initial handover of work results for all positions simultaneously.</li>"
+        "<li>The General Terms and Conditions (GTC) and the privacy policy of Your Sidekicks AG apply, accessible at www.sidekicks.ch.</li>"
+        "</ul>"
+    )
+    lang = high_level_info.get("language", "German").lower()
+    if "en" in lang:
+        abgr_text = abgr_en
+        abgr_title = "Terms and Conditions"
+    elif "de" in lang or "ger" in lang:
+        abgr_text = abgr_de
+        abgr_title = "Abgrenzung"
+    else:
+        abgr_text = abgr_en + "<br /><br />" + abgr_de
+        abgr_title = "Terms and Conditions / Abgrenzung"
+    confirmed_positions.append({
+        "type": "Text Position",
+        "title_input": abgr_title,
+        "description_input": abgr_text,
+        "fixed_text": True # Standard terms: used verbatim by the parallel drafting mode
+    })
+    high_level_info["positions_details"] = confirmed_positions
+    price_confirmed_positions(high_level_info) # All Offer Positions in one pass
+    return high_level_info
+
+def display_pricing_summary(pricing_summary):
+    print("\nPricing Summary:")
+    print(f"  Subtotal: {pricing_summary['subtotal_chf']:.2f} CHF")
+    if pricing_summary["discount_chf"]:
+        print(f"  Volume Discount ({pricing_summary['volume_discount_percent']}%): -{pricing_summary['discount_chf']:.2f} CHF")
+    print(f"  VAT: {pricing_summary['vat_chf']:.2f} CHF")
+    print(f"  Total: {pricing_summary['total_chf']:.2f} CHF")
+
+def build_structure_proposal_messages(high_level_info, retrieved_contexts, client_research_summary, offer_focused_research_summary, user_feedback=""):
+    """Returns the chat messages for a structure proposal (stable prefix first, feedback last)."""
+    context_str = "\n\n---\n\n".join([
+        f"Context from Past Offer (ID: {ctx.get('offer_id', 'N/A')}, Position: {ctx.get('position_title', 'N/A')}, Status: {ctx.get('offer_status', 'unknown')}):\n{ctx['content']}"
+        for ctx in retrieved_contexts
+    ]) if retrieved_contexts else "No specific past offer context was retrieved."
+
+    details_summary = "\n".join([f"- {key.replace('_', ' ').capitalize()}: {value}" for key, value in high_level_info.items() if key not in NON_DETAIL_KEYS])
+
+    user_feedback_prompt_segment = ""
+    if user_feedback:
+        user_feedback_prompt_segment = f"\nUser Feedback for Changes:\n---\n{user_feedback}\n---\nPlease incorporate this feedback into your new proposal."
+
+    return pt.PROPOSE_STRUCTURE.messages(
+        details_summary=details_summary,
+        context_str=context_str,
+        historical_hours_reference=historical_hours_reference(high_level_info.get("client_industry")),
+        client_research_summary=client_research_summary,
+        offer_focused_research_summary=offer_focused_research_summary,
+        user_feedback_for_structure_change_prompt_segment=user_feedback_prompt_segment
+    )
+
+def request_structure_proposal(high_level_info, retrieved_contexts, client_research_summary, offer_focused_research_summary, user_feedback=""):
+    """Builds the structure proposal prompts and returns the LLM's proposal (JSON array or error dict)."""
+    messages = build_structure_proposal_messages(
+        high_level_info, retrieved_contexts, client_research_summary, offer_focused_research_summary, user_feedback
+    )
+
+    print("AI is thinking about the offer structure...")
+    proposed_structure_json = get_llm_json_response(None, None, messages=messages, prompt_name=pt.PROPOSE_STRUCTURE.name, validate=validate_structure)
+    if isinstance(proposed_structure_json, list):
+        # Fill in missing hours and flag outliers against the knowledge base before the consultant reviews
+        apply_hours_estimates(proposed_structure_json, high_level_info.get("client_industry"))
+    return proposed_structure_json
+
+def request_structure_edit(high_level_info, retrieved_contexts, client_research_summary, offer_focused_research_summary, current_structure, user_feedback):
+    """
+    Applies the consultant's change request as a patch: the original proposal conversation is replayed unchanged
+    (so the provider can serve the large prompt prefix from its cache), and the LLM only returns edit operations,
+    which are applied locally. Returns the new structure, or an error dict if the edit could not be applied.
+    """
+    messages = build_structure_proposal_messages(
+        high_level_info, retrieved_contexts, client_research_summary, offer_focused_research_summary
+    ) + [
+        {"role": "assistant", "content": json.dumps(structure_for_prompt(current_structure), ensure_ascii=False, indent=2)},
+        {"role": "user", "content": pt.EDIT_STRUCTURE.render(user_feedback=user_feedback)},
+    ]
+
+    def edit_problems(edit_json):
+        if not isinstance(edit_json, dict):
+            return ["The response must be a JSON object with 'operations'."]
+        try:
+            return validate_structure(apply_structure_operations(current_structure, edit_json.get("operations")))
+        except ValueError as e:
+            return [str(e)]
+
+    print("AI is working on the requested changes...")
+    edit_json = get_llm_json_response(None, None, messages=messages, prompt_name="edit_structure", validate=edit_problems)
+    if not isinstance(edit_json, dict) or "error" in edit_json:
+        return edit_json if isinstance(edit_json, dict) else {"error": "INVALID_EDIT_RESPONSE", "details": str(edit_json)}
+    try:
+        new_structure = apply_structure_operations(current_structure, edit_json.get("operations"))
+    except ValueError as e:
+        print(f"Warning: Could not apply the AI's structure changes: {e}")
+        return {"error": "INVALID_EDIT_OPERATIONS", "details": str(e)}
+    # Only new and changed positions need fresh hour estimates
+    apply_hours_estimates([pos for pos in new_structure if "historical_hours" not in pos], high_level_info.get("client_industry"))
+    return new_structure
+
 def propose_offer_structure_and_get_confirmation(high_level_info, retrieved_contexts, client_research_summary, offer_focused_research_summary):
     user_feedback_for_structure_change = "" # Initialize feedback
     current_proposed_structure = []
 
     while True: # Loop for (r)estart / (c)hange / (a)ccept
-        print("\n--- AI Proposing Offer Structure ---")
-        context_str = "\n\n---\n\n".join([
-            f"Context from Past Offer (ID: {ctx.get('offer_id', 'N/A')}, Position: {ctx.get('position_title', 'N/A')}):\n{ctx['content']}"
-            for ctx in retrieved_contexts
-        ]) if retrieved_contexts else "No specific past offer context was retrieved."
-
-        details_summary = "\n".join([f"- {key.replace('_', ' ').capitalize()}: {value}" for key, value in high_level_info.items() if key not in ["client_research_summary", "offer_focused_research_summary"]])
-
-        system_prompt_for_proposal = pc.PROMPT_PROPOSE_STRUCTURE_SYSTEM_TEMPLATE.format(
-            typical_service_areas_list_str=', '.join(TYPICAL_SERVICE_AREAS)
-        )
-        
-        user_feedback_prompt_segment = ""
-        if user_feedback_for_structure_change:
-            user_feedback_prompt_segment = f"\nUser Feedback for Changes:\n---\n{user_feedback_for_structure_change}\n---\nPlease incorporate this feedback into your new proposal."
-
-        user_prompt_for_proposal = pc.PROMPT_PROPOSE_STRUCTURE_USER_TEMPLATE.format(
-            details_summary=details_summary,
-            context_str=context_str,
-            client_research_summary=client_research_summary,
-            offer_focused_research_summary=offer_focused_research_summary,
-            user_feedback_for_structure_change_prompt_segment=user_feedback_prompt_segment
-        )
-
-        print("AI is thinking about the offer structure...")
-        proposed_structure_json = get_llm_json_response(
-            system_prompt=system_prompt_for_proposal,
-            user_prompt=user_prompt_for_proposal
-        )
+        proposed_structure_json = None
+        if user_feedback_for_structure_change and current_proposed_structure:
+            print("\n--- AI Updating Offer Structure ---")
+            proposed_structure_json = request_structure_edit(
+                high_level_info, retrieved_contexts, client_research_summary,
+                offer_focused_research_summary, current_proposed_structure, user_feedback_for_structure_change
+            )
+            if "error" in proposed_structure_json:
+                print("Falling back to a full new proposal with your feedback...")
+                proposed_structure_json = None
+        if proposed_structure_json is None:
+            print("\n--- AI Proposing Offer Structure ---")
+            proposed_structure_json = request_structure_proposal(
+                high_level_info, retrieved_contexts, client_research_summary,
+                offer_focused_research_summary, user_feedback_for_structure_change
+            )
 
         if "error" in proposed_structure_json or not isinstance(proposed_structure_json, list):
             print("AI failed to propose a valid structure. You can try to (r)estart or define manually.")
@@ -171,6 +342,9 @@ def propose_offer_structure_and_get_confirmation(high_level_info, retrieved_cont
             current_proposed_structure = proposed_structure_json # Store current valid proposal
             display_proposed_structure(current_proposed_structure)
 
+        budget = current_budget.get()
+        if budget is not None: # Every (c)hange round costs another call
+            print(budget.format_line())
         print("\n--- Consultant Review & Confirmation ---")
         action = input("Do you want to (a)ccept this structure, (c)hange it (provide feedback), or (r)estart proposal from scratch? [a/c/r]: ").lower()
 
@@ -178,90 +352,8 @@ def propose_offer_structure_and_get_confirmation(high_level_info, retrieved_cont
             if not current_proposed_structure:
                 print("No structure to accept. Please try (r)estart.")
                 continue
-            confirmed_positions = []
-            for pos in current_proposed_structure:
-                confirmed_pos = {
-                    "type": pos.get("type"),
-                    "title_input": pos.get("proposed_title"),
-                    "description_input": pos.get("focus_description")
-                }
-                if pos.get("type") == "Offer Position":
-                    confirmed_pos["service_area_input"] = pos.get("suggested_service_area")
-                    confirmed_pos["service_area_input"] = pos.get("suggested_service_area", TYPICAL_SERVICE_AREAS[0])
-                    try:
-                        hours = float(pos.get('estimated_hours_suggestion', 1))
-                        if hours <= 0: hours = 1
-                        confirmed_pos["hours_input"] = hours
-                    except (ValueError, TypeError):
-                        print(f"Warning: Invalid hours for '{pos.get('proposed_title')}'. Defaulting to 1.")
-                        confirmed_pos["hours_input"] = 1.0
-                    price_info = calculate_position_price(
-                        confirmed_pos["service_area_input"],
-                        float(confirmed_pos["hours_input"])
-                    )
-                    confirmed_pos["calculated_price_info"] = price_info
-                confirmed_positions.append(confirmed_pos)
-            # --- Always append Abgrenzung/Terms and Conditions as a Text Position ---
-            abgr_de = (
-                "Wenn nicht explizit anders definiert, gilt f&uuml;r alle Positionen:<br />"
-                "<ul>"
-                "<li>Kosten von Drittanbietern sind nicht Bestandteil und werden vom Kunden &uuml;bernommen</li>"
-                "<li>Als Basis f&uuml;r eine Zusammenarbeit ist das Digital Horizon Support Abo Voraussetzung (Ausnahme einzelne Workshops und Kurzprojekte)</li>"
-                "<li>Abonnemente starten am Zusagedatum und werden direkt im Voraus in Rechnung gestellt</li>"
-                "<li>Abonnemente erneuern sich ohne Gegenbericht automatisch. R&uuml;ckerstattungen bei K&uuml;ndigung innerhalb einer laufenden Periode sind nur in Ausnahmef&auml;llen m&ouml;glich</li>"
-                "<li>Bildmaterial, Videos, Texte und andere Medien werden durch den Kunden angeliefert, ausser die Erstellung ist Teil der Offerte</li>"
-                "<li>Abkl&auml;rungen, &Uuml;bergaben, Besprechungen, Einf&uuml;hrungen und Abnahmen finden remote statt (Telefon, Bildschirm&uuml;bertragung, E-Mail etc.)</li>"
-                "<li>Workshops, Meetings oder Schulungen in Person finden an einem Sidekick Standort statt</li>"
-                "<li>Ist ein Vor-Ort Termin gew&uuml;nscht, so werden Anfahrtszeit zum Stundensatz und Fahrtkosten verrechnet</li>"
-                "<li>Bestehende Zug&auml;nge oder Freigaben zu Plattformen werden von Kunde an Sidekicks weitergegeben</li>"
-                "<li>Entscheidet der Kunde bei der Abnahme einer Leistung, wie etwa einer Kampagne, diese nicht zu publizieren, aktivieren oder verschicken, so wird die Position trotzdem verrechnet</li>"
-                "<li>Falls von einer Plattform ein Zahlungsmittel ben&ouml;tigt wird, hinterlegt der Kunde seine eigene Firmenkreditkarte</li>"
-                "<li>Der Kunde ist verpflichtet, seine Finanzen im Zusammenhang mit den Dienstleistungen der Your Sidekicks AG sorgf&auml;ltig zu &uuml;berwachen, einschliesslich der Kontrolle von Werbebudgetausgaben, und Unstimmigkeiten umgehend zu melden. Sidekicks haftet nicht f&uuml;r finanzielle Verluste bei Mediabudgetausgaben.&nbsp;</li>"
-                "<li>Sidekicks haftet nicht f&uuml;r Drittanbieter-Tools, die im Rahmen der Dienstleistung verwendet werden, auch wenn die Toolkosten via Sidekicks getragen werden.&nbsp;</li>"
-                "<li>Auch wenn eine Plattform eine Kampagne, Zielgruppe oder Inhalt unerwartet ablehnen sollte, wird die zugeh&ouml;rige Position verrechnet</li>"
-                "<li>Der Kunde hat die Offertenpunkte und zugeh&ouml;rigen Informationen genau zu pr&uuml;fen, bei Unklarheiten nachzufragen und akzeptiert diese mit der Zusage als Pauschalpreise</li>"
-                "<li>Die Rechnungserstellung erfolgt nach der ersten &Uuml;bergabe der Arbeitsergebnisse f&uuml;r alle Positionen gleichzeitig&nbsp;</li>"
-                "<li>Es gelten die Allgemeine Gesch&auml;ftsbedingungen (AGB) sowie die Datenschutzerkl&auml;rung von Your Sidekicks AG einsehbar unter&nbsp;www.sidekicks.ch</li>"
-                "</ul>"
-            )
-            abgr_en = (
-                "Unless explicitly defined otherwise, the following applies to all positions:<br />"
-                "<ul>"
-                "<li>Costs incurred from third-party services are not included and will be covered by the customer.</li>"
-                "<li>The Digital Horizon Support subscription is a prerequisite for collaboration (except for individual workshops and short-term projects).</li>"
-                "<li>Subscriptions start from the date of confirmation and are billed in advance.</li>"
-                "<li>Subscriptions renew automatically unless notified otherwise. Refunds for cancellations within a current period are only possible in exceptional circumstances.</li>"
-                "<li>Visuals, videos, texts, and other media are to be provided by the customer, unless their creation is included in the offer.</li>"
-                "<li>Clarifications, handovers, meetings, introductions, and acceptances will be conducted remotely (via phone, screen sharing, email, etc.).</li>"
-                "<li>Workshops, meetings, or training sessions in person will take place at a Sidekick location.</li>"
-                "<li>If an on-site meeting is requested, travel time will be billed at the hourly rate, along with travel expenses.</li>"
-                "<li>Existing access or permissions to platforms will be transferred from the customer to Sidekicks.</li>"
-                "<li>If the customer decides not to publish, activate, or distribute a service upon acceptance, such as a campaign, the position will still be invoiced.</li>"
-                "<li>If a platform requires payment, the customer must provide their own corporate credit card.</li>"
-                "<li>The customer is responsible for monitoring their finances related to Your Sidekicks AG's services, including advertising budget expenditures, and reporting any discrepancies promptly. Sidekicks is not liable for financial losses incurred from media budget expenditures.</li>"
-                "<li>Sidekicks is not liable for third-party tools used within the scope of the service, even if the tool costs are covered by Sidekicks.</li>"
-                "<li>Even if a platform unexpectedly rejects a campaign, target audience, or content, the associated position will still be invoiced.</li>"
-                "<li>The customer is responsible for carefully reviewing the offer points and associated information, seeking clarification if needed, and accepting them as fixed prices upon confirmation.</li>"
-                "<li>Invoicing will occur after the initial handover of work results for all positions simultaneously.</li>"
-                "<li>The General Terms and Conditions (GTC) and the privacy policy of Your Sidekicks AG apply, accessible at www.sidekicks.ch.</li>"
-                "</ul>"
-            )
-            lang = high_level_info.get("language", "German").lower()
-            if "en" in lang:
-                abgr_text = abgr_en
-                abgr_title = "Terms and Conditions"
-            elif "de" in lang or "ger" in lang:
-                abgr_text = abgr_de
-                abgr_title = "Abgrenzung"
-            else:
-                abgr_text = abgr_en + "<br /><br />" + abgr_de
-                abgr_title = "Terms and Conditions / Abgrenzung"
-            confirmed_positions.append({
-                "type": "Text Position",
-                "title_input": abgr_title,
-                "description_input": abgr_text
-            })
-            high_level_info["positions_details"] = confirmed_positions
+            confirm_offer_structure(high_level_info, current_proposed_structure)
+            display_pricing_summary(high_level_info["pricing_summary"])
             print("\n--- Offer Structure Confirmed by Consultant ---")
             return high_level_info # Return the whole high_level_info dict
         elif action == 'c':
@@ -319,84 +411,103 @@ Key Services Overview: {final_offer_details_dict.get('key_services_description',
         positions_to_draft_info_str = "No specific positions were confirmed. Draft a general offer based on 'Key Services Overview'."
 
     context_str = "\n\n---\n\n".join([
-        f"Context from Past Offer (ID: {ctx.get('offer_id', 'N/A')}, Position: {ctx.get('position_title', 'N/A')}):\n{ctx['content']}"
+        f"Context from Past Offer (ID: {ctx.get('offer_id', 'N/A')}, Position: {ctx.get('position_title', 'N/A')}, Status: {ctx.get('offer_status', 'unknown')}):\n{ctx['content']}"
         for ctx in retrieved_contexts
     ]) if retrieved_contexts else "No specific past offer context was retrieved."
 
-    # The output_instruction needs to align with the new top-level JSON object structure
-    output_instruction = (
-        "Ensure your output is a single valid JSON object. "
-        "This object must have a top-level string field 'project_title' and a top-level array field 'positions'. "
-        "Each item in the 'positions' array must follow the schema described, including an integer 'position_id' and correct 'type'. "
-        "For 'Offer Position' types, the 'description' MUST be a bullet-point list. "
-        "For 'Text Position' types, the 'description' should be a paragraph."
-    )
-    
-    system_prompt = pc.PROMPT_DRAFT_JSON_SYSTEM
-    user_prompt = pc.PROMPT_DRAFT_JSON_USER_TEMPLATE.format(
+    # The static instructions and schema are part of the (cached) system prompt, see prompt_templates.DRAFT_OFFER
+    messages = pt.DRAFT_OFFER.messages(
         overall_offer_summary=overall_offer_summary, # Contains project_title
         positions_to_draft_info_str=positions_to_draft_info_str,
         context_str=context_str,
-        output_instruction=output_instruction,
-        json_schema_description_text=pc.PROMPT_DRAFT_JSON_SCHEMA_DESCRIPTION, # This schema was updated
         client_research_summary=client_research_summary,
         offer_focused_research_summary=offer_focused_research_summary
     )
 
     print("\n--- Constructing Final JSON Drafting Prompts (for LLM) ---")
-    # print(f"System Prompt for Final Draft: {system_prompt}") # For debugging
-    # print(f"User Prompt for Final Draft: {user_prompt}") # For debugging
-    return system_prompt, user_prompt
-
-# --- MAIN WORKFLOW FUNCTION ---
-def main():
-    print("Starting Sidekicks AI Offer Assistant PoC (Interactive Mode with Review Step)...")
+    return messages[0]["content"], messages[1]["content"]
 
-    load_and_vectorize_offers(DATA_DIR)
-
-    # project_title is now gathered here
-    high_level_offer_info = initial_chat_to_gather_high_level_info() 
+# --- WORKFLOW STAGES ---
+# Non-interactive building blocks shared by the CLI (main) and the HTTP server (offer_server.py).
 
+def run_external_research(high_level_info, research_enabled: bool):
+    """
+    Performs (or skips) client and offer-focused research and stores both summaries in high_level_info.
+    Both calls run concurrently with a hard deadline; 'research_models' records which model answered each.
+    The summaries are the condensed research brief, so all later prompts reuse the same short text.
+    """
     client_research_summary = "No client research performed."
     offer_focused_research_summary = "No offer-focused research performed."
+    research_models = {"client": None, "offer_focused": None}
+    research_brief = None
 
-    if ask_for_external_research():
+    if research_enabled and not research_allowed():
+        print("\n--- Skipping External Research (offer budget) ---")
+    elif research_enabled:
         print("\n--- External Research Process Initiated ---")
-        client_name_for_research = high_level_offer_info.get("client_name", "Unknown Client")
-        client_industry_for_research = high_level_offer_info.get("client_industry", "Unknown Industry")
-        client_research_summary = perform_client_research(client_name_for_research, client_industry_for_research)
-
-        project_desc_for_research = high_level_offer_info.get("key_services_description", "General Offer Focus")
-        project_focus_for_research = high_level_offer_info.get("project_focus_tags_input", "General") # May deprecate this tag usage
-        offer_focused_research_summary = perform_offer_focused_research(project_desc_for_research, project_focus_for_research)
-
-        # Store summaries directly in high_level_offer_info for easier access
-        high_level_offer_info["client_research_summary"] = client_research_summary
-        high_level_offer_info["offer_focused_research_summary"] = offer_focused_research_summary
+        research = perform_research(
+            high_level_info.get("client_name", "Unknown Client"),
+            high_level_info.get("client_industry", "Unknown Industry"),
+            high_level_info.get("key_services_description", "General Offer Focus"),
+            high_level_info.get("project_focus_tags_input", "General") # May deprecate this tag usage
+        )
+        client_research_summary = research["client_research_summary"]
+        offer_focused_research_summary = research["offer_focused_research_summary"]
+        research_models = research["research_models"]
+        research_brief = research["research_brief"]
         print("--- External Research Process Completed ---")
     else:
         print("\n--- Skipping External Research ---")
-        high_level_offer_info["client_research_summary"] = client_research_summary
-        high_level_offer_info["offer_focused_research_summary"] = offer_focused_research_summary
-    
-    rag_query_overall = f"Offer for {high_level_offer_info.get('client_industry', '')} client: {high_level_offer_info.get('project_title', '')}, focusing on {high_level_offer_info.get('project_focus_tags_input', '')} and services like {high_level_offer_info.get('key_services_description', '')}"
-    retrieved_contexts_overall = retrieve_context(rag_query_overall, n_results=5)
 
-    # propose_offer_structure_and_get_confirmation now returns the modified high_level_offer_info
-    # which includes 'positions_details' (the confirmed structure) and 'project_title'.
-    # Let's rename the variable for clarity.
-    confirmed_offer_structure_details = propose_offer_structure_and_get_confirmation(
-        high_level_offer_info,
-        retrieved_contexts_overall,
-        high_level_offer_info["client_research_summary"], 
-        high_level_offer_info["offer_focused_research_summary"]
-    )
+    # Store summaries directly in high_level_info for easier access
+    high_level_info["client_research_summary"] = client_research_summary
+    high_level_info["offer_focused_research_summary"] = offer_focused_research_summary
+    high_level_info["research_models"] = research_models
+    high_level_info["research_brief"] = research_brief # Structured form, stored with the session
+    return high_level_info
 
-    if not confirmed_offer_structure_details or not confirmed_offer_structure_details.get("positions_details"):
-        print("Error: Could not obtain valid position details after confirmation step. Exiting.")
-        return
+def retrieve_overall_context(high_level_info, n_results=5):
+    return retrieve_context(build_overall_query(high_level_info), n_results=budget_context_size(n_results))
 
-    # --- AI-GENERATED PROJECT TITLE ---
+def update_position_pricing(confirmed_offer_structure_details, overrides):
+    """
+    Applies consultant changes to hours/service area of confirmed Offer Positions and recalculates their prices.
+    `overrides` is a list of {"index": <0-based index in positions_details>, "hours": float, "service_area": str}.
+    """
+    positions = confirmed_offer_structure_details.get("positions_details", [])
+    for override in overrides or []:
+        idx = override.get("index")
+        if not isinstance(idx, int) or not 0 <= idx < len(positions) or positions[idx].get("type") != "Offer Position":
+            print(f"Warning: Ignoring pricing override for invalid Offer Position index: {idx}")
+            continue
+        if override.get("service_area"):
+            positions[idx]["service_area_input"] = override["service_area"]
+        if override.get("hours") is not None:
+            positions[idx]["hours_input"] = float(override["hours"])
+    price_confirmed_positions(confirmed_offer_structure_details)
+    return positions
+
+def edit_confirmed_positions(confirmed_offer_structure_details, edits):
+    """
+    Applies post-draft changes to confirmed positions and recalculates the prices. `edits` is a list of
+    {"index": <0-based index in positions_details>, "title": str, "description": str, "hours": float, "service_area": str}
+    (all fields optional; hours and service area only apply to Offer Positions).
+    """
+    positions = confirmed_offer_structure_details.get("positions_details", [])
+    for edit in edits or []:
+        idx = edit.get("index")
+        if not isinstance(idx, int) or not 0 <= idx < len(positions):
+            print(f"Warning: Ignoring edit for invalid position index: {idx}")
+            continue
+        if edit.get("title"):
+            positions[idx]["title_input"] = edit["title"]
+        if edit.get("description"):
+            positions[idx]["description_input"] = edit["description"]
+    pricing_overrides = [edit for edit in edits or [] if edit.get("hours") is not None or edit.get("service_area")]
+    return update_position_pricing(confirmed_offer_structure_details, pricing_overrides)
+
+def generate_project_title(confirmed_offer_structure_details):
+    """Asks the LLM for a project title and stores it (or the consultant's title as fallback) in the details dict."""
     print("\n--- Generating Project Title with AI ---")
     system_prompt = "You are an expert business consultant. Generate a concise, professional project title for a client offer."
     user_prompt = (
@@ -410,26 +521,162 @@ def main():
         f"Structure: {json.dumps(confirmed_offer_structure_details.get('positions_details', []), ensure_ascii=False)}\n"
         "Respond ONLY with the project title, no extra text."
     )
-    ai_title = get_llm_response(system_prompt, user_prompt)
+    ai_title = get_llm_response(
+        system_prompt, user_prompt, prompt_name="project_title",
+        validate=lambda title: [] if title.strip() and "\n" not in title.strip() and len(title.strip()) <= 150 else ["The title must be a single line of at most 150 characters."]
+    )
     if not isinstance(ai_title, str) or (isinstance(ai_title, dict) and "error" in ai_title):
         print("AI failed to generate a project title, using fallback.")
         confirmed_offer_structure_details["project_title"] = confirmed_offer_structure_details.get("project_title", "AI Generated Project Title")
     else:
         confirmed_offer_structure_details["project_title"] = ai_title.strip()
     print(f"AI Project Title: {confirmed_offer_structure_details['project_title']}")
+    return confirmed_offer_structure_details["project_title"]
 
+def draft_final_offer(confirmed_offer_structure_details, retrieved_contexts):
+    """
+    Drafts the final offer JSON, by default with one concurrent call per position (DRAFT_MODE = "parallel").
+    Falls back to the single drafting call if parallel drafting fails. Returns the offer JSON or an error dict.
+    """
+    if DRAFT_MODE == "parallel":
+        offer_json = draft_offer_in_parallel(confirmed_offer_structure_details)
+        if "error" not in offer_json:
+            return offer_json
+        print(f"Parallel drafting failed ({offer_json['error']}). Falling back to drafting the offer in one call...")
     final_system_prompt, final_user_prompt = construct_final_drafting_prompts(
         confirmed_offer_structure_details,
-        retrieved_contexts_overall,
-        confirmed_offer_structure_details["client_research_summary"], 
+        retrieved_contexts,
+        confirmed_offer_structure_details["client_research_summary"],
         confirmed_offer_structure_details["offer_focused_research_summary"]
     )
-
-    ai_generated_json_output = get_llm_json_response( # Renamed variable for clarity
+    return get_llm_json_response(
         system_prompt=final_system_prompt,
-        user_prompt=final_user_prompt
+        user_prompt=final_user_prompt,
+        prompt_name=pt.DRAFT_OFFER.name
     )
 
+def redraft_final_offer(confirmed_offer_structure_details, retrieved_contexts):
+    """
+    Re-drafts the offer after edit_confirmed_positions(): only changed positions if the offer was drafted in parallel
+    (see redraft_changed_positions), otherwise the whole offer. Returns the offer JSON or an error dict.
+    """
+    if confirmed_offer_structure_details.get("draft_cache"):
+        return redraft_changed_positions(confirmed_offer_structure_details)
+    return draft_final_offer(confirmed_offer_structure_details, retrieved_contexts)
+
+def review_draft_edits(confirmed_offer_structure_details, retrieved_contexts, draft):
+    """Lets the consultant change confirmed positions after drafting; only changed positions are re-drafted. Returns the final draft."""
+    positions = confirmed_offer_structure_details["positions_details"]
+    while True:
+        print("\n--- Confirmed Positions ---")
+        for i, pos in enumerate(positions, start=1):
+            hours = f" ({pos.get('hours_input')} h, {pos.get('service_area_input')})" if pos.get("type") == "Offer Position" else ""
+            print(f"  {i}. [{pos.get('type')}] {pos.get('title_input')}{hours}")
+        answer = input("Enter the number of a position to change it, or press Enter to continue: ").strip()
+        if not answer:
+            return draft
+        if not answer.isdigit() or not 1 <= int(answer) <= len(positions):
+            print("Invalid position number.")
+            continue
+        idx = int(answer) - 1
+        pos = positions[idx]
+        edit = {"index": idx}
+        edit["title"] = input(f"Title [{pos.get('title_input')}]: ").strip()
+        edit["description"] = input(f"Focus/description [{pos.get('description_input')}]: ").strip()
+        if pos.get("type") == "Offer Position":
+            hours = input(f"Hours [{pos.get('hours_input')}]: ").strip()
+            try:
+                edit["hours"] = float(hours) if hours else None
+            except ValueError:
+                print("Invalid number of hours, keeping the current value.")
+            edit["service_area"] = input(f"Service area [{pos.get('service_area_input')}]: ").strip()
+        edit_confirmed_positions(confirmed_offer_structure_details, [edit])
+        new_draft = redraft_final_offer(confirmed_offer_structure_details, retrieved_contexts)
+        if "error" in new_draft:
+            print(f"Re-drafting failed ({new_draft['error']}); keeping the previous draft.")
+            continue
+        draft = new_draft
+        session_store.record_draft(current_session_id.get(), draft)
+        display_pricing_summary(confirmed_offer_structure_details["pricing_summary"])
+        print(json.dumps(draft, indent=2, ensure_ascii=False))
+        print(current_budget.get().format_line())
+
+def bexio_is_configured() -> bool:
+    return bool(BEXIO_API_TOKEN) and BEXIO_API_TOKEN != "YOUR_BEXIO_API_TOKEN_PLACEHOLDER_IN_CONFIG"
+
+def export_offer_to_bexio(ai_generated_json_output, pricing_summary=None, client_name=None):
+    """Transforms the drafted offer and creates the quote in Bexio. Returns the Bexio response or an error dict."""
+    discount_in_percent = (pricing_summary or {}).get("volume_discount_percent") or None
+    bexio_payload = transform_to_bexio_format(ai_generated_json_output, discount_in_percent=discount_in_percent, client_name=client_name)
+    if not bexio_payload:
+        print("\nFailed to transform data for Bexio for an unknown reason.")
+        return {"error": "BEXIO_TRANSFORM_FAILED"}
+    if "error" in bexio_payload:
+        print(f"\nFailed to transform data for Bexio: {bexio_payload.get('error')}")
+        return bexio_payload
+    print("\nSuccessfully transformed data for Bexio. Attempting to create quote...")
+    bexio_response = create_bexio_quote(bexio_payload)
+    # create_bexio_quote already prints success/failure details
+    if bexio_response and "error" in bexio_response:
+        print(f"Bexio quote creation returned an error: {bexio_response.get('message', 'Unknown error')}")
+    return bexio_response
+
+def record_cli_stage(session_id, stage, started, output, high_level_info, draft=None, bexio_response=None):
+    """Records a stage of the interactive CLI run and the session state in the session store, and shows the offer budget."""
+    session_store.record_stage(session_id, stage, output, (time.perf_counter() - started) * 1000)
+    session_store.save_session(session_id, high_level_info, high_level_info.get("positions_details"), draft, bexio_response, source="cli")
+    print(current_budget.get().format_line())
+
+# --- MAIN WORKFLOW FUNCTION ---
+def main():
+    print("Starting Sidekicks AI Offer Assistant PoC (Interactive Mode with Review Step)...")
+
+    load_and_vectorize_offers(DATA_DIR)
+
+    session_id = uuid.uuid4().hex
+    current_session_id.set(session_id) # LLM calls of this run are recorded for this session...
+    current_budget.set(OfferBudget()) # ...and charged to its budget
+
+    # project_title is now gathered here
+    high_level_offer_info = initial_chat_to_gather_high_level_info() 
+    session_store.save_session(session_id, high_level_offer_info, source="cli")
+
+    started = time.perf_counter()
+    run_external_research(high_level_offer_info, ask_for_external_research())
+    record_cli_stage(session_id, "research", started, {key: high_level_offer_info[key] for key in ("client_research_summary", "offer_focused_research_summary", "research_models")}, high_level_offer_info)
+
+    started = time.perf_counter()
+    retrieved_contexts_overall = retrieve_overall_context(high_level_offer_info, n_results=5)
+    record_cli_stage(session_id, "context", started, retrieved_contexts_overall, high_level_offer_info)
+
+    # propose_offer_structure_and_get_confirmation now returns the modified high_level_offer_info
+    # which includes 'positions_details' (the confirmed structure) and 'project_title'.
+    # Let's rename the variable for clarity.
+    started = time.perf_counter()
+    confirmed_offer_structure_details = propose_offer_structure_and_get_confirmation(
+        high_level_offer_info,
+        retrieved_contexts_overall,
+        high_level_offer_info["client_research_summary"], 
+        high_level_offer_info["offer_focused_research_summary"]
+    )
+
+    if not confirmed_offer_structure_details or not confirmed_offer_structure_details.get("positions_details"):
+        print("Error: Could not obtain valid position details after confirmation step. Exiting.")
+        session_store.record_stage(session_id, "structure", {"error": "NO_CONFIRMED_STRUCTURE"}, status=409)
+        return
+    record_cli_stage(session_id, "structure", started, {"positions_details": confirmed_offer_structure_details["positions_details"], "pricing_summary": confirmed_offer_structure_details.get("pricing_summary")}, confirmed_offer_structure_details)
+
+    # --- AI-GENERATED PROJECT TITLE ---
+    started = time.perf_counter()
+    generate_project_title(confirmed_offer_structure_details)
+    record_cli_stage(session_id, "title", started, {"project_title": confirmed_offer_structure_details.get("project_title")}, confirmed_offer_structure_details)
+
+    started = time.perf_counter()
+    ai_generated_json_output = draft_final_offer(confirmed_offer_structure_details, retrieved_contexts_overall)
+    if "error" not in ai_generated_json_output:
+        session_store.record_draft(session_id, ai_generated_json_output)
+    record_cli_stage(session_id, "draft", started, ai_generated_json_output, confirmed_offer_structure_details, draft=ai_generated_json_output)
+
     print("\n--- AI Generated Final Offer Content (JSON) ---")
     if "error" in ai_generated_json_output:
         print("Failed to generate valid JSON output for the final offer.")
@@ -444,9 +691,15 @@ def main():
         print(json.dumps(ai_generated_json_output, indent=2, ensure_ascii=False))
         print("--- End of AI Generated Content ---")
 
+        started = time.perf_counter()
+        reviewed_output = review_draft_edits(confirmed_offer_structure_details, retrieved_contexts_overall, ai_generated_json_output)
+        if reviewed_output is not ai_generated_json_output:
+            ai_generated_json_output = reviewed_output
+            record_cli_stage(session_id, "draft_edit", started, ai_generated_json_output, confirmed_offer_structure_details, draft=ai_generated_json_output)
+
         # --- BEXIO INTEGRATION ---
         print("\n--- Bexio Integration ---")
-        if not BEXIO_API_TOKEN or BEXIO_API_TOKEN == "YOUR_BEXIO_API_TOKEN_PLACEHOLDER_IN_CONFIG":
+        if not bexio_is_configured():
             print("BEXIO_API_TOKEN is not configured or is using a placeholder.")
             print("Skipping Bexio quote creation.")
             print("Please set the BEXIO_API_TOKEN in your .env file.")
@@ -456,23 +709,23 @@ def main():
         else:
             confirm_bexio = input("\nDo you want to attempt to create this quote in Bexio? (yes/no): ").lower()
             if confirm_bexio == 'yes':
-                bexio_payload = transform_to_bexio_format(ai_generated_json_output)
-
-                if bexio_payload and "error" not in bexio_payload:
-                    print("\nSuccessfully transformed data for Bexio. Attempting to create quote...")
-                    bexio_response = create_bexio_quote(bexio_payload)
-                    # create_bexio_quote already prints success/failure details
-                    if bexio_response and "error" in bexio_response:
-                         print(f"Bexio quote creation returned an error: {bexio_response.get('message', 'Unknown error')}")
-                elif bexio_payload and "error" in bexio_payload:
-                    print(f"\nFailed to transform data for Bexio: {bexio_payload.get('error')}")
-                else: # Should not happen if transform_to_bexio_format returns None without an error key, but as a fallback
-                    print("\nFailed to transform data for Bexio for an unknown reason.")
+                started = time.perf_counter()
+                bexio_response = export_offer_to_bexio(
+                    ai_generated_json_output,
+                    confirmed_offer_structure_details.get("pricing_summary"),
+                    confirmed_offer_structure_details.get("client_name")
+                )
+                session_store.record_bexio_export(session_id, bexio_response)
+                record_cli_stage(session_id, "bexio", started, bexio_response, confirmed_offer_structure_details,
+                                 draft=ai_generated_json_output, bexio_response=bexio_response)
             else:
                 print("Bexio quote creation skipped by user.")
         print("--- End of Bexio Integration ---")
         # --- END BEXIO INTEGRATION ---
 
+    for prompt_name, stats in get_prompt_cache_stats().items():
+        print(f"Prompt cache '{prompt_name}': {stats['cached_tokens']}/{stats['prompt_tokens']} prompt tokens cached ({stats['cache_hit_rate']:.0%}) over {stats['calls']} call(s)")
+    session_store.flush()
     print("\nSidekicks AI Offer Assistant PoC finished.")
 
 if __name__ == "__main__":
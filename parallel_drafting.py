@@ -0,0 +1,318 @@
+# parallel_drafting.py
+#
+# Drafts the final offer with one LLM call per confirmed position, all running concurrently, instead of one
+# large call that writes every position in sequence. Each call gets the same compact offer summary (a shared,
+# cacheable prompt prefix) plus context retrieved for its own position. Pricing fields are filled in locally
+# from the confirmed pricing, fixed texts (Abgrenzung) are copied verbatim, and a final lightweight call writes
+# the project title and a short introduction. The result is checked against the drafting schema.
+#
+# Post-draft edits: the drafted text of every position is cached with a fingerprint of its drafting inputs, so
+# after the consultant changes some confirmed positions only those are re-drafted and spliced into the offer.
+
+import json
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import prompt_templates as pt
+from config_data import DRAFT_MAX_WORKERS, DRAFT_CONTEXT_PER_POSITION
+from llm_utils import get_llm_json_response
+from vector_store_utils import retrieve_context
+from offer_budget import budget_context_size
+from pricing_utils import price_confirmed_positions
+
+PRICING_FIELDS = ["estimated_hours_input", "hourly_rate_chf", "service_area_used", "calculated_price_chf"]
+DRAFT_INPUT_FIELDS = ["type", "title_input", "description_input", "hours_input", "service_area_input", "fixed_text"]
+
+
+# --- SCHEMA CHECK ---
+def validate_offer_json(offer_json) -> list:
+    """
+    Checks a drafted offer against PROMPT_DRAFT_JSON_SCHEMA_DESCRIPTION.
+    Returns a list of problems (empty if the offer is valid).
+    """
+    if not isinstance(offer_json, dict):
+        return ["The offer must be a JSON object."]
+    problems = []
+    if not isinstance(offer_json.get("project_title"), str) or not offer_json["project_title"].strip():
+        problems.append("'project_title' must be a non-empty string.")
+    positions = offer_json.get("positions")
+    if not isinstance(positions, list) or not positions:
+        return problems + ["'positions' must be a non-empty array."]
+    for i, pos in enumerate(positions, start=1):
+        if not isinstance(pos, dict):
+            problems.append(f"Position {i}: must be an object.")
+            continue
+        if pos.get("position_id") != i:
+            problems.append(f"Position {i}: 'position_id' must be {i}, got {pos.get('position_id')!r}.")
+        if pos.get("type") not in ("Offer Position", "Text Position"):
+            problems.append(f"Position {i}: invalid 'type' {pos.get('type')!r}.")
+        for field in ("position_title", "description"):
+            if not isinstance(pos.get(field), str) or not pos[field].strip():
+                problems.append(f"Position {i}: '{field}' must be a non-empty string.")
+        if "service_tags" in pos:
+            problems.append(f"Position {i}: 'service_tags' must not be included.")
+        if pos.get("type") == "Offer Position":
+            for field in PRICING_FIELDS:
+                expected = str if field == "service_area_used" else (int, float)
+                if not isinstance(pos.get(field), expected) or isinstance(pos.get(field), bool):
+                    problems.append(f"Position {i}: '{field}' is missing or has the wrong type.")
+            description = pos.get("description")
+            if isinstance(description, str) and not all(line.strip().startswith("- ") for line in description.strip().split("\n") if line.strip()):
+                problems.append(f"Position {i}: the description of an Offer Position must be a '- ' bullet list.")
+        elif pos.get("type") == "Text Position":
+            extra = [field for field in PRICING_FIELDS if field in pos]
+            if extra:
+                problems.append(f"Position {i}: Text Positions must not include {extra}.")
+    return problems
+
+
+def validate_position_draft(result) -> list:
+    """Checks one drafted position ({"position_title", "description"}); problems escalate the call (see model_routing.py)."""
+    if not isinstance(result, dict):
+        return ["The position must be a JSON object."]
+    problems = []
+    if not isinstance(result.get("description"), str) or not result["description"].strip():
+        problems.append("'description' must be a non-empty string.")
+    if result.get("position_title") is not None and not isinstance(result["position_title"], str):
+        problems.append("'position_title' must be a string.")
+    return problems
+
+
+# --- PROMPT PARTS ---
+def build_offer_summary(details: dict) -> str:
+    return (
+        f"Project Title: {details.get('project_title', 'N/A')}\n"
+        f"Client Name: {details.get('client_name', 'N/A')}\n"
+        f"Client Industry: {details.get('client_industry', 'N/A')}\n"
+        f"Key Services Overview: {details.get('key_services_description', 'N/A')}\n"
+        f"Language: {details.get('language', 'N/A')}\n"
+        f"Additional Context: {details.get('additional_context', 'N/A')}"
+    )
+
+
+def _structure_overview(positions_details: list) -> str:
+    return "\n".join(
+        f"{i}. [{pos.get('type', 'Offer Position')}] {pos.get('title_input', 'N/A')}"
+        for i, pos in enumerate(positions_details, start=1)
+    )
+
+
+def _pricing_str(pos: dict) -> str:
+    if pos.get("type") != "Offer Position":
+        return ""
+    return (
+        f"- Service Area: {pos.get('service_area_input', 'N/A')}\n"
+        f"- Estimated Hours: {pos.get('hours_input', 'N/A')} (the scope of the bullets should fit this effort)"
+    )
+
+
+def _context_str(contexts: list) -> str:
+    return "\n\n---\n\n".join(
+        f"Context from Past Offer (ID: {ctx.get('offer_id', 'N/A')}, Position: {ctx.get('position_title', 'N/A')}, Status: {ctx.get('offer_status', 'unknown')}):\n{ctx['content']}"
+        for ctx in contexts
+    ) if contexts else "No specific past offer context was retrieved."
+
+
+def _pricing_fields(pos: dict) -> dict:
+    price_info = pos.get("calculated_price_info") or {}
+    if "error" in price_info or not price_info:
+        return {}
+    return {
+        "estimated_hours_input": price_info["estimated_hours_input"],
+        "hourly_rate_chf": price_info["hourly_rate_chf"],
+        "service_area_used": price_info["service_area_used"],
+        "calculated_price_chf": price_info["calculated_price_chf"],
+    }
+
+
+def _as_bullets(description: str) -> str:
+    """Normalizes '•'/'*' bullets or unmarked lines of an Offer Position description to '- ' bullets."""
+    lines = [line.strip() for line in description.strip().split("\n") if line.strip()]
+    return "\n".join(line if line.startswith("- ") else "- " + line.lstrip("-*• ").strip() for line in lines)
+
+
+# --- DRAFTING ---
+def _draft_position(messages: list):
+    return get_llm_json_response(None, None, messages=messages, prompt_name=pt.DRAFT_POSITION.name, validate=validate_position_draft)
+
+
+def _research_summary(details: dict) -> str:
+    return (
+        f"Client: {details.get('client_research_summary', 'No client research performed.')}\n\n"
+        f"Offer focus: {details.get('offer_focused_research_summary', 'No offer-focused research performed.')}"
+    )
+
+
+def _context_query(pos: dict) -> str:
+    return f"Offer Position Title: {pos.get('title_input', '')}\nDescription: {pos.get('description_input', '')}"
+
+
+def position_fingerprint(pos: dict) -> str:
+    """Everything of a confirmed position that goes into its drafting prompt. A different fingerprint = re-draft."""
+    return json.dumps({field: pos.get(field) for field in DRAFT_INPUT_FIELDS}, sort_keys=True, ensure_ascii=False)
+
+
+def _draft_positions(details: dict, indices: list, contexts_by_index: dict, max_workers: int) -> dict:
+    """Drafts the positions `indices` of details['positions_details'] concurrently. Returns {index: LLM result}."""
+    positions_details = details["positions_details"]
+    offer_summary = build_offer_summary(details)
+    structure_overview = _structure_overview(positions_details)
+    research_summary = _research_summary(details)
+    prompts = {
+        i: pt.DRAFT_POSITION.messages(
+            offer_summary=offer_summary,
+            structure_overview=structure_overview,
+            research_summary=research_summary,
+            context_str=_context_str(contexts_by_index[i]),
+            position_number=i + 1,
+            position_type=positions_details[i].get("type", "Offer Position"),
+            title=positions_details[i].get("title_input", "N/A"),
+            focus=positions_details[i].get("description_input", "N/A"),
+            pricing_str=_pricing_str(positions_details[i])
+        )
+        for i in indices
+    }
+    if not prompts:
+        return {}
+    print(f"\n--- Drafting {len(prompts)} positions in parallel ---")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts)))) as executor:
+        # Each call runs in a copy of this context, so its LLM call is recorded for the current session
+        futures = [executor.submit(contextvars.copy_context().run, _draft_position, messages) for messages in prompts.values()]
+        return dict(zip(prompts, [future.result() for future in futures]))
+
+
+def _drafted_text(i: int, pos: dict, result) -> dict:
+    """{"position_title", "description"} of a position: fixed texts verbatim, otherwise the LLM result (or an error dict)."""
+    if pos.get("fixed_text"):
+        return {"position_title": pos.get("title_input"), "description": pos.get("description_input")}
+    if not isinstance(result, dict) or "error" in result or not isinstance(result.get("description"), str):
+        return {"error": "POSITION_DRAFT_FAILED", "details": f"Position {i+1} ('{pos.get('title_input')}'): {result}"}
+    return {"position_title": result.get("position_title") or pos.get("title_input"), "description": result["description"]}
+
+
+def _assemble_position(i: int, pos: dict, drafted_text: dict) -> dict:
+    """Offer JSON position from a confirmed position and its drafted title/description; prices come from the local pricing."""
+    position = {"position_id": i + 1, "type": pos.get("type", "Offer Position"),
+                "position_title": drafted_text["position_title"], "description": drafted_text["description"]}
+    if position["type"] == "Offer Position":
+        position["description"] = _as_bullets(position["description"])
+        position.update(_pricing_fields(pos))
+    return position
+
+
+def _finish_offer(positions: list, introduction, project_title: str) -> dict:
+    """Puts the introduction (if any) first, numbers the positions and checks the offer against the drafting schema."""
+    positions = ([dict(introduction)] if introduction else []) + [dict(position) for position in positions]
+    for position_id, position in enumerate(positions, start=1):
+        position["position_id"] = position_id
+    offer_json = {"project_title": project_title, "positions": positions}
+    problems = validate_offer_json(offer_json)
+    if problems:
+        print(f"Warning: The assembled offer does not match the drafting schema: {problems}")
+        return {"error": "DRAFT_SCHEMA_INVALID", "details": problems, "raw_output": json.dumps(offer_json, ensure_ascii=False)}
+    return offer_json
+
+
+def draft_offer_in_parallel(details: dict, max_workers: int = DRAFT_MAX_WORKERS) -> dict:
+    """
+    Drafts all positions of details['positions_details'] concurrently and assembles the offer JSON.
+    The drafted texts, their fingerprints and contexts are kept in details['draft_cache'] for redraft_changed_positions();
+    its 'last_redrafted' lists the drafted indices (fixed texts are never drafted), as after a re-draft.
+    Returns the offer JSON, or an error dict if a position could not be drafted or the result is invalid.
+    """
+    positions_details = details.get("positions_details", [])
+    if not positions_details:
+        return {"error": "NO_POSITIONS_TO_DRAFT"}
+
+    # Retrieval is local and fast; it runs up front so only the LLM calls are concurrent
+    to_draft = [i for i, pos in enumerate(positions_details) if not pos.get("fixed_text")]
+    contexts_by_index = {i: retrieve_context(_context_query(positions_details[i]), n_results=budget_context_size(DRAFT_CONTEXT_PER_POSITION)) for i in to_draft}
+    drafted = _draft_positions(details, to_draft, contexts_by_index, max_workers)
+
+    cache_entries, positions = [], []
+    for i, pos in enumerate(positions_details):
+        drafted_text = _drafted_text(i, pos, drafted.get(i))
+        if "error" in drafted_text:
+            return drafted_text
+        cache_entries.append({"fingerprint": position_fingerprint(pos), "context_query": _context_query(pos),
+                              "contexts": contexts_by_index.get(i), "drafted": drafted_text})
+        positions.append(_assemble_position(i, pos, drafted_text))
+
+    drafted_overview = "\n".join(
+        f"{p['position_id']}. {p['position_title']}: {p['description'].strip().splitlines()[0][:150]}"
+        for p in positions if p["description"].strip()
+    )
+    finishing = get_llm_json_response(
+        None, None,
+        messages=pt.DRAFT_INTRODUCTION.messages(offer_summary=build_offer_summary(details), drafted_overview=drafted_overview),
+        prompt_name=pt.DRAFT_INTRODUCTION.name,
+        validate=lambda result: [] if isinstance(result, dict) and isinstance(result.get("project_title"), str) and result["project_title"].strip() else ["'project_title' must be a non-empty string."]
+    )
+    project_title = details.get("project_title", "AI Generated Project Title")
+    introduction = None
+    if isinstance(finishing, dict) and "error" not in finishing:
+        project_title = finishing.get("project_title") or project_title
+        if finishing.get("introduction"):
+            introduction = {
+                "position_id": 0,
+                "type": "Text Position",
+                "position_title": finishing.get("introduction_title") or project_title,
+                "description": finishing["introduction"],
+            }
+    else:
+        print("Warning: Could not generate the introduction; the offer is assembled without it.")
+
+    offer_json = _finish_offer(positions, introduction, project_title)
+    if "error" not in offer_json:
+        details["draft_cache"] = {"positions": cache_entries, "introduction": introduction, "project_title": project_title, "last_redrafted": to_draft}
+    return offer_json
+
+
+def redraft_changed_positions(details: dict, max_workers: int = DRAFT_MAX_WORKERS) -> dict:
+    """
+    Post-draft edit: compares details['positions_details'] with the fingerprints in details['draft_cache'] and
+    re-drafts only new or changed positions (hours, service area, title or description input). Unchanged positions,
+    the introduction and the project title are reused; prices and totals are recomputed locally. Contexts are
+    reused when the position's retrieval query did not change. details['draft_cache']['last_redrafted'] lists the
+    re-drafted indices. Falls back to a full draft without a cache. Returns the offer JSON or an error dict.
+    """
+    cache = details.get("draft_cache")
+    positions_details = details.get("positions_details", [])
+    if not cache:
+        return draft_offer_in_parallel(details, max_workers)
+    if not positions_details:
+        return {"error": "NO_POSITIONS_TO_DRAFT"}
+    price_confirmed_positions(details)
+
+    # Unchanged positions are matched by fingerprint, so inserting or removing a position does not re-draft the others
+    unused = {}
+    for entry in cache["positions"]:
+        unused.setdefault(entry["fingerprint"], []).append(entry)
+    cached_contexts = {entry["context_query"]: entry["contexts"] for entry in cache["positions"] if entry.get("contexts") is not None}
+    reused, to_draft, contexts_by_index = {}, [], {}
+    for i, pos in enumerate(positions_details):
+        matches = unused.get(position_fingerprint(pos))
+        if matches:
+            reused[i] = matches.pop(0)
+        elif not pos.get("fixed_text"):
+            to_draft.append(i)
+            query = _context_query(pos)
+            contexts_by_index[i] = cached_contexts.get(query) or retrieve_context(query, n_results=budget_context_size(DRAFT_CONTEXT_PER_POSITION))
+    print(f"Re-drafting {len(to_draft)} of {len(positions_details)} positions (the others are unchanged).")
+    drafted = _draft_positions(details, to_draft, contexts_by_index, max_workers)
+
+    cache_entries, positions = [], []
+    for i, pos in enumerate(positions_details):
+        if i in reused:
+            drafted_text, contexts = reused[i]["drafted"], reused[i].get("contexts")
+        else:
+            drafted_text, contexts = _drafted_text(i, pos, drafted.get(i)), contexts_by_index.get(i)
+            if "error" in drafted_text:
+                return drafted_text
+        cache_entries.append({"fingerprint": position_fingerprint(pos), "context_query": _context_query(pos), "contexts": contexts, "drafted": drafted_text})
+        positions.append(_assemble_position(i, pos, drafted_text))
+
+    offer_json = _finish_offer(positions, cache.get("introduction"), cache.get("project_title") or details.get("project_title", "AI Generated Project Title"))
+    if "error" not in offer_json:
+        details["draft_cache"] = dict(cache, positions=cache_entries, last_redrafted=to_draft)
+    return offer_json
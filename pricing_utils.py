@@ -0,0 +1,167 @@
+# pricing_utils.py
+#
+# Vectorized offer pricing. All money is handled as integer Rappen (CHF cents) in NumPy int64 arrays,
+# so rounding is exact (half-up, like Bexio) and one pass prices a whole structure or thousands of offers.
+# config_data.calculate_position_price is kept for single ad-hoc calls; the workflow uses this module.
+
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+
+from config_data import (
+    INTERNAL_HOURLY_RATES, CLIENT_RATE_OVERRIDES, VOLUME_DISCOUNT_TIERS, VAT_RATE_PERCENT,
+    TOTAL_ROUNDING_RAPPEN, BEXIO_MWST_TYPE, BEXIO_MWST_IS_NET
+)
+
+HOURS_SCALE = 1_000_000 # Hours are stored in millionths, so the price is only rounded once, to the Rappen
+PERCENT_SCALE = 100     # Percentages are stored in basis points (0.01 % resolution)
+
+
+def _to_fixed(values, scale: int) -> np.ndarray:
+    """Converts numbers to scaled int64 (e.g. hours -> millionths of an hour), rounding half-up.
+    Goes through the decimal representation, so 2.335 becomes exactly 2335000 and not 2334999."""
+    return np.array([int((Decimal(str(v)) * scale).to_integral_value(ROUND_HALF_UP)) for v in values], dtype=np.int64)
+
+
+def _div_round_half_up(numerator: np.ndarray, denominator: int) -> np.ndarray:
+    """Integer division rounding half away from zero, for int64 arrays."""
+    return np.sign(numerator) * ((np.abs(numerator) + denominator // 2) // denominator)
+
+
+def rappen_to_chf(rappen: np.ndarray) -> list:
+    """Rappen -> CHF as Python floats (n / 100 is the closest float to the exact decimal amount)."""
+    return (np.asarray(rappen, dtype=np.int64) / 100).tolist()
+
+
+def get_rate_table(client_name: str = None) -> dict:
+    """Internal hourly rates (CHF), with per-client overrides applied on top."""
+    rates = dict(INTERNAL_HOURLY_RATES)
+    if client_name:
+        for name, overrides in CLIENT_RATE_OVERRIDES.items():
+            if name.strip().lower() == client_name.strip().lower():
+                rates.update(overrides)
+    return rates
+
+
+def _resolve_rates(service_areas: list, client_names: list):
+    """Looks up the rate (in Rappen) per position. Unknown service areas fall back to 'Default'."""
+    tables = {}
+    rates = []
+    used_areas = []
+    for area, client in zip(service_areas, client_names):
+        table = tables.get(client)
+        if table is None:
+            table = tables[client] = {k: int(Decimal(str(v)) * 100) for k, v in get_rate_table(client).items()}
+        used_area = area if area in table else "Default"
+        rates.append(table[used_area])
+        used_areas.append(used_area)
+    return np.array(rates, dtype=np.int64), used_areas
+
+
+def _vat_split(subtotals: np.ndarray, mwst_type: int, mwst_is_net: bool):
+    """Returns (net, vat, gross) in Rappen according to the Bexio VAT mode."""
+    vat_bp = int(Decimal(str(VAT_RATE_PERCENT)) * PERCENT_SCALE)
+    if mwst_type != 0 or vat_bp == 0: # 1 = excluding taxes, 2 = exempt: no VAT on the document
+        return subtotals, np.zeros_like(subtotals), subtotals
+    if mwst_is_net: # Prices are net, VAT is added on top
+        vat = _div_round_half_up(subtotals * vat_bp, 100 * PERCENT_SCALE)
+        return subtotals, vat, subtotals + vat
+    # Prices are gross, VAT is contained in them
+    vat = _div_round_half_up(subtotals * vat_bp, 100 * PERCENT_SCALE + vat_bp)
+    return subtotals - vat, vat, subtotals
+
+
+def price_offers_batch(offers: list, mwst_type: int = BEXIO_MWST_TYPE, mwst_is_net: bool = BEXIO_MWST_IS_NET) -> list:
+    """
+    Prices many offers in one vectorized pass.
+
+    Args:
+        offers (list): [{"client_name": str (optional), "positions": [{"service_area": str, "hours": number}, ...]}, ...]
+
+    Returns:
+        list: One result per offer:
+            {
+                "positions": [{"calculated_price_chf", "hourly_rate_chf", "service_area_used", "estimated_hours_input"} or {"error": ...}],
+                "subtotal_chf", "volume_discount_percent", "discount_chf", "net_chf", "vat_chf", "total_chf"
+            }
+    """
+    offer_index, service_areas, client_names, hours, valid = [], [], [], [], []
+    for o_idx, offer in enumerate(offers):
+        for pos in offer.get("positions", []):
+            h = pos.get("hours")
+            is_valid = isinstance(h, (int, float)) and not isinstance(h, bool) and h > 0
+            offer_index.append(o_idx)
+            service_areas.append(pos.get("service_area"))
+            client_names.append(offer.get("client_name"))
+            hours.append(h if is_valid else 0)
+            valid.append(is_valid)
+
+    offer_index = np.array(offer_index, dtype=np.int64)
+    valid = np.array(valid, dtype=bool)
+    hours_fixed = _to_fixed(hours, HOURS_SCALE)
+    rates, used_areas = _resolve_rates(service_areas, client_names)
+
+    # Position price = rate x hours, rounded half-up to the Rappen
+    prices = np.where(valid, _div_round_half_up(rates * hours_fixed, HOURS_SCALE), 0)
+
+    subtotals = np.zeros(len(offers), dtype=np.int64)
+    np.add.at(subtotals, offer_index, prices)
+
+    # Volume discount tier by offer subtotal (tiers sorted by threshold in CHF)
+    tiers = sorted(VOLUME_DISCOUNT_TIERS)
+    thresholds = np.array([int(Decimal(str(t)) * 100) for t, _ in tiers], dtype=np.int64)
+    discount_bp_by_tier = np.array([0] + [int(Decimal(str(p)) * PERCENT_SCALE) for _, p in tiers], dtype=np.int64)
+    discount_bp = discount_bp_by_tier[np.searchsorted(thresholds, subtotals, side="right")]
+    discounts = _div_round_half_up(subtotals * discount_bp, 100 * PERCENT_SCALE)
+
+    net, vat, gross = _vat_split(subtotals - discounts, mwst_type, mwst_is_net)
+    if TOTAL_ROUNDING_RAPPEN > 1: # Swiss 5-Rappen rounding of the document total
+        gross = _div_round_half_up(gross, TOTAL_ROUNDING_RAPPEN) * TOTAL_ROUNDING_RAPPEN
+
+    prices_chf, rates_chf = rappen_to_chf(prices), rappen_to_chf(rates)
+    results = [{"positions": []} for _ in offers]
+    for i, o_idx in enumerate(offer_index.tolist()):
+        if valid[i]:
+            position_result = {
+                "calculated_price_chf": prices_chf[i],
+                "hourly_rate_chf": rates_chf[i],
+                "service_area_used": used_areas[i],
+                "estimated_hours_input": hours[i],
+            }
+        else:
+            position_result = {"error": "Estimated hours must be a positive number."}
+        results[o_idx]["positions"].append(position_result)
+    totals = zip(
+        rappen_to_chf(subtotals), (discount_bp / PERCENT_SCALE).tolist(), rappen_to_chf(discounts),
+        rappen_to_chf(net), rappen_to_chf(vat), rappen_to_chf(gross)
+    )
+    for result, (subtotal, discount_percent, discount, net_chf, vat_chf, total) in zip(results, totals):
+        result.update({
+            "subtotal_chf": subtotal,
+            "volume_discount_percent": discount_percent,
+            "discount_chf": discount,
+            "net_chf": net_chf,
+            "vat_chf": vat_chf,
+            "total_chf": total,
+        })
+    return results
+
+
+def price_positions(positions: list, client_name: str = None, **vat_options) -> dict:
+    """Prices one offer structure. `positions` is a list of {"service_area": str, "hours": number}."""
+    return price_offers_batch([{"client_name": client_name, "positions": positions}], **vat_options)[0]
+
+
+def price_confirmed_positions(high_level_info: dict) -> dict:
+    """
+    Prices all Offer Positions in high_level_info['positions_details'] in one pass,
+    stores 'calculated_price_info' on each of them and the offer totals in high_level_info['pricing_summary'].
+    """
+    offer_positions = [p for p in high_level_info.get("positions_details", []) if p.get("type") == "Offer Position"]
+    result = price_positions(
+        [{"service_area": p.get("service_area_input"), "hours": p.get("hours_input")} for p in offer_positions],
+        client_name=high_level_info.get("client_name")
+    )
+    for pos, price_info in zip(offer_positions, result.pop("positions")):
+        pos["calculated_price_info"] = price_info
+    high_level_info["pricing_summary"] = result
+    return result
@@ -0,0 +1,132 @@
+# prompt_templates.py
+#
+# Compiled versions of the prompts in prompts_config.py. Each template is parsed once at import time and its
+# placeholders are checked against the declared ones, so a typo in a prompt fails on startup instead of in the
+# middle of an offer. ChatPrompt renders the messages stable-prefix-first: the system prompt and the parts of
+# the user prompt that repeat between calls come first, volatile parts (feedback, per-position context) last,
+# so the provider's prompt cache can serve the shared prefix (see llm_utils.get_prompt_cache_stats()).
+
+import string
+
+import prompts_config as pc
+from config_data import TYPICAL_SERVICE_AREAS
+
+
+class PromptTemplate:
+    """A prompt template with placeholders parsed once and validated against `placeholders`."""
+
+    def __init__(self, name: str, text: str, placeholders=()):
+        self.name = name
+        self.pieces = [] # (literal text, placeholder name or None)
+        for literal, field, format_spec, conversion in string.Formatter().parse(text):
+            if field is not None and (not field.isidentifier() or format_spec or conversion):
+                raise ValueError(f"Prompt template '{name}': unsupported placeholder '{{{field}}}'. Escape literal braces as '{{{{' and '}}}}'.")
+            self.pieces.append((literal, field))
+        self.placeholders = frozenset(field for _, field in self.pieces if field is not None)
+        if self.placeholders != frozenset(placeholders):
+            raise ValueError(
+                f"Prompt template '{name}': placeholders {sorted(self.placeholders)} do not match the declared {sorted(placeholders)}."
+            )
+        self.static_text = None
+        if not self.placeholders: # Rendered once; every call returns the identical string
+            self.static_text = self.render()
+
+    def render(self, **values) -> str:
+        if self.static_text is not None and not values:
+            return self.static_text
+        missing = self.placeholders - values.keys()
+        unknown = values.keys() - self.placeholders
+        if missing or unknown:
+            raise KeyError(f"Prompt template '{self.name}': missing values {sorted(missing)}, unknown values {sorted(unknown)}.")
+        return "".join(literal if field is None else literal + str(values[field]) for literal, field in self.pieces)
+
+
+class ChatPrompt:
+    """
+    System + user messages for one LLM call. The user message is `stable` followed by `volatile`.
+    `bound` values (e.g. the static schema) are filled in on every render and need not be passed.
+    """
+
+    def __init__(self, name: str, system: PromptTemplate, stable: PromptTemplate, volatile: PromptTemplate = None, bound: dict = None):
+        self.name = name
+        self.parts = [("system", system), ("stable", stable)] + ([("volatile", volatile)] if volatile else [])
+        self.bound = dict(bound or {})
+        declared = set()
+        for _, template in self.parts:
+            overlap = declared & template.placeholders
+            if overlap:
+                raise ValueError(f"Chat prompt '{name}': placeholders {sorted(overlap)} are used in more than one part.")
+            declared |= template.placeholders
+        unknown_bound = self.bound.keys() - declared
+        if unknown_bound:
+            raise ValueError(f"Chat prompt '{name}': bound values {sorted(unknown_bound)} are not placeholders.")
+        self.placeholders = frozenset(declared - self.bound.keys())
+
+    def render_parts(self, **values) -> dict:
+        unknown = values.keys() - self.placeholders
+        if unknown:
+            raise KeyError(f"Chat prompt '{self.name}': unknown values {sorted(unknown)}.")
+        values = dict(self.bound, **values)
+        return {
+            part: template.render(**{key: values[key] for key in template.placeholders if key in values})
+            for part, template in self.parts
+        }
+
+    def messages(self, **values) -> list:
+        parts = self.render_parts(**values)
+        return [
+            {"role": "system", "content": parts["system"]},
+            {"role": "user", "content": parts["stable"] + parts.get("volatile", "")},
+        ]
+
+
+# --- COMPILED PROMPTS ---
+RESEARCH_BRIEF = ChatPrompt(
+    "research_brief",
+    system=PromptTemplate("research_brief.system", pc.PROMPT_RESEARCH_BRIEF_SYSTEM),
+    stable=PromptTemplate("research_brief.user", pc.PROMPT_RESEARCH_BRIEF_USER_TEMPLATE, [
+        "research_json", "topics", "max_items", "max_item_chars"
+    ]),
+)
+
+PROPOSE_STRUCTURE = ChatPrompt(
+    "propose_structure",
+    system=PromptTemplate("propose_structure.system", pc.PROMPT_PROPOSE_STRUCTURE_SYSTEM_TEMPLATE, ["typical_service_areas_list_str"]),
+    stable=PromptTemplate("propose_structure.user", pc.PROMPT_PROPOSE_STRUCTURE_USER_TEMPLATE, [
+        "details_summary", "context_str", "historical_hours_reference", "client_research_summary", "offer_focused_research_summary"
+    ]),
+    volatile=PromptTemplate("propose_structure.request", pc.PROMPT_PROPOSE_STRUCTURE_REQUEST_TEMPLATE, ["user_feedback_for_structure_change_prompt_segment"]),
+    bound={"typical_service_areas_list_str": ", ".join(TYPICAL_SERVICE_AREAS)},
+)
+
+EDIT_STRUCTURE = PromptTemplate("edit_structure.user", pc.PROMPT_EDIT_STRUCTURE_USER_TEMPLATE, ["user_feedback"])
+
+DRAFT_OFFER = ChatPrompt(
+    "draft_offer",
+    system=PromptTemplate("draft_offer.system", pc.PROMPT_DRAFT_JSON_SYSTEM + pc.PROMPT_DRAFT_JSON_INSTRUCTIONS, [
+        "output_instruction", "json_schema_description_text"
+    ]),
+    stable=PromptTemplate("draft_offer.user", pc.PROMPT_DRAFT_JSON_USER_TEMPLATE, [
+        "overall_offer_summary", "positions_to_draft_info_str", "client_research_summary", "offer_focused_research_summary", "context_str"
+    ]),
+    bound={
+        "output_instruction": pc.PROMPT_DRAFT_JSON_OUTPUT_INSTRUCTION,
+        # The schema text escapes its braces; rendering it turns '{{' into the '{' the model should see
+        "json_schema_description_text": PromptTemplate("draft_offer.schema", pc.PROMPT_DRAFT_JSON_SCHEMA_DESCRIPTION).render(),
+    },
+)
+
+DRAFT_POSITION = ChatPrompt(
+    "draft_position",
+    system=PromptTemplate("draft_position.system", pc.PROMPT_DRAFT_POSITION_SYSTEM),
+    stable=PromptTemplate("draft_position.user", pc.PROMPT_DRAFT_POSITION_USER_TEMPLATE, [
+        "offer_summary", "structure_overview", "research_summary",
+        "context_str", "position_number", "position_type", "title", "focus", "pricing_str"
+    ]),
+)
+
+DRAFT_INTRODUCTION = ChatPrompt(
+    "draft_introduction",
+    system=PromptTemplate("draft_introduction.system", pc.PROMPT_DRAFT_JSON_SYSTEM),
+    stable=PromptTemplate("draft_introduction.user", pc.PROMPT_DRAFT_INTRODUCTION_USER_TEMPLATE, ["offer_summary", "drafted_overview"]),
+)
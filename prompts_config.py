@@ -4,6 +4,31 @@
 # --- INITIAL CHAT ---
 SYS_PROMPT_INITIAL_CHAT = "You are a helpful AI assistant for Sidekicks AG. Your goal is to gather high-level requirements from a consultant for a new sales offer. Ask clear, concise questions one at a time."
 
+# --- RESEARCH BRIEF ---
+PROMPT_RESEARCH_BRIEF_SYSTEM = """
+You are an analyst at Sidekicks AG. You condense external research into a short, structured brief
+that consultants and other AI prompts use when preparing a sales offer. Keep only information that is
+useful for the offer; drop filler, repetition and generic statements. Do not invent facts.
+"""
+
+PROMPT_RESEARCH_BRIEF_USER_TEMPLATE = """
+Raw research results (JSON object, one text per research topic):
+---
+{research_json}
+---
+
+Return ONLY a valid JSON object with one key per research topic above ({topics}). Each value is an object:
+{{
+  "summary": "string (1-2 sentences)",
+  "key_facts": ["string", ...],
+  "challenges": ["string", ...],
+  "opportunities": ["string", ...],
+  "sources": ["URL or publication name", ...]
+}}
+Use at most {max_items} entries per list and at most {max_item_chars} characters per entry.
+Only list sources that are named in the research text.
+"""
+
 # --- OFFER STRUCTURE PROPOSAL ---
 # The {typical_service_areas_list_str} will be filled in.
 # This prompt is for the initial proposal of structure, which the user will confirm/modify.
@@ -49,12 +74,24 @@ Generate ONLY the valid JSON array. Do not include any other text, explanations,
 If the user provides feedback for changes, incorporate that feedback directly into the new proposal.
 """
 
+# Laid out stable-prefix-first (see prompt_templates.py): offer details and knowledge base context do not change
+# between (c)hange iterations, the consultant's feedback is rendered last by PROMPT_PROPOSE_STRUCTURE_REQUEST_TEMPLATE.
 PROMPT_PROPOSE_STRUCTURE_USER_TEMPLATE = """
 High-Level Offer Requirements:
 ---
 {details_summary}
 ---
 
+Relevant Context from Past Offers (for inspiration on typical structures and service components):
+---
+{context_str}
+---
+
+Historical Hours Reference (hours actually offered for comparable past positions; base `estimated_hours_suggestion` on these):
+---
+{historical_hours_reference}
+---
+
 External Client Research Summary (if available):
 ---
 {client_research_summary}
@@ -64,19 +101,34 @@ External Offer-Focused Research Summary (if available):
 ---
 {offer_focused_research_summary}
 ---
+"""
 
-Relevant Context from Past Offers (for inspiration on typical structures and service components):
----
-{context_str}
----
-
+PROMPT_PROPOSE_STRUCTURE_REQUEST_TEMPLATE = """
 {user_feedback_for_structure_change_prompt_segment}
 
 Based on all the above, and any feedback provided, propose the offer structure.
 """
 
 
-# --- FINAL JSON DRAFTING ---
+# Sent after the original proposal conversation (same system and user prompt, so the large context is served
+# from the prompt prefix cache); the model only returns the operations, not the whole structure again.
+PROMPT_EDIT_STRUCTURE_USER_TEMPLATE = """
+The consultant wants the following changes to your proposed structure:
+---
+{user_feedback}
+---
+
+Do NOT repeat the whole structure. Return ONLY a valid JSON object of the form {{"operations": [...]}}
+with the smallest list of operations that implements the changes. Positions are numbered from 1 in the order
+of the structure above, and all numbers refer to that structure (before any of the operations are applied).
+
+Available operations:
+- {{"op": "edit", "position": 2, "changes": {{"proposed_title": "...", "estimated_hours_suggestion": 12}}}}
+  (only the fields that change: type, proposed_title, focus_description, estimated_hours_suggestion, suggested_service_area)
+- {{"op": "remove", "position": 3}}
+- {{"op": "add", "after": 1, "item": {{...a complete "Offer Position" or "Text Position" object...}}}}  ("after": 0 inserts at the start)
+- {{"op": "merge", "positions": [1, 2], "item": {{...the complete combined object...}}}}
+"""
 PROMPT_DRAFT_JSON_SYSTEM = """
 You are an expert AI assistant for Sidekicks AG.
 Your task is to draft a complete sales offer in a structured JSON format, based on a consultant-confirmed plan.
@@ -113,7 +165,66 @@ The overall JSON structure should be:
 }}
 """
 
-# The {output_instruction} and {json_schema_description_text} placeholders will be filled in main.py
+# --- PARALLEL DRAFTING (one call per position, see parallel_drafting.py) ---
+PROMPT_DRAFT_POSITION_SYSTEM = """
+You are an expert AI assistant for Sidekicks AG.
+You are drafting ONE position of a sales offer. Other positions of the same offer are drafted at the same time,
+so stay strictly within the scope of your position and do not repeat content that belongs to the other positions listed.
+For an "Offer Position", the description MUST be a bullet-point list: each bullet starts with '- ', bullets are separated by '\\n'.
+For a "Text Position", the description is a well-written paragraph (use '\\n' for new paragraphs).
+Write in the language requested in the offer details.
+Return ONLY a valid JSON object: {{"position_title": "string", "description": "string"}}
+"""
+
+# Shared part first (identical for every position of the offer), position-specific part last.
+PROMPT_DRAFT_POSITION_USER_TEMPLATE = """
+Offer Summary:
+---
+{offer_summary}
+---
+
+All Positions of this Offer (in order):
+---
+{structure_overview}
+---
+
+External Research Summary (if available):
+---
+{research_summary}
+---
+
+Relevant Context from Past Offers for YOUR position (use as inspiration for content, style and formatting):
+---
+{context_str}
+---
+
+YOUR Position (number {position_number}, type: {position_type}):
+- Title (as confirmed; refine subtly if needed): {title}
+- Key Focus/Description Points to expand: {focus}
+{pricing_str}
+"""
+
+PROMPT_DRAFT_INTRODUCTION_USER_TEMPLATE = """
+Offer Summary:
+---
+{offer_summary}
+---
+
+Drafted Positions (titles and first lines):
+---
+{drafted_overview}
+---
+
+Write the finishing touches for this offer, in the requested language:
+- "project_title": the final project title (keep the given one unless it clearly does not fit the positions).
+- "introduction_title": a short heading for the opening text block.
+- "introduction": a short opening paragraph (2-4 sentences) that introduces the offer to the client and leads into the positions.
+
+Return ONLY a valid JSON object: {{"project_title": "string", "introduction_title": "string", "introduction": "string"}}
+"""
+
+# Offer-specific part of the final drafting call. The static instructions and schema are in the system prompt
+# (PROMPT_DRAFT_JSON_SYSTEM + PROMPT_DRAFT_JSON_INSTRUCTIONS), which is identical for every offer and therefore cached.
 PROMPT_DRAFT_JSON_USER_TEMPLATE = """
 Overall Offer Details (including Project Title):
 ---
@@ -141,7 +252,18 @@ Relevant Context from Past Offers (use these as primary inspiration for expandin
 ---
 {context_str}
 ---
+"""
+
+PROMPT_DRAFT_JSON_OUTPUT_INSTRUCTION = (
+    "Ensure your output is a single valid JSON object. "
+    "This object must have a top-level string field 'project_title' and a top-level array field 'positions'. "
+    "Each item in the 'positions' array must follow the schema described, including an integer 'position_id' and correct 'type'. "
+    "For 'Offer Position' types, the 'description' MUST be a bullet-point list. "
+    "For 'Text Position' types, the 'description' should be a paragraph."
+)
 
+# The {output_instruction} and {json_schema_description_text} placeholders are bound once in prompt_templates.py
+PROMPT_DRAFT_JSON_INSTRUCTIONS = """
 Instruction:
 Based on all the provided information, especially the 'Consultant-Confirmed Plan', draft the complete offer.
 The output must be a single JSON object.
@@ -0,0 +1,61 @@
+# query_cache.py
+#
+# In-process LRU caches for retrieval. The same overall queries (industry, title, focus tags, services) repeat
+# across sessions, (c)hange iterations and bulk runs, so retrieve_context caches
+#   - query embeddings, keyed by the normalized query text (skips the encoder forward pass), and
+#   - full retrieval results, keyed by normalized query, result parameters and the index version
+#     (skips the vector store query; any index write bumps the version, so stale results are never served).
+
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_query(text: str) -> str:
+    """
+    Unicode NFC and collapsed whitespace. Case is kept: the multilingual encoders are cased, so
+    'Bank' and 'bank' may embed differently and must not share a cache entry.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with hit/miss counters."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached value or None."""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,205 @@
+# rate_limiter.py
+#
+# Process-wide rate limit governor for the OpenAI and OpenRouter calls. Every call first takes one request and
+# its estimated tokens from per-model token buckets (requests/min and tokens/min); if a bucket is empty the
+# call waits (is queued) instead of hitting the API and failing. The buckets adapt to the x-ratelimit-* headers
+# of every response, and a 429 pauses the model until the reported reset time.
+#
+# With RATE_LIMIT_STATE_PATH set, the bucket state lives in a small SQLite file, so several processes
+# (CLI runs, server, bulk jobs) on one machine share the same budget.
+
+import re
+import time
+import sqlite3
+import threading
+
+from config_data import LLM_RATE_LIMITS, RATE_LIMIT_SAFETY_FACTOR, RATE_LIMIT_STATE_PATH
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value) -> float:
+    """Parses header durations like '20ms', '1s', '6m0s' or a plain number of seconds. Returns 0.0 if unknown."""
+    if value is None:
+        return 0.0
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(number) * DURATION_SECONDS[unit] for number, unit in DURATION_PART.findall(value))
+
+
+def estimate_tokens(messages: list, completion_tokens: int = 1000) -> int:
+    """Rough token estimate for a chat request (about 4 characters per token plus the expected answer)."""
+    return sum(len(str(message.get("content", ""))) for message in messages) // 4 + completion_tokens
+
+
+class _LocalState:
+    """Bucket state in memory, shared by the threads of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = {} # model -> [request_level, token_level, updated_at, blocked_until]
+
+    def transact(self, model: str, update):
+        with self.lock:
+            row = self.rows.get(model)
+            new_row, result = update(row)
+            self.rows[model] = new_row
+            return result
+
+
+class _SQLiteState:
+    """Bucket state in a SQLite file, shared by all processes on this machine."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (model TEXT PRIMARY KEY, request_level REAL, token_level REAL, updated_at REAL, blocked_until REAL)"
+            )
+
+    def _connection(self):
+        if getattr(self.local, "connection", None) is None:
+            self.local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.connection.execute("PRAGMA journal_mode=WAL")
+        return self.local.connection
+
+    def transact(self, model: str, update):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE") # Serializes the read-modify-write across processes
+        try:
+            row = connection.execute(
+                "SELECT request_level, token_level, updated_at, blocked_until FROM buckets WHERE model = ?", (model,)
+            ).fetchone()
+            new_row, result = update(list(row) if row else None)
+            connection.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?)", (model, *new_row))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return result
+
+
+class RateLimitGovernor:
+    """Token buckets per model. Use acquire() before a call and observe_response()/observe_rate_limit() after it."""
+
+    def __init__(self, limits: dict = LLM_RATE_LIMITS, safety_factor: float = RATE_LIMIT_SAFETY_FACTOR, state_path: str = RATE_LIMIT_STATE_PATH):
+        self.limits = {model: dict(values) for model, values in limits.items()}
+        self.safety_factor = safety_factor
+        self.state = _SQLiteState(state_path) if state_path else _LocalState()
+        self.stats_lock = threading.Lock()
+        self.stats = {"calls": 0, "queued_calls": 0, "queued_seconds": 0.0, "rate_limited": 0}
+
+    def _capacity(self, model: str):
+        limits = self.limits.get(model) or self.limits["default"]
+        return limits["rpm"] * self.safety_factor, limits["tpm"] * self.safety_factor
+
+    def _refilled(self, model: str, row, now: float):
+        request_capacity, token_capacity = self._capacity(model)
+        if row is None:
+            return [request_capacity, token_capacity, now, 0.0]
+        request_level, token_level, updated_at, blocked_until = row
+        elapsed = max(now - updated_at, 0.0)
+        return [
+            min(request_capacity, request_level + elapsed * request_capacity / 60),
+            min(token_capacity, token_level + elapsed * token_capacity / 60),
+            now, blocked_until
+        ]
+
+    def _try_take(self, model: str, tokens: int) -> float:
+        """Takes one request and `tokens` if available. Returns 0.0 on success, else the seconds to wait."""
+        request_capacity, token_capacity = self._capacity(model)
+        tokens = min(tokens, token_capacity) # A single oversized request must still fit into a full bucket
+
+        def update(row):
+            now = time.time()
+            row = self._refilled(model, row, now)
+            if now < row[3]:
+                return row, row[3] - now
+            if row[0] >= 1 and row[1] >= tokens:
+                row[0] -= 1
+                row[1] -= tokens
+                return row, 0.0
+            return row, max((1 - row[0]) * 60 / request_capacity, (tokens - row[1]) * 60 / token_capacity, 0.01)
+
+        return self.state.transact(model, update)
+
+    def acquire(self, model: str, tokens: int):
+        """Blocks until the model's buckets allow one more request with `tokens` tokens."""
+        waited = 0.0
+        while True:
+            wait = self._try_take(model, tokens)
+            if wait <= 0:
+                break
+            wait = min(wait, 5.0) # Re-check regularly, other threads/processes may return budget
+            time.sleep(wait)
+            waited += wait
+        with self.stats_lock:
+            self.stats["calls"] += 1
+            if waited:
+                self.stats["queued_calls"] += 1
+                self.stats["queued_seconds"] += waited
+
+    def observe_usage(self, model: str, estimated_tokens: int, actual_tokens: int):
+        """Corrects the token bucket by the difference between the estimate taken in acquire() and the real usage."""
+        def update(row):
+            row = self._refilled(model, row, time.time())
+            row[1] += estimated_tokens - actual_tokens
+            return row, None
+        self.state.transact(model, update)
+
+    def observe_response(self, model: str, headers):
+        """Adapts limits and levels to the x-ratelimit-* headers (they reflect usage of the whole organization)."""
+        if headers is None:
+            return
+        limit_requests = headers.get("x-ratelimit-limit-requests")
+        limit_tokens = headers.get("x-ratelimit-limit-tokens")
+        if limit_requests and limit_tokens:
+            try:
+                self.limits[model] = {"rpm": float(limit_requests), "tpm": float(limit_tokens)}
+            except ValueError:
+                pass
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_requests is None and remaining_tokens is None:
+            return
+
+        def update(row):
+            row = self._refilled(model, row, time.time())
+            try:
+                if remaining_requests is not None:
+                    row[0] = min(row[0], float(remaining_requests))
+                if remaining_tokens is not None:
+                    row[1] = min(row[1], float(remaining_tokens))
+            except ValueError:
+                pass
+            return row, None
+        self.state.transact(model, update)
+
+    def observe_rate_limit(self, model: str, headers):
+        """After a 429: pauses the model until the reported reset time (at least one second)."""
+        pause = 1.0
+        if headers is not None:
+            pause = max(pause, parse_reset_duration(headers.get("retry-after")),
+                        parse_reset_duration(headers.get("x-ratelimit-reset-requests")) if headers.get("x-ratelimit-remaining-requests") == "0" else 0.0,
+                        parse_reset_duration(headers.get("x-ratelimit-reset-tokens")) if headers.get("x-ratelimit-remaining-tokens") == "0" else 0.0)
+        print(f"Rate limit reached for {model}. Queuing its requests for {pause:.1f}s...")
+
+        def update(row):
+            now = time.time()
+            row = self._refilled(model, row, now)
+            row[3] = max(row[3], now + pause)
+            return row, None
+        self.state.transact(model, update)
+        with self.stats_lock:
+            self.stats["rate_limited"] += 1
+
+    def get_stats(self) -> dict:
+        with self.stats_lock:
+            return dict(self.stats, queued_seconds=round(self.stats["queued_seconds"], 2))
+
+
+governor = RateLimitGovernor()
@@ -1,7 +1,22 @@
 # research_utils.py
 import os
-from openai import OpenAI
-from config_data import OPENROUTER_API_KEY, PERPLEXITY_MODEL_NAME
+import json
+import time
+import asyncio
+from openai import AsyncOpenAI, RateLimitError
+from config_data import (
+    OPENROUTER_API_KEY, PERPLEXITY_MODEL_NAME, PERPLEXITY_FALLBACK_MODEL_NAME,
+    RESEARCH_HEDGE_AFTER_SECONDS, RESEARCH_DEADLINE_SECONDS,
+    RESEARCH_BRIEF_MODEL, RESEARCH_BRIEF_MAX_ITEMS, RESEARCH_BRIEF_MAX_ITEM_CHARS
+)
+import prompt_templates as pt
+from llm_utils import get_llm_json_response
+from rate_limiter import governor, estimate_tokens
+from session_store import session_store
+from offer_budget import charge_call
+from cassette import cassette
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
 def ask_for_external_research() -> bool:
     """Asks the consultant if extensive external research is needed."""
@@ -14,105 +29,252 @@ def ask_for_external_research() -> bool:
         else:
             print("Invalid input. Please enter 'yes' or 'no'.")
 
-# Initialize OpenRouter client
-openrouter_client = None
 if OPENROUTER_API_KEY:
-    try:
-        openrouter_client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=OPENROUTER_API_KEY,
-        )
-        print("OpenRouter client initialized successfully for Perplexity.")
-    except Exception as e:
-        print(f"Error initializing OpenRouter client: {e}")
-        openrouter_client = None # Ensure it's None if init fails
+    print("OpenRouter configured for Perplexity research.")
 else:
     print("Warning: OPENROUTER_API_KEY not found in environment. External research via Perplexity will be skipped.")
 
 
-def perform_client_research(client_name: str, client_industry: str) -> str:
-    """
-    Performs client-specific research using Perplexity AI via OpenRouter.
-    Returns a string with research results or an error/skipped message.
-    """
-    print(f"\n--- Performing External Client Research for: {client_name} ({client_industry}) via OpenRouter/Perplexity ---")
-
-    if not openrouter_client:
-        print("Skipping client research: OpenRouter client not available (OPENROUTER_API_KEY may be missing or initialization failed).")
-        return (
-            f"Skipped: External client research for {client_name}. "
-            f"Reason: OpenRouter client not available."
-        )
-
+# --- RESEARCH PROMPTS ---
+def client_research_messages(client_name: str, client_industry: str) -> list:
     research_query = (
         f"Provide a concise business overview of the company '{client_name}' which operates in the '{client_industry}' industry. "
         f"Focus on their main products/services, target market, key strengths, recent significant news or developments, and potential challenges or opportunities. "
         f"Aim for a summary useful for someone preparing a sales offer for them."
     )
+    return [
+        {"role": "system", "content": "You are an AI research assistant. Provide concise and factual information."},
+        {"role": "user", "content": research_query}
+    ]
 
+def offer_focused_research_messages(project_description: str, focus_tags_str: str) -> list:
+    research_query = (
+        f"For a project involving '{project_description}' with a specific focus on '{focus_tags_str}', "
+        f"what are the current key trends, emerging technologies, best practices, common challenges, and typical client expectations or success metrics? "
+        f"Provide insights that would be valuable for crafting a compelling sales offer position."
+    )
+    return [
+        {"role": "system", "content": "You are an AI research assistant. Provide concise and factual information related to technology and business trends for a specific offer."},
+        {"role": "user", "content": research_query}
+    ]
+
+
+# --- ASYNC CLIENT WITH DEADLINE AND HEDGING ---
+async def _complete(client: AsyncOpenAI, model: str, messages: list, timeout: float) -> str:
+    estimated_tokens = estimate_tokens(messages)
+    queue_start = time.perf_counter()
+    await asyncio.to_thread(governor.acquire, model, estimated_tokens) # Queued with all other calls of this model
+    call_start = time.perf_counter()
+    queued_ms = (call_start - queue_start) * 1000
     try:
-        # #CommentAndMaybeToIntegrateItFurther: Consider adding a timeout to the request
-        completion = openrouter_client.chat.completions.create(
-            model=PERPLEXITY_MODEL_NAME,
-            messages=[
-                {"role": "system", "content": "You are an AI research assistant. Provide concise and factual information."},
-                {"role": "user", "content": research_query}
-            ],
+        raw_response = await client.chat.completions.with_raw_response.create(
+            model=model,
+            messages=messages,
             temperature=0.7, # Optional: Adjust for desired creativity/factuality
-            # max_tokens=500  # Optional: Limit response length
+            timeout=timeout,
         )
-        response_content = completion.choices[0].message.content
-        print("--- Client Research via OpenRouter/Perplexity Successful ---")
-        print("\n--- Perplexity API Response (Client Research) ---")
-        print(response_content)
-        print("--- End of Perplexity API Response ---")
-        return response_content
     except Exception as e:
-        print(f"Error during OpenRouter (Perplexity) client research for '{client_name}': {e}")
-        return f"Error: Could not perform client research for {client_name} via OpenRouter. Details: {str(e)}"
+        if isinstance(e, RateLimitError):
+            governor.observe_rate_limit(model, getattr(e.response, "headers", None))
+        session_store.record_llm_call(model, "research", queued_ms=queued_ms, latency_ms=(time.perf_counter() - call_start) * 1000,
+                                      error=f"{type(e).__name__}: {e}")
+        charge_call(model, started=call_start, duration=time.perf_counter() - call_start)
+        raise # The deadline does not allow waiting; the hedge model may still answer
+    governor.observe_response(model, raw_response.headers)
+    completion = raw_response.parse()
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        governor.observe_usage(model, estimated_tokens, usage.total_tokens)
+    session_store.record_llm_call(model, "research", getattr(usage, "prompt_tokens", None), None, getattr(usage, "completion_tokens", None),
+                                  queued_ms=queued_ms, latency_ms=(time.perf_counter() - call_start) * 1000)
+    charge_call(model, getattr(usage, "prompt_tokens", None), 0, getattr(usage, "completion_tokens", None),
+                started=call_start, duration=time.perf_counter() - call_start)
+    content = completion.choices[0].message.content
+    citations = getattr(completion, "citations", None) # Perplexity returns its source URLs separately
+    if citations:
+        content += "\n\nSources:\n" + "\n".join(f"- {url}" for url in citations)
+    return content
 
-def perform_offer_focused_research(project_description: str, focus_tags: list[str] | str) -> str:
+async def hedged_research(client: AsyncOpenAI, messages: list, primary_model: str = PERPLEXITY_MODEL_NAME,
+                          fallback_model: str = PERPLEXITY_FALLBACK_MODEL_NAME,
+                          hedge_after: float = RESEARCH_HEDGE_AFTER_SECONDS, deadline: float = RESEARCH_DEADLINE_SECONDS) -> dict:
     """
-    Performs offer-focused research using Perplexity AI via OpenRouter.
-    Returns a string with research results or an error/skipped message.
+    Runs one research call with a hard deadline. If the primary model has not answered after `hedge_after`
+    seconds (or fails earlier), the same request is sent to `fallback_model` and whichever answers first wins.
+
+    Returns:
+        dict: {"content", "model", "hedged", "elapsed_seconds"} or {"error", "details", "elapsed_seconds"}.
     """
-    if isinstance(focus_tags, list):
-        focus_tags_str = ", ".join(focus_tags)
-    else:
-        focus_tags_str = focus_tags
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    end = start + deadline
+    can_hedge = bool(fallback_model) and fallback_model != primary_model
+    tasks = {asyncio.create_task(_complete(client, primary_model, messages, deadline)): primary_model}
+    hedged = False
+    errors = []
+    try:
+        while tasks:
+            remaining = end - loop.time()
+            if remaining <= 0:
+                break
+            timeout = remaining if hedged or not can_hedge else min(remaining, max(start + hedge_after - loop.time(), 0))
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                model = tasks.pop(task)
+                try:
+                    content = task.result()
+                except Exception as e:
+                    print(f"Research call with {model} failed: {e}")
+                    errors.append(f"{model}: {e}")
+                    continue
+                return {"content": content, "model": model, "hedged": hedged, "elapsed_seconds": round(loop.time() - start, 2)}
+            if can_hedge and not hedged and (errors or loop.time() - start >= hedge_after):
+                hedged = True
+                print(f"Research with {primary_model} is slow or failed, also asking {fallback_model}...")
+                tasks[asyncio.create_task(_complete(client, fallback_model, messages, end - loop.time()))] = fallback_model
+    finally:
+        for task in tasks: # The losing request is abandoned
+            task.cancel()
+    if errors and not tasks:
+        return {"error": "RESEARCH_FAILED", "details": "; ".join(errors), "elapsed_seconds": round(loop.time() - start, 2)}
+    return {"error": "RESEARCH_DEADLINE_EXCEEDED", "details": f"No answer within {deadline:.0f}s. {'; '.join(errors)}".strip(), "elapsed_seconds": round(loop.time() - start, 2)}
 
-    print(f"\n--- Performing External Offer-Focused Research for: {project_description} (Focus: {focus_tags_str}) via OpenRouter/Perplexity ---")
+async def _research_all(requests: dict) -> dict:
+    """Runs several research calls concurrently. `requests` maps a name to its messages."""
+    async with AsyncOpenAI(base_url=OPENROUTER_BASE_URL, api_key=OPENROUTER_API_KEY, max_retries=0,
+                           http_client=cassette.async_http_client()) as client:
+        results = await asyncio.gather(*(hedged_research(client, messages) for messages in requests.values()))
+    return dict(zip(requests, results))
 
-    if not openrouter_client:
-        print("Skipping offer-focused research: OpenRouter client not available (OPENROUTER_API_KEY may be missing or initialization failed).")
-        return (
-            f"Skipped: External offer-focused research for {project_description}. "
-            f"Reason: OpenRouter client not available."
-        )
+def run_research(requests: dict) -> dict:
+    """Synchronous entry point: runs the research calls concurrently, bounded by RESEARCH_DEADLINE_SECONDS."""
+    return asyncio.run(_research_all(requests))
 
-    research_query = (
-        f"For a project involving '{project_description}' with a specific focus on '{focus_tags_str}', "
-        f"what are the current key trends, emerging technologies, best practices, common challenges, and typical client expectations or success metrics? "
-        f"Provide insights that would be valuable for crafting a compelling sales offer position."
+def _summary_text(result: dict, label: str, subject: str) -> str:
+    """Turns a research result into the summary text used in prompts (errors become a short note)."""
+    if "error" in result:
+        print(f"Error during OpenRouter (Perplexity) {label} for '{subject}': {result['details']}")
+        return f"Error: Could not perform {label} for {subject} via OpenRouter. Details: {result['details']}"
+    print(f"--- {label.capitalize()} via OpenRouter/Perplexity Successful ({result['model']}, {result['elapsed_seconds']}s, {len(result['content'])} chars) ---")
+    print(f"Snippet: {result['content'][:300]}...")
+    return result["content"]
+
+
+# --- RESEARCH BRIEF ---
+BRIEF_LIST_FIELDS = ["key_facts", "challenges", "opportunities", "sources"]
+
+def _cap(text, max_chars: int) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= max_chars else text[:max_chars - 3].rstrip() + "..."
+
+def condense_research(raw_research: dict) -> dict:
+    """
+    Condenses raw research texts ({"client": text, "offer_focused": text}) into a structured brief per topic:
+    {"summary", "key_facts", "challenges", "opportunities", "sources"}. Lengths are capped locally as well,
+    so the brief stays small even if the model ignores the limits. Returns an error dict on failure.
+    """
+    messages = pt.RESEARCH_BRIEF.messages(
+        research_json=json.dumps(raw_research, ensure_ascii=False, indent=2),
+        topics=", ".join(f'"{name}"' for name in raw_research),
+        max_items=RESEARCH_BRIEF_MAX_ITEMS,
+        max_item_chars=RESEARCH_BRIEF_MAX_ITEM_CHARS
     )
+    print("\n--- Condensing research into a structured brief ---")
+    result = get_llm_json_response(None, None, model=RESEARCH_BRIEF_MODEL, messages=messages, prompt_name=pt.RESEARCH_BRIEF.name)
+    if not isinstance(result, dict) or "error" in result:
+        return result if isinstance(result, dict) else {"error": "INVALID_RESEARCH_BRIEF", "details": str(result)}
+    brief = {}
+    for name in raw_research:
+        section = result.get(name)
+        if not isinstance(section, dict):
+            return {"error": "INVALID_RESEARCH_BRIEF", "details": f"Missing section '{name}'."}
+        brief[name] = {"summary": _cap(section.get("summary", ""), 2 * RESEARCH_BRIEF_MAX_ITEM_CHARS)}
+        for field in BRIEF_LIST_FIELDS:
+            items = section.get(field) if isinstance(section.get(field), list) else []
+            brief[name][field] = [_cap(item, RESEARCH_BRIEF_MAX_ITEM_CHARS) for item in items if isinstance(item, str) and item.strip()][:RESEARCH_BRIEF_MAX_ITEMS]
+    return brief
 
-    try:
-        # #CommentAndMaybeToIntegrateItFurther: Consider adding a timeout to the request
-        completion = openrouter_client.chat.completions.create(
-            model=PERPLEXITY_MODEL_NAME,
-            messages=[
-                {"role": "system", "content": "You are an AI research assistant. Provide concise and factual information related to technology and business trends for a specific offer."},
-                {"role": "user", "content": research_query}
-            ],
-            temperature=0.7, # Optional
-            # max_tokens=500  # Optional
-        )
-        response_content = completion.choices[0].message.content
-        print("--- Offer-Focused Research via OpenRouter/Perplexity Successful ---")
-        print("\n--- Perplexity API Response (Offer-Focused Research) ---")
-        print(response_content)
-        print("--- End of Perplexity API Response ---")
-        return response_content
-    except Exception as e:
-        print(f"Error during OpenRouter (Perplexity) offer-focused research for '{project_description}': {e}")
-        return f"Error: Could not perform offer-focused research for {project_description} via OpenRouter. Details: {str(e)}"
+def format_research_brief(section: dict) -> str:
+    """Compact text form of one brief section, as used in the prompts."""
+    lines = [section["summary"]] if section.get("summary") else []
+    for field in BRIEF_LIST_FIELDS:
+        if section.get(field):
+            lines.append(f"{field.replace('_', ' ').capitalize()}:")
+            lines.extend(f"- {item}" for item in section[field])
+    return "\n".join(lines)
+
+
+# --- RESEARCH ENTRY POINTS ---
+def perform_research(client_name: str, client_industry: str, project_description: str, focus_tags: list[str] | str) -> dict:
+    """
+    Performs client and offer-focused research concurrently.
+    Returns {"client_research_summary", "offer_focused_research_summary", "research_models", "research_brief"}:
+    the summaries are the condensed brief in text form, research_models records the model that actually answered
+    each call (None if it was skipped or failed) and research_brief is the structured brief (None if unavailable).
+    """
+    focus_tags_str = ", ".join(focus_tags) if isinstance(focus_tags, list) else focus_tags
+    print(f"\n--- Performing External Research for: {client_name} ({client_industry}) and '{project_description}' (Focus: {focus_tags_str}) via OpenRouter/Perplexity ---")
+
+    if not OPENROUTER_API_KEY:
+        print("Skipping external research: OPENROUTER_API_KEY is missing.")
+        return {
+            "client_research_summary": f"Skipped: External client research for {client_name}. Reason: OpenRouter client not available.",
+            "offer_focused_research_summary": f"Skipped: External offer-focused research for {project_description}. Reason: OpenRouter client not available.",
+            "research_models": {"client": None, "offer_focused": None},
+            "research_brief": None,
+        }
+
+    started = time.perf_counter()
+    results = run_research({
+        "client": client_research_messages(client_name, client_industry),
+        "offer_focused": offer_focused_research_messages(project_description, focus_tags_str),
+    })
+    print(f"Research finished in {time.perf_counter() - started:.1f}s.")
+    summaries = {
+        "client": _summary_text(results["client"], "client research", client_name),
+        "offer_focused": _summary_text(results["offer_focused"], "offer-focused research", project_description),
+    }
+
+    # The prompts get the condensed brief instead of the long raw texts (failed/skipped topics keep their short note)
+    research_brief = None
+    succeeded = {name: summaries[name] for name, result in results.items() if "error" not in result}
+    if succeeded:
+        research_brief = condense_research(succeeded)
+        if "error" in research_brief:
+            print(f"Warning: Could not condense the research ({research_brief['error']}). Using the full research texts.")
+            research_brief = None
+        else:
+            for name, section in research_brief.items():
+                summaries[name] = format_research_brief(section)
+            print(f"Research brief: {sum(len(text) for text in succeeded.values())} -> {sum(len(summaries[name]) for name in succeeded)} chars")
+    return {
+        "client_research_summary": summaries["client"],
+        "offer_focused_research_summary": summaries["offer_focused"],
+        "research_models": {name: result.get("model") for name, result in results.items()},
+        "research_brief": research_brief,
+    }
+
+def perform_client_research(client_name: str, client_industry: str) -> str:
+    """
+    Performs client-specific research using Perplexity AI via OpenRouter.
+    Returns a string with research results or an error/skipped message.
+    """
+    print(f"\n--- Performing External Client Research for: {client_name} ({client_industry}) via OpenRouter/Perplexity ---")
+    if not OPENROUTER_API_KEY:
+        print("Skipping client research: OpenRouter client not available (OPENROUTER_API_KEY may be missing).")
+        return f"Skipped: External client research for {client_name}. Reason: OpenRouter client not available."
+    result = run_research({"client": client_research_messages(client_name, client_industry)})["client"]
+    return _summary_text(result, "client research", client_name)
+
+def perform_offer_focused_research(project_description: str, focus_tags: list[str] | str) -> str:
+    """
+    Performs offer-focused research using Perplexity AI via OpenRouter.
+    Returns a string with research results or an error/skipped message.
+    """
+    focus_tags_str = ", ".join(focus_tags) if isinstance(focus_tags, list) else focus_tags
+    print(f"\n--- Performing External Offer-Focused Research for: {project_description} (Focus: {focus_tags_str}) via OpenRouter/Perplexity ---")
+    if not OPENROUTER_API_KEY:
+        print("Skipping offer-focused research: OpenRouter client not available (OPENROUTER_API_KEY may be missing).")
+        return f"Skipped: External offer-focused research for {project_description}. Reason: OpenRouter client not available."
+    result = run_research({"offer_focused": offer_focused_research_messages(project_description, focus_tags_str)})["offer_focused"]
+    return _summary_text(result, "offer-focused research", project_description)
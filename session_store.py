@@ -0,0 +1,283 @@
+# session_store.py
+#
+# Durable record of every offer session (CLI run or server session) in one SQLite file:
+#   sessions        current state: high-level info, proposed structure, latest draft, Bexio response
+#   stage_outputs   one row per stage run (research, structure, price, draft, ...) with duration and result
+#   llm_calls       one row per chat completion: prompt name, model, token counts, queue wait and latency
+#   drafts          every drafted offer, versioned per session
+#   bexio_exports   every quote export attempt with the Bexio id or the error
+#
+# Writes must not slow down the stages: callers only serialize the row and put it on a queue. A writer thread
+# commits queued rows in batches (one transaction per SESSION_STORE_FLUSH_SECONDS or SESSION_STORE_MAX_BATCH rows)
+# with WAL journaling, so readers (e.g. a restarted server restoring a session) never block the writer.
+#
+# LLM calls are attributed to the session set with session_context(); the id follows asyncio tasks
+# automatically, thread pools have to run their work in contextvars.copy_context().
+
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from config_data import SESSION_STORE_PATH, SESSION_STORE_FLUSH_SECONDS, SESSION_STORE_MAX_BATCH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    client_name TEXT,
+    project_title TEXT,
+    info_json TEXT NOT NULL,
+    proposed_structure_json TEXT,
+    draft_json TEXT,
+    bexio_response_json TEXT
+);
+CREATE TABLE IF NOT EXISTS stage_outputs (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    duration_ms REAL,
+    status INTEGER,
+    output_json TEXT
+);
+CREATE INDEX IF NOT EXISTS stage_outputs_session ON stage_outputs (session_id);
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT,
+    created_at REAL NOT NULL,
+    prompt_name TEXT,
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER,
+    cached_tokens INTEGER,
+    completion_tokens INTEGER,
+    queued_ms REAL,
+    latency_ms REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS llm_calls_session ON llm_calls (session_id);
+CREATE TABLE IF NOT EXISTS drafts (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    draft_json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS drafts_session ON drafts (session_id);
+CREATE TABLE IF NOT EXISTS bexio_exports (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    bexio_id INTEGER,
+    document_nr TEXT,
+    error TEXT,
+    response_json TEXT
+);
+CREATE INDEX IF NOT EXISTS bexio_exports_session ON bexio_exports (session_id);
+"""
+
+STATEMENTS = {
+    "session": (
+        "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (session_id) DO UPDATE SET "
+        "updated_at = excluded.updated_at, client_name = excluded.client_name, project_title = excluded.project_title, "
+        "info_json = excluded.info_json, proposed_structure_json = excluded.proposed_structure_json, "
+        "draft_json = excluded.draft_json, bexio_response_json = excluded.bexio_response_json"
+    ),
+    "stage": "INSERT INTO stage_outputs (session_id, stage, created_at, duration_ms, status, output_json) VALUES (?, ?, ?, ?, ?, ?)",
+    "llm_call": (
+        "INSERT INTO llm_calls (session_id, created_at, prompt_name, model, prompt_tokens, cached_tokens, completion_tokens, "
+        "queued_ms, latency_ms, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+    "draft": (
+        "INSERT INTO drafts (session_id, version, created_at, draft_json) "
+        "SELECT ?1, COALESCE(MAX(version), 0) + 1, ?2, ?3 FROM drafts WHERE session_id = ?1"
+    ),
+    "bexio_export": "INSERT INTO bexio_exports (session_id, created_at, bexio_id, document_nr, error, response_json) VALUES (?, ?, ?, ?, ?, ?)",
+}
+
+current_session_id = contextvars.ContextVar("current_session_id", default=None)
+
+
+def _dumps(value):
+    return None if value is None else json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _loads(value):
+    return None if value is None else json.loads(value)
+
+
+@contextmanager
+def session_context(session_id: str):
+    """LLM calls made inside this block (and in asyncio tasks started from it) are recorded for `session_id`."""
+    token = current_session_id.set(session_id)
+    try:
+        yield
+    finally:
+        current_session_id.reset(token)
+
+
+class SessionStore:
+    """Queue + batching writer thread in front of the session database. All record_* calls return immediately."""
+
+    def __init__(self, path: str = SESSION_STORE_PATH, flush_seconds: float = SESSION_STORE_FLUSH_SECONDS, max_batch: int = SESSION_STORE_MAX_BATCH):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.max_batch = max_batch
+        self.queue = queue.SimpleQueue()
+        self.writer = None
+        self.start_lock = threading.Lock()
+        self.stats = {"rows_written": 0, "batches": 0, "write_errors": 0, "last_batch_ms": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    # --- WRITING ---
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL") # WAL + NORMAL: durable across app crashes, one fsync per checkpoint
+        return connection
+
+    def _enqueue(self, statement: str, params: tuple):
+        if not self.enabled:
+            return
+        if self.writer is None:
+            with self.start_lock: # Started on first use, so scripts that never record a session create no database
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self._write_loop, args=(self._connect(),), name="session-store", daemon=True)
+                    self.writer.start()
+                    atexit.register(self.flush)
+        self.queue.put((statement, params))
+
+    def _write_loop(self, connection):
+        connection.executescript(SCHEMA)
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.max_batch and not isinstance(batch[-1], threading.Event): # An Event = flush() is waiting
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write_batch(connection, batch)
+
+    def _write_batch(self, connection, batch: list):
+        start = time.perf_counter()
+        rows = [item for item in batch if not isinstance(item, threading.Event)]
+        try:
+            if not rows:
+                return
+            connection.execute("BEGIN")
+            # Consecutive rows of the same kind go through one executemany; the order of all rows is kept
+            group_statement, group_params = None, []
+            for statement, params in rows + [(None, None)]:
+                if statement != group_statement and group_params:
+                    connection.executemany(STATEMENTS[group_statement], group_params)
+                    group_params = []
+                group_statement = statement
+                group_params.append(params)
+            connection.execute("COMMIT")
+            self.stats["rows_written"] += len(rows)
+            self.stats["batches"] += 1
+            self.stats["last_batch_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write {len(rows)} session record(s) to {self.path}: {e}")
+            self.stats["write_errors"] += 1
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+        finally:
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Blocks until everything recorded so far is committed. Returns False on timeout."""
+        if self.writer is None:
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def save_session(self, session_id: str, info: dict, proposed_structure=None, draft=None, bexio_response=None, source: str = "server"):
+        """Stores the current state of a session (insert or replace; created_at is kept)."""
+        now = time.time()
+        self._enqueue("session", (
+            session_id, source, now, now, info.get("client_name"), info.get("project_title"),
+            _dumps(info), _dumps(proposed_structure), _dumps(draft), _dumps(bexio_response)
+        ))
+
+    def record_stage(self, session_id: str, stage: str, output=None, duration_ms: float = None, status: int = 200):
+        self._enqueue("stage", (session_id, stage, time.time(), duration_ms, status, _dumps(output)))
+
+    def record_llm_call(self, model: str, prompt_name: str = None, prompt_tokens: int = None, cached_tokens: int = None,
+                        completion_tokens: int = None, queued_ms: float = None, latency_ms: float = 0.0, error: str = None):
+        """Records one chat completion for the session of the current context (None outside of a session)."""
+        self._enqueue("llm_call", (
+            current_session_id.get(), time.time(), prompt_name, model, prompt_tokens, cached_tokens, completion_tokens,
+            queued_ms, latency_ms, error
+        ))
+
+    def record_draft(self, session_id: str, draft: dict):
+        self._enqueue("draft", (session_id, time.time(), _dumps(draft)))
+
+    def record_bexio_export(self, session_id: str, response: dict):
+        response = response or {}
+        self._enqueue("bexio_export", (
+            session_id, time.time(), response.get("id"), response.get("document_nr"),
+            response.get("error") and str(response.get("error")), _dumps(response)
+        ))
+
+    # --- READING ---
+    def _read(self, sql: str, params: tuple = ()) -> list:
+        if not self.enabled:
+            return []
+        self.flush()
+        connection = self._connect()
+        try:
+            connection.executescript(SCHEMA)
+            connection.row_factory = sqlite3.Row
+            return [dict(row) for row in connection.execute(sql, params).fetchall()]
+        finally:
+            connection.close()
+
+    def load_session(self, session_id: str):
+        """Returns the stored state of a session (info, proposed_structure, draft, bexio_response, ...) or None."""
+        rows = self._read("SELECT * FROM sessions WHERE session_id = ?", (session_id,))
+        if not rows:
+            return None
+        row = rows[0]
+        return {
+            "session_id": row["session_id"], "source": row["source"],
+            "created_at": row["created_at"], "updated_at": row["updated_at"],
+            "info": _loads(row["info_json"]),
+            "proposed_structure": _loads(row["proposed_structure_json"]),
+            "draft": _loads(row["draft_json"]),
+            "bexio_response": _loads(row["bexio_response_json"]),
+        }
+
+    def llm_usage_summary(self, session_id: str = None) -> list:
+        """Calls, tokens and latency per model and prompt name, for one session or all of them."""
+        where, params = ("WHERE session_id = ?", (session_id,)) if session_id else ("", ())
+        return self._read(
+            "SELECT model, prompt_name, COUNT(*) AS calls, SUM(error IS NOT NULL) AS errors, "
+            "SUM(prompt_tokens) AS prompt_tokens, SUM(cached_tokens) AS cached_tokens, SUM(completion_tokens) AS completion_tokens, "
+            "ROUND(AVG(queued_ms), 1) AS avg_queued_ms, ROUND(AVG(latency_ms), 1) AS avg_latency_ms, ROUND(MAX(latency_ms), 1) AS max_latency_ms "
+            f"FROM llm_calls {where} GROUP BY model, prompt_name ORDER BY SUM(prompt_tokens + completion_tokens) DESC",
+            params
+        )
+
+    def get_stats(self) -> dict:
+        return dict(self.stats, path=self.path, queued=self.queue.qsize()) if self.enabled else {"path": None}
+
+
+session_store = SessionStore()
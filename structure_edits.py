@@ -0,0 +1,109 @@
+# structure_edits.py
+#
+# Patch-style changes to a proposed offer structure. Instead of regenerating the whole structure for every
+# (c)hange request, the LLM returns a short list of operations that are applied here locally.
+#
+# Operations (positions are numbered from 1, always referring to the structure BEFORE the edit):
+#   {"op": "edit",   "position": 2, "changes": {"proposed_title": "...", "estimated_hours_suggestion": 12}}
+#   {"op": "remove", "position": 3}
+#   {"op": "add",    "after": 1, "item": {...full structure item...}}     ("after": 0 inserts at the start)
+#   {"op": "merge",  "positions": [1, 2], "item": {...full structure item...}}
+
+STRUCTURE_FIELDS = ["type", "proposed_title", "focus_description", "estimated_hours_suggestion", "suggested_service_area"]
+DERIVED_FIELDS = ["historical_hours", "hours_warning"] # Recomputed for new/changed positions after an edit
+
+
+def _clean_item(item: dict) -> dict:
+    return {key: value for key, value in item.items() if key not in DERIVED_FIELDS}
+
+
+def _check_position(value, num_positions: int, op_number: int, allow_zero: bool = False) -> int:
+    lowest = 0 if allow_zero else 1
+    if isinstance(value, bool) or not isinstance(value, int) or not lowest <= value <= num_positions:
+        raise ValueError(f"Operation {op_number}: position {value!r} is out of range ({lowest}-{num_positions}).")
+    return value
+
+
+def _check_item(item, op_number: int) -> dict:
+    if not isinstance(item, dict) or item.get("type") not in ("Offer Position", "Text Position"):
+        raise ValueError(f"Operation {op_number}: 'item' must be a structure object with type 'Offer Position' or 'Text Position'.")
+    return _clean_item(item)
+
+
+def validate_structure(structure) -> list:
+    """Checks a proposed structure. Returns a list of problems (empty if the structure is usable)."""
+    if not isinstance(structure, list) or not structure:
+        return ["The structure must be a non-empty array."]
+    problems = []
+    for i, item in enumerate(structure, start=1):
+        if not isinstance(item, dict) or item.get("type") not in ("Offer Position", "Text Position"):
+            problems.append(f"Position {i}: must be an object with type 'Offer Position' or 'Text Position'.")
+            continue
+        if not isinstance(item.get("proposed_title"), str) or not item["proposed_title"].strip():
+            problems.append(f"Position {i}: 'proposed_title' must be a non-empty string.")
+        hours = item.get("estimated_hours_suggestion")
+        if item["type"] == "Offer Position" and hours is not None: # Missing hours are estimated from the knowledge base
+            try:
+                valid_hours = not isinstance(hours, bool) and float(hours) > 0
+            except (TypeError, ValueError):
+                valid_hours = False
+            if not valid_hours:
+                problems.append(f"Position {i}: 'estimated_hours_suggestion' must be a positive number, got {hours!r}.")
+    return problems
+
+
+def structure_for_prompt(structure: list) -> list:
+    """The structure as the LLM proposed it, without locally derived fields."""
+    return [_clean_item(item) for item in structure]
+
+
+def apply_structure_operations(structure: list, operations: list) -> list:
+    """
+    Applies edit operations to `structure` and returns the new structure (the input is not modified).
+    Unchanged positions keep their dict (including derived fields); new and changed positions are new dicts
+    without derived fields. Raises ValueError with the offending operation if an operation is invalid.
+    """
+    if not isinstance(operations, list):
+        raise ValueError("'operations' must be a list.")
+    num_positions = len(structure)
+    replaced = {}  # position -> new item
+    removed = set()
+    inserted = {}  # position it follows -> [new items]
+
+    for op_number, operation in enumerate(operations, start=1):
+        if not isinstance(operation, dict):
+            raise ValueError(f"Operation {op_number}: must be an object.")
+        op = operation.get("op")
+        if op == "edit":
+            position = _check_position(operation.get("position"), num_positions, op_number)
+            changes = operation.get("changes")
+            if not isinstance(changes, dict) or not changes:
+                raise ValueError(f"Operation {op_number}: 'changes' must be a non-empty object.")
+            unknown = [key for key in changes if key not in STRUCTURE_FIELDS]
+            if unknown:
+                raise ValueError(f"Operation {op_number}: unknown field(s) {unknown}.")
+            current = replaced.get(position, structure[position - 1])
+            replaced[position] = _clean_item({**current, **changes})
+        elif op == "remove":
+            removed.add(_check_position(operation.get("position"), num_positions, op_number))
+        elif op == "add":
+            after = _check_position(operation.get("after"), num_positions, op_number, allow_zero=True)
+            inserted.setdefault(after, []).append(_check_item(operation.get("item"), op_number))
+        elif op == "merge":
+            positions = operation.get("positions")
+            if not isinstance(positions, list) or len(positions) < 2:
+                raise ValueError(f"Operation {op_number}: 'positions' must list at least two positions.")
+            positions = sorted({_check_position(p, num_positions, op_number) for p in positions})
+            replaced[positions[0]] = _check_item(operation.get("item"), op_number)
+            removed.update(positions[1:])
+        else:
+            raise ValueError(f"Operation {op_number}: unknown op {op!r} (expected add, remove, merge or edit).")
+
+    new_structure = list(inserted.get(0, []))
+    for position in range(1, num_positions + 1):
+        if position not in removed:
+            new_structure.append(replaced.get(position, structure[position - 1]))
+        new_structure.extend(inserted.get(position, []))
+    if not new_structure:
+        raise ValueError("The operations would remove every position.")
+    return new_structure
@@ -0,0 +1,83 @@
+# conftest.py
+#
+# The tests run offline: modules that need an API key at import time get a dummy one (no request ever goes out),
+# and nothing is recorded in the real session database. vector_store_utils is imported once with a hashing
+# encoder instead of the sentence-transformers model (no download) and its index in a temporary directory.
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+from unittest import mock
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key-never-sent")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+TEST_VECTOR_STORE = tempfile.mkdtemp(prefix="test_vector_store_")
+
+
+class HashingEncoder:
+    """Bag-of-words stand-in for EmbeddingModel: texts sharing words get similar vectors."""
+    model_id = "test-hashing-encoder"
+    dimension = 64
+
+    def encode(self, texts, show_progress_bar: bool = False):
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                vectors[row, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dimension] += 1.0
+        return vectors[0] if single else vectors
+
+    def encode_shards(self, texts: list, show_progress_bar: bool = False, **options):
+        yield 0, self.encode(texts)
+
+
+def pytest_configure(config):
+    import embedding_utils
+    import vector_backends
+    real_factory = vector_backends.get_vector_backend
+    with mock.patch.object(embedding_utils, "get_embedding_model", HashingEncoder), \
+         mock.patch.object(vector_backends, "get_vector_backend",
+                           lambda name, path, collection_name, **options: real_factory("memmap", TEST_VECTOR_STORE, collection_name)):
+        import vector_store_utils # noqa: F401 (keeps the patched module in sys.modules for all tests)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(TEST_VECTOR_STORE, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def no_session_store(monkeypatch):
+    from session_store import session_store
+    monkeypatch.setattr(session_store, "path", None)
+
+
+@pytest.fixture
+def vector_store(tmp_path, monkeypatch):
+    """vector_store_utils with an empty index of its own for this test."""
+    import vector_store_utils
+    from vector_backends import MemmapBackend
+    monkeypatch.setattr(vector_store_utils, "vector_backend", MemmapBackend(str(tmp_path), "offer_positions"))
+    vector_store_utils.query_embedding_cache.clear()
+    vector_store_utils.query_result_cache.clear()
+    return vector_store_utils
+
+
+@pytest.fixture
+def write_offer(tmp_path):
+    """write_offer(offer_id, positions, **fields) writes an offer file to tmp_path/offers and returns its path."""
+    offers_dir = tmp_path / "offers"
+    offers_dir.mkdir()
+
+    def write(offer_id, positions, filename=None, **fields):
+        path = offers_dir / (filename or f"{offer_id}.json")
+        path.write_text(json.dumps({"offer_id": offer_id, "positions": positions, **fields}, ensure_ascii=False), encoding="utf-8")
+        return str(path)
+    return write
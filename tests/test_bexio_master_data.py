@@ -0,0 +1,133 @@
+import pytest
+import requests
+
+import bexio_master_data as bmd
+from bexio_master_data import BexioMasterData, normalize_name
+
+DATA = {
+    "/2.0/contact": [
+        {"id": 1, "nr": "K-1", "name_1": "Muster AG", "name_2": None, "mail": "info@muster.ch"},
+        {"id": 2, "nr": "K-2", "name_1": "Straßenbau GmbH", "name_2": None},
+        {"id": 3, "nr": "K-3", "name_1": "Beispiel", "name_2": "Hans"},
+        {"id": 4, "nr": "K-4", "name_1": "Twin AG"},
+        {"id": 5, "nr": "K-5", "name_1": "Twin GmbH"},
+    ],
+    "/3.0/taxes": [{"id": 10, "name": "UN81", "code": "UN81", "display_name": "MWST 8.1%", "value": 8.1}],
+    "/2.0/unit": [{"id": 20, "name": "Stunde"}, {"id": 21, "name": "Stück"}],
+    "/2.0/accounts": [{"id": 30, "account_no": "3400", "name": "Dienstleistungserlöse"}],
+    "/3.0/users": [{"id": 40, "firstname": "Anna", "lastname": "Meier", "email": "anna@sidekicks.ch"}],
+}
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, etag=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {"ETag": etag} if etag else {}
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error")
+
+
+class FakeBexio:
+    """Paginated Bexio list endpoints; single-page resources send an ETag and answer If-None-Match with 304."""
+
+    def __init__(self):
+        self.requests = []
+        self.down = False
+
+    def get(self, url, headers, timeout, params):
+        path = url[len(bmd.BEXIO_API_BASE_URL):]
+        self.requests.append((path, params["offset"], headers.get("If-None-Match")))
+        if self.down:
+            return FakeResponse(503)
+        etag = f'"{path}-v1"'
+        if headers.get("If-None-Match") == etag:
+            return FakeResponse(304)
+        return FakeResponse(200, DATA[path][params["offset"]:params["offset"] + params["limit"]], etag)
+
+
+@pytest.fixture
+def master_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(bmd, "BEXIO_API_TOKEN", "test-token")
+    monkeypatch.setattr(bmd, "BEXIO_PAGE_SIZE", 2)
+    monkeypatch.setattr(bmd, "BEXIO_NAME_MATCH_CUTOFF", 0.85)
+    data = BexioMasterData(str(tmp_path / "master_data.json"), ttl_seconds=3600)
+    data.http_session = FakeBexio()
+    return data
+
+
+def test_normalize_name():
+    assert normalize_name("  Straßenbau   GmbH ") == "strassenbau gmbh"
+    assert normalize_name("Muster AG.", strip_legal_form=True) == "muster"
+
+
+def test_refresh_pages_through_every_resource(master_data):
+    assert master_data.refresh() == {"contacts": 5, "taxes": 1, "units": 2, "accounts": 1, "users": 1}
+    assert [offset for path, offset, _ in master_data.http_session.requests if path == "/2.0/contact"] == [0, 2, 4]
+
+
+@pytest.mark.parametrize("resource, name, expected", [
+    ("contacts", "muster ag", 1),
+    ("contacts", "Muster", 1),                # Legal form is optional
+    ("contacts", "Strassenbau GmbH", 2),      # ß == ss
+    ("contacts", "Hans Beispiel", 3),
+    ("contacts", "K-3", 3),
+    ("contacts", "Musterr AG", None),         # Near-miss: possibly another customer, never matched fuzzily
+    ("contacts", "Twin", None),               # Ambiguous
+    ("contacts", "Unknown Corp", None),
+    ("taxes", "8.1%", 10),
+    ("taxes", "MWST 8.1%", 10),
+    ("units", "stunde", 20),
+    ("units", "Stunden", 20),                 # Close match above the cutoff
+    ("accounts", "3400", 30),
+    ("users", "Meier Anna", 40),
+    ("users", 7, 7),                          # IDs are passed through
+])
+def test_resolve(master_data, resource, name, expected):
+    master_data.refresh()
+    assert master_data.resolve(resource, name) == expected
+
+
+def test_cache_file_is_used_and_revalidated_with_etags(master_data, tmp_path):
+    master_data.refresh()
+    second = BexioMasterData(master_data.cache_path, ttl_seconds=3600)
+    second.http_session = FakeBexio()
+    assert second.resolve("units", "Stück") == 21
+    assert second.http_session.requests == [] # Fresh cache file: no API calls
+
+    second.ttl_seconds = 0
+    second.refresh()
+    requests_by_path = {}
+    for path, offset, etag in second.http_session.requests:
+        requests_by_path.setdefault(path, []).append((offset, etag))
+    assert requests_by_path["/3.0/taxes"] == [(0, '"/3.0/taxes-v1"')] # Single page: revalidated, 304
+    assert requests_by_path["/2.0/contact"] == [(0, None), (2, None), (4, None)] # Several pages: refetched
+    assert second.resolve("taxes", "8.1") == 10
+
+
+def test_failed_refresh_keeps_stale_data(master_data):
+    master_data.refresh()
+    master_data.ttl_seconds = 0
+    master_data.http_session.down = True
+    assert master_data.refresh()["contacts"] == 5
+    assert master_data.resolve("contacts", "Muster AG") == 1
+
+
+def test_resolve_quote_ids_falls_back_to_configured_ids(master_data, monkeypatch):
+    master_data.refresh()
+    monkeypatch.setattr(bmd, "master_data", master_data)
+    monkeypatch.setattr(bmd, "BEXIO_CONTACT_BY_CLIENT_NAME", True)
+    monkeypatch.setattr(bmd, "BEXIO_UNIT_NAME_HOURS", "Stunde")
+    monkeypatch.setattr(bmd, "BEXIO_USER_NAME", "Nobody Here")
+    monkeypatch.setattr(bmd, "BEXIO_TAX_NAME_STANDARD", None)
+    ids = bmd.resolve_quote_ids("Muster AG")
+    assert ids["contact_id"] == 1 and ids["unit_id"] == 20
+    assert ids["user_id"] == bmd.BEXIO_USER_ID and ids["tax_id"] == bmd.BEXIO_TAX_ID_STANDARD
+    assert bmd.resolve_quote_ids("Unknown Corp")["contact_id"] == bmd.BEXIO_CONTACT_ID
+    assert bmd.resolve_quote_ids("Musterr AG")["contact_id"] == bmd.BEXIO_CONTACT_ID
+    assert bmd.resolve_quote_ids("MUSTER")["contact_id"] == 1 # Legal-form-stripped match
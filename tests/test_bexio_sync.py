@@ -0,0 +1,164 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import bexio_sync
+from bexio_sync import html_to_position_text, convert_bexio_offer
+from bexio_utils import format_bexio_position
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error")
+
+
+class FakeBexio:
+    """kb_offer list, search (updated_at >= value) and detail endpoints over `quotes` (id -> quote)."""
+
+    def __init__(self, quotes):
+        self.quotes = quotes
+        self.after_page = None # Called after every list/search page, e.g. to edit a quote mid-sync
+        self.listed_ids = []
+
+    def _page(self, quotes, params):
+        key = (lambda q: q["id"]) if params["order_by"] == "id" else (lambda q: (q["updated_at"], q["id"]))
+        page = sorted(quotes, key=key)[params["offset"]:params["offset"] + params["limit"]]
+        page = [{key: value for key, value in quote.items() if key != "positions"} for quote in page]
+        if self.after_page:
+            self.after_page(page)
+        return FakeResponse(200, page)
+
+    def get(self, url, headers, timeout, params=None):
+        path = url.split("/2.0/", 1)[1]
+        if path == "kb_offer":
+            if params["order_by"] == "id":
+                self.listed_ids.append(params["offset"])
+            return self._page(list(self.quotes.values()), params)
+        quote = self.quotes.get(int(path.split("/")[1]))
+        return FakeResponse(200, quote) if quote else FakeResponse(404, {"message": "not found"})
+
+    def post(self, url, params, data, headers, timeout):
+        (criterion,) = json.loads(data)
+        assert (criterion["field"], criterion["criteria"]) == ("updated_at", ">=")
+        return self._page([q for q in self.quotes.values() if q["updated_at"] >= criterion["value"]], params)
+
+
+def quote(quote_id, updated_at, title="Offer", status=3):
+    return {
+        "id": quote_id, "document_nr": f"AN-{quote_id:05d}", "title": title, "updated_at": updated_at,
+        "kb_item_status_id": status, "contact_id": 7, "user_id": 1, "total_net": 1000, "total": 1081, "currency_id": None,
+        "positions": [
+            {"type": "KbPositionText", "text": "<strong>Intro</strong>"},
+            {"type": "KbPositionCustom", "pos": "1", "amount": "8.000000", "unit_price": "100.000000", "position_total": "800.000000",
+             "text": format_bexio_position(f"{title} workshop", "Kick-off on site\n- Interviews\n- Report")},
+        ],
+    }
+
+
+@pytest.fixture
+def bexio(tmp_path, monkeypatch):
+    fake = FakeBexio({i: quote(i, f"2026-10-01 10:00:0{i}") for i in range(1, 6)})
+    indexed, removed = [], []
+    monkeypatch.setattr(bexio_sync, "bexio_http_session", fake)
+    monkeypatch.setattr(bexio_sync, "BEXIO_API_TOKEN", "test-token")
+    monkeypatch.setattr(bexio_sync, "BEXIO_PAGE_SIZE", 2)
+    monkeypatch.setattr(bexio_sync, "BEXIO_SYNC_DELETION_CHECK_SECONDS", 3600)
+    monkeypatch.setattr(bexio_sync, "master_data", SimpleNamespace(items=lambda resource: [{"id": 1, "firstname": "Anna", "lastname": "Meier"}]))
+    monkeypatch.setattr(bexio_sync, "index_offer_files", indexed.extend)
+    monkeypatch.setattr(bexio_sync, "remove_offer_files", removed.extend)
+    (tmp_path / "offers").mkdir()
+    fake.sync = lambda **options: bexio_sync.sync_bexio_offers(str(tmp_path / "offers"), str(tmp_path / "state.json"), **options)
+    fake.files_dir = tmp_path / "offers"
+    fake.files = lambda: sorted(os.listdir(fake.files_dir))
+    fake.indexed, fake.removed = indexed, removed
+    return fake
+
+
+def test_html_to_position_text_reverses_format_bexio_position():
+    html = format_bexio_position("Strategy Workshop", "Two half-days\nwith the board\n- Goals & vision\n* Roadmap")
+    assert html_to_position_text(html) == ("Strategy Workshop", "Two half-days\nwith the board\n- Goals & vision\n- Roadmap")
+
+
+@pytest.mark.parametrize("html, expected", [
+    ("Workshop\nLine one\nLine two", ("Workshop", "Line one\nLine two")),                  # Typed in Bexio: first line is the title
+    ("<p><b>Title</b></p><p>Text &amp; more</p>", ("Title", "Text & more")),
+    ("<div>Intro <strong>bold</strong> word</div>", ("Intro bold word", "")),             # Bold text inside a line is no title
+    ("<strong>Only title</strong>", ("Only title", "")),
+    ("", ("", "")),
+])
+def test_html_to_position_text(html, expected):
+    assert html_to_position_text(html) == expected
+
+
+def test_convert_keeps_priced_positions_and_the_status(bexio):
+    offer = convert_bexio_offer(quote(3, "2026-10-01 10:00:00", title="CRM", status=4))
+    assert offer["offer_id"] == "AN-00003" and offer["status"] == "lost"
+    assert offer["contact_person_internal"] == "Anna Meier"
+    assert offer["positions"] == [{
+        "position_id": "1", "position_title": "CRM workshop", "description": "Kick-off on site\n- Interviews\n- Report",
+        "quantity": 8.0, "unit_price_chf": 100.0, "total_price_chf": 800.0, "service_tags": [],
+    }]
+
+
+def test_sync_writes_changed_quotes_and_advances_the_cursor(bexio):
+    assert bexio.sync()["quotes_seen"] == 5
+    assert bexio.files() == [f"bexio_{i}.json" for i in range(1, 6)]
+    assert len(bexio.indexed) == 5
+    assert bexio.sync()["quotes_seen"] == 0 # Nothing changed since the cursor
+    bexio.quotes[2] = quote(2, "2026-10-02 09:00:00", title="Renamed")
+    result = bexio.sync()
+    assert (result["quotes_seen"], result["files_changed"], result["cursor"]) == (1, 1, "2026-10-02 09:00:00")
+
+
+def test_quote_edited_during_the_sync_does_not_hide_others(bexio):
+    def edit_first_quote(page):
+        if page and page[0]["id"] == 1:
+            bexio.after_page = None
+            bexio.quotes[1] = quote(1, "2026-10-01 11:00:00", title="Edited") # Moves to the end of the updated_at order
+    bexio.after_page = edit_first_quote
+    bexio.sync()
+    assert bexio.files() == [f"bexio_{i}.json" for i in range(1, 6)]
+    assert json.loads((bexio.files_dir / "bexio_1.json").read_text(encoding="utf-8"))["offer_title"] == "Edited"
+    assert bexio.sync()["quotes_seen"] == 0
+
+
+def test_more_quotes_with_one_updated_at_than_fit_on_a_page(bexio):
+    bexio.quotes.update({i: quote(i, "2026-10-03 08:00:00") for i in range(1, 8)})
+    assert bexio.sync()["quotes_seen"] == 7
+    assert bexio.sync()["quotes_seen"] == 0
+
+
+def test_deleted_quotes_are_removed(bexio, tmp_path):
+    bexio.sync() # The first run also checks for deletions
+    bexio.listed_ids.clear()
+    (tmp_path / "offers" / "manual_offer.json").write_text("{}", encoding="utf-8")
+    del bexio.quotes[2], bexio.quotes[4]
+    assert bexio.sync()["files_removed"] == 0 # Checked at most every BEXIO_SYNC_DELETION_CHECK_SECONDS
+    assert bexio.listed_ids == []
+    result = bexio.sync(full=True)
+    assert result["files_removed"] == 2
+    assert bexio.files() == ["bexio_1.json", "bexio_3.json", "bexio_5.json", "manual_offer.json"]
+    assert sorted(os.path.basename(path) for path in bexio.removed) == ["bexio_2.json", "bexio_4.json"]
+
+
+def test_quote_missing_from_the_listing_is_kept_while_it_still_exists(bexio, monkeypatch):
+    bexio.sync()
+    monkeypatch.setattr(bexio_sync, "_all_offer_ids", lambda: {1, 2, 4, 5}) # 3 shifted out of the listing by a deletion
+    assert bexio.sync(full=True)["files_removed"] == 0
+    assert "bexio_3.json" in bexio.files()
+
+
+def test_sync_without_token_is_an_error(monkeypatch):
+    monkeypatch.setattr(bexio_sync, "BEXIO_API_TOKEN", "")
+    assert bexio_sync.sync_bexio_offers()["error"] == "BEXIO_API_TOKEN not configured"
@@ -0,0 +1,168 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from openai import OpenAI, APIConnectionError
+
+import llm_utils
+import cassette as cassette_module
+from cassette import Cassette, request_key, httpx
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    """Answers chat completions with a numbered reply to the last message, and Bexio-like GETs with a JSON list."""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(("POST", self.path, self.headers.get("Authorization")))
+        reply = {"answer": f"{body['messages'][-1]['content']} #{len(self.server.requests)}"}
+        self.send_json({
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": json.dumps(reply)}}],
+            "usage": {"prompt_tokens": 12, "completion_tokens": 4, "total_tokens": 16},
+        })
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path, self.headers.get("Authorization")))
+        self.send_json([{"id": 1, "title": "Offer"}])
+
+    def send_json(self, payload):
+        content = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("x-ratelimit-limit-requests", "500")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAPIHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def use_cassette(monkeypatch, tape: Cassette, base_url: str):
+    """llm_utils talking to `base_url` through `tape`; no SDK retries, so a miss fails at once."""
+    client = OpenAI(api_key="sk-secret", base_url=f"{base_url}/v1", http_client=tape.http_client(), max_retries=0)
+    monkeypatch.setattr(llm_utils, "openai_client", client)
+
+
+def ask(prompt):
+    return llm_utils.get_llm_json_response("Answer as JSON.", prompt, model="gpt-4.1")
+
+
+def read_entries(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_request_key_ignores_json_key_order_but_not_values():
+    key = request_key("post", "https://api.example.com/v1", '{"a": 1, "b": [1, 2]}')
+    assert key == request_key("POST", "https://api.example.com/v1", b'{"b":[1,2],"a":1}')
+    assert key != request_key("POST", "https://api.example.com/v1", '{"a": 2, "b": [1, 2]}')
+    assert key != request_key("GET", "https://api.example.com/v1", '{"a": 1, "b": [1, 2]}')
+    assert request_key("GET", "https://api.example.com/v1", None) == request_key("GET", "https://api.example.com/v1", b"")
+
+
+def test_invalid_mode_and_missing_cassette_are_errors(tmp_path):
+    with pytest.raises(ValueError, match="CASSETTE_MODE"):
+        Cassette("replay-all", str(tmp_path / "c.jsonl"))
+    with pytest.raises(FileNotFoundError, match="no cassette"):
+        Cassette("replay", str(tmp_path / "missing.jsonl")).lookup("GET", "https://x", None)
+
+
+def test_off_mode_leaves_the_clients_alone():
+    tape = Cassette("off", "unused.jsonl")
+    session = requests.Session()
+    assert tape.http_client() is None and tape.async_http_client() is None
+    assert tape.mount(session) is session and not isinstance(session.get_adapter("https://x"), cassette_module.CassetteAdapter)
+
+
+def test_recorded_llm_run_replays_offline(fake_api, tmp_path, monkeypatch):
+    path = str(tmp_path / "cassettes" / "run.jsonl.gz")
+    recorder = Cassette("record", path)
+    use_cassette(monkeypatch, recorder, fake_api.url)
+    recorded = [ask("Title?"), ask("Structure?"), ask("Title?")]
+    recorder.close()
+    assert recorded == [{"answer": "Title? #1"}, {"answer": "Structure? #2"}, {"answer": "Title? #3"}]
+
+    entries = read_entries(path)
+    assert entries[0]["cassette"] == 1
+    assert [entry["status"] for entry in entries[1:]] == [200, 200, 200]
+    assert entries[1]["headers"]["x-ratelimit-limit-requests"] == "500"
+    assert "sk-secret" not in json.dumps(entries) # Credentials are not stored
+
+    fake_api.shutdown() # Nothing may go out during the replay
+    fake_api.requests.clear()
+    player = Cassette("replay", path)
+    use_cassette(monkeypatch, player, fake_api.url)
+    # Identical requests get their responses in recorded order
+    assert [ask("Title?"), ask("Structure?"), ask("Title?")] == recorded
+    assert fake_api.requests == []
+    assert player.get_stats() == {"recorded": 0, "replayed": 3, "replayed_by_url": 0, "misses": 0, "mode": "replay", "path": path}
+
+
+def test_changed_body_gets_the_next_response_for_the_url(fake_api, tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "run.jsonl")
+    recorder = Cassette("record", path)
+    use_cassette(monkeypatch, recorder, fake_api.url)
+    ask("Offer dated 2026-10-18")
+    recorder.close()
+
+    use_cassette(monkeypatch, Cassette("replay", path), fake_api.url)
+    assert ask("Offer dated 2026-10-19") == {"answer": "Offer dated 2026-10-18 #1"}
+    assert "was not recorded with this body" in capsys.readouterr().out
+    # The response is used up: a further request is a miss and fails like a connection error
+    with pytest.raises(APIConnectionError):
+        llm_utils.create_chat_completion("gpt-4.1", [{"role": "user", "content": "Offer dated 2026-10-19"}])
+
+
+def test_recorded_transport_error_is_replayed(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    recorder = Cassette("record", path)
+    recorder.record("POST", "https://api.example.com/v1/chat", b"{}", 30.0, error=httpx.ReadTimeout("timed out"))
+    recorder.record("POST", "https://api.example.com/v1/chat", b"{}", 1.0, cancelled=True)
+    recorder.close()
+    transport = cassette_module.CassetteTransport(Cassette("replay", path))
+    for _ in range(2):
+        with pytest.raises(httpx.ReadTimeout):
+            transport.handle_request(httpx.Request("POST", "https://api.example.com/v1/chat", content=b"{}"))
+
+
+def test_replay_latency_follows_the_setting():
+    entry = {"elapsed": 1.25}
+    assert Cassette("replay", "c.jsonl", replay_latency="real").replay_delay(entry) == 1.25
+    assert Cassette("replay", "c.jsonl", replay_latency="zero").replay_delay(entry) == 0.0
+
+
+def test_bexio_session_records_and_replays(fake_api, tmp_path):
+    path = str(tmp_path / "bexio.jsonl.gz")
+    recorder = Cassette("record", path)
+    session = recorder.mount(requests.Session())
+    url = f"{fake_api.url}/2.0/kb_offer?limit=2"
+    recorded = session.get(url, headers={"Authorization": "Bearer token"})
+    recorder.close()
+    assert "Bearer token" not in json.dumps(read_entries(path))
+
+    fake_api.shutdown()
+    fake_api.requests.clear()
+    session = Cassette("replay", path).mount(requests.Session())
+    response = session.get(url, headers={"Authorization": "Bearer another token"})
+    assert (response.status_code, response.json()) == (200, recorded.json())
+    assert response.headers["x-ratelimit-limit-requests"] == "500"
+    assert fake_api.requests == []
+    with pytest.raises(requests.exceptions.ConnectionError, match="not in the cassette"):
+        session.get(url)
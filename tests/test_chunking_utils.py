@@ -0,0 +1,30 @@
+from chunking_utils import split_description_units, chunk_description
+
+
+def test_units_are_bullets_and_paragraphs():
+    description = "Intro line one\nintro line two\n\n- first bullet\n* second bullet\n• third bullet\nClosing text"
+    assert split_description_units(description) == [
+        "Intro line one intro line two", "- first bullet", "* second bullet", "• third bullet", "Closing text",
+    ]
+
+
+def test_short_description_is_one_chunk():
+    assert chunk_description("- a\n- b", max_words=10) == ["- a\n- b"]
+
+
+def test_chunks_respect_the_word_limit_and_overlap_by_one_unit():
+    bullets = [f"- bullet {i} " + "word " * 8 for i in range(10)] # 10 words each
+    chunks = chunk_description("\n".join(bullets), max_words=30, overlap_units=1)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk.split()) <= 30
+    for previous, following in zip(chunks, chunks[1:]):
+        assert following.splitlines()[0] == previous.splitlines()[-1]
+    covered = {line for chunk in chunks for line in chunk.splitlines()}
+    assert covered == {bullet.strip() for bullet in bullets}
+
+
+def test_unit_longer_than_the_limit_is_split_on_words():
+    chunks = chunk_description(" ".join(f"w{i}" for i in range(25)), max_words=10, overlap_units=0)
+    assert [len(chunk.split()) for chunk in chunks] == [10, 10, 5]
+    assert chunks[0].split()[0] == "w0" and chunks[-1].split()[-1] == "w24"
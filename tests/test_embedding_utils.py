@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+import embedding_utils
+from embedding_utils import EmbeddingModel
+
+WORDS = "offer position title description strategy concept workshop training crm rollout design".split()
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """A randomly initialized one-layer BERT saved locally: a real SentenceTransformer without a download."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+    model_dir = str(tmp_path_factory.mktemp("tiny_model"))
+    with open(os.path.join(model_dir, "vocab.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS))
+    BertTokenizerFast(os.path.join(model_dir, "vocab.txt")).save_pretrained(model_dir)
+    config = BertConfig(vocab_size=len(WORDS) + 5, hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+                        intermediate_size=32, max_position_embeddings=128)
+    BertModel(config).save_pretrained(model_dir)
+    return model_dir
+
+
+@pytest.fixture(scope="session")
+def tiny_model(tiny_model_dir):
+    return EmbeddingModel(tiny_model_dir)
+
+
+def sample_texts(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(WORDS, size=int(rng.integers(1, 60)))) for _ in range(n)]
+
+
+def test_model_id_names_model_and_runtime(tiny_model, tiny_model_dir):
+    assert tiny_model.model_id == f"{tiny_model_dir}|torch"
+    assert tiny_model.dimension == 16
+
+
+def test_length_sorted_batches_stay_under_the_token_budget(tiny_model, monkeypatch):
+    monkeypatch.setattr(embedding_utils, "EMBEDDING_BATCH_TOKEN_BUDGET", 200)
+    monkeypatch.setattr(embedding_utils, "EMBEDDING_MAX_BATCH_SIZE", 8)
+    texts = sample_texts(100)
+    lengths = tiny_model.token_lengths(texts)
+    batches = tiny_model.length_sorted_batches(texts)
+    assert sorted(i for batch in batches for i in batch) == list(range(100))
+    for batch in batches:
+        assert len(batch) <= 8
+        assert len(batch) == 1 or len(batch) * max(lengths[i] for i in batch) <= 200
+    # Batches are formed in length order, so short texts are never padded to the longest text of the corpus
+    maxima = [max(lengths[i] for i in batch) for batch in batches]
+    assert maxima == sorted(maxima)
+
+
+def test_encode_returns_embeddings_in_input_order(tiny_model, monkeypatch):
+    monkeypatch.setattr(embedding_utils, "EMBEDDING_BATCH_TOKEN_BUDGET", 100)
+    texts = sample_texts(30, seed=1)
+    embeddings = tiny_model.encode(texts)
+    assert embeddings.shape == (30, 16)
+    assert embeddings.dtype == np.float32
+    for i in (0, 7, 29):
+        np.testing.assert_allclose(embeddings[i], tiny_model.encode(texts[i]), atol=1e-5)
+
+
+def test_encode_empty_list(tiny_model):
+    assert tiny_model.encode([]).shape == (0, 16)
+
+
+def test_unknown_runtime_is_rejected(tiny_model_dir):
+    with pytest.raises(ValueError, match="Unknown embedding runtime"):
+        EmbeddingModel(tiny_model_dir, runtime="tensorrt")
+
+
+def test_encode_shards_in_order_in_process(tiny_model):
+    texts = sample_texts(25, seed=2)
+    shards = list(tiny_model.encode_shards(texts, workers=1, shard_size=10))
+    assert [start for start, _ in shards] == [0, 10, 20]
+    np.testing.assert_allclose(np.concatenate([embeddings for _, embeddings in shards]), tiny_model.encode(texts), atol=1e-5)
+
+
+def test_encode_shards_in_worker_processes_keeps_input_order(tiny_model):
+    texts = sample_texts(30, seed=3)
+    shards = list(tiny_model.encode_shards(texts, workers=2, threads_per_worker=1, shard_size=7))
+    assert [start for start, _ in shards] == [0, 7, 14, 21, 28]
+    np.testing.assert_allclose(np.concatenate([embeddings for _, embeddings in shards]), tiny_model.encode(texts), atol=1e-5)
@@ -0,0 +1,52 @@
+import pytest
+
+import evaluate_retrieval as er
+
+TOPICS = ["bakery website relaunch", "pharma compliance training", "logistics route planning", "museum audio guide"]
+
+
+def test_recall_mrr_and_ndcg():
+    ranked = ["a", "x", "b", "y"]
+    relevant = {"a", "b"}
+    assert er.recall_at_k(ranked, relevant, 1) == 0.5
+    assert er.recall_at_k(ranked, relevant, 3) == 1.0
+    assert er.reciprocal_rank(["x", "y", "b"], relevant) == pytest.approx(1 / 3)
+    assert er.reciprocal_rank(["x"], relevant) == 0.0
+    assert er.ndcg_at_k(["a", "b"], relevant, 2) == pytest.approx(1.0)
+    assert er.ndcg_at_k(ranked, relevant, 3) == pytest.approx((1 + 1 / 2) / (1 + 1 / 1.5849625))
+    assert er.ndcg_at_k(["x", "y"], relevant, 2) == 0.0
+
+
+@pytest.fixture
+def topic_offers(write_offer, tmp_path):
+    for i, topic in enumerate(TOPICS):
+        write_offer(f"O{i}", [
+            {"position_id": 1, "position_title": f"{topic} concept", "description": f"Concept for the {topic}"},
+            {"position_id": 2, "position_title": f"{topic} delivery", "description": f"Delivery of the {topic}"},
+        ], offer_title=topic, client_industry_anonymized="Industry", project_focus_tags=topic.split())
+    write_offer("EMPTY", [])
+    return str(tmp_path / "offers")
+
+
+def test_held_out_offers_become_labeled_queries(topic_offers):
+    ids, texts, metadatas, queries = er.build_documents_and_queries(topic_offers, num_queries=10)
+    assert len(ids) == len(texts) == len(metadatas) == 8
+    assert len(queries) == 4 # Offers without positions give no query
+    query = next(q for q in queries if q["offer_id"] == "O2")
+    assert query["relevant"] == {"O2_1", "O2_2"}
+    assert "logistics route planning" in query["query"]
+    assert len(er.build_documents_and_queries(topic_offers, num_queries=2)[3]) == 2
+
+
+def test_run_evaluation_reports_quality_and_latency_per_backend(topic_offers):
+    summary = er.run_evaluation(topic_offers, ["memmap-int8", "memmap-float16"], num_queries=4, ks=[1, 2])
+    assert [result["backend"] for result in summary["results"]] == ["memmap-int8", "memmap-float16"]
+    for result in summary["results"]:
+        assert (result["documents"], result["queries"]) == (8, 4)
+        assert result["recall@2"] == 1.0 and result["mrr"] == 1.0
+        assert 0 < result["search_p50_ms"] <= result["latency_p50_ms"] <= result["latency_p99_ms"]
+        assert result["build_seconds"] >= result["insert_seconds"]
+
+
+def test_empty_data_dir(tmp_path):
+    assert er.run_evaluation(str(tmp_path), ["memmap-int8"], 10, [1]) == {}
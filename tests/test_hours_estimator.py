@@ -0,0 +1,102 @@
+import time
+from functools import partial
+
+import numpy as np
+import pytest
+
+import hours_estimator
+from offer_corpus import OfferCorpus
+
+
+def position(position_id, hours, tags, unit_price=100):
+    return {"position_id": position_id, "position_title": f"Position {position_id}", "quantity": hours,
+            "unit_price_chf": unit_price, "total_price_chf": hours * unit_price, "service_tags": tags}
+
+
+@pytest.fixture
+def hours_data(tmp_path, monkeypatch, write_offer):
+    """Three offers with hourly positions; hours_estimator reads them with its index cached in tmp_path."""
+    write_offer("A", [position(1, 10, ["SEO"]), position(2, 20, ["seo "]), position(3, 30, ["Design"])], client_industry_anonymized="Retail")
+    write_offer("B", [position(1, 40, ["SEO"]), position(2, 8, ["Design"])], client_industry_anonymized="retail")
+    write_offer("C", [position(1, 4, ["Design"]), {"position_id": 2, "position_title": "Licence", "quantity": 1, "unit_price_chf": 450, "total_price_chf": 450}])
+    monkeypatch.setattr(hours_estimator, "load_corpus", OfferCorpus.build)
+    monkeypatch.setattr(hours_estimator, "HOURS_INDEX_PATH", str(tmp_path / "hours_index.json"))
+    monkeypatch.setattr(hours_estimator, "VECTOR_STORE_PATH", str(tmp_path))
+    monkeypatch.setattr(hours_estimator, "_hours_index", None)
+    monkeypatch.setattr(hours_estimator, "_hours_index_checked", None)
+    monkeypatch.setattr(hours_estimator, "retrieve_context", lambda query, n_results: [])
+    data_dir = str(tmp_path / "offers")
+    monkeypatch.setattr(hours_estimator, "get_hours_index", partial(hours_estimator.get_hours_index, data_dir))
+    return data_dir
+
+
+def test_implied_hours_from_hourly_and_fixed_prices():
+    hours = hours_estimator.implied_hours(np.array([12.0, 1.0, 0.0, 3.0]), np.array([100.0, 450.0, 100.0, np.nan]), np.array([1200.0, 450.0, 0.0, 0.0]))
+    np.testing.assert_allclose(hours, [12.0, 4.5, np.nan, np.nan])
+
+
+def test_index_groups_normalized_tags_and_industries(hours_data):
+    index = hours_estimator.get_hours_index()
+    assert index["by_tag"]["seo"] == {"count": 3, "p25": 15.0, "median": 20.0, "p75": 30.0, "mean": 23.33}
+    assert index["by_tag"]["design"]["count"] == 3
+    assert index["by_industry"]["retail"]["count"] == 5
+    assert index["overall"]["count"] == 7
+    assert index["by_position"]["C_2"] == 4.5
+
+
+def test_index_is_cached_until_an_offer_file_changes(hours_data, write_offer, monkeypatch):
+    first = hours_estimator.get_hours_index()
+    monkeypatch.setattr(hours_estimator, "_hours_index", None)
+    monkeypatch.setattr(hours_estimator, "load_corpus", lambda data_dir: pytest.fail("rebuilt an unchanged index"))
+    assert hours_estimator.get_hours_index() == first # Read back from the cache file
+    monkeypatch.setattr(hours_estimator, "load_corpus", OfferCorpus.build)
+    monkeypatch.setattr(hours_estimator, "HOURS_INDEX_CHECK_SECONDS", 0)
+    write_offer("D", [position(1, 100, ["SEO"])])
+    assert hours_estimator.get_hours_index()["by_tag"]["seo"]["count"] == 4
+
+
+def test_offer_files_are_scanned_at_most_once_per_check_interval(hours_data, write_offer, monkeypatch):
+    scans = []
+    signature = hours_estimator.data_dir_signature
+    monkeypatch.setattr(hours_estimator, "data_dir_signature", lambda data_dir: scans.append(data_dir) or signature(data_dir))
+    for title in ("SEO audit", "Design", "Rollout"):
+        hours_estimator.estimate_hours(title, service_area="SEO")
+    assert len(scans) == 1
+    write_offer("D", [position(1, 100, ["SEO"])])
+    assert hours_estimator.get_hours_index()["by_tag"]["seo"]["count"] == 3 # Not checked again yet
+    checked_at = time.monotonic() - hours_estimator.HOURS_INDEX_CHECK_SECONDS
+    monkeypatch.setattr(hours_estimator, "_hours_index_checked", (hours_data, checked_at)) # The interval has passed
+    assert hours_estimator.get_hours_index()["by_tag"]["seo"]["count"] == 4
+    assert len(scans) == 2
+
+
+def test_estimate_prefers_similar_positions_then_tag_industry_and_overall(hours_data, monkeypatch):
+    assert hours_estimator.estimate_hours("SEO audit", service_area="SEO")["basis"] == "service area"
+    assert hours_estimator.estimate_hours("Something", service_area="Unknown", industry="Retail")["basis"] == "industry"
+    assert hours_estimator.estimate_hours("Something")["basis"] == "all positions"
+    monkeypatch.setattr(hours_estimator, "retrieve_context", lambda query, n_results: [
+        {"offer_id": "A", "position_id": "1"}, {"offer_id": "B", "position_id": "1"}, {"offer_id": "X", "position_id": "9"},
+    ])
+    estimate = hours_estimator.estimate_hours("SEO audit", service_area="SEO")
+    assert estimate == {"estimate": 25.0, "low": 17.5, "high": 32.5, "basis": "similar positions", "samples": 2}
+
+
+def test_apply_estimates_fills_missing_hours_and_flags_outliers(hours_data):
+    structure = [
+        {"type": "Offer Position", "proposed_title": "SEO", "suggested_service_area": "SEO", "estimated_hours_suggestion": None},
+        {"type": "Offer Position", "proposed_title": "SEO", "suggested_service_area": "SEO", "estimated_hours_suggestion": 200},
+        {"type": "Offer Position", "proposed_title": "SEO", "suggested_service_area": "SEO", "estimated_hours_suggestion": 22},
+        {"type": "Section Header", "proposed_title": "Phase 1"},
+    ]
+    hours_estimator.apply_hours_estimates(structure)
+    assert structure[0]["estimated_hours_suggestion"] == 20.0
+    assert structure[1]["hours_warning"].startswith("well above similar past work (15.0-30.0 h")
+    assert "hours_warning" not in structure[2]
+    assert "historical_hours" not in structure[3]
+
+
+def test_reference_lists_overall_industry_and_tags(hours_data):
+    reference = hours_estimator.historical_hours_reference("Retail")
+    assert reference.splitlines()[0].startswith("- All past positions: median")
+    assert "- Past positions in this industry" in reference
+    assert "- Service 'seo'" in reference and "- Service 'design'" in reference
@@ -0,0 +1,91 @@
+import os
+import time
+import threading
+
+import pytest
+
+import kb_watcher
+from kb_watcher import KnowledgeBaseWatcher
+
+
+@pytest.fixture
+def indexed(monkeypatch):
+    """Records the files kb_watcher indexes and removes; index_offer_files raises while `failures` is positive."""
+    calls = {"indexed": [], "removed": [], "failures": 0}
+
+    def index_offer_files(paths):
+        if calls["failures"]:
+            calls["failures"] -= 1
+            raise OSError("No space left on device")
+        calls["indexed"].append(sorted(paths))
+
+    monkeypatch.setattr(kb_watcher, "index_offer_files", index_offer_files)
+    monkeypatch.setattr(kb_watcher, "remove_offer_files", lambda paths: calls["removed"].append(sorted(paths)))
+    return calls
+
+
+def watcher(tmp_path, **options):
+    options = {"debounce_seconds": 0.01, "max_delay_seconds": 1.0, "use_inotify": False, "retry_seconds": 0.2, "retry_max_seconds": 0.5, **options}
+    return KnowledgeBaseWatcher(str(tmp_path), **options)
+
+
+def offer_file(tmp_path, name="A1.json"):
+    path = tmp_path / name
+    path.write_text("{}", encoding="utf-8")
+    return os.path.abspath(path)
+
+
+def test_sync_indexes_existing_and_removes_deleted_files(tmp_path, indexed):
+    path = offer_file(tmp_path)
+    gone = os.path.abspath(tmp_path / "gone.json")
+    kb = watcher(tmp_path)
+    kb.sync({path: time.time(), gone: time.time()})
+    assert (indexed["indexed"], indexed["removed"]) == ([[path]], [[gone]])
+    freshness = kb.get_freshness()
+    assert (freshness["files_indexed_total"], freshness["files_removed_total"], freshness["pending_files"]) == (1, 1, 0)
+
+
+def test_failed_batch_is_kept_pending_with_its_change_time(tmp_path, indexed):
+    path = offer_file(tmp_path)
+    kb = watcher(tmp_path)
+    changed = time.time() - 30
+    indexed["failures"] = 1
+    kb.notify(path) # A newer event for the same file does not hide the original change time
+    kb.sync({path: changed})
+    assert kb.pending[path] == changed
+    freshness = kb.get_freshness()
+    assert freshness["sync_errors_total"] == 1
+    assert freshness["oldest_pending_seconds"] >= 30 # The index is stale, not up to date
+
+
+def test_retry_backoff_doubles_up_to_the_maximum_and_resets(tmp_path, indexed):
+    path = offer_file(tmp_path)
+    kb = watcher(tmp_path)
+    indexed["failures"] = 3
+    delays = []
+    for _ in range(3):
+        kb.sync({path: time.time()})
+        delays.append(kb.retry_at - time.time())
+    assert delays == pytest.approx([0.2, 0.4, 0.5], abs=0.05)
+    kb.sync(kb.pending)
+    assert (kb.failed_syncs, kb.retry_at) == (0, 0.0)
+
+
+def test_failed_sync_is_retried_in_the_background(tmp_path, indexed):
+    path = offer_file(tmp_path)
+    kb = watcher(tmp_path)
+    indexed["failures"] = 1
+    thread = threading.Thread(target=kb._sync_loop, daemon=True)
+    thread.start()
+    try:
+        kb.notify(path)
+        deadline = time.time() + 5
+        while not indexed["indexed"] and time.time() < deadline:
+            time.sleep(0.02)
+    finally:
+        kb.stop_event.set()
+        with kb.condition:
+            kb.condition.notify_all()
+        thread.join(timeout=5)
+    assert indexed["indexed"] == [[path]] # Without another change to the file
+    assert kb.get_freshness()["pending_files"] == 0
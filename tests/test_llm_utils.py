@@ -0,0 +1,112 @@
+import os
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from openai import OpenAI
+
+import llm_utils
+import batch_stand_in_server
+from rate_limiter import RateLimitGovernor
+
+
+@pytest.fixture
+def stand_in_batches(tmp_path, monkeypatch):
+    """llm_utils batch calls going to batch_stand_in_server.py on a free local port; batches complete at once."""
+    monkeypatch.setattr(batch_stand_in_server, "completion_delay", 0.0)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), batch_stand_in_server.StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(llm_utils, "batch_client", OpenAI(api_key="stand-in", base_url=f"http://127.0.0.1:{server.server_port}/v1"))
+    monkeypatch.setattr(llm_utils, "LLM_BATCH_DIR", str(tmp_path / "batches"))
+    yield llm_utils
+    server.shutdown()
+    server.server_close()
+
+
+def request(custom_id, prompt="Draft the offer", model="gpt-4.1-mini"):
+    return llm_utils.build_batch_request(custom_id, [{"role": "user", "content": prompt}], model=model)
+
+
+def test_build_batch_request():
+    line = request("offer-1")
+    assert line["custom_id"] == "offer-1" and line["url"] == "/v1/chat/completions"
+    assert line["body"]["model"] == "gpt-4.1-mini" and line["body"]["messages"][0]["content"] == "Draft the offer"
+    assert "response_format" not in line["body"] # Only for models with native JSON mode (supports_json_mode)
+    assert request("offer-1", model="gpt-4-turbo")["body"]["response_format"] == {"type": "json_object"}
+
+
+def test_run_batch_maps_results_and_errors_by_custom_id(stand_in_batches):
+    results = stand_in_batches.run_batch(
+        [request("offer-1"), request("structure-2", "Please propose the offer structure"), request("offer-fail-3")], poll_seconds=0.05
+    )
+    assert results["offer-1"]["project_title"] == "Stand-in Offer"
+    assert results["structure-2"][1]["proposed_title"] == "Konzeption"
+    assert results["offer-fail-3"]["error"] == "BATCH_REQUEST_FAILED"
+
+
+def test_large_jobs_are_split_into_several_batches(stand_in_batches, monkeypatch):
+    monkeypatch.setattr(stand_in_batches, "LLM_BATCH_MAX_REQUESTS", 2)
+    results = stand_in_batches.run_batch([request(f"offer-{i}") for i in range(5)], poll_seconds=0.05)
+    assert sorted(results) == [f"offer-{i}" for i in range(5)]
+    assert len(os.listdir(stand_in_batches.LLM_BATCH_DIR)) == 3
+
+
+def test_submissions_in_the_same_second_get_their_own_input_files(stand_in_batches, monkeypatch):
+    monkeypatch.setattr(stand_in_batches.time, "time", lambda: 1_700_000_000.0)
+    first = stand_in_batches.submit_batch([request("offer-1")])
+    second = stand_in_batches.submit_batch([request("offer-1")])
+    assert first != second
+    assert len(os.listdir(stand_in_batches.LLM_BATCH_DIR)) == 2
+
+
+def test_duplicate_custom_ids_are_rejected():
+    with pytest.raises(ValueError, match="unique custom_id"):
+        llm_utils.submit_batch([request("offer-1"), request("offer-1")])
+
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    """Chat completions endpoint that answers the first request with a 429."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.hits += 1
+        if self.server.hits == 1:
+            status, payload = 429, {"error": {"message": "Rate limit reached", "type": "requests"}}
+        else:
+            status, payload = 200, {
+                "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4.1",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Hello"}}],
+                "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+            }
+        content = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_rate_limit_retries_go_through_the_governor(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitedHandler)
+    server.hits = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    governor = RateLimitGovernor({"default": {"rpm": 600, "tpm": 60000}}, safety_factor=1.0, state_path=None)
+    acquired = []
+    acquire = governor.acquire
+    monkeypatch.setattr(governor, "acquire", lambda model, tokens: acquired.append(model) or acquire(model, tokens))
+    monkeypatch.setattr(llm_utils, "governor", governor)
+    # The module client with its own retry policy, pointed at the local server
+    monkeypatch.setattr(llm_utils, "openai_client", llm_utils.openai_client.with_options(base_url=f"http://127.0.0.1:{server.server_port}/v1"))
+    try:
+        completion = llm_utils.create_chat_completion("gpt-4.1", [{"role": "user", "content": "Hi"}])
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert completion.choices[0].message.content == "Hello"
+    assert server.hits == 2
+    assert acquired == ["gpt-4.1", "gpt-4.1"] # The SDK did not retry the 429 behind the governor's back
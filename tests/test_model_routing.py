@@ -0,0 +1,111 @@
+import pytest
+
+import llm_utils
+import model_routing
+from offer_budget import OfferBudget, budget_context
+from model_routing import models_for_step, record_routing, get_routing_stats
+
+
+@pytest.fixture(autouse=True)
+def fresh_routing_stats(monkeypatch):
+    monkeypatch.setattr(model_routing, "routing_stats", {})
+
+
+def test_steps_are_routed_to_their_tier_and_escalate_to_the_large_tier():
+    assert models_for_step("propose_structure", "default-model") == ["gpt-4.1-mini", "gpt-4.1"]
+    assert models_for_step("draft_position", "default-model") == ["gpt-4.1"] # Already on the escalation tier
+    assert models_for_step("unrouted_step", "default-model") == ["default-model"]
+    assert models_for_step(None, "default-model") == ["default-model"]
+
+
+def test_step_override_wins_over_the_tier(monkeypatch):
+    monkeypatch.setitem(model_routing.LLM_STEP_MODEL_OVERRIDES, "propose_structure", "gpt-4o")
+    monkeypatch.setitem(model_routing.LLM_STEP_MODEL_OVERRIDES, "unrouted_step", "gpt-4o")
+    assert models_for_step("propose_structure", "default-model") == ["gpt-4o", "gpt-4.1"]
+    assert models_for_step("unrouted_step", "default-model") == ["gpt-4o", "gpt-4.1"]
+
+
+def test_no_escalation_without_an_escalation_tier(monkeypatch):
+    monkeypatch.setattr(model_routing, "LLM_ESCALATION_TIER", None)
+    assert models_for_step("propose_structure", "default-model") == ["gpt-4.1-mini"]
+
+
+def test_routing_stats_count_calls_escalations_and_models():
+    record_routing("propose_structure", "gpt-4.1-mini", False)
+    record_routing("propose_structure", "gpt-4.1", True)
+    record_routing(None, "gpt-4.1", False)
+    stats = get_routing_stats()
+    assert stats["propose_structure"] == {"calls": 2, "escalations": 1, "models": {"gpt-4.1-mini": 1, "gpt-4.1": 1}}
+    assert stats["other"]["calls"] == 1
+    stats["propose_structure"]["models"].clear() # A copy: the live counters are unchanged
+    assert get_routing_stats()["propose_structure"]["models"] == {"gpt-4.1-mini": 1, "gpt-4.1": 1}
+
+
+def run_routed(answers, model=None, step="propose_structure", validate=None):
+    models = []
+
+    def call(candidate):
+        models.append(candidate)
+        return answers[candidate]
+    return llm_utils.run_routed(call, model, "default-model", step, validate), models
+
+
+def has_positions(result):
+    return [] if result.get("positions") else ["'positions' must be a non-empty array."]
+
+
+def test_valid_small_tier_output_is_not_escalated():
+    result, models = run_routed({"gpt-4.1-mini": {"positions": [1]}}, validate=has_positions)
+    assert (result, models) == ({"positions": [1]}, ["gpt-4.1-mini"])
+    assert get_routing_stats()["propose_structure"]["escalations"] == 0
+
+
+def test_invalid_output_and_errors_are_escalated():
+    answers = {"gpt-4.1-mini": {"positions": []}, "gpt-4.1": {"positions": [1]}}
+    assert run_routed(answers, validate=has_positions) == ({"positions": [1]}, ["gpt-4.1-mini", "gpt-4.1"])
+    answers["gpt-4.1-mini"] = {"error": "LLM_JSON_PARSE_ERROR", "details": "Expecting value"}
+    assert run_routed(answers) == ({"positions": [1]}, ["gpt-4.1-mini", "gpt-4.1"])
+    assert get_routing_stats()["propose_structure"] == {"calls": 2, "escalations": 2, "models": {"gpt-4.1": 2}}
+
+
+def test_output_still_invalid_after_escalation_is_an_error():
+    result, models = run_routed({"gpt-4.1-mini": {"positions": []}, "gpt-4.1": {"positions": []}}, validate=has_positions)
+    assert models == ["gpt-4.1-mini", "gpt-4.1"]
+    assert result == {"error": "OUTPUT_VALIDATION_FAILED", "details": ["'positions' must be a non-empty array."], "raw_output": '{"positions": []}'}
+
+
+def test_error_of_the_last_model_is_returned_as_is():
+    error = {"error": "LLM_CALL_FAILED", "details": "timeout"}
+    assert run_routed({"gpt-4.1-mini": error, "gpt-4.1": error})[0] == error
+
+
+def test_budget_stop_is_not_escalated():
+    error = {"error": "OFFER_BUDGET_EXCEEDED", "details": "Offer budget: ..."}
+    assert run_routed({"gpt-4.1-mini": error}) == (error, ["gpt-4.1-mini"])
+
+
+def test_explicit_model_is_used_as_is():
+    result, models = run_routed({"gpt-4o": {"positions": []}}, model="gpt-4o", validate=has_positions)
+    assert models == ["gpt-4o"]
+    assert result["error"] == "OUTPUT_VALIDATION_FAILED"
+
+
+def degraded_budget():
+    budget = OfferBudget(max_tokens=100, max_usd=0, max_seconds=0)
+    budget.charge("gpt-4.1", prompt_tokens=90)
+    return budget
+
+
+def test_degraded_offer_does_not_escalate_to_the_same_small_model():
+    with budget_context(degraded_budget()):
+        result, models = run_routed({"gpt-4.1-mini": {"positions": []}}, validate=has_positions)
+    assert models == ["gpt-4.1-mini"] # gpt-4.1 is mapped to gpt-4.1-mini: not run a second time
+    assert result["error"] == "OUTPUT_VALIDATION_FAILED"
+    assert get_routing_stats()["propose_structure"] == {"calls": 1, "escalations": 0, "models": {"gpt-4.1-mini": 1}}
+
+
+def test_routing_stats_record_the_model_actually_called():
+    with budget_context(degraded_budget()):
+        result, models = run_routed({"gpt-4.1-mini": {"positions": [1]}}, step="draft_position")
+    assert models == ["gpt-4.1-mini"]
+    assert get_routing_stats()["draft_position"]["models"] == {"gpt-4.1-mini": 1}
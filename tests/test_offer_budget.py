@@ -0,0 +1,147 @@
+import contextvars
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import llm_utils
+import offer_budget
+from offer_budget import (
+    OfferBudget, budget_context, estimate_cost_usd, charge_call, budget_model, research_allowed,
+    budget_max_retries, budget_context_size, budget_exceeded_error
+)
+
+
+class FakeOpenAI:
+    """openai_client stand-in: every chat completion answers `content` with 1000 prompt (400 cached) and 200 completion tokens."""
+
+    def __init__(self, content='{"ok": true}'):
+        self.content = content
+        self.models = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(with_raw_response=self))
+
+    def create(self, model, messages, **kwargs):
+        self.models.append(model)
+        completion = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.content))],
+            usage=SimpleNamespace(prompt_tokens=1000, completion_tokens=200, total_tokens=1200,
+                                  prompt_tokens_details=SimpleNamespace(cached_tokens=400)),
+        )
+        return SimpleNamespace(headers={}, parse=lambda: completion)
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    client = FakeOpenAI()
+    monkeypatch.setattr(llm_utils, "openai_client", client)
+    return client
+
+
+def test_estimate_cost_bills_cached_tokens_at_the_cached_price():
+    # gpt-4.1: 2.00 input, 0.50 cached, 8.00 output per 1M tokens
+    assert estimate_cost_usd("gpt-4.1", 1000, 400, 200) == pytest.approx((600 * 2.00 + 400 * 0.50 + 200 * 8.00) / 1e6)
+    assert estimate_cost_usd("gpt-4.1", 100, 500, 0) == pytest.approx(100 * 0.50 / 1e6) # Never more cached than prompt tokens
+    assert estimate_cost_usd("unknown-model", 1000, None, None) == estimate_cost_usd("gpt-4.1", 1000, 0, 0)
+
+
+def test_overlapping_calls_add_their_time_once():
+    budget = OfferBudget(max_tokens=0, max_usd=0, max_seconds=100)
+    budget.charge("gpt-4.1", started=10.0, duration=4.0)
+    budget.charge("gpt-4.1", started=11.0, duration=2.0) # Inside the first call
+    budget.charge("gpt-4.1", started=12.0, duration=4.0) # Overlaps the first call by 2 seconds
+    budget.charge("gpt-4.1", started=20.0, duration=1.0)
+    budget.charge("gpt-4.1", duration=0.5) # No start time: added as is
+    assert budget.used["seconds"] == pytest.approx(4.0 + 2.0 + 1.0 + 0.5)
+    assert budget.calls == 5
+
+
+def test_level_follows_the_highest_fraction_of_any_limit():
+    budget = OfferBudget(max_tokens=1000, max_usd=100.0, max_seconds=0, degrade_at=0.8)
+    assert (budget.level, budget.fraction()) == ("ok", 0.0)
+    budget.charge("gpt-4.1", prompt_tokens=700, completion_tokens=0)
+    assert budget.level == "ok"
+    budget.charge("gpt-4.1", prompt_tokens=100, completion_tokens=0)
+    assert budget.level == "degraded"
+    budget.charge("gpt-4.1", prompt_tokens=0, completion_tokens=200)
+    assert budget.level == "exceeded"
+    summary = budget.summary()
+    assert (summary["level"], summary["calls"], summary["used"]["tokens"]) == ("exceeded", 3, 1000)
+    assert summary["limits"] == {"tokens": 1000, "usd": 100.0, "seconds": 0}
+    assert budget.format_line().startswith("Offer budget: 1,000/1,000 tokens, $0.00/$100.00, 0s model time")
+    assert OfferBudget(max_tokens=0, max_usd=0, max_seconds=0).fraction() == 0.0
+
+
+def test_hooks_are_no_ops_without_a_budget():
+    charge_call("gpt-4.1", 10**9, 0, 10**9)
+    assert budget_model("gpt-4.1") == "gpt-4.1"
+    assert research_allowed()
+    assert budget_max_retries(3) == 3
+    assert budget_context_size(5) == 5
+    assert budget_exceeded_error() is None
+
+
+def test_degraded_offer_uses_cheaper_settings_and_notices_each_step_once(capsys):
+    budget = OfferBudget(max_tokens=100, max_usd=0, max_seconds=0)
+    budget.charge("gpt-4.1", prompt_tokens=85)
+    with budget_context(budget):
+        assert budget_model("gpt-4.1") == "gpt-4.1-mini"
+        assert budget_model("gpt-4.1") == "gpt-4.1-mini"
+        assert budget_model("gpt-4.1-mini") == "gpt-4.1-mini" # No fallback configured
+        assert not research_allowed()
+        assert budget_max_retries(3) == 2
+        assert budget_context_size(5) == 2
+        assert budget_context_size(1) == 1
+        assert budget_exceeded_error() is None
+    assert capsys.readouterr().out.count("using gpt-4.1-mini instead of gpt-4.1") == 1
+    assert offer_budget.current_budget.get() is None
+
+
+def test_exceeded_offer_stops_calls_only_with_the_hard_stop(monkeypatch):
+    budget = OfferBudget(max_tokens=100, max_usd=0, max_seconds=0)
+    budget.charge("gpt-4.1", prompt_tokens=100)
+    with budget_context(budget):
+        assert budget_max_retries(3) == 1
+        assert budget_exceeded_error() is None
+        monkeypatch.setattr(offer_budget, "OFFER_BUDGET_HARD_STOP", True)
+        error = budget_exceeded_error()
+    assert error["error"] == "OFFER_BUDGET_EXCEEDED"
+    assert "100/100 tokens" in error["details"]
+
+
+def test_copied_context_in_a_thread_charges_the_same_budget():
+    budget = OfferBudget()
+    with budget_context(budget):
+        context = contextvars.copy_context()
+    threads = [threading.Thread(target=context.copy().run, args=(charge_call, "gpt-4.1", 10, 0, 5)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (budget.calls, budget.used["tokens"]) == (4, 60)
+
+
+def test_llm_calls_are_charged_to_the_offer_budget(fake_openai):
+    budget = OfferBudget(max_tokens=10_000, max_usd=0, max_seconds=0)
+    with budget_context(budget):
+        assert llm_utils.get_llm_json_response("System", "User", model="gpt-4.1") == {"ok": True}
+    assert (budget.calls, budget.used["tokens"]) == (1, 1200)
+    assert budget.used["usd"] == pytest.approx(estimate_cost_usd("gpt-4.1", 1000, 400, 200))
+    assert fake_openai.models == ["gpt-4.1"]
+
+
+def test_degraded_offer_calls_the_fallback_model(fake_openai):
+    budget = OfferBudget(max_tokens=10_000, max_usd=0, max_seconds=0)
+    budget.charge("gpt-4.1", prompt_tokens=8_000)
+    with budget_context(budget):
+        assert llm_utils.get_llm_response("System", "User", model="gpt-4.1") == '{"ok": true}'
+    assert fake_openai.models == ["gpt-4.1-mini"]
+
+
+def test_hard_stop_skips_the_call(fake_openai, monkeypatch):
+    monkeypatch.setattr(offer_budget, "OFFER_BUDGET_HARD_STOP", True)
+    budget = OfferBudget(max_tokens=1000, max_usd=0, max_seconds=0)
+    budget.charge("gpt-4.1", prompt_tokens=1000)
+    with budget_context(budget):
+        result = llm_utils.get_llm_json_response("System", "User", model="gpt-4.1")
+    assert result["error"] == "OFFER_BUDGET_EXCEEDED"
+    assert fake_openai.models == []
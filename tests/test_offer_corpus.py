@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+import pytest
+
+import offer_corpus
+from offer_corpus import OfferCorpus, OfferFileError, read_offer_file, validate_offer, load_corpus
+
+
+def write_raw(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content if isinstance(content, bytes) else content.encode("utf-8"))
+    return str(path)
+
+
+def file_errors(path):
+    with pytest.raises(OfferFileError) as error:
+        read_offer_file(path)
+    return error.value.errors
+
+
+def test_trailing_comma_is_located(tmp_path):
+    path = write_raw(tmp_path, "a.json", '{\n  "offer_id": "A1",\n  "positions": [],\n}')
+    (message,) = file_errors(path)
+    assert message.startswith("line 3, column 18: trailing comma before '}'")
+    assert message.splitlines()[1:] == ['      "positions": [],', "                     ^"]
+
+
+def test_other_syntax_errors_keep_the_json_message(tmp_path):
+    (message,) = file_errors(write_raw(tmp_path, "a.json", '{"offer_id": "A1" "positions": []}'))
+    assert message.startswith("line 1, column 19: Expecting ',' delimiter")
+
+
+def test_non_utf8_file_is_reported_with_its_position(tmp_path):
+    (message,) = file_errors(write_raw(tmp_path, "a.json", '{"offer_id": "Z\xfcrich"}'.encode("latin-1")))
+    assert message == "line 1, column 16: not UTF-8 (byte 0xfc); save the file as UTF-8"
+
+
+def test_utf8_bom_is_accepted(tmp_path):
+    assert read_offer_file(write_raw(tmp_path, "a.json", '﻿{"offer_id": 1, "positions": []}'))["offer_id"] == 1
+
+
+def test_schema_errors_have_json_paths():
+    errors = validate_offer({
+        "offer_id": True, "project_focus_tags": ["SEO", 3], "total_price_chf_excl_vat": "1000",
+        "positions": [{"position_id": 1, "quantity": "8"}, "text", {"service_tags": "SEO", "description": None}],
+    })
+    assert errors == [
+        "$.offer_id: expected a string or integer, got bool",
+        "$.project_focus_tags: expected a list of strings, got list",
+        "$.total_price_chf_excl_vat: expected a number, got str",
+        "$.positions[0].quantity: expected a number, got str",
+        "$.positions[1]: expected an object, got str",
+        "$.positions[2].service_tags: expected a list of strings, got str",
+    ]
+    assert validate_offer({"offer_id": "A1"}) == ["$.positions: missing"]
+    assert validate_offer([]) == ["$: expected an object, got list"]
+
+
+def test_iter_offers_collects_errors_per_file(tmp_path, write_offer):
+    write_offer("A1", [{"position_id": 1}])
+    broken = write_raw(tmp_path / "offers", "b.json", '{"offer_id": "B1",}')
+    errors = {}
+    assert [offer["offer_id"] for _, offer in offer_corpus.iter_offers(str(tmp_path / "offers"), errors)] == ["A1"]
+    assert list(errors) == [broken]
+
+
+def corpus_files(write_offer):
+    write_offer("A1", [
+        {"position_id": 1, "position_title": "Workshop", "description": "Kick-off", "quantity": 8, "unit_price_chf": 100, "service_tags": ["SEO", "Design"]},
+        {"position_title": "Licence", "total_price_chf": 450},
+    ], client_industry_anonymized=" Retail ", status="won", total_price_chf_excl_vat=1250)
+    write_offer("B1", [{"position_id": "x", "service_tags": ["SEO"]}])
+
+
+def test_corpus_columns(tmp_path, write_offer):
+    corpus_files(write_offer)
+    corpus = OfferCorpus.build(str(tmp_path / "offers"))
+    assert (corpus.n_offers, corpus.n_positions) == (2, 3)
+    assert list(corpus.positions_of(0)) == [0, 1]
+    assert corpus.position(0) == {"position_id": "1", "position_title": "Workshop", "description": "Kick-off", "quantity": 8.0,
+                                  "unit_price_chf": 100.0, "total_price_chf": None, "service_tags": ["SEO", "Design"]}
+    assert corpus.position(1)["position_id"] == "2" # Missing ids are numbered
+    assert corpus.offer_industry(0) == "Retail" and corpus.offer_status(0) == "won" and corpus.offer_status(1) == "unknown"
+    assert corpus.tag_position_index().tolist() == [0, 0, 2]
+
+
+def test_snapshot_round_trip_and_reuse(tmp_path, write_offer, monkeypatch):
+    corpus_files(write_offer)
+    data_dir, snapshot_dir = str(tmp_path / "offers"), str(tmp_path / "snapshot")
+    monkeypatch.setattr(offer_corpus, "_corpus", None)
+    built = load_corpus(data_dir, snapshot_dir)
+    monkeypatch.setattr(offer_corpus, "_corpus", None)
+    monkeypatch.setattr(OfferCorpus, "build", classmethod(lambda cls, data_dir: pytest.fail("rebuilt an unchanged corpus")))
+    loaded = load_corpus(data_dir, snapshot_dir)
+    assert isinstance(loaded.quantity, np.memmap)
+    assert [loaded.position(i) for i in range(3)] == [built.position(i) for i in range(3)]
+    assert loaded.tags == built.tags
+
+
+def test_changed_file_rebuilds_the_corpus(tmp_path, write_offer, monkeypatch):
+    corpus_files(write_offer)
+    data_dir = str(tmp_path / "offers")
+    monkeypatch.setattr(offer_corpus, "_corpus", None)
+    assert load_corpus(data_dir, str(tmp_path / "snapshot")).n_offers == 2
+    write_offer("C1", [])
+    assert load_corpus(data_dir, str(tmp_path / "snapshot")).n_offers == 3
+    assert sorted(os.listdir(tmp_path)) == ["offers", "snapshot"] # Old snapshot directories are cleaned up
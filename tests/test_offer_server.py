@@ -0,0 +1,84 @@
+import pytest
+
+import offer_server
+from session_store import SessionStore
+
+INFO = {"client_name": "Muster AG", "project_title": "CRM Rollout", "estimated_num_components": "3"}
+
+
+@pytest.fixture
+def server_sessions(tmp_path, monkeypatch):
+    """offer_server with an empty session table and a session store of its own."""
+    monkeypatch.setattr(offer_server, "sessions", {})
+    monkeypatch.setattr(offer_server, "session_store", SessionStore(str(tmp_path / "sessions.sqlite3")))
+    return offer_server
+
+
+def test_idle_sessions_are_evicted_and_restored(server_sessions):
+    session = server_sessions.create_session(INFO)
+    session["draft"] = {"offer_title": "CRM Rollout", "positions": []}
+    server_sessions.save_session(session)
+    session["last_used"] -= 2 * server_sessions.SERVER_SESSION_IDLE_SECONDS
+
+    fresh = server_sessions.create_session(INFO) # Adding a session sweeps idle ones
+    assert list(server_sessions.sessions) == [fresh["id"]]
+
+    restored = server_sessions.get_session(session["id"])
+    assert restored is not session
+    assert restored["info"]["client_name"] == "Muster AG"
+    assert restored["draft"] == session["draft"]
+    assert set(server_sessions.sessions) == {session["id"], fresh["id"]}
+
+
+def test_busy_and_recent_sessions_are_kept(server_sessions):
+    busy = server_sessions.create_session(INFO)
+    recent = server_sessions.create_session(INFO)
+    busy["last_used"] -= 2 * server_sessions.SERVER_SESSION_IDLE_SECONDS
+    with busy["lock"]: # A stage is running
+        with server_sessions.sessions_lock:
+            assert server_sessions.evict_idle_sessions() == 0
+    with server_sessions.sessions_lock:
+        assert server_sessions.evict_idle_sessions() == 1
+    assert list(server_sessions.sessions) == [recent["id"]]
+
+
+def test_nothing_is_evicted_without_a_session_store(server_sessions, monkeypatch):
+    monkeypatch.setattr(server_sessions, "session_store", SessionStore(None))
+    session = server_sessions.create_session(INFO)
+    session["last_used"] -= 2 * server_sessions.SERVER_SESSION_IDLE_SECONDS
+    with server_sessions.sessions_lock:
+        assert server_sessions.evict_idle_sessions() == 0
+    assert server_sessions.get_session(session["id"]) is session
+
+
+def test_unknown_session_is_404(server_sessions):
+    with pytest.raises(offer_server.StageError) as error:
+        server_sessions.get_session("0123abcd")
+    assert error.value.status == 404
+
+
+def test_get_session_returns_the_live_session_after_a_concurrent_eviction(server_sessions, monkeypatch):
+    session = server_sessions.create_session(INFO)
+    server_sessions.save_session(session)
+    server_sessions.sessions.clear()
+    restore = server_sessions.restore_session
+    evicted = []
+
+    def restore_then_evict(session_id):
+        restored = restore(session_id)
+        if not evicted: # Another request's sweep drops it before the caller got it
+            evicted.append(server_sessions.sessions.pop(session_id))
+        return restored
+
+    monkeypatch.setattr(server_sessions, "restore_session", restore_then_evict)
+    live = server_sessions.get_session(session["id"])
+    assert live is server_sessions.sessions[session["id"]]
+    assert live is not evicted[0]
+
+
+def test_get_session_refreshes_last_used_before_releasing_the_lock(server_sessions):
+    session = server_sessions.create_session(INFO)
+    session["last_used"] -= 2 * server_sessions.SERVER_SESSION_IDLE_SECONDS
+    assert server_sessions.get_session(session["id"]) is session
+    with server_sessions.sessions_lock:
+        assert server_sessions.evict_idle_sessions() == 0
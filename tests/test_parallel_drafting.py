@@ -0,0 +1,232 @@
+import re
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import llm_utils
+import model_routing
+import parallel_drafting
+import prompt_templates as pt
+from pricing_utils import price_confirmed_positions
+
+
+class FakeLLM:
+    """Answers drafting calls from the prompt: a position draft echoes the confirmed title, as bullets."""
+
+    def __init__(self, fail_title=None):
+        self.calls = []
+        self.validators = {}
+        self.lock = threading.Lock()
+        self.fail_title = fail_title
+
+    def __call__(self, system_prompt, user_prompt, messages=None, prompt_name=None, **options):
+        prompt = messages[-1]["content"]
+        with self.lock:
+            self.calls.append((prompt_name, prompt))
+            self.validators[prompt_name] = options.get("validate")
+        if prompt_name == pt.DRAFT_POSITION.name:
+            title = re.search(r"- Title \(as confirmed; refine subtly if needed\): (.*)", prompt).group(1)
+            if title == self.fail_title:
+                return {"error": "LLM_JSON_PARSE_ERROR"}
+            return {"position_title": f"{title} (drafted)", "description": f"• Scope of {title}\n* Deliverables"}
+        return {"project_title": "Drafted Project", "introduction_title": "Introduction", "introduction": "Dear client"}
+
+    def titles_drafted(self):
+        return sorted(re.search(r"- Title .*?: (.*)", prompt).group(1) for name, prompt in self.calls if name == pt.DRAFT_POSITION.name)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    llm = FakeLLM()
+    monkeypatch.setattr(parallel_drafting, "get_llm_json_response", llm)
+    monkeypatch.setattr(parallel_drafting, "retrieve_context", lambda query, n_results: [
+        {"offer_id": "A1", "position_title": "Past", "offer_status": "won", "content": f"context for {query.splitlines()[0]}"}
+    ])
+    return llm
+
+
+def offer_details():
+    details = {
+        "project_title": "CRM Rollout", "client_name": "Muster AG", "language": "English",
+        "positions_details": [
+            {"type": "Offer Position", "title_input": "Analysis", "description_input": "Current state", "hours_input": 8, "service_area_input": "Default"},
+            {"type": "Text Position", "title_input": "Abgrenzung", "description_input": "Hosting is not included.", "fixed_text": True},
+            {"type": "Offer Position", "title_input": "Rollout", "description_input": "Go-live", "hours_input": 12.5, "service_area_input": "Default"},
+        ],
+    }
+    price_confirmed_positions(details)
+    return details
+
+
+def test_offer_is_assembled_from_position_drafts(fake_llm):
+    offer = parallel_drafting.draft_offer_in_parallel(offer_details())
+    assert parallel_drafting.validate_offer_json(offer) == []
+    assert offer["project_title"] == "Drafted Project"
+    assert [(p["position_id"], p["type"], p["position_title"]) for p in offer["positions"]] == [
+        (1, "Text Position", "Introduction"),
+        (2, "Offer Position", "Analysis (drafted)"),
+        (3, "Text Position", "Abgrenzung"),
+        (4, "Offer Position", "Rollout (drafted)"),
+    ]
+    assert offer["positions"][2]["description"] == "Hosting is not included." # Fixed texts are copied verbatim
+    assert offer["positions"][3]["description"] == "- Scope of Rollout\n- Deliverables"
+    assert offer["positions"][3]["calculated_price_chf"] == 1250.0 # From the local pricing, not the LLM
+    assert fake_llm.titles_drafted() == ["Analysis", "Rollout"]
+
+
+def test_each_position_prompt_shares_the_offer_prefix_and_has_its_own_context(fake_llm):
+    parallel_drafting.draft_offer_in_parallel(offer_details())
+    prompts = [prompt for name, prompt in fake_llm.calls if name == pt.DRAFT_POSITION.name]
+    assert len(prompts) == 2
+    shared = prompts[0][:prompts[0].index("context for")]
+    assert prompts[1].startswith(shared) and "Client Name: Muster AG" in shared
+    assert {"context for Offer Position Title: Analysis", "context for Offer Position Title: Rollout"} == {
+        re.search(r"context for [^\n]*", prompt).group(0) for prompt in prompts
+    }
+
+
+def test_positions_are_drafted_concurrently(fake_llm, monkeypatch):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def wait_for_each_other(system_prompt, user_prompt, prompt_name=None, **options):
+        if prompt_name == pt.DRAFT_POSITION.name:
+            barrier.wait() # Both position calls must be in flight at the same time
+        return fake_llm(system_prompt, user_prompt, prompt_name=prompt_name, **options)
+
+    monkeypatch.setattr(parallel_drafting, "get_llm_json_response", wait_for_each_other)
+    assert "error" not in parallel_drafting.draft_offer_in_parallel(offer_details(), max_workers=2)
+
+
+def test_failed_position_draft_fails_the_offer(fake_llm):
+    fake_llm.fail_title = "Rollout"
+    result = parallel_drafting.draft_offer_in_parallel(offer_details())
+    assert result["error"] == "POSITION_DRAFT_FAILED"
+    assert "Position 3 ('Rollout')" in result["details"]
+
+
+def test_validate_offer_json_reports_schema_problems():
+    offer = {"project_title": " ", "positions": [
+        {"position_id": 1, "type": "Offer Position", "position_title": "A", "description": "no bullets", "service_tags": []},
+        {"position_id": 3, "type": "Text Position", "position_title": "B", "description": "x", "hourly_rate_chf": 100},
+    ]}
+    problems = parallel_drafting.validate_offer_json(offer)
+    assert "'project_title' must be a non-empty string." in problems
+    assert "Position 1: 'service_tags' must not be included." in problems
+    assert "Position 1: 'calculated_price_chf' is missing or has the wrong type." in problems
+    assert "Position 1: the description of an Offer Position must be a '- ' bullet list." in problems
+    assert "Position 2: 'position_id' must be 2, got 3." in problems
+    assert "Position 2: Text Positions must not include ['hourly_rate_chf']." in problems
+
+
+def test_position_drafts_are_validated(fake_llm):
+    parallel_drafting.draft_offer_in_parallel(offer_details())
+    assert fake_llm.validators[pt.DRAFT_POSITION.name] is parallel_drafting.validate_position_draft
+
+
+@pytest.mark.parametrize("result, problems", [
+    ({"position_title": "Analysis", "description": "- Scope"}, []),
+    ({"description": "- Scope"}, []), # The confirmed title is used
+    ({"position_title": "Analysis", "description": " "}, ["'description' must be a non-empty string."]),
+    ({"position_title": ["Analysis"], "description": "- Scope"}, ["'position_title' must be a string."]),
+    (["- Scope"], ["The position must be a JSON object."]),
+])
+def test_validate_position_draft(result, problems):
+    assert parallel_drafting.validate_position_draft(result) == problems
+
+
+def test_invalid_small_tier_position_draft_is_escalated(monkeypatch):
+    answers = {"gpt-4.1-mini": {"position_title": "Analysis"}, "gpt-4.1": {"position_title": "Analysis", "description": "- Scope"}}
+    models = []
+
+    def create(model, messages, **kwargs):
+        models.append(model)
+        completion = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(answers[model])))], usage=None)
+        return SimpleNamespace(headers={}, parse=lambda: completion)
+
+    monkeypatch.setattr(llm_utils, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(with_raw_response=SimpleNamespace(create=create)))))
+    monkeypatch.setitem(model_routing.LLM_STEP_TIERS, pt.DRAFT_POSITION.name, "small")
+    monkeypatch.setattr(model_routing, "routing_stats", {})
+    result = parallel_drafting._draft_position([{"role": "system", "content": "Draft"}, {"role": "user", "content": "Position 1"}])
+    assert result == answers["gpt-4.1"]
+    assert models == ["gpt-4.1-mini", "gpt-4.1"]
+    assert model_routing.get_routing_stats()[pt.DRAFT_POSITION.name]["escalations"] == 1
+
+
+def drafted_offer(fake_llm, monkeypatch):
+    """A drafted offer_details() with the LLM calls and retrieval queries of the first draft cleared."""
+    queries = []
+    retrieve = parallel_drafting.retrieve_context
+    monkeypatch.setattr(parallel_drafting, "retrieve_context", lambda query, n_results: queries.append(query) or retrieve(query, n_results))
+    details = offer_details()
+    parallel_drafting.draft_offer_in_parallel(details)
+    fake_llm.calls.clear()
+    queries.clear()
+    return details, queries
+
+
+def test_fingerprint_covers_the_drafting_inputs_only():
+    pos = offer_details()["positions_details"][0]
+    fingerprint = parallel_drafting.position_fingerprint(pos)
+    assert parallel_drafting.position_fingerprint(dict(pos, calculated_price_info={"calculated_price_chf": 1.0})) == fingerprint
+    for field, value in [("hours_input", 9), ("service_area_input", "Design"), ("title_input", "Analyse"), ("description_input", "Target state")]:
+        assert parallel_drafting.position_fingerprint(dict(pos, **{field: value})) != fingerprint
+
+
+def test_only_changed_positions_are_redrafted(fake_llm, monkeypatch):
+    details, queries = drafted_offer(fake_llm, monkeypatch)
+    details["positions_details"][2]["hours_input"] = 20
+    offer = parallel_drafting.redraft_changed_positions(details)
+    assert fake_llm.titles_drafted() == ["Rollout"]
+    assert queries == [] # Same title and description: the retrieved context is reused
+    assert details["draft_cache"]["last_redrafted"] == [2]
+    assert offer["positions"][3]["calculated_price_chf"] == 2000.0 # Re-priced locally
+    assert offer["positions"][0]["description"] == "Dear client" # Introduction and project title are reused
+    assert offer["project_title"] == "Drafted Project"
+    assert not [name for name, prompt in fake_llm.calls if name != pt.DRAFT_POSITION.name]
+
+
+def test_unchanged_offer_is_not_redrafted(fake_llm, monkeypatch):
+    details, queries = drafted_offer(fake_llm, monkeypatch)
+    assert parallel_drafting.validate_offer_json(parallel_drafting.redraft_changed_positions(details)) == []
+    assert fake_llm.calls == [] and queries == []
+    assert details["draft_cache"]["last_redrafted"] == []
+
+
+def test_inserted_position_does_not_redraft_the_others(fake_llm, monkeypatch):
+    details, queries = drafted_offer(fake_llm, monkeypatch)
+    details["positions_details"].insert(1, {"type": "Offer Position", "title_input": "Training", "description_input": "Key users",
+                                            "hours_input": 4, "service_area_input": "Default"})
+    offer = parallel_drafting.redraft_changed_positions(details)
+    assert fake_llm.titles_drafted() == ["Training"]
+    assert queries == ["Offer Position Title: Training\nDescription: Key users"] # A new query is retrieved
+    assert details["draft_cache"]["last_redrafted"] == [1]
+    assert [p["position_title"] for p in offer["positions"]] == ["Introduction", "Analysis (drafted)", "Training (drafted)", "Abgrenzung", "Rollout (drafted)"]
+    assert [p["position_id"] for p in offer["positions"]] == [1, 2, 3, 4, 5]
+
+
+def test_changed_description_is_retrieved_again(fake_llm, monkeypatch):
+    details, queries = drafted_offer(fake_llm, monkeypatch)
+    details["positions_details"][0]["description_input"] = "Current state and target processes"
+    parallel_drafting.redraft_changed_positions(details)
+    assert fake_llm.titles_drafted() == ["Analysis"]
+    assert queries == ["Offer Position Title: Analysis\nDescription: Current state and target processes"]
+    assert details["draft_cache"]["positions"][0]["contexts"][0]["content"] == "context for Offer Position Title: Analysis"
+
+
+def test_failed_redraft_keeps_the_previous_cache(fake_llm, monkeypatch):
+    details, _ = drafted_offer(fake_llm, monkeypatch)
+    cache = details["draft_cache"]
+    details["positions_details"][2]["title_input"] = "Go-live"
+    fake_llm.fail_title = "Go-live"
+    assert parallel_drafting.redraft_changed_positions(details)["error"] == "POSITION_DRAFT_FAILED"
+    assert details["draft_cache"] is cache
+
+
+def test_redraft_without_a_cache_drafts_everything(fake_llm):
+    details = offer_details()
+    offer = parallel_drafting.redraft_changed_positions(details)
+    assert fake_llm.titles_drafted() == ["Analysis", "Rollout"]
+    assert details["draft_cache"]["last_redrafted"] == [0, 2] # The fixed text (1) is never drafted
+    assert offer["project_title"] == "Drafted Project"
@@ -0,0 +1,69 @@
+import pytest
+
+import pricing_utils
+from config_data import calculate_position_price, INTERNAL_HOURLY_RATES
+
+FRACTIONAL_HOURS = [0.25, 1.5, 2.335, 3.333, 7.125, 12.75, 0.1, 16.667, 40, 123.456]
+
+
+@pytest.mark.parametrize("hours", FRACTIONAL_HOURS)
+@pytest.mark.parametrize("service_area", sorted(INTERNAL_HOURLY_RATES))
+def test_position_prices_match_calculate_position_price(service_area, hours):
+    expected = calculate_position_price(service_area, hours)
+    position = pricing_utils.price_positions([{"service_area": service_area, "hours": hours}])["positions"][0]
+    assert position["calculated_price_chf"] == expected["calculated_price_chf"]
+    assert position["hourly_rate_chf"] == expected["hourly_rate_chf"]
+    assert position["service_area_used"] == expected["service_area_used"]
+
+
+def test_hours_are_not_rounded_before_multiplying(monkeypatch):
+    monkeypatch.setitem(INTERNAL_HOURLY_RATES, "Design", 60)
+    position = pricing_utils.price_positions([{"service_area": "Design", "hours": 2.335}])["positions"][0]
+    assert position["calculated_price_chf"] == 140.10 # Not 140.40 (= 2.34 h x 60)
+
+
+def test_price_is_rounded_half_up_to_the_rappen(monkeypatch):
+    monkeypatch.setitem(INTERNAL_HOURLY_RATES, "Design", 1)
+    prices = pricing_utils.price_positions([{"service_area": "Design", "hours": h} for h in (0.005, 0.015, 0.0249)])
+    assert [p["calculated_price_chf"] for p in prices["positions"]] == [0.01, 0.02, 0.02]
+
+
+def test_invalid_hours_are_reported_per_position():
+    result = pricing_utils.price_positions([{"service_area": "Default", "hours": h} for h in (0, -1, "3", True, 2)])
+    assert [p.get("error") is not None for p in result["positions"]] == [True, True, True, True, False]
+    assert result["subtotal_chf"] == 200.0
+
+
+def test_unknown_service_area_and_client_overrides(monkeypatch):
+    monkeypatch.setattr(pricing_utils, "CLIENT_RATE_OVERRIDES", {"Muster AG": {"Default": 90}})
+    positions = [{"service_area": "Nonexistent", "hours": 1}]
+    assert pricing_utils.price_positions(positions)["positions"][0]["service_area_used"] == "Default"
+    assert pricing_utils.price_positions(positions, client_name=" muster ag")["positions"][0]["calculated_price_chf"] == 90.0
+
+
+def test_totals_with_discount_vat_and_5_rappen_rounding(monkeypatch):
+    monkeypatch.setattr(pricing_utils, "VOLUME_DISCOUNT_TIERS", [(1000, 3), (5000, 5)])
+    monkeypatch.setattr(pricing_utils, "VAT_RATE_PERCENT", 8.1)
+    monkeypatch.setattr(pricing_utils, "TOTAL_ROUNDING_RAPPEN", 5)
+    result = pricing_utils.price_positions([{"service_area": "Default", "hours": 12.33}], mwst_type=0, mwst_is_net=True)
+    assert result["subtotal_chf"] == 1233.0
+    assert result["volume_discount_percent"] == 3.0
+    assert result["discount_chf"] == 36.99
+    assert result["net_chf"] == 1196.01
+    assert result["vat_chf"] == 96.88 # 8.1 % of 1196.01 = 96.877
+    assert result["total_chf"] == 1292.9 # 1292.89 rounded to 5 Rappen
+
+
+def test_gross_prices_contain_the_vat(monkeypatch):
+    monkeypatch.setattr(pricing_utils, "VAT_RATE_PERCENT", 8.1)
+    monkeypatch.setattr(pricing_utils, "TOTAL_ROUNDING_RAPPEN", 1)
+    monkeypatch.setattr(pricing_utils, "VOLUME_DISCOUNT_TIERS", [])
+    result = pricing_utils.price_positions([{"service_area": "Default", "hours": 10.81}], mwst_type=0, mwst_is_net=False)
+    assert result["total_chf"] == 1081.0
+    assert result["vat_chf"] == 81.0
+    assert result["net_chf"] == 1000.0
+
+
+def test_batch_prices_offers_independently():
+    offers = [{"positions": [{"service_area": "Default", "hours": 1}]}, {"positions": []}, {"positions": [{"service_area": "Default", "hours": 2}] * 3}]
+    assert [result["subtotal_chf"] for result in pricing_utils.price_offers_batch(offers)] == [100.0, 0.0, 600.0]
@@ -0,0 +1,80 @@
+import pytest
+
+import prompt_templates as pt
+from prompt_templates import PromptTemplate, ChatPrompt
+
+
+def compiled_templates():
+    for name, value in vars(pt).items():
+        if isinstance(value, PromptTemplate):
+            yield name, value
+        elif isinstance(value, ChatPrompt):
+            for part, template in value.parts:
+                yield f"{name}.{part}", template
+
+
+def test_render_fills_placeholders_and_unescapes_braces():
+    template = PromptTemplate("t", 'Answer as {{"title": "..."}} for {client} ({client})', ["client"])
+    assert template.render(client="Muster AG") == 'Answer as {"title": "..."} for Muster AG (Muster AG)'
+
+
+@pytest.mark.parametrize("name, template", list(compiled_templates()))
+def test_compiled_templates_render_like_str_format(name, template):
+    values = {field: f"<{field}>" for field in template.placeholders}
+    source = "".join(literal.replace("{", "{{").replace("}", "}}") + (f"{{{field}}}" if field else "") for literal, field in template.pieces)
+    assert template.render(**values) == source.format(**values)
+
+
+def test_static_template_is_rendered_once():
+    template = PromptTemplate("t", "No {{placeholders}} here")
+    assert template.render() is template.render()
+    assert template.render() == "No {placeholders} here"
+
+
+@pytest.mark.parametrize("text, message", [
+    ("{client.name}", "unsupported placeholder"),
+    ("{hours:.2f}", "unsupported placeholder"),
+    ("{client!r}", "unsupported placeholder"),
+    ("{0}", "unsupported placeholder"),
+    ("{client} {typo}", "do not match the declared"),
+])
+def test_bad_templates_fail_when_compiled(text, message):
+    with pytest.raises(ValueError, match=message):
+        PromptTemplate("t", text, ["client"])
+
+
+def test_missing_and_unknown_values_are_rejected():
+    template = PromptTemplate("t", "{a} {b}", ["a", "b"])
+    with pytest.raises(KeyError, match=r"missing values \['b'\], unknown values \['c'\]"):
+        template.render(a=1, c=2)
+
+
+def test_chat_prompt_puts_stable_parts_before_volatile_ones():
+    prompt = ChatPrompt(
+        "p",
+        system=PromptTemplate("p.system", "You write offers in {language}.", ["language"]),
+        stable=PromptTemplate("p.user", "Context: {context}\n", ["context"]),
+        volatile=PromptTemplate("p.request", "Change: {feedback}", ["feedback"]),
+        bound={"language": "German"},
+    )
+    assert prompt.placeholders == {"context", "feedback"}
+    first = prompt.messages(context="past offers", feedback="shorter")
+    second = prompt.messages(context="past offers", feedback="add a workshop")
+    assert first[0] == {"role": "system", "content": "You write offers in German."}
+    assert first[1]["content"] == "Context: past offers\nChange: shorter"
+    assert second[1]["content"].startswith("Context: past offers\n")
+    with pytest.raises(KeyError, match="unknown values"):
+        prompt.messages(context="x", feedback="y", language="French")
+
+
+def test_chat_prompt_rejects_shared_and_unknown_placeholders():
+    system = PromptTemplate("s", "{a}", ["a"])
+    with pytest.raises(ValueError, match="used in more than one part"):
+        ChatPrompt("p", system=system, stable=PromptTemplate("u", "{a}", ["a"]))
+    with pytest.raises(ValueError, match="not placeholders"):
+        ChatPrompt("p", system=system, stable=PromptTemplate("u", "x"), bound={"b": 1})
+
+
+def test_draft_offer_schema_reaches_the_model_with_single_braces():
+    system = pt.DRAFT_OFFER.render_parts(**{field: "" for field in pt.DRAFT_OFFER.placeholders})["system"]
+    assert "{{" not in system and "{" in system
@@ -0,0 +1,78 @@
+import threading
+
+from query_cache import LRUCache, normalize_query
+
+
+def test_normalize_query_keeps_case():
+    assert normalize_query("  Offer for\tBank \n client ") == "Offer for Bank client"
+    assert normalize_query("Zu\u0308rich") == "Z\u00fcrich" # NFD -> NFC
+    assert normalize_query("Bank") != normalize_query("bank")
+    assert normalize_query(None) == ""
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1 # "b" is now the least recently used
+    cache.put("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert cache.get_stats() == {"size": 2, "max_size": 2, "hits": 3, "misses": 1, "hit_rate": 0.75}
+
+
+def test_size_zero_disables_the_cache():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert cache.get_stats()["size"] == 0
+
+
+def test_concurrent_use_keeps_the_size_bound():
+    cache = LRUCache(50)
+
+    def work(offset):
+        for i in range(500):
+            cache.put((offset, i), i)
+            cache.get((offset, i - 1))
+
+    threads = [threading.Thread(target=work, args=(t,)) for t in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.get_stats()
+    assert stats["size"] == 50
+    assert stats["hits"] + stats["misses"] == 8 * 500
+
+
+def test_retrieval_results_are_cached_until_the_index_changes(vector_store, write_offer, monkeypatch):
+    vector_store.index_offer_files([write_offer("A1", [{"position_id": "1", "position_title": "Workshop", "description": "SEO workshop"}])])
+    queries = []
+    real_query = vector_store.vector_backend.query
+    monkeypatch.setattr(vector_store.vector_backend, "query", lambda *args, **kwargs: queries.append(1) or real_query(*args, **kwargs))
+
+    first = vector_store.retrieve_context("SEO  workshop", n_results=2)
+    first[0]["content"] = "changed by the caller"
+    second = vector_store.retrieve_context(" SEO workshop ", n_results=2) # Same normalized query
+    assert len(queries) == 1
+    assert second[0]["content"] != "changed by the caller" # Callers get copies
+
+    vector_store.index_offer_files([write_offer("B1", [{"position_id": "1", "position_title": "SEO", "description": "SEO audit"}])])
+    third = vector_store.retrieve_context("SEO workshop", n_results=2)
+    assert len(queries) == 2
+    assert {doc["offer_id"] for doc in third} == {"A1", "B1"}
+    assert vector_store.get_retrieval_cache_stats()["query_embeddings"]["hits"] >= 1 # The embedding was reused
+
+
+def test_cached_results_are_invalidated_by_index_writes_of_another_process(vector_store, write_offer, tmp_path):
+    from vector_backends import MemmapBackend
+    vector_store.index_offer_files([write_offer("A1", [{"position_id": "1", "position_title": "Workshop", "description": "SEO workshop"}])])
+    assert [doc["offer_id"] for doc in vector_store.retrieve_context("SEO workshop", n_results=2)] == ["A1"]
+
+    index_version = vector_store.index_version
+    # Stands in for e.g. bexio_sync.py indexing into the same store while the server runs
+    other_process = MemmapBackend(str(tmp_path), "offer_positions")
+    ids, documents, metadatas = zip(*vector_store.build_position_documents("B1", {"position_id": "1", "position_title": "SEO", "description": "SEO workshop audit"}, 0, "B1.json"))
+    other_process.upsert(list(ids), vector_store.embedding_model.encode(list(documents)), list(documents), list(metadatas))
+    assert vector_store.index_version == index_version # This process wrote nothing since
+    assert {doc["offer_id"] for doc in vector_store.retrieve_context("SEO workshop", n_results=2)} == {"A1", "B1"}
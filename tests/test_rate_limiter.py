@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from rate_limiter import RateLimitGovernor, parse_reset_duration, estimate_tokens
+
+LIMITS = {"default": {"rpm": 600, "tpm": 60000}, "small": {"rpm": 60, "tpm": 6000}}
+
+
+@pytest.fixture
+def governor():
+    return RateLimitGovernor(LIMITS, safety_factor=1.0, state_path=None)
+
+
+@pytest.mark.parametrize("value, seconds", [
+    (None, 0.0), ("20ms", 0.02), ("1s", 1.0), ("6m0s", 360.0), ("1h2m3.5s", 3723.5), ("7", 7.0), ("soon", 0.0),
+])
+def test_parse_reset_duration(value, seconds):
+    assert parse_reset_duration(value) == pytest.approx(seconds)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens([{"content": "x" * 400}, {"content": "y" * 100}], completion_tokens=50) == 175
+
+
+def test_request_bucket_queues_calls_beyond_the_limit(governor):
+    for _ in range(60):
+        assert governor._try_take("small", 10) == 0.0
+    assert governor._try_take("small", 10) == pytest.approx(1.0, abs=0.05) # 60 rpm refill one request per second
+
+
+def test_token_bucket_and_oversized_requests(governor):
+    assert governor._try_take("small", 5000) == 0.0
+    assert governor._try_take("small", 2000) == pytest.approx(10.0, abs=0.1) # 1000 tokens missing at 100 tokens/s
+    governor.observe_usage("small", 5000, 1000) # The call used far less than estimated
+    assert governor._try_take("small", 2000) == 0.0
+    assert governor._try_take("other", 10 ** 9) == 0.0 # Capped to a full bucket (default limits)
+
+
+def test_headers_adapt_limits_and_levels(governor):
+    governor.observe_response("small", {"x-ratelimit-limit-requests": "120", "x-ratelimit-limit-tokens": "12000",
+                                        "x-ratelimit-remaining-requests": "0", "x-ratelimit-remaining-tokens": "5000"})
+    assert governor.limits["small"] == {"rpm": 120.0, "tpm": 12000.0}
+    assert governor._try_take("small", 10) == pytest.approx(0.5, abs=0.05)
+
+
+def test_rate_limit_pauses_the_model(governor):
+    governor.observe_rate_limit("small", {"retry-after": "3"})
+    assert governor._try_take("small", 10) == pytest.approx(3.0, abs=0.1)
+    assert governor._try_take("default", 10) == 0.0
+    assert governor.get_stats()["rate_limited"] == 1
+
+
+def test_acquire_waits_and_counts_queued_calls():
+    governor = RateLimitGovernor({"default": {"rpm": 600, "tpm": 10 ** 6}}, safety_factor=1.0, state_path=None)
+    for _ in range(600):
+        governor.acquire("m", 1)
+    start = time.perf_counter()
+    governor.acquire("m", 1)
+    assert time.perf_counter() - start >= 0.08 # 10 requests per second
+    stats = governor.get_stats()
+    assert (stats["calls"], stats["queued_calls"]) == (601, 1)
+
+
+def test_sqlite_state_is_shared_between_governors(tmp_path):
+    path = str(tmp_path / "rate_limits.sqlite")
+    first = RateLimitGovernor(LIMITS, safety_factor=1.0, state_path=path)
+    second = RateLimitGovernor(LIMITS, safety_factor=1.0, state_path=path) # Stands in for another process
+    for _ in range(30):
+        first.acquire("small", 1)
+        second.acquire("small", 1)
+    assert first._try_take("small", 1) > 0.5
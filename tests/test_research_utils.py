@@ -0,0 +1,148 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import research_utils
+from config_data import PERPLEXITY_MODEL_NAME, PERPLEXITY_FALLBACK_MODEL_NAME
+
+MESSAGES = [{"role": "user", "content": "Tell me about Muster AG"}]
+
+
+class FakeClient:
+    """AsyncOpenAI stand-in: `answers` maps a model to (delay in seconds, answer text or exception)."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls, self.cancelled = [], []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(with_raw_response=self))
+
+    async def create(self, model, messages, temperature, timeout):
+        self.calls.append(model)
+        delay, answer = self.answers[model]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        if isinstance(answer, Exception):
+            raise answer
+        completion = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=answer))],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15),
+            citations=[f"https://example.com/{model}"],
+        )
+        return SimpleNamespace(headers={}, parse=lambda: completion)
+
+
+def research(client, **options):
+    options = {"primary_model": "primary", "fallback_model": "fallback", "hedge_after": 0.1, "deadline": 2.0, **options}
+    return asyncio.run(research_utils.hedged_research(client, MESSAGES, **options))
+
+
+def test_default_fallback_model_differs_from_the_primary():
+    assert PERPLEXITY_FALLBACK_MODEL_NAME and PERPLEXITY_FALLBACK_MODEL_NAME != PERPLEXITY_MODEL_NAME
+
+
+def test_fast_primary_is_not_hedged():
+    client = FakeClient({"primary": (0.0, "Overview"), "fallback": (0.0, "Other")})
+    result = research(client)
+    assert (result["model"], result["hedged"]) == ("primary", False)
+    assert result["content"] == "Overview\n\nSources:\n- https://example.com/primary"
+    assert client.calls == ["primary"]
+
+
+def test_slow_primary_is_hedged_and_the_loser_cancelled():
+    client = FakeClient({"primary": (1.5, "late"), "fallback": (0.05, "Quick overview")})
+    result = research(client)
+    assert (result["model"], result["hedged"]) == ("fallback", True)
+    assert result["elapsed_seconds"] < 1.0
+    assert client.cancelled == ["primary"]
+
+
+def test_failing_primary_hedges_without_waiting():
+    client = FakeClient({"primary": (0.0, RuntimeError("502 Bad Gateway")), "fallback": (0.0, "Overview")})
+    result = research(client, hedge_after=10.0)
+    assert (result["model"], result["hedged"]) == ("fallback", True)
+    assert result["elapsed_seconds"] < 1.0
+
+
+def test_both_failing_is_reported():
+    client = FakeClient({"primary": (0.0, RuntimeError("boom")), "fallback": (0.0, RuntimeError("down"))})
+    result = research(client)
+    assert result["error"] == "RESEARCH_FAILED"
+    assert result["details"] == "primary: boom; fallback: down"
+
+
+def test_deadline_ends_the_call():
+    client = FakeClient({"primary": (5.0, "late"), "fallback": (5.0, "late")})
+    result = research(client, deadline=0.3)
+    assert result["error"] == "RESEARCH_DEADLINE_EXCEEDED"
+    assert result["elapsed_seconds"] < 1.0
+    assert sorted(client.cancelled) == ["fallback", "primary"]
+
+
+@pytest.mark.parametrize("fallback_model", [None, "primary"])
+def test_no_hedging_without_a_different_fallback(fallback_model):
+    client = FakeClient({"primary": (0.3, "Overview")})
+    result = research(client, fallback_model=fallback_model)
+    assert (result["model"], result["hedged"]) == ("primary", False)
+    assert client.calls == ["primary"]
+
+
+def brief_answer(**overrides):
+    section = {
+        "summary": "Muster AG   sells\nfurniture. " * 100,
+        "key_facts": ["Founded 1950", "x" * 1000, "", 42, "Fact 4", "Fact 5", "Fact 6", "Fact 7"],
+        "challenges": "not a list",
+        "opportunities": ["Online shop"],
+    }
+    return {"client": dict(section, **overrides)}
+
+
+def test_condensed_brief_is_capped_locally(monkeypatch):
+    monkeypatch.setattr(research_utils, "get_llm_json_response", lambda *args, **kwargs: brief_answer())
+    brief = research_utils.condense_research({"client": "long research text"})["client"]
+    assert len(brief["summary"]) == 2 * research_utils.RESEARCH_BRIEF_MAX_ITEM_CHARS
+    assert brief["summary"].startswith("Muster AG sells furniture. Muster AG") and brief["summary"].endswith("...")
+    assert len(brief["key_facts"]) == research_utils.RESEARCH_BRIEF_MAX_ITEMS
+    assert brief["key_facts"][0] == "Founded 1950"
+    assert len(brief["key_facts"][1]) == research_utils.RESEARCH_BRIEF_MAX_ITEM_CHARS
+    assert brief["challenges"] == [] and brief["sources"] == []
+
+
+def test_missing_brief_section_is_an_error(monkeypatch):
+    monkeypatch.setattr(research_utils, "get_llm_json_response", lambda *args, **kwargs: brief_answer())
+    result = research_utils.condense_research({"client": "text", "offer_focused": "text"})
+    assert result == {"error": "INVALID_RESEARCH_BRIEF", "details": "Missing section 'offer_focused'."}
+
+
+def test_format_research_brief():
+    section = {"summary": "Retailer.", "key_facts": ["A", "B"], "challenges": [], "opportunities": ["C"], "sources": []}
+    assert research_utils.format_research_brief(section) == "Retailer.\nKey facts:\n- A\n- B\nOpportunities:\n- C"
+
+
+def test_prompts_get_the_brief_and_failed_topics_keep_their_note(monkeypatch):
+    monkeypatch.setattr(research_utils, "OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setattr(research_utils, "run_research", lambda requests: {
+        "client": {"content": "Long client research", "model": "primary", "hedged": False, "elapsed_seconds": 1.0},
+        "offer_focused": {"error": "RESEARCH_FAILED", "details": "down", "elapsed_seconds": 1.0},
+    })
+    condensed = []
+    monkeypatch.setattr(research_utils, "condense_research", lambda raw: condensed.append(raw) or {"client": {"summary": "Short brief"}})
+    result = research_utils.perform_research("Muster AG", "Retail", "CRM Rollout", ["CRM"])
+    assert condensed == [{"client": "Long client research"}]
+    assert result["client_research_summary"] == "Short brief"
+    assert result["offer_focused_research_summary"].startswith("Error: Could not perform offer-focused research")
+    assert result["research_models"] == {"client": "primary", "offer_focused": None}
+
+
+def test_full_research_text_is_used_if_condensing_fails(monkeypatch):
+    monkeypatch.setattr(research_utils, "OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setattr(research_utils, "run_research", lambda requests: {
+        name: {"content": f"Research on {name}", "model": "primary", "hedged": False, "elapsed_seconds": 1.0} for name in requests
+    })
+    monkeypatch.setattr(research_utils, "condense_research", lambda raw: {"error": "LLM_JSON_PARSE_ERROR"})
+    result = research_utils.perform_research("Muster AG", "Retail", "CRM Rollout", "CRM")
+    assert result["client_research_summary"] == "Research on client"
+    assert result["research_brief"] is None
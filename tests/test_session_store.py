@@ -0,0 +1,97 @@
+import sqlite3
+import threading
+
+import pytest
+
+from session_store import SessionStore, session_context
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(str(tmp_path / "sessions.sqlite3"), flush_seconds=0.05, max_batch=50)
+
+
+def rows(store, sql):
+    connection = sqlite3.connect(store.path)
+    try:
+        return connection.execute(sql).fetchall()
+    finally:
+        connection.close()
+
+
+def test_save_and_load_session_keeps_created_at(store):
+    store.save_session("s1", {"client_name": "Acme", "project_title": "CRM"}, source="cli")
+    first = store.load_session("s1")
+    store.save_session("s1", {"client_name": "Acme AG", "project_title": "CRM"},
+                       proposed_structure={"positions": [1]}, draft={"offer": 1}, bexio_response={"id": 7}, source="cli")
+    session = store.load_session("s1")
+    assert session["info"] == {"client_name": "Acme AG", "project_title": "CRM"}
+    assert session["proposed_structure"] == {"positions": [1]}
+    assert session["draft"] == {"offer": 1}
+    assert session["bexio_response"] == {"id": 7}
+    assert session["created_at"] == first["created_at"]
+    assert session["updated_at"] >= first["updated_at"]
+    assert store.load_session("missing") is None
+
+
+def test_records_are_committed_after_flush(store):
+    store.record_stage("s1", "research", output={"summary": "ü"}, duration_ms=12.5)
+    store.record_draft("s1", {"v": 1})
+    store.record_draft("s1", {"v": 2})
+    store.record_bexio_export("s1", {"error": "Unauthorized", "details": "401"})
+    store.record_bexio_export("s1", {"id": 42, "document_nr": "AN-00042"})
+    assert store.flush()
+    assert rows(store, "SELECT stage, duration_ms, status, output_json FROM stage_outputs") == [("research", 12.5, 200, '{"summary": "ü"}')]
+    assert rows(store, "SELECT version, draft_json FROM drafts ORDER BY id") == [(1, '{"v": 1}'), (2, '{"v": 2}')]
+    assert rows(store, "SELECT bexio_id, document_nr, error FROM bexio_exports ORDER BY id") == [(None, None, "Unauthorized"), (42, "AN-00042", None)]
+
+
+def test_rows_are_written_in_batches_in_wal_mode(store):
+    for i in range(120):
+        store.record_stage("s1", f"stage {i}")
+    store.flush()
+    assert store.stats["rows_written"] == 120
+    assert store.stats["batches"] <= 5 # max_batch 50: not one transaction per row
+    assert [stage for (stage,) in rows(store, "SELECT stage FROM stage_outputs ORDER BY id")] == [f"stage {i}" for i in range(120)]
+    assert rows(store, "PRAGMA journal_mode") == [("wal",)]
+
+
+def test_llm_calls_are_attributed_to_the_session_context(store):
+    with session_context("s1"):
+        store.record_llm_call("gpt-4.1", "draft", prompt_tokens=100, cached_tokens=40, completion_tokens=20, latency_ms=300)
+        worker = threading.Thread(target=store.record_llm_call, args=("gpt-4.1-mini", "structure"), kwargs={"latency_ms": 50})
+        worker.start() # A plain thread does not inherit the context
+        worker.join()
+    store.record_llm_call("gpt-4.1", "draft", prompt_tokens=10, completion_tokens=5, latency_ms=100, error="timeout")
+    assert store.llm_usage_summary("s1") == [{
+        "model": "gpt-4.1", "prompt_name": "draft", "calls": 1, "errors": 0, "prompt_tokens": 100, "cached_tokens": 40,
+        "completion_tokens": 20, "avg_queued_ms": None, "avg_latency_ms": 300.0, "max_latency_ms": 300.0,
+    }]
+    summary = {(row["model"], row["prompt_name"]): row for row in store.llm_usage_summary()}
+    assert summary[("gpt-4.1", "draft")]["calls"] == 2
+    assert summary[("gpt-4.1", "draft")]["errors"] == 1
+    assert summary[("gpt-4.1-mini", "structure")]["calls"] == 1
+    assert rows(store, "SELECT COUNT(*) FROM llm_calls WHERE session_id IS NULL") == [(2,)]
+
+
+def test_write_error_is_counted_and_does_not_stop_the_writer(store):
+    store.record_stage("s1", "ok")
+    store.flush()
+    store._enqueue("stage", ("s1",)) # Wrong number of parameters: the batch is rolled back
+    store.flush()
+    store.record_stage("s1", "after")
+    store.flush()
+    assert store.stats["write_errors"] == 1
+    assert [stage for (stage,) in rows(store, "SELECT stage FROM stage_outputs ORDER BY id")] == ["ok", "after"]
+
+
+def test_disabled_store_records_nothing(tmp_path):
+    store = SessionStore(None)
+    store.save_session("s1", {"client_name": "Acme"})
+    store.record_stage("s1", "research")
+    assert store.writer is None
+    assert store.flush()
+    assert store.load_session("s1") is None
+    assert store.llm_usage_summary() == []
+    assert store.get_stats() == {"path": None}
+    assert list(tmp_path.iterdir()) == []
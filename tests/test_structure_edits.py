@@ -0,0 +1,88 @@
+import pytest
+
+from structure_edits import apply_structure_operations, validate_structure, structure_for_prompt
+
+
+def offer_position(title, hours=8, **fields):
+    return {"type": "Offer Position", "proposed_title": title, "focus_description": f"About {title}",
+            "estimated_hours_suggestion": hours, "suggested_service_area": "Default", **fields}
+
+
+@pytest.fixture
+def structure():
+    return [
+        {"type": "Text Position", "proposed_title": "Introduction"},
+        offer_position("Analysis", historical_hours={"estimate": 8}),
+        offer_position("Concept"),
+        offer_position("Rollout", hours_warning="well above similar past work"),
+    ]
+
+
+def titles(structure):
+    return [item["proposed_title"] for item in structure]
+
+
+def test_positions_refer_to_the_structure_before_the_edit(structure):
+    new = apply_structure_operations(structure, [
+        {"op": "remove", "position": 1},
+        {"op": "add", "after": 2, "item": offer_position("Workshop")},
+        {"op": "edit", "position": 4, "changes": {"proposed_title": "Go-live"}},
+        {"op": "add", "after": 0, "item": {"type": "Text Position", "proposed_title": "Cover"}},
+    ])
+    assert titles(new) == ["Cover", "Analysis", "Workshop", "Concept", "Go-live"]
+    assert titles(structure) == ["Introduction", "Analysis", "Concept", "Rollout"] # Input is unchanged
+
+
+def test_unchanged_positions_keep_derived_fields_changed_ones_lose_them(structure):
+    new = apply_structure_operations(structure, [{"op": "edit", "position": 4, "changes": {"estimated_hours_suggestion": 12}}])
+    assert new[1] is structure[1]
+    assert new[3]["estimated_hours_suggestion"] == 12
+    assert "hours_warning" not in new[3]
+    assert structure[3]["hours_warning"]
+
+
+def test_edits_of_one_position_accumulate(structure):
+    new = apply_structure_operations(structure, [
+        {"op": "edit", "position": 3, "changes": {"proposed_title": "Design"}},
+        {"op": "edit", "position": 3, "changes": {"estimated_hours_suggestion": 3}},
+    ])
+    assert (new[2]["proposed_title"], new[2]["estimated_hours_suggestion"]) == ("Design", 3)
+
+
+def test_merge_replaces_the_first_position_and_drops_the_others(structure):
+    new = apply_structure_operations(structure, [{"op": "merge", "positions": [4, 2], "item": offer_position("Analysis & Rollout", 20)}])
+    assert titles(new) == ["Introduction", "Analysis & Rollout", "Concept"]
+
+
+@pytest.mark.parametrize("operation, message", [
+    ({"op": "edit", "position": 5, "changes": {"proposed_title": "x"}}, "out of range"),
+    ({"op": "edit", "position": True, "changes": {"proposed_title": "x"}}, "out of range"),
+    ({"op": "edit", "position": 1, "changes": {"price": 1}}, "unknown field"),
+    ({"op": "edit", "position": 1, "changes": {}}, "non-empty object"),
+    ({"op": "add", "after": 1, "item": {"type": "Chapter"}}, "'item' must be"),
+    ({"op": "merge", "positions": [2], "item": offer_position("x")}, "at least two"),
+    ({"op": "rename", "position": 1}, "unknown op"),
+    ("remove 1", "must be an object"),
+])
+def test_invalid_operations_name_the_operation(structure, operation, message):
+    with pytest.raises(ValueError, match=f"Operation 2: .*{message}"):
+        apply_structure_operations(structure, [{"op": "remove", "position": 1}, operation])
+
+
+def test_removing_everything_is_rejected(structure):
+    with pytest.raises(ValueError, match="remove every position"):
+        apply_structure_operations(structure, [{"op": "remove", "position": p} for p in range(1, 5)])
+
+
+def test_validate_structure(structure):
+    assert validate_structure(structure) == []
+    assert validate_structure([]) == ["The structure must be a non-empty array."]
+    assert validate_structure([offer_position("A", hours=None), offer_position("B", hours="12")]) == []
+    problems = validate_structure([{"type": "Chapter"}, offer_position(" "), offer_position("C", hours=0), offer_position("D", hours="many")])
+    assert [problem.split(":")[0] for problem in problems] == ["Position 1", "Position 2", "Position 3", "Position 4"]
+
+
+def test_structure_for_prompt_drops_derived_fields(structure):
+    prompt_structure = structure_for_prompt(structure)
+    assert all("historical_hours" not in item and "hours_warning" not in item for item in prompt_structure)
+    assert titles(prompt_structure) == titles(structure)
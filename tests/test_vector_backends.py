@@ -0,0 +1,145 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from vector_backends import MemmapBackend, get_vector_backend, _RowStore
+
+
+def make_vectors(n, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def add_rows(backend, vectors, prefix="id", files=4):
+    n = len(vectors)
+    backend.add(
+        ids=[f"{prefix}{i}" for i in range(n)],
+        embeddings=vectors,
+        documents=[f"document {i}" for i in range(n)],
+        metadatas=[{"source_file": f"f{i % files}.json", "row": i, "parent_content": "long text " * 100} for i in range(n)],
+    )
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+def test_memmap_query_matches_exact_cosine_search(tmp_path, dtype):
+    vectors = make_vectors(300)
+    backend = MemmapBackend(str(tmp_path), "c", dtype=dtype)
+    add_rows(backend, vectors)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    for q in range(0, 300, 37):
+        exact = np.argsort(-(normalized @ normalized[q]))[:5]
+        hits = backend.query(vectors[q] * 3.0, n_results=5) # The query norm must not matter
+        assert hits[0]["id"] == f"id{q}"
+        assert hits[0]["distance"] == pytest.approx(0.0, abs=0.01)
+        assert len({hit["id"] for hit in hits} & {f"id{i}" for i in exact}) >= 4
+
+
+def test_memmap_hits_carry_documents_and_metadata(tmp_path):
+    backend = MemmapBackend(str(tmp_path), "c")
+    add_rows(backend, make_vectors(20))
+    hit = backend.query(make_vectors(20)[7], n_results=1)[0]
+    assert hit["document"] == "document 7"
+    assert hit["metadata"]["row"] == 7
+    assert hit["metadata"]["parent_content"].startswith("long text")
+
+
+def test_memmap_upsert_replaces_and_delete_removes(tmp_path):
+    vectors = make_vectors(40)
+    backend = MemmapBackend(str(tmp_path), "c")
+    add_rows(backend, vectors)
+    backend.upsert(["id3", "new"], np.stack([-vectors[3], vectors[5] + 0.01]), ["replaced", "added"], [{"source_file": "f3.json"}, {"source_file": "g.json"}])
+    assert backend.count() == 41
+    assert backend.query(-vectors[3], n_results=1)[0]["document"] == "replaced"
+    backend.delete(backend.get_ids({"source_file": "f1.json"}))
+    assert backend.count() == 31
+    assert not any(hit["id"] == "id1" for hit in backend.query(vectors[1], n_results=31))
+
+
+def test_memmap_get_ids_filters_on_short_metadata_only(tmp_path):
+    backend = MemmapBackend(str(tmp_path), "c")
+    add_rows(backend, make_vectors(12))
+    assert sorted(backend.get_ids({"source_file": "f2.json"})) == ["id10", "id2", "id6"]
+    assert backend.get_ids({"source_file": "f2.json", "row": 6}) == ["id6"]
+    assert backend.get_ids({"parent_content": "long text " * 100}) == [] # Long texts are not kept as filter values
+
+
+def test_memmap_ivf_layout_survives_writes(tmp_path):
+    vectors = make_vectors(500)
+    backend = MemmapBackend(str(tmp_path), "c", nprobe=16)
+    add_rows(backend, vectors)
+    backend.build_ivf(8)
+    assert backend.snapshot.centroids.shape == (8, 16)
+    assert backend.query(vectors[42], n_results=1)[0]["id"] == "id42"
+    backend.upsert(["extra"], vectors[:1] * -1, ["extra"], [{"source_file": "x.json"}])
+    assert backend.snapshot.centroids is not None
+    assert backend.query(-vectors[0], n_results=1)[0]["id"] == "extra"
+
+
+def test_memmap_reader_in_another_instance_reloads_new_generation(tmp_path):
+    writer = MemmapBackend(str(tmp_path), "c")
+    reader = MemmapBackend(str(tmp_path), "c") # Stands in for a worker process opening the same index
+    vectors = make_vectors(10)
+    add_rows(writer, vectors)
+    assert reader.count() == 10
+    writer.delete(["id4"])
+    assert reader.count() == 9
+    assert reader.generation == writer.generation
+
+
+def test_memmap_replaced_generation_is_kept_for_the_grace_period(tmp_path):
+    backend = MemmapBackend(str(tmp_path), "c", grace_seconds=0.3)
+    vectors = make_vectors(10)
+    add_rows(backend, vectors)
+    first_files = set(os.listdir(backend.dir)) - {"sidecar.json"}
+    backend.delete(["id0"])
+    backend.delete(["id1"]) # Generation 1 was replaced just now: still on disk for readers of the old sidecar
+    assert first_files <= set(os.listdir(backend.dir))
+    time.sleep(0.35)
+    backend.delete(["id2"])
+    assert not first_files & set(os.listdir(backend.dir))
+    assert backend.count() == 7
+
+
+def test_memmap_reset_is_an_empty_generation(tmp_path):
+    backend = MemmapBackend(str(tmp_path), "c")
+    reader = MemmapBackend(str(tmp_path), "c")
+    add_rows(backend, make_vectors(5))
+    backend.set_index_metadata({"embedding_model_id": "m"})
+    backend.reset()
+    assert reader.count() == 0
+    assert reader.query(make_vectors(1)[0]) == []
+    assert backend.get_index_metadata() == {"distance": "cosine"}
+
+
+def test_row_store_round_trip_through_files(tmp_path):
+    rows = _RowStore.build(["a", "ü"], ["doc a", "dök"], [{"k": 1}, {"k": "x" * 1000}])
+    files = rows.save(str(tmp_path), 7)
+    opened = _RowStore.open(str(tmp_path), files)
+    assert len(opened) == 2
+    assert opened.ids() == ["a", "ü"]
+    assert opened.row(1) == ("dök", {"k": "x" * 1000})
+    assert opened.filters() == [{"k": 1}, {}]
+    merged = opened.select([1], _RowStore.build(["c"], ["doc c"], [{}]))
+    assert merged.ids() == ["ü", "c"]
+    assert merged.row(0)[0] == "dök"
+
+
+def test_chroma_backend_uses_cosine_distance(tmp_path):
+    pytest.importorskip("chromadb")
+    vectors = make_vectors(30)
+    backend = get_vector_backend("chroma", str(tmp_path), "offer_positions")
+    add_rows(backend, vectors * np.arange(1, 31, dtype=np.float32)[:, None]) # Unnormalized, like model output
+    assert backend.get_index_metadata()["distance"] == "cosine"
+    hit = backend.query(vectors[9], n_results=1)[0]
+    assert hit["id"] == "id9"
+    assert hit["distance"] == pytest.approx(0.0, abs=1e-4)
+
+
+def test_version_changes_with_writes_of_another_instance(tmp_path):
+    backend = MemmapBackend(str(tmp_path), "c")
+    other = MemmapBackend(str(tmp_path), "c")
+    before = backend.version()
+    add_rows(other, make_vectors(3))
+    assert backend.version() != before
+    assert backend.version() == other.version()
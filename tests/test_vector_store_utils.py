@@ -0,0 +1,80 @@
+import vector_store_utils as vsu
+
+
+def long_description(topic, bullets=40):
+    return "\n".join(f"- {topic} step {i}: " + "detail " * 10 for i in range(bullets))
+
+
+def test_short_position_is_one_document():
+    documents = vsu.build_position_documents("A1", {"position_id": "2", "position_title": "Workshop", "description": "One day"}, 1, "a.json")
+    assert len(documents) == 1
+    doc_id, text, metadata = documents[0]
+    assert doc_id == "A1_2"
+    assert text == "Offer Position Title: Workshop\nDescription: One day"
+    assert metadata["parent_id"] == "A1_2" and metadata["chunk_count"] == 1
+
+
+def test_long_position_is_chunked_with_parent_text():
+    position = {"position_id": "1", "position_title": "Migration", "description": long_description("migration")}
+    documents = vsu.build_position_documents("A1", position, 0, "a.json")
+    assert len(documents) > 1
+    assert [doc_id for doc_id, _, _ in documents] == [f"A1_1#c{i}" for i in range(len(documents))]
+    for _, text, metadata in documents:
+        assert text.startswith("Offer Position Title: Migration\nDescription: - migration step")
+        assert metadata["parent_id"] == "A1_1"
+        assert metadata["parent_content"] == f"Offer Position Title: Migration\nDescription: {position['description']}"
+
+
+def test_collapse_hits_keeps_best_chunk_per_parent():
+    hits = [
+        {"id": "A_1#c3", "document": "chunk", "metadata": {"parent_id": "A_1", "parent_content": "full A1", "offer_id": "A"}},
+        {"id": "B_2", "document": "short B2", "metadata": {"parent_id": "B_2", "offer_id": "B"}},
+        {"id": "A_1#c0", "document": "chunk", "metadata": {"parent_id": "A_1", "parent_content": "full A1", "offer_id": "A"}},
+        {"id": "C_1", "document": "short C1", "metadata": {"parent_id": "C_1", "offer_id": "C"}},
+    ]
+    assert [doc["content"] for doc in vsu.collapse_hits(hits, 3)] == ["full A1", "short B2", "short C1"]
+    assert [doc["content"] for doc in vsu.collapse_hits(hits, 2)] == ["full A1", "short B2"]
+
+
+def test_retrieval_returns_the_whole_long_position(vector_store, write_offer):
+    migration = long_description("database migration")
+    path = write_offer("A1", [
+        {"position_id": "1", "position_title": "Migration", "description": migration},
+        {"position_id": "2", "position_title": "Training", "description": "Onsite training for the sales team"},
+    ])
+    vector_store.index_offer_files([path])
+    results = vector_store.retrieve_context("database migration step detail", n_results=2)
+    assert results[0]["position_id"] == "1"
+    assert results[0]["content"] == f"Offer Position Title: Migration\nDescription: {migration}"
+    assert len({doc["position_id"] for doc in results}) == len(results)
+
+
+def indexed_ids(vector_store, filename):
+    return sorted(vector_store.vector_backend.get_ids({"source_file": filename}))
+
+
+def test_reindexing_a_file_drops_removed_positions(vector_store, write_offer):
+    path = write_offer("A1", [{"position_id": "1", "description": "Kickoff"}, {"position_id": "2", "description": "Workshop"}])
+    assert vector_store.index_offer_files([path]) == 2
+    write_offer("A1", [{"position_id": "1", "description": "Kickoff meeting"}], filename="A1.json")
+    assert vector_store.index_offer_files([path]) == 1
+    assert indexed_ids(vector_store, "A1.json") == ["A1_1"]
+
+
+def test_unreadable_file_keeps_its_indexed_chunks(vector_store, write_offer):
+    good = write_offer("A1", [{"position_id": "1", "description": "Kickoff"}])
+    broken = write_offer("B1", [{"position_id": "1", "description": "Workshop"}, {"position_id": "2", "description": "Training"}])
+    vector_store.index_offer_files([good, broken])
+    with open(broken, "w", encoding="utf-8") as f:
+        f.write('{"offer_id": "B1", "positions": [') # Half-written by an editor
+    write_offer("A1", [{"position_id": "1", "description": "Kickoff"}, {"position_id": "2", "description": "Rollout"}], filename="A1.json")
+    assert vector_store.index_offer_files([good, broken]) == 2
+    assert indexed_ids(vector_store, "A1.json") == ["A1_1", "A1_2"]
+    assert indexed_ids(vector_store, "B1.json") == ["B1_1", "B1_2"]
+
+
+def test_removed_files_are_dropped_from_the_index(vector_store, write_offer):
+    path = write_offer("A1", [{"position_id": "1", "description": "Kickoff"}])
+    vector_store.index_offer_files([path])
+    assert vector_store.remove_offer_files([path]) == 1
+    assert vector_store.vector_backend.count() == 0
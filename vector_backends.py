@@ -0,0 +1,583 @@
+# vector_backends.py
+
+import os
+import re
+import json
+import time
+import numpy as np
+
+# Data files of one memmap generation, e.g. vectors.12.bin or rows.12.npy (files without a number: generation 0)
+GENERATION_FILE = re.compile(r"^[a-z]+(?:\.(\d+))?\.(?:bin|npy|npz)$")
+FILTER_MAX_CHARS = 256 # Longer metadata strings (e.g. parent_content) are not kept for get_ids() filters
+
+# --- BACKEND INTERFACE ---
+class VectorStoreBackend:
+    """
+    Minimal interface every vector store used by vector_store_utils has to provide.
+    Query results are returned as a list of dicts with the keys
+    'id', 'document', 'metadata' and 'distance' (lower is better), best match first.
+    """
+    name = "base"
+    incremental_add = False # True if many small add() calls cost about the same as one large call
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def add(self, ids: list, embeddings, documents: list, metadatas: list):
+        raise NotImplementedError
+
+    def query(self, query_embedding, n_results: int = 3) -> list:
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def upsert(self, ids: list, embeddings, documents: list, metadatas: list):
+        """Like add(), but replaces rows whose id already exists."""
+        raise NotImplementedError
+
+    def delete(self, ids: list):
+        raise NotImplementedError
+
+    def get_ids(self, where: dict) -> list:
+        """Ids of all rows whose metadata matches every key/value in `where`."""
+        raise NotImplementedError
+
+    def get_index_metadata(self) -> dict:
+        """Index-level metadata such as the embedding model id the vectors were created with and the 'distance' metric."""
+        raise NotImplementedError
+
+    def set_index_metadata(self, metadata: dict):
+        raise NotImplementedError
+
+    def version(self):
+        """A value that changes whenever the stored index changes, also by writes of other processes (None = unknown)."""
+        return None
+
+
+class ChromaBackend(VectorStoreBackend):
+    """ChromaDB persistent collection (SQLite + HNSW). The default backend."""
+    name = "chroma"
+    incremental_add = True
+
+    def __init__(self, path: str, collection_name: str):
+        import chromadb # Imported lazily so memmap-only workers never load ChromaDB
+        self.path = path
+        self.collection_name = collection_name
+        self.client = chromadb.PersistentClient(path=path)
+        self.collection = self._get_or_create_collection()
+
+    def _get_or_create_collection(self):
+        # Cosine distance like the memmap backend (the embeddings are not normalized, so L2 would rank differently).
+        # The space of an existing collection cannot change; get_index_metadata() reports it, and an index with
+        # another distance is rebuilt by load_and_vectorize_offers().
+        return self.client.get_or_create_collection(name=self.collection_name, metadata={"hnsw:space": "cosine"})
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def version(self):
+        # Every write goes through the SQLite file (or its write-ahead log), whichever process makes it
+        return tuple(_file_signature(os.path.join(self.path, name)) for name in ("chroma.sqlite3", "chroma.sqlite3-wal"))
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self._write_batches(self.collection.add, ids, embeddings, documents, metadatas)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self._write_batches(self.collection.upsert, ids, embeddings, documents, metadatas)
+
+    def _write_batches(self, write, ids, embeddings, documents, metadatas):
+        if isinstance(embeddings, np.ndarray):
+            embeddings = embeddings.tolist()
+        # ChromaDB rejects very large single inserts, so write in slices
+        batch_size = 5000
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            write(
+                embeddings=embeddings[start:end],
+                documents=documents[start:end],
+                metadatas=metadatas[start:end],
+                ids=ids[start:end]
+            )
+
+    def query(self, query_embedding, n_results=3):
+        if isinstance(query_embedding, np.ndarray):
+            query_embedding = query_embedding.tolist()
+        results = self.collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            include=['documents', 'metadatas', 'distances']
+        )
+        hits = []
+        if results and results.get('documents') and results['documents'][0]:
+            for i, doc in enumerate(results['documents'][0]):
+                hits.append({
+                    "id": results['ids'][0][i],
+                    "document": doc,
+                    "metadata": results['metadatas'][0][i] if results.get('metadatas') and results['metadatas'][0] else {},
+                    "distance": results['distances'][0][i] if results.get('distances') else None,
+                })
+        return hits
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(ids=list(ids))
+
+    def get_ids(self, where):
+        if len(where) > 1:
+            where = {"$and": [{key: value} for key, value in where.items()]}
+        return self.collection.get(where=where, include=[])["ids"]
+
+    def reset(self):
+        self.client.delete_collection(name=self.collection_name)
+        self.collection = self._get_or_create_collection()
+
+    def get_index_metadata(self):
+        metadata = dict(self.collection.metadata or {})
+        metadata["distance"] = metadata.get("hnsw:space", "l2")
+        return metadata
+
+    def set_index_metadata(self, metadata):
+        merged = self.get_index_metadata()
+        merged.update(metadata)
+        # 'hnsw:*' settings are fixed at creation time and may not be passed to modify(); 'distance' is derived from them
+        self.collection.modify(metadata={k: v for k, v in merged.items() if not k.startswith("hnsw:") and k != "distance"})
+
+
+class _RowStore:
+    """
+    Ids, documents and metadata of one memmap generation, stored like the offer_corpus text columns: UTF-8 blobs
+    (.npy, memory-mapped) plus one int64 offsets table. Column 0 holds the ids, column 1 each row as a JSON
+    [document, metadata] pair, column 2 the metadata values usable in get_ids() filters (without long texts such as
+    parent_content). A query decodes only the rows of its hits; the id list and the filter values are decoded on first
+    use by writes and get_ids(), which query-only worker processes never call.
+    """
+    COLUMNS = ("ids", "rows", "filters")
+
+    def __init__(self, offsets: np.ndarray, ids: np.ndarray, rows: np.ndarray, filters: np.ndarray):
+        self.offsets = offsets
+        self.blobs = (ids, rows, filters)
+        self._ids = None
+        self._filters = None
+
+    @classmethod
+    def build(cls, ids: list, documents: list, metadatas: list):
+        return cls._from_parts((
+            [str(doc_id).encode("utf-8") for doc_id in ids],
+            [json.dumps([document, metadata], ensure_ascii=False).encode("utf-8") for document, metadata in zip(documents, metadatas)],
+            [json.dumps(_filter_values(metadata), ensure_ascii=False).encode("utf-8") for metadata in metadatas],
+        ))
+
+    @classmethod
+    def _from_parts(cls, parts: tuple):
+        offsets = np.zeros((len(parts[0]) + 1, len(cls.COLUMNS)), dtype=np.int64)
+        for column, column_parts in enumerate(parts):
+            offsets[1:, column] = np.cumsum(np.fromiter((len(part) for part in column_parts), dtype=np.int64, count=len(column_parts)))
+        return cls(offsets, *(np.frombuffer(b"".join(column_parts), dtype=np.uint8) for column_parts in parts))
+
+    @classmethod
+    def open(cls, directory: str, files: dict):
+        return cls(*(np.load(os.path.join(directory, files[f"{name}_file"]), mmap_mode="r") for name in ("offsets",) + cls.COLUMNS))
+
+    def save(self, directory: str, generation: int) -> dict:
+        """Writes the offsets and blobs of `generation` and returns their file names for the sidecar."""
+        files = {}
+        for name, array in zip(("offsets",) + self.COLUMNS, (self.offsets,) + self.blobs):
+            files[f"{name}_file"] = f"{name}.{generation}.npy"
+            np.save(os.path.join(directory, files[f"{name}_file"]), np.asarray(array))
+        return files
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _raw(self, column: int, row: int) -> bytes:
+        return self.blobs[column][self.offsets[row, column]:self.offsets[row + 1, column]].tobytes()
+
+    def id(self, row: int) -> str:
+        return self._raw(0, row).decode("utf-8")
+
+    def row(self, row: int) -> tuple:
+        """(document, metadata) of one row."""
+        document, metadata = json.loads(self._raw(1, row))
+        return document, metadata
+
+    def ids(self) -> list:
+        if self._ids is None:
+            self._ids = [self.id(row) for row in range(len(self))]
+        return self._ids
+
+    def filters(self) -> list:
+        if self._filters is None:
+            self._filters = [json.loads(self._raw(2, row)) for row in range(len(self))]
+        return self._filters
+
+    def select(self, rows: list, appended=None):
+        """A new store with `rows` of this one followed by all rows of `appended`, copied without decoding them."""
+        return _RowStore._from_parts(tuple(
+            [self._raw(column, row) for row in rows] + ([appended._raw(column, row) for row in range(len(appended))] if appended else [])
+            for column in range(len(self.COLUMNS))
+        ))
+
+
+def _filter_values(metadata: dict) -> dict:
+    return {key: value for key, value in metadata.items() if not (isinstance(value, str) and len(value) > FILTER_MAX_CHARS)}
+
+
+def _file_signature(path: str):
+    """Changes whenever the file is replaced (os.replace gives it a new inode), None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class _MemmapSnapshot:
+    """One immutable generation of the memmap index. Queries read a single snapshot reference."""
+    __slots__ = ("rows", "dim", "vectors", "scales", "centroids", "lists")
+
+    def __init__(self, rows=None, dim=0, vectors=None, scales=None, centroids=None, lists=None):
+        self.rows = rows if rows is not None else _RowStore.build([], [], [])
+        self.dim = dim
+        self.vectors = vectors
+        self.scales = scales
+        self.centroids = centroids
+        self.lists = lists
+
+
+class MemmapBackend(VectorStoreBackend):
+    """
+    Flat file index: L2-normalized embeddings stored as int8 (with one float32 scale per vector)
+    or float16 in a raw memory-mapped file; ids, documents and metadata in memory-mapped blobs (see _RowStore).
+
+    All data files are opened read-only with np.memmap, so any number of worker processes
+    share the same physical pages through the OS page cache instead of each holding a copy.
+    Search is exact (one matrix-vector product) unless an IVF layout was built with
+    build_ivf(), in which case only the `nprobe` closest clusters are scanned.
+
+    Every write produces a new generation of data files; the small sidecar.json is replaced last and points
+    to them, so readers always see a consistent index and concurrent queries keep using the previous snapshot
+    until the swap. Readers in other processes notice a new sidecar on their next call and switch over. Files of
+    a replaced generation are deleted only `grace_seconds` after it was replaced (by a later write), so a reader
+    that read the old sidecar just before the swap can still open them.
+
+    Limitation: every upsert() and delete() writes a complete new generation, i.e. costs O(index size) no matter
+    how few rows change. Fine for bulk builds and occasional watcher re-indexes; for large archives with frequent
+    edits prefer the chroma backend or batch the changes.
+    """
+    name = "memmap"
+
+    def __init__(self, path: str, collection_name: str, dtype: str = "int8", nprobe: int = 8, grace_seconds: float = 300.0):
+        if dtype not in ("int8", "float16"):
+            raise ValueError(f"Unsupported memmap dtype '{dtype}'. Use 'int8' or 'float16'.")
+        self.dir = os.path.join(path, f"{collection_name}.memmap")
+        self.dtype = dtype
+        self.nprobe = nprobe
+        self.grace_seconds = grace_seconds
+        self.generation = 0
+        self.retired = {}  # generation -> time it was replaced; its files are deleted after grace_seconds
+        self.sidecar_signature = None
+        self.snapshot = _MemmapSnapshot()
+        os.makedirs(self.dir, exist_ok=True)
+        self._load()
+
+    # --- file layout ---
+    def _file(self, name):
+        return os.path.join(self.dir, name)
+
+    def _refresh(self):
+        """Reloads the index if a new generation was committed (by another process) since it was loaded."""
+        if _file_signature(self._file("sidecar.json")) != self.sidecar_signature:
+            self._load()
+
+    def _load(self):
+        """(Re)opens the memory maps of the current generation and swaps in the new snapshot."""
+        sidecar_path = self._file("sidecar.json")
+        for attempt in range(3):
+            signature = _file_signature(sidecar_path)
+            if signature is None:
+                self.snapshot, self.generation, self.retired, self.sidecar_signature = _MemmapSnapshot(), 0, {}, None
+                return
+            try:
+                with open(sidecar_path, 'r', encoding='utf-8') as f:
+                    sidecar = json.load(f)
+                snapshot = self._open_snapshot(sidecar)
+                break
+            except FileNotFoundError:
+                # A writer replaced the sidecar and removed the files it named while we read it: read the new one
+                if attempt == 2:
+                    raise
+        self.generation = sidecar.get("generation", 0)
+        self.retired = sidecar.get("retired", {})
+        self.dtype = sidecar["dtype"]
+        self.sidecar_signature = signature
+        self.snapshot = snapshot # Single reference assignment: in-flight queries keep the old snapshot
+
+    def _open_snapshot(self, sidecar: dict) -> _MemmapSnapshot:
+        if "ids" in sidecar: # Indexes written before the row store keep ids, documents and metadata in the sidecar
+            rows = _RowStore.build(sidecar["ids"], sidecar["documents"], sidecar["metadatas"])
+        else:
+            rows = _RowStore.open(self.dir, sidecar)
+        snapshot = _MemmapSnapshot(rows, sidecar["dim"])
+        if len(rows):
+            shape = (len(rows), snapshot.dim)
+            # Indexes written before generations were introduced use fixed file names
+            snapshot.vectors = np.memmap(self._file(sidecar.get("vectors_file", "vectors.bin")), dtype=sidecar["dtype"], mode='r', shape=shape)
+            if sidecar["dtype"] == "int8":
+                snapshot.scales = np.memmap(self._file(sidecar.get("scales_file", "scales.bin")), dtype=np.float32, mode='r', shape=(shape[0],))
+            ivf_file = sidecar.get("ivf_file", "ivf.npz")
+            if ivf_file and os.path.exists(self._file(ivf_file)):
+                ivf = np.load(self._file(ivf_file))
+                snapshot.centroids = ivf["centroids"]
+                assignments = ivf["assignments"]
+                snapshot.lists = [np.flatnonzero(assignments == c) for c in range(len(snapshot.centroids))]
+        return snapshot
+
+    def _read_sidecar(self) -> dict:
+        with open(self._file("sidecar.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_sidecar(self, sidecar: dict):
+        with open(self._file("sidecar.json.tmp"), 'w', encoding='utf-8') as f:
+            json.dump(sidecar, f, ensure_ascii=False)
+        os.replace(self._file("sidecar.json.tmp"), self._file("sidecar.json"))
+
+    def _save_ivf(self, name: str, centroids: np.ndarray, assignments: np.ndarray):
+        with open(self._file(f"{name}.tmp"), 'wb') as f:
+            np.savez(f, centroids=centroids, assignments=assignments)
+        os.replace(self._file(f"{name}.tmp"), self._file(name))
+
+    def _write(self, vectors: np.ndarray, scales, rows: _RowStore, ivf=None):
+        """
+        Writes a new generation of data files, then commits it by replacing the sidecar.
+        `ivf` is an optional (centroids, assignments) pair to carry the IVF layout over.
+        """
+        generation = self.generation + 1
+        sidecar = {
+            "generation": generation, "count": len(rows),
+            "dim": int(vectors.shape[1]) if vectors.ndim == 2 and vectors.shape[1] else self.snapshot.dim,
+            "dtype": self.dtype, "vectors_file": f"vectors.{generation}.bin", "scales_file": None, "ivf_file": None,
+        }
+        vectors.tofile(self._file(sidecar["vectors_file"]))
+        if scales is not None:
+            sidecar["scales_file"] = f"scales.{generation}.bin"
+            scales.astype(np.float32).tofile(self._file(sidecar["scales_file"]))
+        if ivf is not None:
+            sidecar["ivf_file"] = f"ivf.{generation}.npz"
+            self._save_ivf(sidecar["ivf_file"], ivf[0], ivf[1])
+        sidecar.update(rows.save(self.dir, generation))
+        sidecar["retired"] = dict(self._remove_retired_generations(), **{str(self.generation): time.time()})
+        self._write_sidecar(sidecar)
+        self._load()
+
+    def _remove_retired_generations(self) -> dict:
+        """
+        Deletes the files of generations replaced more than `grace_seconds` ago and returns the ones to keep: still in
+        the grace period, or still mapped by another process on Windows (where mapped files cannot be deleted; they
+        are retried on the next write). On POSIX, readers holding an older snapshot keep its unlinked files alive.
+        """
+        now = time.time()
+        expired = {int(generation) for generation, replaced_at in self.retired.items() if now - replaced_at >= self.grace_seconds}
+        failed = set()
+        for name in os.listdir(self.dir):
+            match = GENERATION_FILE.match(name)
+            generation = int(match.group(1) or 0) if match else None # Files without a number are generation 0
+            if generation in expired:
+                try:
+                    os.remove(self._file(name))
+                except OSError:
+                    failed.add(generation)
+        return {generation: replaced_at for generation, replaced_at in self.retired.items()
+                if int(generation) not in expired or int(generation) in failed}
+
+    # --- quantization ---
+    def _encode(self, embeddings: np.ndarray):
+        embeddings = _normalize(np.asarray(embeddings, dtype=np.float32))
+        if self.dtype == "float16":
+            return embeddings.astype(np.float16), None
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    @staticmethod
+    def _scores(snapshot, rows, query: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        """
+        Cosine similarity between the query and the stored vectors at `rows` (None = all).
+        Works through the memmap in chunks so only one chunk is ever upcast to float32.
+        """
+        total = len(snapshot.rows) if rows is None else len(rows)
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, chunk):
+            end = min(start + chunk, total)
+            selection = slice(start, end) if rows is None else rows[start:end]
+            scores[start:end] = snapshot.vectors[selection].astype(np.float32) @ query
+            if snapshot.scales is not None:
+                scores[start:end] *= snapshot.scales[selection]
+        return scores
+
+    @staticmethod
+    def _dequantize(snapshot, rows) -> np.ndarray:
+        vectors = snapshot.vectors[rows].astype(np.float32)
+        if snapshot.scales is not None:
+            vectors *= snapshot.scales[rows][:, None]
+        return vectors
+
+    # --- interface ---
+    def count(self) -> int:
+        self._refresh()
+        return len(self.snapshot.rows)
+
+    def version(self):
+        self._refresh() # Picks up generations committed by other processes
+        return (self.generation, self.sidecar_signature)
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self.upsert(ids, embeddings, documents, metadatas)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        """Adds new rows; rows whose id already exists are replaced."""
+        self._rewrite(set(ids), ids, embeddings, documents, metadatas)
+
+    def delete(self, ids):
+        if ids:
+            self._rewrite(set(ids), [], None, [], [])
+
+    def _rewrite(self, drop_ids: set, ids, embeddings, documents, metadatas):
+        self._refresh()
+        snapshot = self.snapshot
+        keep = [row for row, doc_id in enumerate(snapshot.rows.ids()) if doc_id not in drop_ids]
+        parts_vectors, parts_scales, parts_assignments = [], [], []
+        if snapshot.centroids is not None:
+            # Keep the IVF layout: existing rows keep their cluster, new rows join the nearest centroid
+            old_assignments = np.empty(len(snapshot.rows), dtype=np.int32)
+            for c, rows in enumerate(snapshot.lists):
+                old_assignments[rows] = c
+            parts_assignments.append(old_assignments[keep])
+        if snapshot.vectors is not None and keep:
+            parts_vectors.append(np.asarray(snapshot.vectors[keep]))
+            if snapshot.scales is not None:
+                parts_scales.append(np.asarray(snapshot.scales[keep]))
+        if ids:
+            codes, scales = self._encode(embeddings)
+            parts_vectors.append(codes)
+            if scales is not None:
+                parts_scales.append(scales)
+            if snapshot.centroids is not None:
+                new_vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+                parts_assignments.append(np.argmax(new_vectors @ snapshot.centroids.T, axis=1).astype(np.int32))
+        if not parts_vectors:
+            self.reset(keep_index_metadata=True)
+            return
+        ivf = (snapshot.centroids, np.concatenate(parts_assignments)) if snapshot.centroids is not None else None
+        self._write(
+            np.concatenate(parts_vectors),
+            np.concatenate(parts_scales) if parts_scales else None,
+            snapshot.rows.select(keep, _RowStore.build(list(ids), list(documents), list(metadatas)) if ids else None),
+            ivf=ivf,
+        )
+
+    def get_ids(self, where: dict) -> list:
+        """Metadata strings longer than FILTER_MAX_CHARS (e.g. parent_content) cannot be filtered on."""
+        self._refresh()
+        rows = self.snapshot.rows
+        return [
+            doc_id for doc_id, values in zip(rows.ids(), rows.filters())
+            if all(values.get(key) == value for key, value in where.items())
+        ]
+
+    def query(self, query_embedding, n_results=3):
+        self._refresh()
+        snapshot = self.snapshot
+        if not len(snapshot.rows):
+            return []
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32)[None, :])[0]
+        rows = None
+        if snapshot.centroids is not None:
+            probe = np.argsort(-(snapshot.centroids @ query))[:self.nprobe]
+            rows = np.concatenate([snapshot.lists[c] for c in probe])
+            if len(rows) < n_results: # Too few candidates in the probed clusters, fall back to exact search
+                rows = None
+        scores = self._scores(snapshot, rows, query)
+        k = min(n_results, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        hits = []
+        for i in top:
+            row = int(i) if rows is None else int(rows[i])
+            document, metadata = snapshot.rows.row(row)
+            hits.append({
+                "id": snapshot.rows.id(row),
+                "document": document,
+                "metadata": metadata,
+                "distance": float(1.0 - scores[i]),
+            })
+        return hits
+
+    def get_index_metadata(self):
+        metadata = {}
+        if os.path.exists(self._file("index_metadata.json")):
+            with open(self._file("index_metadata.json"), 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        return dict(metadata, distance="cosine")
+
+    def set_index_metadata(self, metadata):
+        merged = self.get_index_metadata()
+        merged.update(metadata)
+        with open(self._file("index_metadata.json.tmp"), 'w', encoding='utf-8') as f:
+            json.dump(merged, f, ensure_ascii=False)
+        os.replace(self._file("index_metadata.json.tmp"), self._file("index_metadata.json"))
+
+    def reset(self, keep_index_metadata: bool = False):
+        """Empties the index by committing an empty generation, so readers in other processes switch over cleanly."""
+        self._refresh()
+        if not keep_index_metadata and os.path.exists(self._file("index_metadata.json")):
+            os.remove(self._file("index_metadata.json"))
+        self._write(np.zeros((0, self.snapshot.dim), dtype=self.dtype), None, _RowStore.build([], [], []))
+
+    def build_ivf(self, nlist: int, iterations: int = 10, seed: int = 0):
+        """Clusters the stored vectors with a few rounds of k-means so queries only scan `nprobe` lists."""
+        self._refresh()
+        snapshot = self.snapshot
+        count = len(snapshot.rows)
+        if not count or nlist <= 1:
+            return
+        rng = np.random.default_rng(seed)
+        nlist = min(nlist, count)
+        sample_rows = rng.choice(count, size=min(count, nlist * 256), replace=False)
+        sample = self._dequantize(snapshot, np.sort(sample_rows))
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assignments == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        # Assign every stored vector in chunks to keep memory flat
+        assignments = np.empty(count, dtype=np.int32)
+        chunk = 65536
+        for start in range(0, count, chunk):
+            rows = slice(start, min(start + chunk, count))
+            assignments[rows] = np.argmax(self._dequantize(snapshot, rows) @ centroids.T, axis=1)
+        sidecar = self._read_sidecar()
+        sidecar["ivf_file"] = f"ivf.{self.generation}.npz"
+        self._save_ivf(sidecar["ivf_file"], centroids.astype(np.float32), assignments)
+        self._write_sidecar(sidecar)
+        self._load()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# --- FACTORY ---
+def get_vector_backend(backend_name: str, path: str, collection_name: str, **options) -> VectorStoreBackend:
+    """Returns the configured vector store backend ('chroma' or 'memmap')."""
+    if backend_name == "chroma":
+        return ChromaBackend(path, collection_name)
+    if backend_name == "memmap":
+        return MemmapBackend(path, collection_name, **options)
+    raise ValueError(f"Unknown vector backend '{backend_name}'. Use 'chroma' or 'memmap'.")
@@ -1,84 +1,265 @@
 # vector_store_utils.py
 
 import os
-import json
-from sentence_transformers import SentenceTransformer
-import chromadb
+import threading
+import numpy as np
+from config_data import (
+    EMBEDDING_MODEL_NAME, VECTOR_BACKEND, MEMMAP_INDEX_DTYPE, MEMMAP_IVF_NLIST, MEMMAP_IVF_NPROBE, MEMMAP_GENERATION_GRACE_SECONDS,
+    CHUNK_MAX_WORDS, CHUNK_OVERLAP_UNITS, CHUNK_QUERY_OVERSAMPLE, QUERY_EMBEDDING_CACHE_SIZE, QUERY_RESULT_CACHE_SIZE
+)
+from vector_backends import get_vector_backend
+from embedding_utils import get_embedding_model
+from chunking_utils import chunk_description
+from offer_corpus import read_offer_file, load_corpus
+from query_cache import LRUCache, normalize_query
 
 # --- CONSTANTS ---
 VECTOR_STORE_PATH = "vector_store"
 COLLECTION_NAME = "offer_positions"
-EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 
 # --- INITIALIZE CLIENTS ---
-embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-chroma_client = chromadb.PersistentClient(path=VECTOR_STORE_PATH)
-collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+embedding_model = get_embedding_model()
+backend_options = {
+    "dtype": MEMMAP_INDEX_DTYPE, "nprobe": MEMMAP_IVF_NPROBE, "grace_seconds": MEMMAP_GENERATION_GRACE_SECONDS
+} if VECTOR_BACKEND == "memmap" else {}
+vector_backend = get_vector_backend(VECTOR_BACKEND, VECTOR_STORE_PATH, COLLECTION_NAME, **backend_options)
+
+# Everything that changes what is stored in the index. A mismatch with the stored values forces a re-embed.
+INDEX_SIGNATURE = {
+    "embedding_model_id": embedding_model.model_id,
+    "chunking": f"words{CHUNK_MAX_WORDS}-overlap{CHUNK_OVERLAP_UNITS}",
+    "distance": "cosine", # Chroma collections created before they used cosine distance are rebuilt
+}
+
+# Serializes index writers (full build, watcher re-index). Queries never take this lock.
+index_write_lock = threading.Lock()
+index_version = 0 # Bumped by every index write of this process (see vector_backend.version() for all writers)
+
+query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+query_result_cache = LRUCache(QUERY_RESULT_CACHE_SIZE)
+
+# --- HELPER FUNCTIONS ---
+def _index_changed():
+    """Called after every index write: cached retrieval results of earlier versions are never served again."""
+    global index_version
+    index_version += 1
+    query_result_cache.clear()
+
+def build_position_documents(offer_id: str, position: dict, pos_idx: int, filename: str, offer_status: str = "unknown"):
+    """
+    Turns one offer position into the (id, text, metadata) triples to index.
+    Short descriptions give a single document. Long ones are chunked; every chunk carries
+    the parent position id and the full parent text, so retrieval can return the whole position.
+    """
+    description = position.get("description")
+    if not description:
+        return []
+    title = position.get("position_title", f"Position {pos_idx+1}")
+    position_id = position.get("position_id", str(pos_idx+1))
+    parent_id = f"{offer_id}_{position_id}"
+    parent_content = f"Offer Position Title: {title}\nDescription: {description}"
+    base_metadata = {
+        "offer_id": offer_id,
+        "position_id": position_id,
+        "position_title": title,
+        "source_file": filename,
+        "parent_id": parent_id,
+        "offer_status": offer_status, # won / lost / pending / draft for offers synced from Bexio
+    }
+
+    chunks = chunk_description(description, CHUNK_MAX_WORDS, CHUNK_OVERLAP_UNITS)
+    if len(chunks) <= 1:
+        return [(parent_id, parent_content, dict(base_metadata, chunk_index=0, chunk_count=1))]
+
+    documents = []
+    for chunk_idx, chunk in enumerate(chunks):
+        metadata = dict(base_metadata, chunk_index=chunk_idx, chunk_count=len(chunks), parent_content=parent_content)
+        # The title is repeated in every chunk so each chunk embeds with its topic
+        documents.append((f"{parent_id}#c{chunk_idx}", f"Offer Position Title: {title}\nDescription: {chunk}", metadata))
+    return documents
+
+def build_file_documents(filepath: str):
+    """Reads and validates one offer JSON file and returns (ids, texts, metadatas) for all its positions."""
+    filename = os.path.basename(filepath)
+    ids, texts, metadatas = [], [], []
+    offer_data = read_offer_file(filepath)
+    offer_id = offer_data.get("offer_id", "unknown_offer")
+    offer_status = offer_data.get("status") or "unknown"
+    for pos_idx, position in enumerate(offer_data.get("positions", [])):
+        for doc_id, text_content, metadata in build_position_documents(offer_id, position, pos_idx, filename, offer_status):
+            texts.append(text_content)
+            metadatas.append(metadata)
+            ids.append(doc_id)
+    return ids, texts, metadatas
 
 # --- VECTOR STORE FUNCTIONS ---
 def load_and_vectorize_offers(data_dir: str):
-    print(f"Checking collection '{COLLECTION_NAME}' for existing documents...")
-    if collection.count() > 0:
-        print(f"Collection already contains {collection.count()} documents. Skipping vectorization.")
-        print("If you want to re-vectorize, please clear the 'vector_store' directory and run again.")
-        return
+    print(f"Checking collection '{COLLECTION_NAME}' ({vector_backend.name} backend) for existing documents...")
+    if vector_backend.count() > 0:
+        index_metadata = vector_backend.get_index_metadata()
+        stale_keys = [key for key, value in INDEX_SIGNATURE.items() if index_metadata.get(key) != value]
+        if not stale_keys:
+            print(f"Collection already contains {vector_backend.count()} documents. Skipping vectorization.")
+            print("If you want to re-vectorize, please clear the 'vector_store' directory and run again.")
+            return
+        # Vectors from different models live in different embedding spaces and must never be mixed
+        for key in stale_keys:
+            print(f"Index '{key}' is '{index_metadata.get(key, 'unknown')}', but the configuration requires '{INDEX_SIGNATURE[key]}'.")
+        print("Clearing the collection and re-embedding all offers...")
+        vector_backend.reset()
+        _index_changed()
 
     print(f"Vectorizing offers from directory: {data_dir}")
     texts_to_embed = []
     metadatas = []
     ids = []
 
-    for filename in os.listdir(data_dir):
-        if filename.endswith(".json"):
-            filepath = os.path.join(data_dir, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    offer_data = json.load(f)
-                offer_id = offer_data.get("offer_id", "unknown_offer")
-                for pos_idx, position in enumerate(offer_data.get("positions", [])):
-                    description = position.get("description")
-                    title = position.get("position_title", f"Position {pos_idx+1}")
-                    if description:
-                        text_content = f"Offer Position Title: {title}\nDescription: {description}"
-                        texts_to_embed.append(text_content)
-                        metadatas.append({
-                            "offer_id": offer_id,
-                            "position_id": position.get("position_id", str(pos_idx+1)),
-                            "position_title": title,
-                            "source_file": filename
-                        })
-                        ids.append(f"{offer_id}_{position.get('position_id', str(pos_idx+1))}")
-            except Exception as e:
-                print(f"Warning: Error processing {filename}: {e}")
+    corpus = load_corpus(data_dir) # Validated, columnar; invalid files are reported and skipped
+    for offer_index in range(corpus.n_offers):
+        offer_id, filename, offer_status = corpus.offer_id[offer_index], corpus.source_file[offer_index], corpus.offer_status(offer_index)
+        for pos_idx, position_index in enumerate(corpus.positions_of(offer_index)):
+            position = corpus.position(position_index)
+            for doc_id, text_content, metadata in build_position_documents(offer_id, position, pos_idx, filename, offer_status):
+                ids.append(doc_id)
+                texts_to_embed.append(text_content)
+                metadatas.append(metadata)
 
     if texts_to_embed:
-        print(f"Generating embeddings for {len(texts_to_embed)} position descriptions...")
-        embeddings = embedding_model.encode(texts_to_embed, show_progress_bar=True).tolist()
-        print(f"Adding {len(texts_to_embed)} items to ChromaDB collection '{COLLECTION_NAME}'...")
-        collection.add(embeddings=embeddings, documents=texts_to_embed, metadatas=metadatas, ids=ids)
-        print(f"Successfully added {collection.count()} documents to the collection.")
+        print(f"Generating embeddings for {len(texts_to_embed)} position description chunks...")
+        shard_embeddings = []
+        for start, embeddings in embedding_model.encode_shards(texts_to_embed, show_progress_bar=True):
+            if not vector_backend.incremental_add:
+                shard_embeddings.append(embeddings) # A memmap write rewrites the whole index, so write once at the end
+                continue
+            end = start + len(embeddings)
+            with index_write_lock: # Streamed: shard N is stored while the workers encode the following shards
+                vector_backend.add(ids=ids[start:end], embeddings=embeddings, documents=texts_to_embed[start:end], metadatas=metadatas[start:end])
+        with index_write_lock:
+            if shard_embeddings:
+                print(f"Adding {len(texts_to_embed)} items to {vector_backend.name} collection '{COLLECTION_NAME}'...")
+                vector_backend.add(ids=ids, embeddings=np.concatenate(shard_embeddings), documents=texts_to_embed, metadatas=metadatas)
+            vector_backend.set_index_metadata(INDEX_SIGNATURE)
+            if VECTOR_BACKEND == "memmap" and MEMMAP_IVF_NLIST > 0:
+                print(f"Building IVF layout with {MEMMAP_IVF_NLIST} clusters...")
+                vector_backend.build_ivf(MEMMAP_IVF_NLIST)
+            _index_changed()
+        print(f"Successfully added {vector_backend.count()} documents to the collection.")
     else:
         print("No offer descriptions found to vectorize.")
 
-def retrieve_context(query_text, n_results=3):
-    print(f"\nRetrieving context for RAG based on query: '{query_text[:100]}...'")
-    query_embedding = embedding_model.encode(query_text).tolist()
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results,
-        include=['documents', 'metadatas']
+def index_offer_files(filepaths: list) -> int:
+    """
+    Incrementally (re-)indexes the given offer files: their new chunks are upserted first,
+    then chunks that no longer exist (e.g. a removed position) are deleted.
+    Queries running in parallel see either the old or the new version of a file, never none.
+    A file that cannot be read (e.g. half-written invalid JSON) keeps its indexed chunks;
+    deleted files are removed with remove_offer_files. Returns the number of indexed documents.
+    """
+    ids, texts, metadatas, parsed_files = [], [], [], []
+    for filepath in filepaths:
+        try:
+            file_ids, file_texts, file_metadatas = build_file_documents(filepath)
+        except Exception as e:
+            print(f"Warning: Error processing {os.path.basename(filepath)}: {e}")
+            continue
+        parsed_files.append(filepath)
+        ids.extend(file_ids)
+        texts.extend(file_texts)
+        metadatas.extend(file_metadatas)
+
+    # Embedding happens outside the lock; only the (fast) store update is serialized
+    embeddings = embedding_model.encode(texts) if texts else None
+    with index_write_lock:
+        stale_ids = []
+        for filepath in parsed_files:
+            stale_ids.extend(vector_backend.get_ids({"source_file": os.path.basename(filepath)}))
+        if texts:
+            vector_backend.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+            vector_backend.set_index_metadata(INDEX_SIGNATURE)
+        new_ids = set(ids)
+        vector_backend.delete([doc_id for doc_id in stale_ids if doc_id not in new_ids])
+        _index_changed()
+    return len(ids)
+
+def remove_offer_files(filenames: list) -> int:
+    """Removes all indexed chunks of the given (deleted) offer files. Returns the number of removed documents."""
+    with index_write_lock:
+        stale_ids = []
+        for filename in filenames:
+            stale_ids.extend(vector_backend.get_ids({"source_file": os.path.basename(filename)}))
+        vector_backend.delete(stale_ids)
+        _index_changed()
+    return len(stale_ids)
+
+def build_overall_query(high_level_info: dict) -> str:
+    """The overall RAG query of an offer (industry, title, focus tags, services)."""
+    return (
+        f"Offer for {high_level_info.get('client_industry', '')} client: {high_level_info.get('project_title', '')}, "
+        f"focusing on {high_level_info.get('project_focus_tags_input', '')} and services like {high_level_info.get('key_services_description', '')}"
     )
+
+def collapse_hits(hits: list, n_results: int) -> list:
+    """
+    Turns chunk hits (best first) into up to `n_results` distinct parent positions with their full text.
+    Several chunks of the same long position collapse into one result, ranked by its best-matching chunk.
+    """
     retrieved_docs = []
-    if results and results.get('documents') and results['documents'][0]:
-        for i, doc in enumerate(results['documents'][0]):
-            metadata = results['metadatas'][0][i] if results.get('metadatas') and results['metadatas'][0] else {}
-            retrieved_docs.append({
-                "content": doc,
-                "offer_id": metadata.get("offer_id"),
-                "position_id": metadata.get("position_id"),
-                "position_title": metadata.get("position_title"),
-            })
+    seen_parents = set()
+    for hit in hits or []:
+        metadata = hit.get("metadata") or {}
+        parent_id = metadata.get("parent_id", hit["id"])
+        if parent_id in seen_parents:
+            continue
+        seen_parents.add(parent_id)
+        retrieved_docs.append({
+            "content": metadata.get("parent_content") or hit["document"],
+            "offer_id": metadata.get("offer_id"),
+            "position_id": metadata.get("position_id"),
+            "position_title": metadata.get("position_title"),
+            "offer_status": metadata.get("offer_status", "unknown"),
+        })
+        if len(retrieved_docs) >= n_results:
+            break
+    return retrieved_docs
+
+def encode_query(query_text: str):
+    """Embedding of a normalized query, from the LRU cache if the same query was encoded before."""
+    key = (embedding_model.model_id, query_text)
+    query_embedding = query_embedding_cache.get(key)
+    if query_embedding is None:
+        query_embedding = embedding_model.encode(query_text)
+        query_embedding.setflags(write=False) # Shared between callers
+        query_embedding_cache.put(key, query_embedding)
+    return query_embedding
+
+def retrieve_context(query_text, n_results=3):
+    """
+    Returns up to `n_results` distinct past offer positions for the query (see collapse_hits).
+    Repeated queries are served from the LRU caches (see query_cache.py) until the index changes.
+    """
+    query_text = normalize_query(query_text)
+    print(f"\nRetrieving context for RAG based on query: '{query_text[:100]}...'")
+    # There are no retrieval filters yet; n_results and the oversampling determine the result set. The backend
+    # version also changes when another process (e.g. bexio_sync.py) writes the index.
+    backend_version = vector_backend.version()
+    result_key = (query_text, n_results, CHUNK_QUERY_OVERSAMPLE, index_version if backend_version is None else backend_version)
+    cached = query_result_cache.get(result_key)
+    if cached is not None:
+        print(f"Retrieved {len(cached)} relevant contexts for RAG (cached).")
+        return [dict(doc) for doc in cached]
+
+    hits = vector_backend.query(encode_query(query_text), n_results=n_results * CHUNK_QUERY_OVERSAMPLE)
+    retrieved_docs = collapse_hits(hits, n_results)
+    if retrieved_docs:
         print(f"Retrieved {len(retrieved_docs)} relevant contexts for RAG.")
     else:
         print("No relevant contexts found for RAG.")
+    query_result_cache.put(result_key, [dict(doc) for doc in retrieved_docs])
     return retrieved_docs
+
+def get_retrieval_cache_stats() -> dict:
+    return {
+        "index_version": index_version,
+        "query_embeddings": query_embedding_cache.get_stats(),
+        "query_results": query_result_cache.get_stats(),
+    }